@@ -281,8 +281,16 @@ ALLOWED_UPLOAD_EXTENSIONS = [
 # Para RateLimitMiddleware personalizado
 RATE_LIMIT_MAX_REQUESTS = 100  # Máximo de requests
 RATE_LIMIT_WINDOW_SECONDS = 60  # Ventana de tiempo en segundos
+# Límites por prefijo de ruta (contador propio): {prefijo: (máximo, ventana en segundos)}
+RATE_LIMIT_RUTAS = {
+    '/api/accounts/auth/login/': (10, 60),  # Login: frenar fuerza bruta
+}
+# Contadores en el cache de Django: compartidos entre workers
+# 'usuarios.rate_limit.VentanaFija' o 'usuarios.rate_limit.VentanaDeslizante'
+RATE_LIMIT_BACKEND = 'usuarios.rate_limit.VentanaFija'
+RATE_LIMIT_CACHE_ALIAS = 'default'
 
-# En producción, considerar usar Redis para rate limiting:
+# En producción el cache debe ser compartido (Redis); con LocMemCache cada worker cuenta por separado:
 # CACHES = {
 #     'default': {
 #         'BACKEND': 'django_redis.cache.RedisCache',
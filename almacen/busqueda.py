@@ -0,0 +1,148 @@
+# almacen/busqueda.py
+"""
+Búsqueda de texto para los listados de Almacén.
+
+MovimientoAlmacen guarda en 'texto_busqueda' una copia desnormalizada de los
+textos que se buscan (producto, documento, OC, referencia, cliente/proveedor)
+con un índice FULLTEXT en MySQL; Producto tiene su propio FULLTEXT sobre
+nombre/código. Los números de documento y códigos se buscan además en
+cualquier posición ("123" encuentra "0000123") con un índice FULLTEXT ngram
+sobre esas columnas (migraciones almacen 0017 / importaciones 0043).
+
+En MySQL cada rama del OR empieza por un MATCH: un LIKE '%x%' solo se agrega
+con AND, para confirmar sobre los candidatos del índice (nunca como rama suelta,
+que obliga a recorrer toda la tabla). En otros motores se usa icontains para todo.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q, BooleanField
+from django.db.models.expressions import RawSQL
+
+# innodb_ft_min_token_size: términos más cortos no están en el índice FULLTEXT
+FULLTEXT_MIN_TOKEN = 3
+# ngram_token_size de MySQL (índices de los campos de búsqueda infija)
+NGRAM_MIN_TOKEN = 2
+TEXTO_BUSQUEDA_MAX = 1000
+# Operadores del modo BOOLEAN de MySQL que no deben llegar desde el usuario
+_OPERADORES_FULLTEXT = re.compile(r'[+\-<>()~*"@]+')
+
+
+def texto_busqueda_movimiento(nombre_producto, valores):
+    """
+    Texto desnormalizado de un movimiento a partir de sus valores
+    (mismas claves que MovimientoAlmacen).
+    """
+    partes = [
+        nombre_producto,
+        valores.get('numero_documento_erp'),
+        valores.get('referencia_documento'),
+        valores.get('cliente_erp_nombre'),
+        valores.get('nombre_proveedor'),
+        (valores.get('numero_orden_compra') or '')[:300],
+    ]
+    texto = ' '.join(str(p).strip() for p in partes if p and str(p).strip())
+    return texto[:TEXTO_BUSQUEDA_MAX]
+
+
+def _terminos(valor):
+    return [t for t in _OPERADORES_FULLTEXT.sub(' ', valor or '').split() if t]
+
+
+def _algun_campo_contiene(columnas, termino):
+    filtro = Q()
+    for columna in columnas:
+        filtro |= Q(**{f'{columna}__icontains': termino})
+    return filtro
+
+
+def _match(modelo, columnas, consulta):
+    # Columnas sin calificar: la tabla puede ir con alias (ej. dentro de un subquery)
+    lista = ', '.join(connection.ops.quote_name(modelo._meta.get_field(c).column) for c in columnas)
+    return Q(RawSQL(f'MATCH ({lista}) AGAINST (%s IN BOOLEAN MODE)', [consulta], output_field=BooleanField()))
+
+
+def filtro_busqueda(modelo, valor, columnas_fulltext, campos_infijo=()):
+    """
+    Q que busca 'valor' en 'modelo':
+    - Todos los términos (prefijo) en el índice FULLTEXT de 'columnas_fulltext'.
+    - O el valor completo en cualquier posición de alguno de 'campos_infijo'
+      (en MySQL deben tener un índice FULLTEXT ngram con exactamente esas columnas).
+    Retorna None si no hay nada que buscar (en MySQL: ningún término alcanza el
+    tamaño mínimo de token de los índices).
+    """
+    valor = (valor or '').strip()
+    terminos = _terminos(valor)
+    if not terminos:
+        return None
+
+    if connection.vendor != 'mysql':
+        # Otros motores (tests / desarrollo): cada término en alguna de las columnas
+        filtro = Q()
+        for campo in campos_infijo:
+            filtro |= Q(**{f'{campo}__icontains': valor})
+        por_terminos = Q()
+        for termino in terminos:
+            por_terminos &= _algun_campo_contiene(columnas_fulltext, termino)
+        return filtro | por_terminos
+
+    ramas = []
+    # Dentro de la frase los operadores no se interpretan (ej. F001-123): solo se quitan las comillas
+    frase = valor.replace('"', ' ').strip()
+    if campos_infijo and len(frase) >= NGRAM_MIN_TOKEN:
+        # Frase en el índice ngram (candidatos) + LIKE que confirma la subcadena exacta
+        ramas.append(_match(modelo, campos_infijo, f'"{frase}"') & _algun_campo_contiene(campos_infijo, valor))
+
+    buscables = [t for t in terminos if len(t) >= FULLTEXT_MIN_TOKEN]
+    if buscables:
+        por_terminos = _match(modelo, columnas_fulltext, ' '.join(f'+{t}*' for t in buscables))
+        # El índice no tiene los términos cortos: se exigen con AND sobre los candidatos
+        for termino in terminos:
+            if len(termino) < FULLTEXT_MIN_TOKEN:
+                por_terminos &= _algun_campo_contiene(columnas_fulltext, termino)
+        ramas.append(por_terminos)
+
+    if not ramas:
+        return None
+    filtro = ramas[0]
+    for rama in ramas[1:]:
+        filtro |= rama
+    return filtro
+
+
+def reindexar_movimientos(empresa_id=None, tamanio_lote=2000, modelo=None):
+    """
+    Recalcula 'texto_busqueda' de los movimientos existentes (ej. después de renombrar
+    productos). Recorre por id en bloques y solo escribe las filas que cambian; no
+    genera historial (es un dato derivado). Retorna la cantidad de filas actualizadas.
+    'modelo' permite pasar el modelo histórico desde una migración de datos.
+    """
+    if modelo is None:
+        from .models import MovimientoAlmacen as modelo
+
+    campos = ['numero_documento_erp', 'referencia_documento', 'cliente_erp_nombre',
+              'nombre_proveedor', 'numero_orden_compra']
+    # _base_manager: incluye los registros con borrado lógico (y existe en el modelo de la migración)
+    base = modelo._base_manager.all()
+    if empresa_id:
+        base = base.filter(empresa_id=empresa_id)
+
+    actualizados = 0
+    ultimo_id = 0
+    while True:
+        filas = list(
+            base.filter(id__gt=ultimo_id).order_by('id')
+            .values('id', 'texto_busqueda', 'producto__nombre_producto', *campos)[:tamanio_lote]
+        )
+        if not filas:
+            return actualizados
+        ultimo_id = filas[-1]['id']
+
+        cambios = []
+        for fila in filas:
+            texto = texto_busqueda_movimiento(fila['producto__nombre_producto'], fila)
+            if texto != fila['texto_busqueda']:
+                cambios.append(modelo(id=fila['id'], texto_busqueda=texto))
+        if cambios:
+            modelo._base_manager.bulk_update(cambios, ['texto_busqueda'])
+            actualizados += len(cambios)
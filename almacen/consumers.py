@@ -17,15 +17,34 @@ class SyncStatusMixin:
         if not event:
             return
 
-        # Construimos el payload para el frontend
+        # Construimos el payload para el frontend. Los avances ya llegan agrupados
+        # (almacen.progreso.ReporteProgreso); 'result' solo viaja si el evento lo trae.
         response_data = {
             'type': 'sync_update',  # El frontend escucha esto
             'status': event.get('status'),
             'message': event.get('message'),
-            'result': event.get('result'),
         }
+        if event.get('result') is not None:
+            response_data['result'] = event['result']
 
         #print(f"[Almacen Mixin] Enviando update: {response_data['message']}")
 
         # 'self.send' funcionará porque quien use este Mixin será un WebsocketConsumer
-        await self.send(text_data=json.dumps(response_data))
\ No newline at end of file
+        await self.send(text_data=json.dumps(response_data))
+
+class ExportacionesMixin:
+    """
+    Mixin para los avisos de exportaciones en segundo plano (evento 'kardex.export'),
+    enviados al grupo personal del usuario.
+    """
+
+    async def kardex_export(self, event):
+        if not event:
+            return
+
+        await self.send(text_data=json.dumps({
+            'type': 'kardex_export',  # El frontend escucha esto
+            'status': event.get('status'),
+            'message': event.get('message'),
+            'result': event.get('result'),
+        }))
@@ -0,0 +1,167 @@
+# almacen/estado_sync.py
+"""
+Índice de estado de los jobs de sincronización (tabla EstadoJobSync).
+
+CheckSyncStatusAPIView recorría el StartedJobRegistry y todos los ids de la cola,
+trayendo cada job de Redis para saber si el usuario tenía una sincronización
+activa. Ahora cada job escribe su estado en una fila por (tipo, alias):
+
+- encolar:   TriggerSyncAPIView / encolar_sincronizacion_multi (cada hijo y el cierre);
+- iniciar:   al arrancar la tarea;
+- avanzar:   con la misma cadencia que el WebSocket (ReporteProgreso);
+- terminar:  finished / failed.
+
+La fila multi-empresa guarda {'hijos': {alias: job_id}}; su avance se arma al
+consultar con las filas de los hijos (resumen).
+
+Cada escritura renueva 'expira'. Un job activo (queued/started) cuyo 'expira'
+venció no está dando señales: se considera zombi y no cuenta como activo
+(limpiar_colas lo marca y lo quita de rq).
+"""
+import datetime
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import EstadoJobSync
+
+# Un job en curso publica al menos cada SYNC_PROGRESO_LATIDO_SEGUNDOS mientras avanza;
+# una sola página lenta del ERP puede tardar, por eso el margen es amplio.
+SYNC_ESTADO_TTL_SEGUNDOS = getattr(settings, 'SYNC_ESTADO_TTL_SEGUNDOS', 900)
+# En cola no hay latido: se espera hasta el timeout de la tarea
+SYNC_ESTADO_TTL_COLA_SEGUNDOS = getattr(settings, 'SYNC_ESTADO_TTL_COLA_SEGUNDOS', 7200)
+
+TIPO_EMPRESA = EstadoJobSync.TIPO_EMPRESA
+TIPO_MULTI = EstadoJobSync.TIPO_MULTI
+
+
+def _expira(segundos):
+    return timezone.now() + datetime.timedelta(seconds=segundos)
+
+
+def registrar_encolado(tipo, alias, job_id, user_id=None, detalle=None, ttl=SYNC_ESTADO_TTL_COLA_SEGUNDOS):
+    """
+    El job entra a la cola: la fila pasa a ser de este job (reemplaza la anterior).
+    Se llama antes de encolar (job_id generado de antemano). Si la fila ya es de este
+    job, el worker se adelantó (iniciado / terminado) y no se vuelve a 'queued'.
+    """
+    if not job_id:
+        return
+    if EstadoJobSync.objects.filter(tipo=tipo, empresa_alias=alias or '', job_id=job_id).exists():
+        return
+    EstadoJobSync.objects.update_or_create(
+        tipo=tipo, empresa_alias=alias or '',
+        defaults={
+            'job_id': job_id, 'user_id': user_id, 'estado': EstadoJobSync.ESTADO_EN_COLA,
+            'percent': 0, 'message': 'En cola', 'detalle': detalle,
+            'encolado': timezone.now(), 'iniciado': None,
+            'expira': _expira(ttl),
+        },
+    )
+
+
+def registrar_inicio(tipo, alias, job_id, user_id=None, message='Iniciando Sincronización...'):
+    """
+    El worker tomó el job. Se usa update_or_create porque el job puede no haber pasado
+    por registrar_encolado (encolado desde la consola, rq-scheduler, etc.).
+    Sin job (ejecución directa, p. ej. sync_multi_erp) no se registra nada.
+    """
+    if not job_id:
+        return
+    defaults = {
+        'job_id': job_id, 'estado': EstadoJobSync.ESTADO_EN_CURSO,
+        'percent': 0, 'message': message, 'iniciado': timezone.now(),
+        'expira': _expira(SYNC_ESTADO_TTL_SEGUNDOS),
+    }
+    if user_id is not None:
+        defaults['user_id'] = user_id
+    fila = EstadoJobSync.objects.filter(tipo=tipo, empresa_alias=alias or '')
+    if not fila.filter(job_id=job_id).update(**defaults):
+        # La fila era de otro job: no hereda su usuario
+        defaults.update(user_id=user_id, encolado=None, detalle=None)
+        EstadoJobSync.objects.update_or_create(tipo=tipo, empresa_alias=alias or '', defaults=defaults)
+
+
+def registrar_avance(tipo, alias, job_id, percent, message):
+    """Avance + latido. Solo toca la fila si sigue siendo de este job y no terminó."""
+    if not job_id:
+        return
+    valores = {
+        'estado': EstadoJobSync.ESTADO_EN_CURSO, 'percent': percent, 'message': (message or '')[:255],
+        'expira': _expira(SYNC_ESTADO_TTL_SEGUNDOS), 'actualizado': timezone.now(),
+    }
+    EstadoJobSync.objects.filter(
+        tipo=tipo, empresa_alias=alias or '', job_id=job_id, estado__in=EstadoJobSync.ESTADOS_ACTIVOS
+    ).update(**valores)
+
+
+def registrar_fin(tipo, alias, job_id, exito, message):
+    if not job_id:
+        return
+    ahora = timezone.now()
+    valores = {
+        'estado': EstadoJobSync.ESTADO_FINALIZADO if exito else EstadoJobSync.ESTADO_FALLIDO,
+        'message': (message or '')[:255], 'expira': ahora, 'actualizado': ahora,
+    }
+    if exito:
+        valores['percent'] = 100
+    EstadoJobSync.objects.filter(tipo=tipo, empresa_alias=alias or '', job_id=job_id).update(**valores)
+
+
+def activos():
+    """Jobs en cola o en curso que siguen dando señales."""
+    return EstadoJobSync.objects.filter(
+        estado__in=EstadoJobSync.ESTADOS_ACTIVOS, expira__gt=timezone.now()
+    )
+
+
+def activo_de_usuario(user_id):
+    """Sincronización activa del usuario (la que está en curso antes que la que espera en cola)."""
+    return (
+        activos().filter(user_id=user_id)
+        .order_by('-estado', '-actualizado')  # 'started' > 'queued'
+        .first()
+    )
+
+
+def zombis():
+    """Jobs que figuran activos pero dejaron de dar señales antes de 'expira'."""
+    return EstadoJobSync.objects.filter(
+        estado__in=EstadoJobSync.ESTADOS_ACTIVOS, expira__lte=timezone.now()
+    )
+
+
+def resumen(registro):
+    """
+    {message, percent} del registro. En el multi-empresa se calcula con las filas de
+    los hijos (una consulta) y se agrega 'empresas' con el detalle por alias.
+    """
+    data = {'message': registro.message or 'Sincronización en progreso...', 'percent': registro.percent}
+    hijos = (registro.detalle or {}).get('hijos') if registro.tipo == TIPO_MULTI else None
+    if not hijos:
+        return data
+
+    ahora = timezone.now()
+    filas = {
+        fila.empresa_alias: fila
+        for fila in EstadoJobSync.objects.filter(tipo=TIPO_EMPRESA, empresa_alias__in=list(hijos))
+    }
+    empresas = {}
+    for alias, job_id in hijos.items():
+        fila = filas.get(alias)
+        if fila is None or fila.job_id != job_id:
+            # Otra sincronización de la misma base reemplazó la fila
+            empresas[alias] = {'status': 'unknown', 'percent': 0, 'message': 'Sin datos'}
+            continue
+        estado = fila.estado
+        if estado in EstadoJobSync.ESTADOS_ACTIVOS and fila.expira <= ahora:
+            estado = EstadoJobSync.ESTADO_ZOMBI
+        terminado = estado not in EstadoJobSync.ESTADOS_ACTIVOS
+        empresas[alias] = {'status': estado, 'percent': 100 if terminado else fila.percent,
+                           'message': fila.message, 'job_id': job_id}
+
+    percent = round(sum(e['percent'] for e in empresas.values()) / len(empresas), 1)
+    en_curso = [a for a, e in empresas.items() if e['status'] == EstadoJobSync.ESTADO_EN_CURSO]
+    data.update(percent=percent, message=f"Sincronizando {len(en_curso)} empresa(s)... {percent}%",
+                empresas=empresas)
+    return data
@@ -1,9 +1,9 @@
 import django_filters
-from django.db.models import Q
 from django.utils import timezone
 from datetime import datetime, time
 from .models import MovimientoAlmacen,Stock,Almacen
 from importaciones.models import Producto
+from .busqueda import filtro_busqueda
 import datetime as dt_module
 
 
@@ -50,22 +50,22 @@ class MovimientoAlmacenFilter(django_filters.FilterSet):
     def global_search(self, queryset, name, value):
         """
         Busca el valor en:
-        1. Número de documento ERP
+        1. Número de documento ERP (también en cualquier posición)
         2. Nombre del producto
         3. Número de Orden de Compra
-        4. Referencia
-        5. Nombre del Cliente
+        4. Referencia (también en cualquier posición)
+        5. Nombre del Cliente / Proveedor
+        Usa la columna desnormalizada 'texto_busqueda' (índice FULLTEXT) y, para documento y referencia,
+        un índice FULLTEXT ngram; ver almacen/busqueda.py.
         """
-        if not value:
-            return queryset
-
-        return queryset.filter(
-            Q(numero_documento_erp__icontains=value) |
-            Q(producto__nombre_producto__icontains=value) |
-            Q(numero_orden_compra__icontains=value) |
-            Q(referencia_documento__icontains=value) |
-            Q(cliente_erp_nombre__icontains=value)
+        filtro = filtro_busqueda(
+            MovimientoAlmacen, value,
+            columnas_fulltext=('texto_busqueda',),
+            campos_infijo=('numero_documento_erp', 'referencia_documento')
         )
+        if filtro is None:
+            return queryset
+        return queryset.filter(filtro)
 
     # --- TUS MÉTODOS AUXILIARES (Sin cambios) ---
     def filter_utc_desde(self, queryset, name, value):
@@ -125,13 +125,15 @@ class StockFilter(django_filters.FilterSet):
         }
 
     def filter_search_producto(self, queryset, name, value):
-        if not value:
-            return queryset
-        # Busca en los campos relacionados del modelo Producto
-        return queryset.filter(
-            Q(producto__codigo_producto__icontains=value) |
-            Q(producto__nombre_producto__icontains=value)
+        # Busca en Producto con su índice FULLTEXT (nombre/código) + código en cualquier posición (ngram)
+        filtro = filtro_busqueda(
+            Producto, value,
+            columnas_fulltext=('nombre_producto', 'codigo_producto'),
+            campos_infijo=('codigo_producto',)
         )
+        if filtro is None:
+            return queryset
+        return queryset.filter(producto__in=Producto.all_objects.filter(filtro).values('id'))
 
     def filter_solo_con_stock(self, queryset, name, value):
         if value:  # Si el filtro es ?solo_con_stock=true
@@ -0,0 +1,181 @@
+# almacen/kardex_columnar.py
+"""
+Motor columnar del Kárdex.
+
+En lugar de una consulta y un bucle Python por producto, procesa los productos en
+lotes: una consulta de movimientos para todo el lote, una de notas, una de saldos
+anteriores (kardex_saldos.saldos_anteriores) y el saldo corrido como cumsum de
+NumPy agrupado por producto. Las filas resultantes son las mismas que las de
+services._calcular_kardex_para_un_producto (ver el comando benchmark_kardex).
+"""
+import datetime
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+from django.db.models import Sum, DecimalField
+from django.db.models.functions import Coalesce
+
+from .kardex_saldos import saldos_anteriores
+from .models import MovimientoAlmacen, MovimientoAlmacenNota, Transferencia
+
+KARDEX_LOTE_PRODUCTOS = 200
+NOTAS_LOTE_IDS = 1000
+# Las cantidades tienen 6 decimales: el saldo se acumula en enteros escalados (exacto)
+ESCALA_CANTIDAD = 10 ** 6
+
+CAMPOS_MOVIMIENTO = (
+    'producto_id', 'id_erp_cab', 'fecha_documento', 'tipo_documento_erp', 'numero_documento_erp',
+    'es_ingreso', 'cantidad', 'glosa_cabecera', 'glosa_detalle', 'cliente_erp_nombre',
+    'nombre_proveedor', 'referencia_documento', 'codigo_movimiento', 'almacen_ref',
+)
+
+
+def _rango_utc(fecha_inicio, fecha_fin):
+    from .services import make_utc_range_start, make_utc_range_end
+
+    if isinstance(fecha_inicio, datetime.datetime): fecha_inicio = fecha_inicio.date()
+    if isinstance(fecha_fin, datetime.datetime): fecha_fin = fecha_fin.date()
+    return fecha_inicio, make_utc_range_start(fecha_inicio), make_utc_range_end(fecha_fin)
+
+
+def _notas_por_documento(empresa_id, ids_documentos):
+    """{id_erp_cab: notas concatenadas} con una consulta por cada NOTAS_LOTE_IDS documentos."""
+    ids_documentos = list(ids_documentos)
+    notas = {}
+    for i in range(0, len(ids_documentos), NOTAS_LOTE_IDS):
+        filas = MovimientoAlmacenNota.objects.filter(
+            empresa_id=empresa_id,
+            id_erp_cab__in=ids_documentos[i:i + NOTAS_LOTE_IDS]
+        ).order_by('id').values_list('id_erp_cab', 'texto_descripcion')
+        for doc_id, texto in filas:
+            texto = (texto or '').strip()
+            if texto:
+                notas[doc_id] = f"{notas[doc_id]} {texto}" if doc_id in notas else texto
+    return notas
+
+
+def _unir(a, b):
+    """" - ".join(filter(None, [a, b])) sobre columnas de texto ('' = vacío)."""
+    return np.where((a != '') & (b != ''), a + ' - ' + b, a + b)
+
+
+def _detalles(df, notas):
+    """Columna 'detalle' con la misma jerarquía que el cálculo fila por fila."""
+    def texto(columna):
+        return df[columna].fillna('').astype(str)
+
+    codigo = texto('codigo_movimiento').str.strip().str.upper()
+    glosa_cabecera = texto('glosa_cabecera')
+    cliente = texto('cliente_erp_nombre')
+
+    # Nota real: nota externa -> glosa de detalle -> glosa de cabecera
+    nota = df['id_erp_cab'].map(notas).fillna('').astype(str)
+    nota = nota.where(nota != '', texto('glosa_detalle').str.strip())
+    nota = nota.where(nota != '', glosa_cabecera.str.strip())
+
+    transferencia = glosa_cabecera.where(
+        glosa_cabecera != '',
+        # f"{None}" -> 'None', igual que el cálculo fila por fila
+        'TRANSFERENCIA ENTRE ALMACENES - ' + df['almacen_ref'].fillna('None').astype(str) + ' '
+    )
+    flete = pd.Series(_unir(cliente.str.strip(), nota), index=df.index)
+    flete = flete.where(flete != '', 'REINGRESO POR NC')
+    entidad = pd.Series(np.where(df['es_ingreso'], texto('nombre_proveedor'), cliente), index=df.index)
+    otros = _unir(entidad, glosa_cabecera)
+
+    return np.select([codigo == 'TD', codigo == 'FT'], [transferencia, flete], otros)
+
+
+def _filas_kardex(movs, saldo_inicial, fecha_inicio):
+    """Arma la lista de filas de un producto a partir de sus columnas ya calculadas."""
+    filas = [{
+        'fecha': fecha_inicio,
+        'doc': 'SALDO ANTERIOR',
+        'entrada': 0,
+        'salida': 0,
+        'saldo': saldo_inicial,
+        'detalle': '---'
+    }]
+    for fecha, tipo, numero, ref, es_ingreso, cantidad, detalle, acumulado in movs:
+        filas.append({
+            'fecha': fecha,
+            'doc': f"{tipo}-{numero}",
+            'ref': ref,
+            'entrada': cantidad if es_ingreso else 0,
+            'salida': cantidad if not es_ingreso else 0,
+            'detalle': detalle,
+            'origen': 'ERP',
+            'saldo': saldo_inicial + Decimal(int(acumulado)).scaleb(-6),
+        })
+    return filas
+
+
+def _kardex_lote(empresa_id, almacen_id, producto_ids, fecha_inicio, utc_start, utc_end):
+    saldos = saldos_anteriores(empresa_id, almacen_id, producto_ids, utc_start)
+
+    movs = list(MovimientoAlmacen.objects.filter(
+        empresa_id=empresa_id,
+        almacen_id=almacen_id,
+        producto_id__in=producto_ids,
+        fecha_documento__range=[utc_start, utc_end],
+        state=True,
+        estado_erp__in=['V', 'F']
+    ).order_by('producto_id', 'fecha_documento', 'id').values_list(*CAMPOS_MOVIMIENTO))
+
+    resultado = {pid: _filas_kardex([], saldos[pid], fecha_inicio) for pid in producto_ids}
+    if not movs:
+        return resultado
+
+    df = pd.DataFrame.from_records(movs, columns=CAMPOS_MOVIMIENTO)
+    notas = _notas_por_documento(empresa_id, df['id_erp_cab'].dropna().unique())
+    detalle = _detalles(df, notas).tolist()
+
+    # Saldo corrido: cumsum de (entrada - salida) por producto, en enteros escalados
+    cantidad = np.rint(pd.to_numeric(df['cantidad'], errors='coerce').fillna(0).to_numpy(dtype='float64')
+                       * ESCALA_CANTIDAD).astype('int64')
+    delta = pd.Series(np.where(df['es_ingreso'].to_numpy(dtype=bool), cantidad, -cantidad), index=df.index)
+    acumulado = delta.groupby(df['producto_id'], sort=False).cumsum().to_numpy()
+
+    # Cortes del lote (ya ordenado por producto)
+    producto_col = df['producto_id'].to_numpy()
+    cortes = np.flatnonzero(producto_col[1:] != producto_col[:-1]) + 1
+    for inicio, fin in zip(np.r_[0, cortes], np.r_[cortes, len(movs)]):
+        pid = int(producto_col[inicio])
+        resultado[pid] = _filas_kardex(
+            ((m[2], m[3], m[4], m[11], m[5], m[6], detalle[i], acumulado[i])
+             for i, m in enumerate(movs[inicio:fin], inicio)),
+            saldos[pid], fecha_inicio
+        )
+    return resultado
+
+
+def iterar_kardex_columnar(empresa_id, almacen_id, producto_ids, fecha_inicio, fecha_fin,
+                           tamanio_lote=KARDEX_LOTE_PRODUCTOS):
+    """
+    Produce (producto_id, filas_kardex) en el orden de 'producto_ids', procesando
+    'tamanio_lote' productos por consulta (memoria acotada en las exportaciones).
+    """
+    fecha_inicio, utc_start, utc_end = _rango_utc(fecha_inicio, fecha_fin)
+    producto_ids = list(producto_ids)
+    for i in range(0, len(producto_ids), tamanio_lote):
+        lote = producto_ids[i:i + tamanio_lote]
+        resultado = _kardex_lote(empresa_id, almacen_id, lote, fecha_inicio, utc_start, utc_end)
+        for pid in lote:
+            yield pid, resultado[pid]
+
+
+def stock_en_transito(empresa_id, almacen_id, producto_ids):
+    """{producto_id: cantidad EN_TRANSITO hacia el almacén} en una sola consulta agrupada."""
+    totales = {pid: Decimal('0') for pid in producto_ids}
+    filas = Transferencia.objects.filter(
+        empresa_id=empresa_id,
+        almacen_destino_id=almacen_id,  # Lo que viene HACIA mí
+        producto_id__in=list(producto_ids),
+        estado='EN_TRANSITO'
+    ).values('producto_id').annotate(
+        total=Coalesce(Sum('cantidad_enviada'), Decimal('0'), output_field=DecimalField())
+    ).order_by()
+    for fila in filas:
+        totales[fila['producto_id']] = fila['total']
+    return totales
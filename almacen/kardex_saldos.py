@@ -0,0 +1,227 @@
+# almacen/kardex_saldos.py
+"""
+Snapshots mensuales del Kárdex (KardexSaldoMensual).
+
+El saldo anterior de un Kárdex se obtiene del último cierre mensual antes de
+la fecha de inicio más la suma de la "cola" (movimientos entre ese cierre y
+la fecha de inicio), en lugar de sumar todo el historial del producto.
+"""
+import datetime
+import logging
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Sum, Q, Max, DecimalField
+from django.db.models.functions import Coalesce
+
+from .models import MovimientoAlmacen, KardexSaldoMensual
+
+logger = logging.getLogger(__name__)
+
+CERO = Decimal('0')
+# Estados ERP que cuentan para el saldo (mismo criterio que el SALDO ANTERIOR del Kárdex)
+ESTADOS_ERP_SALDO = ['V', 'F', 'P']
+SALDOS_BULK_BATCH_SIZE = 1000
+
+
+def primer_dia_mes(fecha):
+    """Fecha (date) del primer día del mes en UTC."""
+    if isinstance(fecha, datetime.datetime):
+        if fecha.tzinfo is not None:
+            fecha = fecha.astimezone(datetime.timezone.utc)
+        fecha = fecha.date()
+    return fecha.replace(day=1)
+
+
+def _mes_siguiente(periodo):
+    return (periodo.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+
+
+def _inicio_utc(periodo):
+    return datetime.datetime.combine(periodo, datetime.time.min).replace(tzinfo=datetime.timezone.utc)
+
+
+def _movimientos_saldo(empresa_id, almacen_id, producto_id):
+    return MovimientoAlmacen.objects.filter(
+        empresa_id=empresa_id,
+        almacen_id=almacen_id,
+        producto_id=producto_id,
+        state=True,
+        estado_erp__in=ESTADOS_ERP_SALDO
+    )
+
+
+def _sumar(queryset):
+    agregado = queryset.aggregate(
+        ingresos=Coalesce(Sum('cantidad', filter=Q(es_ingreso=True)), CERO, output_field=DecimalField()),
+        salidas=Coalesce(Sum('cantidad', filter=Q(es_ingreso=False)), CERO, output_field=DecimalField())
+    )
+    return agregado['ingresos'] - agregado['salidas']
+
+
+def saldo_anterior(empresa_id, almacen_id, producto_id, utc_start):
+    """
+    Saldo acumulado ANTES de utc_start: último snapshot cerrado antes del mes de
+    utc_start + movimientos posteriores a ese snapshot (máximo un mes de cola).
+    """
+    snapshot = KardexSaldoMensual.objects.filter(
+        empresa_id=empresa_id,
+        almacen_id=almacen_id,
+        producto_id=producto_id,
+        periodo__lt=primer_dia_mes(utc_start)
+    ).order_by('-periodo').values('periodo', 'saldo_cierre').first()
+
+    cola = _movimientos_saldo(empresa_id, almacen_id, producto_id).filter(fecha_documento__lt=utc_start)
+    if not snapshot:
+        return _sumar(cola)
+    cola = cola.filter(fecha_documento__gte=_inicio_utc(_mes_siguiente(snapshot['periodo'])))
+    return snapshot['saldo_cierre'] + _sumar(cola)
+
+
+def saldos_anteriores(empresa_id, almacen_id, producto_ids, utc_start):
+    """
+    saldo_anterior() para varios productos con un número fijo de consultas:
+    últimos snapshots (2) + una suma de colas agrupada por producto.
+    Retorna {producto_id: saldo}; los productos sin movimientos quedan en 0.
+    """
+    producto_ids = list(producto_ids)
+    saldos = {pid: CERO for pid in producto_ids}
+    if not producto_ids:
+        return saldos
+
+    snapshots = KardexSaldoMensual.objects.filter(
+        empresa_id=empresa_id,
+        almacen_id=almacen_id,
+        producto_id__in=producto_ids,
+        periodo__lt=primer_dia_mes(utc_start)
+    )
+    ultimos = dict(snapshots.values('producto_id').annotate(ultimo=Max('periodo'))
+                   .values_list('producto_id', 'ultimo'))
+    desde_por_producto = {pid: None for pid in producto_ids}
+    if ultimos:
+        for fila in snapshots.filter(periodo__in=set(ultimos.values())).values(
+                'producto_id', 'periodo', 'saldo_cierre'):
+            if ultimos.get(fila['producto_id']) == fila['periodo']:
+                saldos[fila['producto_id']] = fila['saldo_cierre']
+                desde_por_producto[fila['producto_id']] = _inicio_utc(_mes_siguiente(fila['periodo']))
+
+    # Casi todos los productos comparten el mismo último cierre: pocas ramas en el OR
+    por_desde = defaultdict(list)
+    for pid, desde in desde_por_producto.items():
+        por_desde[desde].append(pid)
+    rango = Q()
+    for desde, pids in por_desde.items():
+        rango |= Q(producto_id__in=pids, fecha_documento__gte=desde) if desde else Q(producto_id__in=pids)
+
+    colas = MovimientoAlmacen.objects.filter(
+        rango,
+        empresa_id=empresa_id,
+        almacen_id=almacen_id,
+        state=True,
+        estado_erp__in=ESTADOS_ERP_SALDO,
+        fecha_documento__lt=utc_start
+    ).values('producto_id').annotate(
+        ingresos=Coalesce(Sum('cantidad', filter=Q(es_ingreso=True)), CERO, output_field=DecimalField()),
+        salidas=Coalesce(Sum('cantidad', filter=Q(es_ingreso=False)), CERO, output_field=DecimalField())
+    ).order_by()
+    for fila in colas:
+        saldos[fila['producto_id']] += fila['ingresos'] - fila['salidas']
+    return saldos
+
+
+def _acumular_por_mes(filas):
+    """filas: (fecha_documento, es_ingreso, cantidad) -> {periodo: [ingresos, salidas]}"""
+    meses = defaultdict(lambda: [CERO, CERO])
+    for fecha, es_ingreso, cantidad in filas:
+        meses[primer_dia_mes(fecha)][0 if es_ingreso else 1] += cantidad or CERO
+    return meses
+
+
+def _snapshots(empresa_id, almacen_id, producto_id, saldo_base, meses):
+    saldo = saldo_base
+    resultado = []
+    for periodo in sorted(meses):
+        ingresos, salidas = meses[periodo]
+        saldo += ingresos - salidas
+        resultado.append(KardexSaldoMensual(
+            empresa_id=empresa_id, almacen_id=almacen_id, producto_id=producto_id,
+            periodo=periodo, ingresos=ingresos, salidas=salidas, saldo_cierre=saldo
+        ))
+    return resultado
+
+
+def reconstruir_saldos_mensuales(empresa_id, almacen_id, producto_id, desde):
+    """
+    Regenera los snapshots de un par (almacén, producto) desde el mes de 'desde'.
+    Solo lee los movimientos de ese mes en adelante; el saldo base sale del snapshot previo.
+    Llamar dentro de la transacción que modificó los movimientos.
+    """
+    periodo_desde = primer_dia_mes(desde)
+    inicio = _inicio_utc(periodo_desde)
+    movimientos = _movimientos_saldo(empresa_id, almacen_id, producto_id)
+
+    previo = KardexSaldoMensual.objects.filter(
+        empresa_id=empresa_id, almacen_id=almacen_id, producto_id=producto_id, periodo__lt=periodo_desde
+    ).order_by('-periodo').values('periodo', 'saldo_cierre').first()
+    if previo:
+        base = previo['saldo_cierre'] + _sumar(movimientos.filter(
+            fecha_documento__gte=_inicio_utc(_mes_siguiente(previo['periodo'])), fecha_documento__lt=inicio
+        ))
+    else:
+        base = _sumar(movimientos.filter(fecha_documento__lt=inicio))
+
+    meses = _acumular_por_mes(
+        movimientos.filter(fecha_documento__gte=inicio).values_list('fecha_documento', 'es_ingreso', 'cantidad')
+    )
+
+    KardexSaldoMensual.objects.filter(
+        empresa_id=empresa_id, almacen_id=almacen_id, producto_id=producto_id, periodo__gte=periodo_desde
+    ).delete()
+    KardexSaldoMensual.objects.bulk_create(_snapshots(empresa_id, almacen_id, producto_id, base, meses))
+
+
+def reconstruir_todos_los_saldos(empresa_id=None):
+    """
+    Regenera todos los snapshots (o los de una empresa) en una sola pasada
+    ordenada por (empresa, almacén, producto). Retorna la cantidad de snapshots creados.
+    """
+    filtro = Q(state=True, estado_erp__in=ESTADOS_ERP_SALDO)
+    if empresa_id:
+        filtro &= Q(empresa_id=empresa_id)
+
+    filas = MovimientoAlmacen.objects.filter(filtro).order_by(
+        'empresa_id', 'almacen_id', 'producto_id'
+    ).values_list('empresa_id', 'almacen_id', 'producto_id', 'fecha_documento', 'es_ingreso', 'cantidad')
+
+    total = 0
+    pendientes = []
+
+    def volcar(forzar=False):
+        nonlocal total, pendientes
+        if pendientes and (forzar or len(pendientes) >= SALDOS_BULK_BATCH_SIZE):
+            KardexSaldoMensual.objects.bulk_create(pendientes, batch_size=SALDOS_BULK_BATCH_SIZE)
+            total += len(pendientes)
+            pendientes = []
+
+    with transaction.atomic():
+        borrar = KardexSaldoMensual.objects.all()
+        if empresa_id:
+            borrar = borrar.filter(empresa_id=empresa_id)
+        borrar.delete()
+
+        clave_actual, meses = None, None
+        for emp_id, alm_id, prod_id, fecha, es_ingreso, cantidad in filas.iterator(chunk_size=5000):
+            clave = (emp_id, alm_id, prod_id)
+            if clave != clave_actual:
+                if clave_actual is not None:
+                    pendientes.extend(_snapshots(*clave_actual, CERO, meses))
+                    volcar()
+                clave_actual, meses = clave, defaultdict(lambda: [CERO, CERO])
+            meses[primer_dia_mes(fecha)][0 if es_ingreso else 1] += cantidad or CERO
+        if clave_actual is not None:
+            pendientes.extend(_snapshots(*clave_actual, CERO, meses))
+        volcar(forzar=True)
+
+    logger.info(f"Snapshots de Kárdex regenerados: {total}")
+    return total
@@ -0,0 +1,72 @@
+# almacen/management/commands/benchmark_kardex.py
+import datetime
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from almacen.models import Almacen, MovimientoAlmacen
+from almacen.services import iterar_kardex_detallado, iterar_kardex_fila_a_fila
+from importaciones.models import Empresa
+
+
+class Command(BaseCommand):
+    help = ('Compara el Kárdex fila por fila (implementación anterior) contra el motor columnar: '
+            'tiempo, consultas y que ambos resultados sean idénticos.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('empresa_alias', type=str, help='Nombre de la empresa (ej: bd_semilla_starsoft).')
+        parser.add_argument('almacen', type=str, help='Código del almacén (ej: AL).')
+        parser.add_argument('--desde', type=str, default=None, help='YYYY-MM-DD. Default: hace un año.')
+        parser.add_argument('--hasta', type=str, default=None, help='YYYY-MM-DD. Default: hoy.')
+        parser.add_argument('--productos', type=int, default=200,
+                            help='Máximo de productos (los que tienen movimientos en el almacén).')
+        parser.add_argument('--repeticiones', type=int, default=3)
+
+    def _medir(self, funcion, args, repeticiones):
+        mejor, resultado, consultas = None, None, 0
+        for _ in range(repeticiones):
+            with CaptureQueriesContext(connection) as ctx:
+                inicio = time.perf_counter()
+                resultado = dict(funcion(*args))
+                duracion = time.perf_counter() - inicio
+            consultas = len(ctx.captured_queries)
+            mejor = duracion if mejor is None else min(mejor, duracion)
+        return mejor, consultas, resultado
+
+    def handle(self, *args, **options):
+        try:
+            empresa = Empresa.objects.get(nombre_empresa=options['empresa_alias'])
+            almacen = Almacen.objects.get(empresa=empresa, codigo=options['almacen'])
+        except (Empresa.DoesNotExist, Almacen.DoesNotExist) as e:
+            self.stdout.write(self.style.ERROR(f"Datos maestros no encontrados: {e}"))
+            return
+
+        hasta = datetime.date.fromisoformat(options['hasta']) if options['hasta'] else datetime.date.today()
+        desde = datetime.date.fromisoformat(options['desde']) if options['desde'] \
+            else hasta - datetime.timedelta(days=365)
+
+        producto_ids = list(
+            MovimientoAlmacen.objects.filter(empresa=empresa, almacen=almacen)
+            .values_list('producto_id', flat=True).distinct().order_by('producto_id')[:options['productos']]
+        )
+        argumentos = (empresa.id, almacen.id, producto_ids, desde, hasta)
+        self.stdout.write(f"Kárdex de {len(producto_ids)} productos, {desde} a {hasta} "
+                          f"(mejor de {options['repeticiones']})...")
+
+        t_anterior, q_anterior, anterior = self._medir(iterar_kardex_fila_a_fila, argumentos,
+                                                       options['repeticiones'])
+        t_columnar, q_columnar, columnar = self._medir(iterar_kardex_detallado, argumentos,
+                                                       options['repeticiones'])
+        filas = sum(len(d['kardex']) for d in columnar.values())
+
+        self.stdout.write(f"  Fila por fila: {t_anterior:8.3f} s  {q_anterior:6d} consultas")
+        self.stdout.write(f"  Columnar:      {t_columnar:8.3f} s  {q_columnar:6d} consultas")
+        self.stdout.write(f"  Filas: {filas}  Aceleración: x{t_anterior / max(t_columnar, 1e-9):.1f}")
+
+        if anterior == columnar:
+            self.stdout.write(self.style.SUCCESS("✅ Resultados idénticos."))
+        else:
+            distintos = [pid for pid in anterior if anterior[pid] != columnar.get(pid)]
+            self.stdout.write(self.style.ERROR(f"❌ Resultados distintos en productos: {distintos[:20]}"))
@@ -2,31 +2,59 @@ from django.core.management.base import BaseCommand
 import django_rq
 from rq.registry import StartedJobRegistry
 
+from almacen import estado_sync
+from almacen.models import EstadoJobSync
+from almacen.tasks import limpiar_exportaciones_kardex
+
 
 class Command(BaseCommand):
-    help = 'Limpia trabajos zombis (Started) de Redis a la fuerza'
+    help = ('Limpia trabajos zombis de sincronización: los que figuran activos en el índice de estado '
+            '(EstadoJobSync) pero dejaron de dar señales. Con --todos elimina a la fuerza todo el registro Started. '
+            'También borra las exportaciones de Kárdex vencidas (KARDEX_EXPORT_TTL_SEGUNDOS).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--todos', action='store_true',
+                            help='Elimina todos los trabajos del registro Started (comportamiento anterior).')
 
     def handle(self, *args, **options):
+        borrados = limpiar_exportaciones_kardex()
+        if borrados:
+            self.stdout.write(f"Exportaciones de Kárdex vencidas eliminadas: {borrados}")
+
         queue = django_rq.get_queue('default')
         registry = StartedJobRegistry(queue=queue)
-        connection = queue.connection
 
-        count = registry.count
-        self.stdout.write(f"Trabajos zombis detectados: {count}")
+        if options['todos']:
+            job_ids = registry.get_job_ids()
+        else:
+            zombis = list(estado_sync.zombis())
+            job_ids = [z.job_id for z in zombis if z.job_id]
+            for z in zombis:
+                self.stdout.write(f" - {z.tipo}:{z.empresa_alias or '*'} sin señales desde {z.actualizado:%Y-%m-%d %H:%M:%S}")
+
+        # El índice deja de contarlos como activos
+        EstadoJobSync.objects.filter(
+            job_id__in=job_ids, estado__in=EstadoJobSync.ESTADOS_ACTIVOS
+        ).update(estado=EstadoJobSync.ESTADO_ZOMBI)
 
-        if count == 0:
+        self.stdout.write(f"Trabajos zombis detectados: {len(job_ids)}")
+
+        if not job_ids:
             self.stdout.write(self.style.SUCCESS("No hay nada que limpiar."))
             return
 
-        for job_id in registry.get_job_ids():
+        self._eliminar(queue, registry, job_ids)
+        self.stdout.write(self.style.SUCCESS("✅ Limpieza completada exitosamente."))
+
+    def _eliminar(self, queue, registry, job_ids):
+        connection = queue.connection
+        for job_id in job_ids:
             # Eliminar del registro 'Started' a la fuerza
             connection.zrem(registry.key, job_id)
 
-            # Eliminar la data del trabajo
+            # Eliminar la data del trabajo (también lo saca de la cola si seguía esperando)
             job = queue.fetch_job(job_id)
             if job:
                 job.delete()
 
             self.stdout.write(f" - Eliminado ID: {job_id}")
-
-        self.stdout.write(self.style.SUCCESS("✅ Limpieza completada exitosamente."))
\ No newline at end of file
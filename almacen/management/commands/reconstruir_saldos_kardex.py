@@ -0,0 +1,26 @@
+# almacen/management/commands/reconstruir_saldos_kardex.py
+from django.core.management.base import BaseCommand
+
+from almacen.kardex_saldos import reconstruir_todos_los_saldos
+from importaciones.models import Empresa
+
+
+class Command(BaseCommand):
+    help = 'Regenera los snapshots mensuales del Kárdex (KardexSaldoMensual) desde MovimientoAlmacen.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('empresa_alias', type=str, nargs='?',
+                            help='Nombre de la empresa (ej: F001). Si se omite, regenera todas.')
+
+    def handle(self, *args, **options):
+        empresa_id = None
+        if options['empresa_alias']:
+            try:
+                empresa_id = Empresa.objects.get(nombre_empresa=options['empresa_alias']).id
+            except Empresa.DoesNotExist:
+                self.stdout.write(self.style.ERROR(f"Empresa '{options['empresa_alias']}' no encontrada."))
+                return
+
+        self.stdout.write("Regenerando snapshots mensuales del Kárdex...")
+        total = reconstruir_todos_los_saldos(empresa_id)
+        self.stdout.write(self.style.SUCCESS(f"✅ {total} snapshots generados."))
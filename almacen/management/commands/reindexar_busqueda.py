@@ -0,0 +1,26 @@
+# almacen/management/commands/reindexar_busqueda.py
+from django.core.management.base import BaseCommand
+
+from almacen.busqueda import reindexar_movimientos
+from importaciones.models import Empresa
+
+
+class Command(BaseCommand):
+    help = 'Recalcula la columna de búsqueda (texto_busqueda) de MovimientoAlmacen.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('empresa_alias', type=str, nargs='?',
+                            help='Nombre de la empresa (ej: F001). Si se omite, reindexa todas.')
+
+    def handle(self, *args, **options):
+        empresa_id = None
+        if options['empresa_alias']:
+            try:
+                empresa_id = Empresa.objects.get(nombre_empresa=options['empresa_alias']).id
+            except Empresa.DoesNotExist:
+                self.stdout.write(self.style.ERROR(f"Empresa '{options['empresa_alias']}' no encontrada."))
+                return
+
+        self.stdout.write("Reindexando búsqueda de movimientos...")
+        total = reindexar_movimientos(empresa_id)
+        self.stdout.write(self.style.SUCCESS(f"✅ {total} movimientos actualizados."))
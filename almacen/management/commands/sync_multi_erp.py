@@ -1,11 +1,14 @@
 # almacen/management/commands/sync_multi_erp.py
 import logging
+import multiprocessing
 import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 from django.core.management.base import BaseCommand
-from django.db import transaction
+from django.db import transaction, connections
 
 # Importamos la tarea
-from almacen.tasks import sincronizar_empresa_erp_task
+from almacen.tasks import sincronizar_empresa_erp_task, ALIASES_ERP, SYNC_ERP_MAX_PARALELO
 
 # Importamos modelos para el borrado
 from almacen.models import (
@@ -15,11 +18,29 @@ from almacen.models import (
 from importaciones.models import Empresa
 
 
+def _sincronizar_en_proceso(empresa_alias, start_year, reconciliation_days):
+    """Punto de entrada de cada proceso hijo (una base ERP por proceso)."""
+    try:
+        return sincronizar_empresa_erp_task(
+            empresa_alias=empresa_alias,
+            start_year=start_year,
+            reconciliation_days=reconciliation_days,
+            user_id=None
+        )
+    finally:
+        connections.close_all()
+
+
 class Command(BaseCommand):
-    help = 'Ejecuta la sincronización ERP (Fase 1) en primer plano.'
+    help = 'Ejecuta la sincronización ERP en primer plano (una o varias empresas, en paralelo).'
 
     def add_arguments(self, parser):
-        parser.add_argument('empresa_alias', type=str, help='Alias de la BD ERP (ej: F001).')
+        parser.add_argument('empresa_alias', type=str, nargs='*',
+                            help='Alias de la(s) BD ERP (ej: bd_semilla_starsoft bd_maxi_starsoft).')
+        parser.add_argument('--todas', action='store_true',
+                            help=f"Sincroniza todas las bases ERP configuradas ({', '.join(ALIASES_ERP)}).")
+        parser.add_argument('--paralelo', type=int, default=SYNC_ERP_MAX_PARALELO,
+                            help=f'Máximo de empresas sincronizando a la vez. Default: {SYNC_ERP_MAX_PARALELO}.')
         parser.add_argument('--start-year', type=int, default=2000,
                             help='Año inicial (solo efectivo si es primera vez o con reset).')
 
@@ -38,72 +59,105 @@ class Command(BaseCommand):
         )
 
     def handle(self, *args, **options):
-        empresa_alias = options['empresa_alias']
+        aliases = options['empresa_alias'] or (ALIASES_ERP if options['todas'] else [])
         start_year = options['start_year']
         reset_data = options['reset_all_data']
+        paralelo = max(1, options['paralelo'])
 
         # Capturamos los días (Default 7 si no se pone nada)
         reconciliation_days = options['days']
 
+        if not aliases:
+            self.stdout.write(self.style.ERROR("Indique al menos un alias de empresa o use --todas."))
+            return
+
         # Configuración de Logs
         task_logger = logging.getLogger('almacen.tasks')
         task_logger.setLevel(logging.INFO)
         console_handler = logging.StreamHandler(sys.stdout)
-        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+        formatter = logging.Formatter('%(asctime)s - %(process)d - %(levelname)s - %(message)s')
         console_handler.setFormatter(formatter)
         task_logger.addHandler(console_handler)
 
-        try:
-            empresa = Empresa.objects.get(nombre_empresa=empresa_alias)
-        except Empresa.DoesNotExist:
-            self.stdout.write(self.style.ERROR(f"Empresa '{empresa_alias}' no encontrada."))
-            return
+        empresas = []
+        for empresa_alias in aliases:
+            try:
+                empresas.append(Empresa.objects.get(nombre_empresa=empresa_alias))
+            except Empresa.DoesNotExist:
+                self.stdout.write(self.style.ERROR(f"Empresa '{empresa_alias}' no encontrada."))
+                return
 
-        self.stdout.write(self.style.SUCCESS(f"=== INICIANDO FASE 1 (EXTRACCIÓN) PARA {empresa_alias} ==="))
+        self.stdout.write(self.style.SUCCESS(f"=== INICIANDO FASE 1 (EXTRACCIÓN) PARA {', '.join(aliases)} ==="))
 
         # Lógica de Borrado
         if reset_data:
             self.stdout.write(
-                self.style.WARNING(f"!!! ALERTA: SE BORRARÁ TODA LA DATA HISTÓRICA DE {empresa_alias} !!!"))
+                self.style.WARNING(f"!!! ALERTA: SE BORRARÁ TODA LA DATA HISTÓRICA DE {', '.join(aliases)} !!!"))
             confirm = input(f"¿Estás 100% seguro? Escribe 'SI' para confirmar: ")
 
             if confirm == 'SI':
                 self.stdout.write("Borrando datos... esto puede tardar unos segundos...")
-                with transaction.atomic():
-                    ControlSyncMovAlmacen.objects.filter(empresa=empresa).delete()
-                    # Borramos tablas de la Fase 1 (Legacy)
-                    from almacen.models import LegacyMovAlmCab, LegacyMovAlmDet
-                    LegacyMovAlmDet.objects.filter(empresa=empresa).delete()
-                    LegacyMovAlmCab.objects.filter(empresa=empresa).delete()
-
-                    # También limpiamos las tablas finales para empezar limpio
-                    Transferencia.objects.filter(empresa=empresa).delete()
-                    MovimientoAlmacen.objects.filter(empresa=empresa).delete()
-                    Stock.objects.filter(empresa=empresa).delete()
-
-                    self.stdout.write(self.style.SUCCESS("✅ LIMPIEZA COMPLETA (Legacy + Finales)."))
+                for empresa in empresas:
+                    self._borrar_datos(empresa)
+                self.stdout.write(self.style.SUCCESS("✅ LIMPIEZA COMPLETA (Legacy + Finales)."))
             else:
                 self.stdout.write(self.style.ERROR("Operación cancelada. Saliendo."))
                 return
 
-        # Ejecución Síncrona
         self.stdout.write(
-            self.style.SUCCESS(f"⏳ Iniciando sincronización... (Reconciliación: últimos {reconciliation_days} días)"))
+            self.style.SUCCESS(f"⏳ Iniciando sincronización... (Reconciliación: últimos {reconciliation_days} días, "
+                               f"{min(paralelo, len(aliases))} en paralelo)"))
 
         try:
-            # Llamamos a la función pasando el nuevo argumento
-            resultado = sincronizar_empresa_erp_task(
-                empresa_alias=empresa_alias,
-                start_year=start_year,
-                reconciliation_days=reconciliation_days,  # <-- Pasamos el valor aquí
-                user_id=None
-            )
-
-            self.stdout.write(self.style.SUCCESS(f"\n✨ PROCESO FINALIZADO: {resultado}"))
+            if paralelo == 1 or len(aliases) == 1:
+                # Ejecución Síncrona (mismo proceso)
+                for empresa_alias in aliases:
+                    resultado = sincronizar_empresa_erp_task(
+                        empresa_alias=empresa_alias,
+                        start_year=start_year,
+                        reconciliation_days=reconciliation_days,  # <-- Pasamos el valor aquí
+                        user_id=None
+                    )
+                    self._reportar(empresa_alias, resultado)
+            else:
+                # Un proceso por base ERP: el tiempo total lo marca la más lenta, no la suma
+                connections.close_all()  # Los hijos (fork) abren sus propias conexiones
+                with ProcessPoolExecutor(max_workers=min(paralelo, len(aliases)),
+                                         mp_context=multiprocessing.get_context('fork')) as pool:
+                    futuros = {
+                        pool.submit(_sincronizar_en_proceso, empresa_alias, start_year, reconciliation_days):
+                            empresa_alias
+                        for empresa_alias in aliases
+                    }
+                    for futuro in as_completed(futuros):
+                        empresa_alias = futuros[futuro]
+                        try:
+                            self._reportar(empresa_alias, futuro.result())
+                        except Exception as e:
+                            self._reportar(empresa_alias, f"Error: {e}")
 
         except KeyboardInterrupt:
             self.stdout.write(self.style.ERROR("\n⛔ Proceso interrumpido por el usuario (Ctrl+C)."))
         except Exception as e:
             self.stdout.write(self.style.ERROR(f"\n❌ Ocurrió un error durante la ejecución: {str(e)}"))
         finally:
-            task_logger.removeHandler(console_handler)
\ No newline at end of file
+            task_logger.removeHandler(console_handler)
+
+    def _reportar(self, empresa_alias, resultado):
+        if resultado == "OK":
+            self.stdout.write(self.style.SUCCESS(f"\n✨ {empresa_alias}: PROCESO FINALIZADO ({resultado})"))
+        else:
+            self.stdout.write(self.style.ERROR(f"\n❌ {empresa_alias}: {resultado}"))
+
+    def _borrar_datos(self, empresa):
+        with transaction.atomic():
+            ControlSyncMovAlmacen.objects.filter(empresa=empresa).delete()
+            # Borramos tablas de la Fase 1 (Legacy)
+            from almacen.models import LegacyMovAlmCab, LegacyMovAlmDet
+            LegacyMovAlmDet.objects.filter(empresa=empresa).delete()
+            LegacyMovAlmCab.objects.filter(empresa=empresa).delete()
+
+            # También limpiamos las tablas finales para empezar limpio
+            Transferencia.objects.filter(empresa=empresa).delete()
+            MovimientoAlmacen.objects.filter(empresa=empresa).delete()
+            Stock.objects.filter(empresa=empresa).delete()
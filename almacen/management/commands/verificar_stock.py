@@ -0,0 +1,52 @@
+# almacen/management/commands/verificar_stock.py
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from almacen.models import Stock
+from almacen.stock_ledger import comparar_stock_con_historial
+from importaciones.models import Empresa
+
+
+class Command(BaseCommand):
+    help = 'Compara la tabla Stock (ledger incremental) contra el recálculo completo del historial.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('empresa_alias', type=str, nargs='?',
+                            help='Nombre de la empresa (ej: F001). Si se omite, revisa todas.')
+        parser.add_argument(
+            '--corregir',
+            action='store_true',
+            help='Recalcula desde el historial los pares (almacén, producto) con diferencias.'
+        )
+
+    def handle(self, *args, **options):
+        empresa_id = None
+        if options['empresa_alias']:
+            try:
+                empresa_id = Empresa.objects.get(nombre_empresa=options['empresa_alias']).id
+            except Empresa.DoesNotExist:
+                self.stdout.write(self.style.ERROR(f"Empresa '{options['empresa_alias']}' no encontrada."))
+                return
+
+        diferencias = comparar_stock_con_historial(empresa_id)
+
+        if not diferencias:
+            self.stdout.write(self.style.SUCCESS("✅ El Stock coincide con el historial de movimientos."))
+            return
+
+        self.stdout.write(self.style.WARNING(f"Se encontraron {len(diferencias)} diferencias:"))
+        for dif in diferencias:
+            emp_id, alm_id, prod_id = dif['clave']
+            self.stdout.write(
+                f" - Empresa {emp_id} / Almacén {alm_id} / Producto {prod_id}: "
+                f"actual {dif['ledger_actual']} (esperado {dif['esperado_actual']}), "
+                f"tránsito {dif['ledger_transito']} (esperado {dif['esperado_transito']})"
+            )
+
+        if options['corregir']:
+            with transaction.atomic():
+                for dif in diferencias:
+                    Stock.recalcular_stock_completo(*dif['clave'])
+            self.stdout.write(self.style.SUCCESS(f"✅ {len(diferencias)} registros de Stock recalculados."))
+        else:
+            self.stdout.write("Ejecute con --corregir para recalcularlos desde el historial.")
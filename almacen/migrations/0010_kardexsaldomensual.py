@@ -0,0 +1,33 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('almacen', '0009_historicalregistroestibaje_fecha_operacion_and_more'),
+        ('importaciones', '0038_importacionespermissions_alter_despacho_archivo_pdf'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KardexSaldoMensual',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('periodo', models.DateField(help_text='Primer día del mes')),
+                ('ingresos', models.DecimalField(decimal_places=6, default=0, max_digits=15)),
+                ('salidas', models.DecimalField(decimal_places=6, default=0, max_digits=15)),
+                ('saldo_cierre', models.DecimalField(decimal_places=6, default=0, max_digits=15)),
+                ('almacen', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='kardex_saldos', to='almacen.almacen')),
+                ('empresa', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='kardex_saldos', to='importaciones.empresa')),
+                ('producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='kardex_saldos', to='importaciones.producto')),
+            ],
+            options={
+                'verbose_name': 'Saldo Mensual Kárdex',
+                'verbose_name_plural': 'Saldos Mensuales Kárdex',
+                'unique_together': {('empresa', 'almacen', 'producto', 'periodo')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('almacen', '0010_kardexsaldomensual'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='legacymovalmcab',
+            name='hash_erp',
+            field=models.CharField(blank=True, max_length=40, null=True),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('almacen', '0011_legacymovalmcab_hash_erp'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='controlsyncmovalmacen',
+            name='fase2_desde',
+            field=models.DateTimeField(blank=True, help_text='Inicio (CAFECDOC) del rango de la Fase 2 pendiente', null=True),
+        ),
+        migrations.AddField(
+            model_name='controlsyncmovalmacen',
+            name='fase2_ultima_clave',
+            field=models.CharField(blank=True, help_text='CAALMA|CATD|CANUMDOC de la última cabecera Legacy confirmada en la Fase 2', max_length=20, null=True),
+        ),
+        migrations.AddField(
+            model_name='controlsyncmovalmacen',
+            name='fase2_ultima_fecha',
+            field=models.DateTimeField(blank=True, help_text='CAFECDOC de la última cabecera Legacy confirmada en la Fase 2', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='legacymovalmcab',
+            index=models.Index(fields=['empresa', 'cafecdoc', 'caalma', 'catd', 'canumdoc'], name='legacy_mova_empresa_641d4d_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='legacymovalmcab',
+            name='legacy_mova_empresa_089cd9_idx',
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('almacen', '0012_checkpoint_fase2'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='movimientoalmacen',
+            index=models.Index(fields=['fecha_documento', 'id'], name='almacen_mov_fecha_d_7ec967_idx'),
+        ),
+    ]
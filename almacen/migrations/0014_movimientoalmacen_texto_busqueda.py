@@ -0,0 +1,59 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:22
+
+from django.db import migrations, models
+
+
+def crear_fulltext(apps, schema_editor):
+    # Django no genera índices FULLTEXT: solo en MySQL (otros motores usan icontains)
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    schema_editor.execute(
+        'CREATE FULLTEXT INDEX almacen_mov_texto_busqueda_ft ON almacen_movimientoalmacen (texto_busqueda)'
+    )
+
+
+def eliminar_fulltext(apps, schema_editor):
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    schema_editor.execute('DROP INDEX almacen_mov_texto_busqueda_ft ON almacen_movimientoalmacen')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('almacen', '0013_movimientoalmacen_cursor_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historicalmovimientoalmacen',
+            name='texto_busqueda',
+            field=models.TextField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='movimientoalmacen',
+            name='texto_busqueda',
+            field=models.TextField(blank=True, editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='historicalmovimientoalmacen',
+            name='numero_documento_erp',
+            field=models.CharField(db_index=True, help_text='Ej: 0000001 (viene de CANUMDOC/DENUMDOC)', max_length=11),
+        ),
+        migrations.AlterField(
+            model_name='historicalmovimientoalmacen',
+            name='referencia_documento',
+            field=models.CharField(blank=True, db_index=True, max_length=25, null=True),
+        ),
+        migrations.AlterField(
+            model_name='movimientoalmacen',
+            name='numero_documento_erp',
+            field=models.CharField(db_index=True, help_text='Ej: 0000001 (viene de CANUMDOC/DENUMDOC)', max_length=11),
+        ),
+        migrations.AlterField(
+            model_name='movimientoalmacen',
+            name='referencia_documento',
+            field=models.CharField(blank=True, db_index=True, max_length=25, null=True),
+        ),
+        migrations.RunPython(crear_fulltext, eliminar_fulltext),
+    ]
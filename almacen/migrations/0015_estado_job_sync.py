@@ -0,0 +1,40 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:47
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('almacen', '0014_movimientoalmacen_texto_busqueda'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstadoJobSync',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('empresa', 'Sincronización de una empresa'), ('multi', 'Sincronización multi-empresa')], max_length=20)),
+                ('empresa_alias', models.CharField(blank=True, default='', help_text='Alias de la base ERP (vacío en el job multi-empresa)', max_length=100)),
+                ('job_id', models.CharField(blank=True, max_length=100, null=True)),
+                ('estado', models.CharField(choices=[('queued', 'En cola'), ('started', 'En curso'), ('finished', 'Finalizado'), ('failed', 'Fallido'), ('zombie', 'Zombi')], default='queued', max_length=20)),
+                ('percent', models.FloatField(default=0)),
+                ('message', models.CharField(blank=True, default='', max_length=255)),
+                ('detalle', models.JSONField(blank=True, help_text="Jobs hijos del multi-empresa: {'hijos': {alias: job_id}}", null=True)),
+                ('encolado', models.DateTimeField(blank=True, null=True)),
+                ('iniciado', models.DateTimeField(blank=True, null=True)),
+                ('actualizado', models.DateTimeField(auto_now=True)),
+                ('expira', models.DateTimeField(help_text='Sin una nueva señal antes de esta fecha, el job se considera zombi')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Estado Job Sincronización',
+                'verbose_name_plural': 'Estados Jobs Sincronización',
+                'indexes': [models.Index(fields=['user', 'estado'], name='estado_job_sync_user_idx'), models.Index(fields=['estado', 'expira'], name='estado_job_sync_expira_idx')],
+                'constraints': [models.UniqueConstraint(fields=('tipo', 'empresa_alias'), name='unique_tipo_alias_estado_job_sync')],
+            },
+        ),
+    ]
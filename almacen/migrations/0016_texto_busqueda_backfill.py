@@ -0,0 +1,19 @@
+from django.db import migrations
+
+
+def rellenar_texto_busqueda(apps, schema_editor):
+    # 0014 agregó la columna vacía: sin esto los movimientos fuera de la ventana de sync no se encuentran
+    from almacen.busqueda import reindexar_movimientos
+
+    reindexar_movimientos(modelo=apps.get_model('almacen', 'MovimientoAlmacen'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('almacen', '0015_estado_job_sync'),
+    ]
+
+    operations = [
+        migrations.RunPython(rellenar_texto_busqueda, migrations.RunPython.noop),
+    ]
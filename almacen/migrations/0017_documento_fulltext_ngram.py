@@ -0,0 +1,28 @@
+from django.db import migrations
+
+
+def crear_fulltext_ngram(apps, schema_editor):
+    # Búsqueda infija de números de documento (almacen/busqueda.py). Solo en MySQL.
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    schema_editor.execute(
+        'CREATE FULLTEXT INDEX almacen_mov_documento_ngram_ft ON almacen_movimientoalmacen '
+        '(numero_documento_erp, referencia_documento) WITH PARSER ngram'
+    )
+
+
+def eliminar_fulltext_ngram(apps, schema_editor):
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    schema_editor.execute('DROP INDEX almacen_mov_documento_ngram_ft ON almacen_movimientoalmacen')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('almacen', '0016_texto_busqueda_backfill'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_fulltext_ngram, eliminar_fulltext_ngram),
+    ]
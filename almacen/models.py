@@ -1,5 +1,5 @@
 from django.db import models, transaction
-from django.db.models import Sum, F, Q, DecimalField
+from django.db.models import Sum, F, Q, Max, DecimalField
 from django.db.models.functions import Coalesce
 from django.utils import timezone
 import base.models
@@ -334,6 +334,8 @@ class LegacyMovAlmCab(models.Model):
 
     # --- Control de Sincronización (Opcional pero recomendado) ---
     # fecha_sincronizado = models.DateTimeField(auto_now=True)
+    # Firma del documento en el ERP (cabecera + detalles): la reconciliación solo toca los que cambian
+    hash_erp = models.CharField(max_length=40, null=True, blank=True)
 
     class Meta:
         managed = True  # Django gestionará esta tabla en MySQL
@@ -345,7 +347,8 @@ class LegacyMovAlmCab(models.Model):
             models.UniqueConstraint(fields=['empresa', 'caalma', 'catd', 'canumdoc'], name='unique_legacy_cab_pk')
         ]
         indexes = [
-            models.Index(fields=['empresa', 'cafecdoc']),  # Para buscar por fecha
+            # Para buscar por fecha y recorrer la Fase 2 por (cafecdoc, clave) sin ordenar en memoria
+            models.Index(fields=['empresa', 'cafecdoc', 'caalma', 'catd', 'canumdoc']),
         ]
 
 
@@ -454,7 +457,8 @@ class MovimientoAlmacen(base.models.BaseModel):  # Hereda de tu BaseModel
                                   help_text="PK de MOVALMDET (ej: AD-NI-0000001-1)")
     # --- Datos del Movimiento (Mapeados desde ERP) ---
     tipo_documento_erp = models.CharField(max_length=2, help_text="Ej: NI, GS, TR (viene de CATD/DETD)")
-    numero_documento_erp = models.CharField(max_length=11, help_text="Ej: 0000001 (viene de CANUMDOC/DENUMDOC)")
+    numero_documento_erp = models.CharField(max_length=11, db_index=True,
+                                            help_text="Ej: 0000001 (viene de CANUMDOC/DENUMDOC)")
     item_erp = models.IntegerField(help_text="Número de línea (viene de DEITEM)")
     fecha_documento = models.DateTimeField()
     fecha_movimiento = models.DateTimeField(null=True, blank=True, help_text="Podría ser CAFECDOC o CAFECACT")
@@ -464,7 +468,7 @@ class MovimientoAlmacen(base.models.BaseModel):  # Hereda de tu BaseModel
     valor_total = models.DecimalField(max_digits=15, decimal_places=6, default=0)
     glosa_cabecera = models.TextField(null=True, blank=True)
     glosa_detalle = models.TextField(null=True, blank=True)
-    referencia_documento = models.CharField(max_length=25, null=True, blank=True)
+    referencia_documento = models.CharField(max_length=25, null=True, blank=True, db_index=True)
     numero_orden_compra = models.TextField(null=True, blank=True)  # TextField por CANUMORD(5000)
     lote = models.CharField(max_length=50, null=True, blank=True)
     serie = models.CharField(max_length=50, null=True, blank=True)
@@ -493,6 +497,8 @@ class MovimientoAlmacen(base.models.BaseModel):  # Hereda de tu BaseModel
     )
     cantidad_bultos = models.DecimalField(max_digits=15, decimal_places=2, null=True, blank=True,
                                           help_text="Cantidad de bultos (ej. campo CANTBULTOS del ERP)")
+    # Copia desnormalizada de los textos buscables (índice FULLTEXT en MySQL, ver almacen/busqueda.py)
+    texto_busqueda = models.TextField(null=True, blank=True, editable=False)
 
     #sede_afecta=models.CharField(max_length=10,null=True,blank=True,help_text="AQP= AREQUIPA, LM= LIMA, NA= no aplica")
     #estado_mov=models.
@@ -507,6 +513,10 @@ class MovimientoAlmacen(base.models.BaseModel):  # Hereda de tu BaseModel
                 name='unique_erp_detail_movement'
             )
         ]
+        indexes = [
+            # Paginación por cursor del listado: ORDER BY fecha_documento DESC, id DESC
+            models.Index(fields=['fecha_documento', 'id']),
+        ]
 
     @property
     def descripcion_visual(self):
@@ -629,7 +639,8 @@ class Stock(models.Model):
             state=True
         ).aggregate(
             ingresos=Coalesce(Sum('cantidad', filter=Q(es_ingreso=True)), 0, output_field=DecimalField()),
-            salidas=Coalesce(Sum('cantidad', filter=Q(es_ingreso=False)), 0, output_field=DecimalField())
+            salidas=Coalesce(Sum('cantidad', filter=Q(es_ingreso=False)), 0, output_field=DecimalField()),
+            ultima_fecha=Max('fecha_documento')
         )
 
         stock_actual = agregado['ingresos'] - agregado['salidas']
@@ -652,11 +663,35 @@ class Stock(models.Model):
             producto_id=producto_id,
             defaults={
                 'cantidad_actual': stock_actual,
-                'cantidad_en_transito': en_transito
+                'cantidad_en_transito': en_transito,
+                'fecha_ultimo_movimiento': agregado['ultima_fecha']
             }
         )
 
 
+class KardexSaldoMensual(models.Model):
+    """
+    Saldo de cierre por (empresa, almacén, producto) al final de cada mes (UTC) con movimientos.
+    El Kárdex parte del snapshot más cercano y solo suma la cola hasta la fecha de inicio.
+    Se mantiene desde el ledger de stock y se reconstruye con `reconstruir_saldos_kardex`.
+    """
+    empresa = models.ForeignKey(Empresa, on_delete=models.CASCADE, related_name='kardex_saldos')
+    almacen = models.ForeignKey(Almacen, on_delete=models.CASCADE, related_name='kardex_saldos')
+    producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='kardex_saldos')
+    periodo = models.DateField(help_text="Primer día del mes")
+    ingresos = models.DecimalField(max_digits=15, decimal_places=6, default=0)
+    salidas = models.DecimalField(max_digits=15, decimal_places=6, default=0)
+    saldo_cierre = models.DecimalField(max_digits=15, decimal_places=6, default=0)
+
+    class Meta:
+        unique_together = (('empresa', 'almacen', 'producto', 'periodo'),)
+        verbose_name = "Saldo Mensual Kárdex"
+        verbose_name_plural = "Saldos Mensuales Kárdex"
+
+    def __str__(self):
+        return f"{self.producto_id} en {self.almacen_id} ({self.periodo:%Y-%m}): {self.saldo_cierre}"
+
+
 class Transferencia(base.models.BaseModel):
     ESTADOS = [
         ('EN_TRANSITO', 'En Tránsito'),
@@ -701,31 +736,27 @@ class Transferencia(base.models.BaseModel):
     def __str__(self):
         return f"Traslado {self.id_erp_salida_det} ({self.estado})"
 
-    def _disparar_recalculo_stock(self):
-        """
-        Función helper que se ejecuta DESPUÉS de que la transacción se haya guardado.
-        """
-        logger.info(f"COMMIT exitoso para {self.id}. Disparando recálculo de stock...")
-        try:
-            Stock.recalcular_stock_completo(
-                self.empresa_id,
-                self.almacen_origen_id,
-                self.producto_id
-            )
-            Stock.recalcular_stock_completo(
-                self.empresa_id,
-                self.almacen_destino_id,
-                self.producto_id
-            )
-            logger.info(f"Recálculo completado para {self.id}.")
-        except Exception as e:
-            logger.error(f"Error en recálculo de stock POST-COMMIT para {self.id}: {e}", exc_info=True)
+    def _registrar_movimiento_ingreso(self, ledger, pk_det, valores):
+        """update_or_create del movimiento NI registrando en el ledger el aporte anterior y el nuevo."""
+        anterior = MovimientoAlmacen.objects.filter(empresa=self.empresa, id_erp_det=pk_det).first()
+        ledger.movimiento(anterior, signo=-1)
+        from .busqueda import texto_busqueda_movimiento
+        valores['texto_busqueda'] = texto_busqueda_movimiento(valores['producto'].nombre_producto, valores)
+        movimiento, _ = MovimientoAlmacen.objects.update_or_create(
+            empresa=self.empresa, id_erp_det=pk_det, defaults=valores
+        )
+        ledger.movimiento(movimiento)
 
+    @transaction.atomic
     def recibir_mercaderia(self, cantidad_recibida, fecha_recepcion, notas='', auto_recepcion=False,
                            _skip_recalc_signal=False):
         if self.estado != 'EN_TRANSITO':
             return False
 
+        from .stock_ledger import LedgerStock
+        ledger = LedgerStock()
+        ledger.transferencia(self, signo=-1)  # deja de estar en tránsito
+
         # 1. Actualizar estado de la Transferencia
         recibida = cantidad_recibida or 0
         diferencia = recibida - self.cantidad_enviada
@@ -751,7 +782,7 @@ class Transferencia(base.models.BaseModel):
 
         # 2. CREAR EL MOVIMIENTO (NI) USANDO DATA LEGACY
         if self.estado in ['RECIBIDO', 'RECIBIDO_PARCIAL', 'RECIBIDO_SOBRANTE']:
-            from .models import MovimientoAlmacen, LegacyMovAlmCab, LegacyMovAlmDet
+            from .models import LegacyMovAlmCab, LegacyMovAlmDet
 
             # A. Identificar IDs
             # Si el sync ya vinculó la NI, usamos ese ID. Si no, generamos uno temporal.
@@ -854,28 +885,25 @@ class Transferencia(base.models.BaseModel):
                 }
 
             # D. Crear/Actualizar el Movimiento
-            MovimientoAlmacen.objects.update_or_create(
-                empresa=self.empresa,
-                id_erp_det=pk_det,
-                defaults={
-                    'id_erp_cab': pk_cab,
-                    'almacen': self.almacen_destino,
-                    'producto': self.producto,
-                    'es_ingreso': True,
-                    'state': True,
-                    **datos_movimiento  # Desempaquetamos los datos (Legacy o Básicos)
-                }
-            )
-
-        # 3. Recálculo de Stock
+            self._registrar_movimiento_ingreso(ledger, pk_det, {
+                'id_erp_cab': pk_cab,
+                'almacen': self.almacen_destino,
+                'producto': self.producto,
+                'es_ingreso': True,
+                'state': True,
+                **datos_movimiento  # Desempaquetamos los datos (Legacy o Básicos)
+            })
+
+        # 3. Ajuste incremental de Stock (misma transacción)
         if not _skip_recalc_signal:
-            logger.info(f"Transferencia {self.id} recibida. Recalculando stock.")
-            transaction.on_commit(self._disparar_recalculo_stock)
+            ledger.aplicar()
+            logger.info(f"Transferencia {self.id} recibida. Stock ajustado.")
         else:
-            logger.info(f"Transferencia {self.id} recibida (re-cálculo omitido).")
+            logger.info(f"Transferencia {self.id} recibida (ajuste de stock omitido).")
 
         return True
 
+    @transaction.atomic
     def revertir_recepcion(self):
         """
         Revierte una transferencia a 'EN_TRANSITO' y ELIMINA el movimiento de ingreso generado.
@@ -884,18 +912,20 @@ class Transferencia(base.models.BaseModel):
             logger.warning(f"Intento de revertir transferencia {self.id} que ya está EN TRANSITO.")
             return False
 
-        # --- 1. ¡NUEVO! ELIMINAR EL MOVIMIENTO DE ALMACÉN ---
-        # Importamos aquí para evitar referencia circular
-        from .models import MovimientoAlmacen
+        from .stock_ledger import LedgerStock
+        ledger = LedgerStock()
 
+        # --- 1. ¡NUEVO! ELIMINAR EL MOVIMIENTO DE ALMACÉN ---
         # Buscamos el movimiento usando la misma clave (ID) que usamos para crearlo.
         # Nota: Usamos 'id_erp_ingreso_det' o el ID generado por la web.
         id_bussines_key = self.id_erp_ingreso_det or f"WEB-TR-{self.id}-IN"
 
-        deleted_count, _ = MovimientoAlmacen.objects.filter(
+        movimientos = MovimientoAlmacen.objects.filter(
             empresa=self.empresa,
             id_erp_det=id_bussines_key
-        ).delete()
+        )
+        ledger.movimientos_eliminados(movimientos)
+        deleted_count, _ = movimientos.delete()
 
         logger.info(f"Reversión TR-{self.id}: Se eliminaron {deleted_count} registros de MovimientoAlmacen.")
 
@@ -910,10 +940,10 @@ class Transferencia(base.models.BaseModel):
         # --- 3. Guardar cambios en la Transferencia ---
         self.save()
 
-        # --- 4. Recalcular Stock ---
-        # Ahora que borramos el MovimientoAlmacen, al recalcular, el stock bajará.
-        # IMPORTANTE: Sin paréntesis en la función, como corregimos antes.
-        transaction.on_commit(self._disparar_recalculo_stock)
+        # --- 4. Ajustar Stock ---
+        # Baja el ingreso borrado en destino y vuelve a sumar el tránsito en origen.
+        ledger.transferencia(self)
+        ledger.aplicar()
 
         logger.info(f"Transferencia {self.id} revertida exitosamente.")
         return True
@@ -940,6 +970,25 @@ class ControlSyncMovAlmacen(models.Model):
         help_text="Cuándo se ejecutó la última comparación completa de claves (para anulaciones)"
     )
 
+    # --- Checkpoint de la Fase 2 (Legacy -> Final) ---
+    # Solo tienen valor mientras hay una Fase 2 pendiente; se limpian al terminarla.
+    fase2_desde = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="Inicio (CAFECDOC) del rango de la Fase 2 pendiente"
+    )
+    fase2_ultima_fecha = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="CAFECDOC de la última cabecera Legacy confirmada en la Fase 2"
+    )
+    fase2_ultima_clave = models.CharField(
+        max_length=20,
+        null=True,
+        blank=True,
+        help_text="CAALMA|CATD|CANUMDOC de la última cabecera Legacy confirmada en la Fase 2"
+    )
+
     class Meta:
         # Hacemos que la empresa sea la clave primaria si solo hay una entrada por empresa
         constraints = [
@@ -953,6 +1002,64 @@ class ControlSyncMovAlmacen(models.Model):
         return f"Sync MovAlm {self.empresa.nombre_empresa}: {fecha_str}"
 
 
+class EstadoJobSync(models.Model):
+    """
+    Índice del estado de los jobs de sincronización (ver estado_sync.py).
+    Una fila por (tipo de tarea, base ERP); se actualiza al encolar, iniciar,
+    avanzar y terminar. 'expira' se renueva con cada escritura: un job activo
+    con 'expira' vencido dejó de dar señales (zombi).
+    """
+    TIPO_EMPRESA = 'empresa'
+    TIPO_MULTI = 'multi'
+    TIPOS = [
+        (TIPO_EMPRESA, 'Sincronización de una empresa'),
+        (TIPO_MULTI, 'Sincronización multi-empresa'),
+    ]
+
+    ESTADO_EN_COLA = 'queued'
+    ESTADO_EN_CURSO = 'started'
+    ESTADO_FINALIZADO = 'finished'
+    ESTADO_FALLIDO = 'failed'
+    ESTADO_ZOMBI = 'zombie'
+    ESTADOS = [
+        (ESTADO_EN_COLA, 'En cola'),
+        (ESTADO_EN_CURSO, 'En curso'),
+        (ESTADO_FINALIZADO, 'Finalizado'),
+        (ESTADO_FALLIDO, 'Fallido'),
+        (ESTADO_ZOMBI, 'Zombi'),
+    ]
+    ESTADOS_ACTIVOS = (ESTADO_EN_COLA, ESTADO_EN_CURSO)
+
+    tipo = models.CharField(max_length=20, choices=TIPOS)
+    empresa_alias = models.CharField(max_length=100, blank=True, default='',
+                                     help_text="Alias de la base ERP (vacío en el job multi-empresa)")
+    job_id = models.CharField(max_length=100, null=True, blank=True)
+    user = models.ForeignKey('auth.User', on_delete=models.SET_NULL, null=True, blank=True,
+                             related_name='+')
+    estado = models.CharField(max_length=20, choices=ESTADOS, default=ESTADO_EN_COLA)
+    percent = models.FloatField(default=0)
+    message = models.CharField(max_length=255, blank=True, default='')
+    detalle = models.JSONField(null=True, blank=True, help_text="Jobs hijos del multi-empresa: {'hijos': {alias: job_id}}")
+    encolado = models.DateTimeField(null=True, blank=True)
+    iniciado = models.DateTimeField(null=True, blank=True)
+    actualizado = models.DateTimeField(auto_now=True)
+    expira = models.DateTimeField(help_text="Sin una nueva señal antes de esta fecha, el job se considera zombi")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['tipo', 'empresa_alias'], name='unique_tipo_alias_estado_job_sync')
+        ]
+        indexes = [
+            models.Index(fields=['user', 'estado'], name='estado_job_sync_user_idx'),
+            models.Index(fields=['estado', 'expira'], name='estado_job_sync_expira_idx'),
+        ]
+        verbose_name = "Estado Job Sincronización"
+        verbose_name_plural = "Estados Jobs Sincronización"
+
+    def __str__(self):
+        return f"{self.tipo}:{self.empresa_alias or '*'} {self.estado} ({self.percent}%)"
+
+
 class TipoEstibaje(base.models.BaseModel):
     """
     Catálogo de servicios y sus tarifas base.
@@ -0,0 +1,113 @@
+# almacen/progreso.py
+"""
+Reporte de progreso de la sincronización con eventos agrupados.
+
+El bucle de sincronización avisa su avance en cada lote (50-500 filas). Enviar
+cada aviso por WebSocket y guardarlo en job.meta pone idas y vueltas a Redis en
+el bucle y satura al navegador en una resincronización completa. ReporteProgreso
+se queda con el último avance y solo lo publica (grupo de la empresa + job.meta,
+con la misma cadencia) cuando:
+
+- pasó el intervalo mínimo (SYNC_PROGRESO_MAX_POR_SEGUNDO) y el porcentaje avanzó
+  al menos SYNC_PROGRESO_DELTA_MINIMO, o pasó el latido (SYNC_PROGRESO_LATIDO_SEGUNDOS)
+  sin publicar;
+- cambia la fase (se publica el cierre de la anterior y el inicio de la nueva);
+- se publica un estado (started, running_f1, finished, failed...), que primero
+  vacía el avance pendiente.
+
+Con 'indice' = (tipo, alias) cada publicación también renueva la fila del job en
+el índice de estado (estado_sync.py), que sirve de latido para detectar zombis.
+"""
+import time
+
+from django.conf import settings
+from rq import get_current_job
+
+SYNC_PROGRESO_MAX_POR_SEGUNDO = getattr(settings, 'SYNC_PROGRESO_MAX_POR_SEGUNDO', 2)
+SYNC_PROGRESO_DELTA_MINIMO = getattr(settings, 'SYNC_PROGRESO_DELTA_MINIMO', 1.0)
+SYNC_PROGRESO_LATIDO_SEGUNDOS = getattr(settings, 'SYNC_PROGRESO_LATIDO_SEGUNDOS', 10)
+
+
+class ReporteProgreso:
+    """Avances de una sincronización hacia el grupo de la empresa y el job.meta, agrupados."""
+
+    def __init__(self, empresa_id=None, max_por_segundo=SYNC_PROGRESO_MAX_POR_SEGUNDO,
+                 delta_minimo=SYNC_PROGRESO_DELTA_MINIMO, latido=SYNC_PROGRESO_LATIDO_SEGUNDOS,
+                 reloj=time.monotonic, indice=None):
+        self.empresa_id = empresa_id
+        self.indice = indice
+        self.intervalo = 1 / max_por_segundo if max_por_segundo else 0
+        self.delta_minimo = delta_minimo
+        self.latido = latido
+        self._reloj = reloj
+        self._job = get_current_job()
+        self._pendiente = None  # (percent, message, phase) aún sin publicar
+        self._ultimo_percent = None
+        self._ultima_fase = None
+        self._ultimo_envio = None
+
+    # --- API ---
+
+    def avance(self, percent, message, phase=None):
+        """Registra el avance; se publica solo si toca según la cadencia o cambió la fase."""
+        if phase != self._ultima_fase and self._ultima_fase is not None:
+            self.vaciar()
+        self._pendiente = (percent, message, phase)
+        if self._debe_publicar(percent, phase):
+            self.vaciar()
+
+    def estado(self, status, message, result=None, percent=None):
+        """Cambio de estado: siempre se publica (antes se vacía el avance pendiente)."""
+        self.vaciar()
+        self._enviar(status, message, result)
+        if percent is not None:
+            self._guardar_meta(percent, message)
+
+    def finalizar(self, result="OK"):
+        self.estado('finished', "Proceso Exitoso.", result=result)
+        self._guardar_meta(100, "Finalizado")
+
+    def vaciar(self):
+        """Publica el último avance pendiente (si lo hay)."""
+        if self._pendiente is None:
+            return
+        percent, message, phase = self._pendiente
+        self._pendiente = None
+        self._enviar('progress', message, {'percent': percent, 'phase': phase})
+        self._guardar_meta(percent, message)
+        self._ultimo_percent, self._ultima_fase = percent, phase
+        self._ultimo_envio = self._reloj()
+
+    # --- Internos ---
+
+    def _debe_publicar(self, percent, phase):
+        if self._ultimo_envio is None or phase != self._ultima_fase:
+            return True
+        transcurrido = self._reloj() - self._ultimo_envio
+        if transcurrido < self.intervalo:
+            return False
+        return (abs(percent - (self._ultimo_percent or 0)) >= self.delta_minimo
+                or transcurrido >= self.latido)
+
+    def _enviar(self, status, message, result=None):
+        from .tasks import notificar_grupo_empresa
+
+        notificar_grupo_empresa(self.empresa_id, status, message, result=result)
+
+    def _guardar_meta(self, percent, message):
+        """Mismo formato que actualizar_progreso_job (recuperación con F5) + índice de estado."""
+        if not self._job:
+            return
+        try:
+            self._job.meta['progress_percent'] = percent
+            self._job.meta['progress_message'] = message
+            self._job.save_meta()
+        except Exception:
+            pass
+        if self.indice:
+            from .estado_sync import registrar_avance
+
+            try:
+                registrar_avance(*self.indice, self._job.id, percent, message)
+            except Exception:
+                pass
@@ -1,13 +1,15 @@
 # almacen/services.py
 import datetime
 from decimal import Decimal
-from django.db.models import Sum, Q, DecimalField
+from django.db.models import Sum, DecimalField
 from django.db.models.functions import Coalesce
 from django.utils import timezone
 from .models import (
     MovimientoAlmacen, Transferencia, Stock,
     Empresa, Almacen, Producto, MovimientoAlmacenNota
 )
+from .kardex_saldos import saldo_anterior
+from .kardex_columnar import iterar_kardex_columnar, stock_en_transito
 
 
 # --- HELPERS DE FECHA (UTC PURO) ---
@@ -62,26 +64,15 @@ def _calcular_kardex_para_un_producto(empresa_id, almacen_id, producto_id, fecha
     # =========================================================================
     # 1. CÁLCULO DE SALDO ANTERIOR
     # =========================================================================
-    saldo_agg = MovimientoAlmacen.objects.filter(
-        empresa_id=empresa_id,
-        almacen_id=almacen_id,
-        producto_id=producto_id,
-        fecha_documento__lt=utc_start,
-        state=True,
-        estado_erp__in=['V', 'F', 'P']
-    ).aggregate(
-        ingresos=Coalesce(Sum('cantidad', filter=Q(es_ingreso=True)), Decimal('0'), output_field=DecimalField()),
-        salidas=Coalesce(Sum('cantidad', filter=Q(es_ingreso=False)), Decimal('0'), output_field=DecimalField())
-    )
-
-    saldo_inicial = saldo_agg['ingresos'] - saldo_agg['salidas']
+    # Snapshot mensual más cercano + cola del mes (ver kardex_saldos)
+    saldo_inicial = saldo_anterior(empresa_id, almacen_id, producto_id, utc_start)
 
     # =========================================================================
     # 2. OBTENCIÓN DE DATOS (MOVIMIENTOS + NOTAS)
     # =========================================================================
 
     # A. Traemos los movimientos (Incluimos 'id_erp_cab' y 'glosa_detalle')
-    movs = MovimientoAlmacen.objects.filter(
+    movs = list(MovimientoAlmacen.objects.filter(
         empresa_id=empresa_id,
         almacen_id=almacen_id,
         producto_id=producto_id,
@@ -95,7 +86,7 @@ def _calcular_kardex_para_un_producto(empresa_id, almacen_id, producto_id, fecha
         'glosa_cabecera', 'glosa_detalle',  # Traemos ambas glosas
         'cliente_erp_nombre', 'nombre_proveedor',
         'referencia_documento', 'codigo_movimiento', 'almacen_ref'
-    ).order_by('fecha_documento')
+    ).order_by('fecha_documento'))
 
     # B. Traemos las Notas Externas (Optimización en memoria)
     # Extraemos IDs únicos de documentos
@@ -202,8 +193,40 @@ def _calcular_kardex_para_un_producto(empresa_id, almacen_id, producto_id, fecha
 
 def get_kardex_detallado(empresa_id, almacen_id, producto_ids, fecha_inicio, fecha_fin):
     """Genera el reporte consolidado."""
+    return dict(iterar_kardex_detallado(empresa_id, almacen_id, producto_ids, fecha_inicio, fecha_fin))
+
 
-    reporte_consolidado = {}
+def iterar_kardex_detallado(empresa_id, almacen_id, producto_ids, fecha_inicio, fecha_fin):
+    """
+    Igual que get_kardex_detallado pero produce (producto_id, datos) de a uno,
+    para que las exportaciones escriban cada producto sin retener el reporte completo.
+    Usa el motor columnar (kardex_columnar): consultas por lote de productos, no por producto.
+    """
+    productos_validos = list(
+        Producto.objects.filter(empresa_id=empresa_id, id__in=producto_ids)
+        .values('id', 'codigo_producto', 'nombre_producto')
+    )
+    productos = {p['id']: p for p in productos_validos}
+
+    # EXTRA: stock en tránsito para el encabezado del reporte (informativo, no suma al Kárdex físico)
+    transito = stock_en_transito(empresa_id, almacen_id, productos)
+
+    for producto_id, kardex_producto in iterar_kardex_columnar(
+            empresa_id, almacen_id, [p['id'] for p in productos_validos], fecha_inicio, fecha_fin):
+        producto = productos[producto_id]
+        yield producto_id, {
+            "codigo_producto": producto['codigo_producto'],
+            "nombre_producto": producto['nombre_producto'],
+            "stock_en_transito": transito[producto_id],  # <--- Dato nuevo útil
+            "kardex": kardex_producto
+        }
+
+
+def iterar_kardex_fila_a_fila(empresa_id, almacen_id, producto_ids, fecha_inicio, fecha_fin):
+    """
+    Implementación anterior (un cálculo y un agregado de tránsito por producto).
+    Se conserva como referencia para el comando benchmark_kardex.
+    """
     productos_validos = Producto.objects.filter(empresa_id=empresa_id, id__in=producto_ids)
 
     for producto in productos_validos:
@@ -211,22 +234,18 @@ def get_kardex_detallado(empresa_id, almacen_id, producto_ids, fecha_inicio, fec
             empresa_id, almacen_id, producto.id, fecha_inicio, fecha_fin
         )
 
-        # EXTRA: Calculamos el stock en tránsito para mostrarlo en el encabezado del reporte
-        # Esto lee de Transferencia, pero NO se suma al Kárdex físico, es solo informativo.
         stock_transito = Transferencia.objects.filter(
             empresa_id=empresa_id,
-            almacen_destino_id=almacen_id,  # Lo que viene HACIA mí
+            almacen_destino_id=almacen_id,
             producto_id=producto.id,
             estado='EN_TRANSITO'
         ).aggregate(
             total=Coalesce(Sum('cantidad_enviada'), Decimal('0'), output_field=DecimalField())
         )['total']
 
-        reporte_consolidado[producto.id] = {
+        yield producto.id, {
             "codigo_producto": producto.codigo_producto,
             "nombre_producto": producto.nombre_producto,
-            "stock_en_transito": stock_transito,  # <--- Dato nuevo útil
+            "stock_en_transito": stock_transito,
             "kardex": kardex_producto
         }
-
-    return reporte_consolidado
@@ -0,0 +1,178 @@
+# almacen/stock_ledger.py
+"""
+Ledger incremental de Stock.
+
+En lugar de re-sumar TODO el historial de MovimientoAlmacen por cada
+(almacén, producto) afectado, cada escritura registra su aporte con signo:
+
+    ledger = LedgerStock()
+    ledger.movimiento(mov_anterior, signo=-1)   # retira el aporte previo
+    ... crear / actualizar / borrar ...
+    ledger.movimiento(mov_nuevo)                # suma el aporte actual
+    ledger.aplicar()                            # un UPDATE por par afectado
+
+El costo depende de las filas cambiadas, no de los años de historial.
+Los snapshots mensuales del Kárdex (KardexSaldoMensual) de cada par se
+regeneran desde el mes más antiguo tocado.
+"""
+import logging
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db.models import F, Value, Sum, Min, Q, DecimalField
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import MovimientoAlmacen, Transferencia, Stock
+from .kardex_saldos import reconstruir_saldos_mensuales
+
+logger = logging.getLogger(__name__)
+
+CERO = Decimal('0')
+
+
+def aporte_movimiento(mov):
+    """(clave_stock, cantidad con signo) de un movimiento, o None si no afecta el stock."""
+    if mov is None or not mov.state:
+        return None
+    cantidad = Decimal(mov.cantidad or 0)
+    clave = (mov.empresa_id, mov.almacen_id, mov.producto_id)
+    return clave, (cantidad if mov.es_ingreso else -cantidad)
+
+
+def aporte_transferencia(transf):
+    """(clave_stock, cantidad en tránsito) que una transferencia suma a su almacén ORIGEN."""
+    if transf is None or not transf.state or transf.estado != 'EN_TRANSITO':
+        return None
+    clave = (transf.empresa_id, transf.almacen_origen_id, transf.producto_id)
+    return clave, Decimal(transf.cantidad_enviada or 0)
+
+
+class LedgerStock:
+    """
+    Acumula deltas de stock por (empresa_id, almacen_id, producto_id)
+    y los aplica en bloque con UPDATE ... SET cantidad = cantidad + delta.
+    """
+
+    def __init__(self):
+        # clave -> [delta_actual, delta_transito, fecha_mas_reciente]
+        self.deltas = defaultdict(lambda: [CERO, CERO, None])
+        # clave -> fecha_documento más antigua tocada (para los snapshots del Kárdex)
+        self.saldos_desde = {}
+
+    def _marcar_saldo(self, clave, fecha):
+        if fecha and (clave not in self.saldos_desde or fecha < self.saldos_desde[clave]):
+            self.saldos_desde[clave] = fecha
+
+    def movimiento(self, mov, signo=1):
+        aporte = aporte_movimiento(mov)
+        if not aporte:
+            return
+        clave, cantidad = aporte
+        delta = self.deltas[clave]
+        delta[0] += signo * cantidad
+        self._marcar_saldo(clave, mov.fecha_documento)
+        if signo > 0 and mov.fecha_documento and (delta[2] is None or mov.fecha_documento > delta[2]):
+            delta[2] = mov.fecha_documento
+
+    def transferencia(self, transf, signo=1):
+        aporte = aporte_transferencia(transf)
+        if not aporte:
+            return
+        clave, cantidad = aporte
+        self.deltas[clave][1] += signo * cantidad
+
+    def movimientos_eliminados(self, queryset):
+        """Registra el retiro de los movimientos de un queryset ANTES de borrarlo (una sola consulta)."""
+        filas = queryset.filter(state=True).values('empresa_id', 'almacen_id', 'producto_id', 'es_ingreso') \
+            .annotate(total=Sum('cantidad'), desde=Min('fecha_documento'))
+        for fila in filas:
+            clave = (fila['empresa_id'], fila['almacen_id'], fila['producto_id'])
+            self._marcar_saldo(clave, fila['desde'])
+            total = fila['total'] or CERO
+            self.deltas[clave][0] -= total if fila['es_ingreso'] else -total
+
+    def aplicar(self):
+        """
+        Aplica los deltas acumulados. Debe llamarse DESPUÉS de escribir los movimientos
+        y dentro de la misma transacción. Si el par aún no tiene fila en Stock,
+        se inicializa con un recálculo completo (que ya incluye los cambios).
+        """
+        for clave, (delta_actual, delta_transito, fecha) in self.deltas.items():
+            if not delta_actual and not delta_transito and fecha is None:
+                continue
+            empresa_id, almacen_id, producto_id = clave
+            cambios = {
+                'cantidad_actual': F('cantidad_actual') + delta_actual,
+                'cantidad_en_transito': F('cantidad_en_transito') + delta_transito,
+            }
+            if fecha is not None:
+                cambios['fecha_ultimo_movimiento'] = Greatest(
+                    Coalesce(F('fecha_ultimo_movimiento'), Value(fecha)), Value(fecha)
+                )
+            actualizados = Stock.objects.filter(
+                empresa_id=empresa_id, almacen_id=almacen_id, producto_id=producto_id
+            ).update(**cambios)
+            if not actualizados:
+                Stock.recalcular_stock_completo(empresa_id, almacen_id, producto_id)
+        self.deltas.clear()
+
+        for clave, desde in self.saldos_desde.items():
+            reconstruir_saldos_mensuales(*clave, desde)
+        self.saldos_desde.clear()
+
+
+def comparar_stock_con_historial(empresa_id=None):
+    """
+    Recalcula el stock completo con dos consultas agrupadas y lo compara con la tabla Stock.
+    Retorna lista de dicts con las diferencias encontradas.
+    """
+    filtro_mov = Q(state=True)
+    filtro_transf = Q(estado='EN_TRANSITO')
+    filtro_stock = Q()
+    if empresa_id:
+        filtro_mov &= Q(empresa_id=empresa_id)
+        filtro_transf &= Q(empresa_id=empresa_id)
+        filtro_stock &= Q(empresa_id=empresa_id)
+
+    esperado = defaultdict(lambda: {'actual': CERO, 'transito': CERO})
+
+    movimientos = MovimientoAlmacen.objects.filter(filtro_mov).values(
+        'empresa_id', 'almacen_id', 'producto_id'
+    ).annotate(
+        ingresos=Coalesce(Sum('cantidad', filter=Q(es_ingreso=True)), CERO, output_field=DecimalField()),
+        salidas=Coalesce(Sum('cantidad', filter=Q(es_ingreso=False)), CERO, output_field=DecimalField()),
+    )
+    for fila in movimientos:
+        clave = (fila['empresa_id'], fila['almacen_id'], fila['producto_id'])
+        esperado[clave]['actual'] = fila['ingresos'] - fila['salidas']
+
+    transitos = Transferencia.objects.filter(filtro_transf).values(
+        'empresa_id', 'almacen_origen_id', 'producto_id'
+    ).annotate(total=Coalesce(Sum('cantidad_enviada'), CERO, output_field=DecimalField()))
+    for fila in transitos:
+        clave = (fila['empresa_id'], fila['almacen_origen_id'], fila['producto_id'])
+        esperado[clave]['transito'] = fila['total']
+
+    diferencias = []
+    vistos = set()
+    for stock in Stock.objects.filter(filtro_stock).values(
+            'id', 'empresa_id', 'almacen_id', 'producto_id', 'cantidad_actual', 'cantidad_en_transito'):
+        clave = (stock['empresa_id'], stock['almacen_id'], stock['producto_id'])
+        vistos.add(clave)
+        valores = esperado.get(clave, {'actual': CERO, 'transito': CERO})
+        if stock['cantidad_actual'] != valores['actual'] or stock['cantidad_en_transito'] != valores['transito']:
+            diferencias.append({
+                'clave': clave,
+                'ledger_actual': stock['cantidad_actual'], 'esperado_actual': valores['actual'],
+                'ledger_transito': stock['cantidad_en_transito'], 'esperado_transito': valores['transito'],
+            })
+
+    for clave, valores in esperado.items():
+        if clave not in vistos and (valores['actual'] or valores['transito']):
+            diferencias.append({
+                'clave': clave,
+                'ledger_actual': None, 'esperado_actual': valores['actual'],
+                'ledger_transito': None, 'esperado_transito': valores['transito'],
+            })
+
+    return diferencias
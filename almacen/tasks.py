@@ -1,7 +1,10 @@
 # almacen/tasks.py
 
+import hashlib
 import logging
+import os
 import re
+import time
 import datetime
 from collections import defaultdict
 
@@ -10,23 +13,52 @@ from rq import get_current_job
 from django.utils import timezone
 from django.db import connections, transaction
 from django.db.models import Q
+from django.db.models.expressions import RawSQL
 from django.conf import settings
-from django.core.paginator import Paginator
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
+from simple_history.utils import bulk_create_with_history, bulk_update_with_history
 
 # MODELOS
 from .models import (
     MovAlmCab, MovAlmDet,
     LegacyMovAlmCab, LegacyMovAlmDet, ControlSyncMovAlmacen,
-    MovimientoAlmacen, Transferencia, Stock, Almacen, MovimientoAlmacenNota
+    MovimientoAlmacen, Transferencia, Almacen, MovimientoAlmacenNota
 )
+from .stock_ledger import LedgerStock
+from .busqueda import texto_busqueda_movimiento
+from . import estado_sync
+from .progreso import ReporteProgreso
 from importaciones.models import Empresa, Producto
 
 logger = logging.getLogger(__name__)
 
 TIPOS_DOC_RELEVANTES = ['NI', 'GS', 'TR', 'TK', 'NS', 'BV', 'NC', 'FT']
 DIAS_PARA_AUTO_RECEPCION = 7
+LEGACY_BULK_BATCH_SIZE = 500
+# SQL Server admite 2100 parámetros por consulta: cada bloque manda su lista de CANUMDOC
+# más los dos límites del rango de clave (ver extraer_detalles_erp)
+MSSQL_MAX_PARAMETROS = 2100
+# Cabeceras ERP por consulta keyset en la Fase 1
+FASE1_CHUNK_CABECERAS = min(getattr(settings, 'SYNC_ERP_CHUNK_SIZE', 500), MSSQL_MAX_PARAMETROS - 100)
+CLAVE_CAB_ERP = ('caalma', 'catd', 'canumdoc')
+CLAVE_DET_ERP = ('dealma', 'detd', 'denumdoc')
+FASE2_LOTE_CABECERAS = 500
+# Orden de recorrido (y checkpoint) de la Fase 2
+CLAVE_FASE2 = ('cafecdoc', 'caalma', 'catd', 'canumdoc')
+FASE2_BULK_BATCH_SIZE = 500
+
+# Columnas copiadas 1:1 desde MOVALMCAB / MOVALMDET (además de la clave)
+CAMPOS_LEGACY_CAB = [
+    'cafecdoc', 'catipmov', 'cacodmov', 'casitua', 'carftdoc', 'carfndoc', 'casoli', 'cafecdev',
+    'cacodpro', 'cacencos', 'carfalma', 'caglosa', 'cafecact', 'cahora', 'causuari', 'cacodcli',
+    'canomcli', 'casitgui', 'canompro', 'canomtra', 'cacodtran', 'caimportacion', 'canroimp',
+    'motivo_gs', 'canumord', 'cadirenv',
+]
+CAMPOS_LEGACY_DET = [
+    'decodigo', 'decantid', 'depreuni', 'deserie', 'defecdoc', 'deglosa', 'delote', 'deunidad',
+    'devaltot', 'dedescri', 'detexto',
+]
 
 
 # ==========================================
@@ -47,6 +79,18 @@ def notificar_grupo_empresa(empresa_id, status, message, result=None):
         logger.error(f"WebSocket Error: {e}")
 
 
+def _kwargs_upsert(unique_fields, update_fields):
+    """
+    Arma los kwargs de bulk_create(update_conflicts=True) según el motor de 'default'.
+    MySQL (INSERT ... ON DUPLICATE KEY UPDATE) no admite 'unique_fields':
+    usa directamente las UniqueConstraint existentes de la tabla.
+    """
+    kwargs = {'update_conflicts': True, 'update_fields': update_fields}
+    if connections['default'].features.supports_update_conflicts_with_target:
+        kwargs['unique_fields'] = unique_fields
+    return kwargs
+
+
 def actualizar_progreso_job(percent_float, msg):
     """Guarda en Redis para recuperación (F5)."""
     try:
@@ -67,7 +111,8 @@ def actualizar_progreso_job(percent_float, msg):
 def sincronizar_empresa_erp_task(empresa_alias, start_year=2000, reconciliation_days=30, user_id=None):
     ahora = timezone.now()
     db_alias = empresa_alias
-    BATCH_SIZE = 50
+    job_actual = get_current_job()
+    job_id = job_actual.id if job_actual else None
 
     # 1. Validaciones
     try:
@@ -77,9 +122,13 @@ def sincronizar_empresa_erp_task(empresa_alias, start_year=2000, reconciliation_
         except Empresa.DoesNotExist:
             raise Exception(f"Empresa '{db_alias}' no existe.")
     except Exception as e:
+        estado_sync.registrar_fin(estado_sync.TIPO_EMPRESA, db_alias, job_id, False, f"Error Config: {e}")
         return f"Error Config: {e}"
 
-    notificar_grupo_empresa(empresa.id, 'started', f'Iniciando Sincronización...')
+    # Avisos agrupados: WebSocket + job.meta + índice de estado con cadencia limitada (ver progreso.py)
+    estado_sync.registrar_inicio(estado_sync.TIPO_EMPRESA, db_alias, job_id, user_id=user_id)
+    reporte = ReporteProgreso(empresa.id, indice=(estado_sync.TIPO_EMPRESA, db_alias))
+    reporte.estado('started', f'Iniciando Sincronización...')
 
     try:
         # ---------------------------------------------------------
@@ -114,87 +163,46 @@ def sincronizar_empresa_erp_task(empresa_alias, start_year=2000, reconciliation_
         # ---------------------------------------------------------
         # FASE 1: EXTRACCIÓN (ERP -> Legacy)
         # ---------------------------------------------------------
-        notificar_grupo_empresa(empresa.id, 'running_f1', 'Fase 1: Extrayendo datos...')
+        reporte.estado('running_f1', 'Fase 1: Extrayendo datos...')
 
-        qs_base = MovAlmCab.objects.using(db_alias).filter(
-            Q(cafecdoc__gte=ultima_sync_fecha),
-            catd__in=TIPOS_DOC_RELEVANTES
-        ).order_by('cafecdoc')
-
-        total_f1 = qs_base.count()
+        filtro_f1 = Q(cafecdoc__gte=ultima_sync_fecha, catd__in=TIPOS_DOC_RELEVANTES)
+        total_f1 = MovAlmCab.objects.using(db_alias).filter(filtro_f1).count()
 
         if total_f1 > 0:
-            paginator = Paginator(qs_base, BATCH_SIZE)
             processed_count = 0
             ultima_fecha_ok = None
 
-            for page_num in paginator.page_range:
-                page = paginator.page(page_num)
-                batch_records = page.object_list
-
-                # Prefetching Masivo
-                q_filters = Q()
-                for cab in batch_records:
-                    q_filters |= Q(dealma=cab.caalma, detd=cab.catd, denumdoc=cab.canumdoc)
-
-                remote_details = MovAlmDet.objects.using(db_alias).filter(q_filters).order_by('deitem')
-                grouped_details = defaultdict(list)
-                for d in remote_details:
-                    grouped_details[(d.dealma, d.detd, d.denumdoc)].append(d)
+            # Keyset por (CAALMA, CATD, CANUMDOC): cada consulta arranca en la última clave leída
+            for batch_records in extraer_cabeceras_erp(db_alias, filtro_f1):
+                grouped_details = extraer_detalles_erp(db_alias, batch_records)
 
-                # Transacción de Escritura
+                # Transacción de Escritura (número constante de sentencias por página)
                 with transaction.atomic(using='default'):
-                    for cab in batch_records:
-                        key = (cab.caalma, cab.catd, cab.canumdoc)
-
-                        cab_defaults = {
-                            'cafecdoc': cab.cafecdoc, 'catipmov': cab.catipmov, 'cacodmov': cab.cacodmov,
-                            'casitua': cab.casitua, 'carftdoc': cab.carftdoc, 'carfndoc': cab.carfndoc,
-                            'casoli': cab.casoli, 'cafecdev': cab.cafecdev, 'cacodpro': cab.cacodpro,
-                            'cacencos': cab.cacencos, 'carfalma': cab.carfalma, 'caglosa': cab.caglosa,
-                            'cafecact': cab.cafecact, 'cahora': cab.cahora, 'causuari': cab.causuari,
-                            'cacodcli': cab.cacodcli, 'canomcli': cab.canomcli, 'casitgui': cab.casitgui,
-                            'canompro': cab.canompro, 'canomtra': cab.canomtra, 'cacodtran': cab.cacodtran,
-                            'caimportacion': cab.caimportacion, 'canroimp': cab.canroimp,
-                            'motivo_gs': cab.motivo_gs, 'canumord': cab.canumord, 'cadirenv': cab.cadirenv,
-                        }
-                        LegacyMovAlmCab.objects.update_or_create(
-                            empresa=empresa, caalma=cab.caalma, catd=cab.catd,
-                            canumdoc=cab.canumdoc, defaults=cab_defaults
-                        )
-
-                        LegacyMovAlmDet.objects.filter(
-                            empresa=empresa, dealma=key[0], detd=key[1], denumdoc=key[2]
-                        ).delete()
-
-                        nuevos_detalles = [
-                            LegacyMovAlmDet(
-                                empresa=empresa, dealma=d.dealma, detd=d.detd, denumdoc=d.denumdoc,
-                                deitem=d.deitem, decodigo=d.decodigo, decantid=d.decantid,
-                                depreuni=d.depreuni, deserie=d.deserie, defecdoc=d.defecdoc,
-                                deglosa=d.deglosa, delote=d.delote, deunidad=d.deunidad,
-                                devaltot=d.devaltot, dedescri=d.dedescri, detexto=d.detexto
-                            ) for d in grouped_details.get(key, [])
-                        ]
-                        LegacyMovAlmDet.objects.bulk_create(nuevos_detalles)
-                        if cab.cafecdoc: ultima_fecha_ok = cab.cafecdoc
+                    upsert_legacy_lote(empresa, batch_records, grouped_details)
+
+                for cab in batch_records:
+                    if cab.cafecdoc and (ultima_fecha_ok is None or cab.cafecdoc > ultima_fecha_ok):
+                        ultima_fecha_ok = cab.cafecdoc
 
                 processed_count += len(batch_records)
 
                 # Progreso Fase 1 (0% - 50%)
-                progreso_f1 = processed_count / total_f1
+                progreso_f1 = min(processed_count / total_f1, 1)
                 percent_global = round(progreso_f1 * 50, 1)
                 msg = f"Fase 1: {int(percent_global)}% ({processed_count}/{total_f1})"
 
-                notificar_grupo_empresa(empresa.id, 'progress', msg,
-                                        result={'percent': percent_global, 'phase': 'Fase 1'})
-                actualizar_progreso_job(percent_global, msg)
+                reporte.avance(percent_global, msg, 'Fase 1')
 
-                if ultima_fecha_ok:
-                    control_sync.ultima_fecha = ultima_fecha_ok
-                    control_sync.save(update_fields=['ultima_fecha'])
+            # El orden por clave no es cronológico: la marca solo avanza al terminar la extracción
+            # La Fase 2 de este rango queda pendiente antes de mover la marca: si el job
+            # se cae antes de terminarla, la próxima ejecución no lo pierde.
+            if ultima_fecha_ok:
+                control_sync.ultima_fecha = ultima_fecha_ok
+                if control_sync.fase2_desde is None or control_sync.fase2_desde > fecha_inicio_fase2:
+                    control_sync.fase2_desde = fecha_inicio_fase2
+                control_sync.save(update_fields=['ultima_fecha', 'fase2_desde'])
         else:
-            actualizar_progreso_job(50, "Fase 1 (Al día)")
+            reporte.avance(50, "Fase 1 (Al día)", 'Fase 1')
 
         # Reconciliación (Solo para la ventana reciente)
         reconciliar_datos_recientes_f1(empresa, db_alias, ahora, reconciliation_days)
@@ -205,15 +213,16 @@ def sincronizar_empresa_erp_task(empresa_alias, start_year=2000, reconciliation_
         logger.info(f"--- Fase 2 iniciando desde: {fecha_inicio_fase2} ---")
 
         # LLAMADA CORREGIDA: Pasamos la FECHA, no los días.
-        procesar_legacy_data_logic(empresa, fecha_inicio_fase2, ahora)
+        procesar_legacy_data_logic(empresa, fecha_inicio_fase2, ahora, reporte=reporte)
 
     except Exception as e_main:
         logger.error(f"Error FATAL: {e_main}", exc_info=True)
-        notificar_grupo_empresa(empresa.id, 'failed', str(e_main))
+        reporte.estado('failed', str(e_main))
+        estado_sync.registrar_fin(estado_sync.TIPO_EMPRESA, db_alias, job_id, False, str(e_main))
         return f"Error: {e_main}"
 
-    notificar_grupo_empresa(empresa.id, 'finished', "Proceso Exitoso.", result="OK")
-    actualizar_progreso_job(100, "Finalizado")
+    reporte.finalizar(result="OK")
+    estado_sync.registrar_fin(estado_sync.TIPO_EMPRESA, db_alias, job_id, True, "Finalizado")
     return "OK"
 
 
@@ -221,155 +230,616 @@ def sincronizar_empresa_erp_task(empresa_alias, start_year=2000, reconciliation_
 # SECCIÓN 3: LÓGICA INTERNA FASE 1
 # ==========================================
 
+def _q_clave(campos, valores, operador):
+    """
+    Comparación de tuplas (a, b, c) <op> (x, y, z) expandida a Q
+    (SQL Server no soporta row-value constructors). operador: gt, gte, lt, lte.
+    """
+    estricto = operador[:2]
+    condicion = Q(**dict(zip(campos, valores))) if operador.endswith('e') else Q()
+    for i, campo in enumerate(campos):
+        iguales = dict(zip(campos[:i], valores[:i]))
+        condicion |= Q(**iguales, **{f"{campo}__{estricto}": valores[i]})
+    return condicion
+
+
+def extraer_cabeceras_erp(db_alias, filtro, chunk_size=None):
+    """
+    Lee MOVALMCAB en bloques de 'chunk_size' ordenados por la PK (CAALMA, CATD, CANUMDOC).
+    Cada bloque es WHERE filtro AND clave > última_clave: sin COUNT ni OFFSET por página,
+    el costo de una página profunda es el mismo que el de la primera.
+    """
+    chunk_size = chunk_size or FASE1_CHUNK_CABECERAS
+    ultima_clave = None
+    while True:
+        qs = anotar_firma_erp(MovAlmCab.objects.using(db_alias).filter(filtro), db_alias)
+        if ultima_clave:
+            qs = qs.filter(_q_clave(CLAVE_CAB_ERP, ultima_clave, 'gt'))
+        bloque = list(qs.order_by(*CLAVE_CAB_ERP)[:chunk_size])
+        if not bloque:
+            return
+        yield bloque
+        if len(bloque) < chunk_size:
+            return
+        ultima_clave = tuple(getattr(bloque[-1], campo) for campo in CLAVE_CAB_ERP)
+
+
+def extraer_detalles_erp(db_alias, cabeceras):
+    """
+    Detalles de un bloque de cabeceras (ordenadas por PK) con un rango de clave
+    [primera, última] + DENUMDOC IN (...), en vez de un OR por cabecera.
+    """
+    claves = {(c.caalma, c.catd, c.canumdoc) for c in cabeceras}
+    primera = (cabeceras[0].caalma, cabeceras[0].catd, cabeceras[0].canumdoc)
+    ultima = (cabeceras[-1].caalma, cabeceras[-1].catd, cabeceras[-1].canumdoc)
+
+    detalles = MovAlmDet.objects.using(db_alias).filter(
+        _q_clave(CLAVE_DET_ERP, primera, 'gte') & _q_clave(CLAVE_DET_ERP, ultima, 'lte'),
+        denumdoc__in={c.canumdoc for c in cabeceras}
+    ).order_by(*CLAVE_DET_ERP, 'deitem')
+
+    grouped_details = defaultdict(list)
+    for d in detalles:
+        key = (d.dealma, d.detd, d.denumdoc)
+        if key in claves:
+            grouped_details[key].append(d)
+    return grouped_details
+
+
+def extraer_cabeceras_por_clave(db_alias, claves):
+    """
+    Cabeceras ERP de un bloque de claves (alma, td, num) con el mismo rango de clave
+    + CANUMDOC IN (...) que extraer_detalles_erp; las claves exactas se filtran en Python.
+    """
+    claves = sorted(set(claves))
+    if not claves:
+        return []
+    buscadas = set(claves)
+    cabeceras = anotar_firma_erp(MovAlmCab.objects.using(db_alias).filter(
+        _q_clave(CLAVE_CAB_ERP, claves[0], 'gte') & _q_clave(CLAVE_CAB_ERP, claves[-1], 'lte'),
+        canumdoc__in={clave[2] for clave in claves}
+    ), db_alias).order_by(*CLAVE_CAB_ERP)
+    return [cab for cab in cabeceras if (cab.caalma, cab.catd, cab.canumdoc) in buscadas]
+
+
+def anotar_firma_erp(qs, db_alias):
+    """
+    En SQL Server agrega a cada cabecera 'firma_cab' = CHECKSUM(columnas copiadas) y
+    'firma_det' = CHECKSUM_AGG(CHECKSUM(...)) de sus detalles, calculados en el ERP.
+    En otros motores no anota nada (ver firma_documento).
+    """
+    if connections[db_alias].vendor != 'microsoft':
+        return qs
+
+    def columnas(modelo, tabla, campos):
+        cols = []
+        for campo in campos:
+            field = modelo._meta.get_field(campo)
+            col = f"{tabla}.[{field.column}]"
+            # CHECKSUM no acepta text/ntext
+            cols.append(f"CAST({col} AS NVARCHAR(MAX))" if field.get_internal_type() == 'TextField' else col)
+        return ", ".join(cols)
+
+    cab = f"[{MovAlmCab._meta.db_table}]"
+    det = "d"
+    sql_cab = f"CHECKSUM({columnas(MovAlmCab, cab, CAMPOS_LEGACY_CAB)})"
+    sql_det = (
+        f"(SELECT CHECKSUM_AGG(CHECKSUM(d.[DEITEM], {columnas(MovAlmDet, det, CAMPOS_LEGACY_DET)})) "
+        f"FROM [{MovAlmDet._meta.db_table}] d "
+        f"WHERE d.[DEALMA] = {cab}.[CAALMA] AND d.[DETD] = {cab}.[CATD] AND d.[DENUMDOC] = {cab}.[CANUMDOC])"
+    )
+    return qs.annotate(firma_cab=RawSQL(sql_cab, []), firma_det=RawSQL(sql_det, []))
+
+
+def firma_documento(cab, detalles):
+    """
+    Firma de un documento ERP. Con las anotaciones de anotar_firma_erp (SQL Server) usa
+    los CHECKSUM del ERP; si no, un md5 de las mismas columnas calculado aquí.
+    """
+    if hasattr(cab, 'firma_cab'):
+        return f"{cab.firma_cab}:{cab.firma_det}"
+    partes = [repr([getattr(cab, campo) for campo in CAMPOS_LEGACY_CAB])]
+    partes += [repr([d.deitem] + [getattr(d, campo) for campo in CAMPOS_LEGACY_DET]) for d in detalles]
+    return hashlib.md5("|".join(partes).encode('utf-8')).hexdigest()
+
+
+def _clave_txt(caalma, catd, canumdoc):
+    return (caalma.strip(), catd.strip(), canumdoc.strip())
+
+
+def firmas_erp(db_alias, filtro):
+    """{(alma, td, num): firma} de las cabeceras ERP del filtro."""
+    if connections[db_alias].vendor == 'microsoft':
+        # Una sola consulta: el ERP agrega las firmas, no viajan los detalles
+        filas = anotar_firma_erp(MovAlmCab.objects.using(db_alias).filter(filtro), db_alias) \
+            .values_list('caalma', 'catd', 'canumdoc', 'firma_cab', 'firma_det')
+        return {_clave_txt(a, t, n): f"{fc}:{fd}" for a, t, n, fc, fd in filas}
+
+    firmas = {}
+    for bloque in extraer_cabeceras_erp(db_alias, filtro):
+        detalles = extraer_detalles_erp(db_alias, bloque)
+        for cab in bloque:
+            firmas[_clave_txt(cab.caalma, cab.catd, cab.canumdoc)] = firma_documento(
+                cab, detalles.get((cab.caalma, cab.catd, cab.canumdoc), []))
+    return firmas
+
+
+def _q_claves(campos, claves):
+    """OR de claves (alma, td, num) sobre 'campos'; solo para lotes acotados."""
+    q = Q()
+    for clave in claves:
+        q |= Q(**dict(zip(campos, clave)))
+    return q
+
+
+def upsert_legacy_lote(empresa, cabeceras_erp, detalles_por_cab):
+    """
+    Copia un lote de cabeceras ERP (y sus detalles) a las tablas Legacy
+    en un número CONSTANTE de sentencias, sin importar el tamaño del lote:
+      1. Upsert masivo de cabeceras (clave: unique_legacy_cab_pk).
+      2. Un solo DELETE de los detalles previos de esas cabeceras.
+      3. Un INSERT masivo con los detalles actuales.
+    Debe llamarse dentro de una transacción.
+    """
+    if not cabeceras_erp:
+        return
+
+    cabeceras = [
+        LegacyMovAlmCab(
+            empresa=empresa, caalma=cab.caalma, catd=cab.catd, canumdoc=cab.canumdoc,
+            hash_erp=firma_documento(cab, detalles_por_cab.get((cab.caalma, cab.catd, cab.canumdoc), [])),
+            **{campo: getattr(cab, campo) for campo in CAMPOS_LEGACY_CAB}
+        ) for cab in cabeceras_erp
+    ]
+    LegacyMovAlmCab.objects.bulk_create(
+        cabeceras, batch_size=LEGACY_BULK_BATCH_SIZE,
+        **_kwargs_upsert(['empresa', 'caalma', 'catd', 'canumdoc'], CAMPOS_LEGACY_CAB + ['hash_erp'])
+    )
+
+    # Los detalles se reemplazan completos: así desaparecen los ítems borrados en el ERP
+    claves = [(cab.caalma, cab.catd, cab.canumdoc) for cab in cabeceras_erp]
+    LegacyMovAlmDet.objects.filter(_q_claves(CLAVE_DET_ERP, claves), empresa=empresa).delete()
+
+    nuevos_detalles = [
+        LegacyMovAlmDet(
+            empresa=empresa, dealma=d.dealma, detd=d.detd, denumdoc=d.denumdoc, deitem=d.deitem,
+            **{campo: getattr(d, campo) for campo in CAMPOS_LEGACY_DET}
+        )
+        for cab in cabeceras_erp
+        for d in detalles_por_cab.get((cab.caalma, cab.catd, cab.canumdoc), [])
+    ]
+    LegacyMovAlmDet.objects.bulk_create(nuevos_detalles, batch_size=LEGACY_BULK_BATCH_SIZE)
+
+
 def reconciliar_datos_recientes_f1(empresa, db_alias, ahora, dias_atras):
-    """Detecta eliminaciones y cambios de estado (V->F, V->A) recientes."""
+    """
+    Detecta eliminaciones y cambios (estado V->F, V->A, detalles) recientes comparando
+    la firma ERP de cada documento con la guardada en Legacy. Solo se re-extraen
+    los documentos cuya firma difiere; en un día sin cambios son dos consultas.
+    """
     fecha_inicio = ahora - datetime.timedelta(days=dias_atras)
+    filtro = Q(catd__in=TIPOS_DOC_RELEVANTES, cafecdoc__gt=fecha_inicio)
     try:
-        cabeceras_erp = MovAlmCab.objects.using(db_alias).filter(
-            catd__in=TIPOS_DOC_RELEVANTES,
-            cafecdoc__gt=fecha_inicio
-        ).values('caalma', 'catd', 'canumdoc', 'casitgui')
-
-        mapa_erp = {}
-        for c in cabeceras_erp:
-            pk = f"{c['caalma'].strip()}-{c['catd'].strip()}-{c['canumdoc'].strip()}"
-            mapa_erp[pk] = c['casitgui']
+        mapa_erp = firmas_erp(db_alias, filtro)
     except Exception as e:
         logger.error(f"Error ERP Reconciliacion: {e}")
         return
 
-    cabeceras_local = LegacyMovAlmCab.objects.filter(empresa=empresa, cafecdoc__gt=fecha_inicio).values('id', 'caalma',
-                                                                                                        'catd',
-                                                                                                        'canumdoc',
-                                                                                                        'casitgui')
-
-    pks_actualizar = {}
-    pks_borrar = []
-
-    for c_loc in cabeceras_local:
-        pk = f"{c_loc['caalma'].strip()}-{c_loc['catd'].strip()}-{c_loc['canumdoc'].strip()}"
-        estado_erp = mapa_erp.get(pk)
-        if estado_erp:
-            if c_loc['casitgui'] != estado_erp: pks_actualizar[c_loc['id']] = estado_erp
-        else:
-            pks_borrar.append(c_loc['id'])
-
-    if pks_borrar:
-        cabs = LegacyMovAlmCab.objects.filter(id__in=pks_borrar)
-        for c in cabs:
-            LegacyMovAlmDet.objects.filter(empresa=empresa, dealma=c.caalma, detd=c.catd, denumdoc=c.canumdoc).delete()
-        cabs.delete()
-
-    if pks_actualizar:
-        for cid, nestado in pks_actualizar.items():
-            LegacyMovAlmCab.objects.filter(id=cid).update(casitgui=nestado)
+    cabeceras_local = LegacyMovAlmCab.objects.filter(empresa=empresa, cafecdoc__gt=fecha_inicio) \
+        .values_list('id', 'caalma', 'catd', 'canumdoc', 'hash_erp')
+
+    ids_borrar, claves_borrar, claves_cambiadas = [], [], []
+    for cid, caalma, catd, canumdoc, hash_local in cabeceras_local:
+        clave = (caalma, catd, canumdoc)
+        firma = mapa_erp.get(_clave_txt(*clave))
+        if firma is None:
+            ids_borrar.append(cid)
+            claves_borrar.append(clave)
+        elif firma != hash_local:
+            claves_cambiadas.append(clave)
+
+    if ids_borrar:
+        with transaction.atomic(using='default'):
+            for i in range(0, len(claves_borrar), LEGACY_BULK_BATCH_SIZE):
+                LegacyMovAlmDet.objects.filter(
+                    _q_claves(CLAVE_DET_ERP, claves_borrar[i:i + LEGACY_BULK_BATCH_SIZE]), empresa=empresa
+                ).delete()
+            LegacyMovAlmCab.objects.filter(id__in=ids_borrar).delete()
+
+    # Re-extracción de los documentos cambiados (cabecera + detalles) con el upsert de la Fase 1.
+    # Ordenadas por clave: cada bloque es un rango acotado en el índice de la PK del ERP.
+    claves_cambiadas.sort()
+    for i in range(0, len(claves_cambiadas), FASE1_CHUNK_CABECERAS):
+        cabeceras = extraer_cabeceras_por_clave(db_alias, claves_cambiadas[i:i + FASE1_CHUNK_CABECERAS])
+        if not cabeceras:
+            continue
+        with transaction.atomic(using='default'):
+            upsert_legacy_lote(empresa, cabeceras, extraer_detalles_erp(db_alias, cabeceras))
+
+    if ids_borrar or claves_cambiadas:
+        logger.info(f"Reconciliación: {len(ids_borrar)} eliminados, {len(claves_cambiadas)} actualizados.")
 
 
 # ==========================================
 # SECCIÓN 4: LÓGICA INTERNA FASE 2
 # ==========================================
 
-def procesar_legacy_data_logic(empresa, fecha_inicio_proceso, ahora):
+def procesar_legacy_data_logic(empresa, fecha_inicio_proceso, ahora, reporte=None):
     """
-    Versión corregida: Define pk_det dentro del bucle para evitar errores.
+    Convierte Legacy -> MovimientoAlmacen / Transferencia / Notas.
+    Trabaja por lotes de cabeceras: precarga en memoria almacenes, productos y
+    los registros existentes del lote, calcula las diferencias y las escribe
+    en bloque (sin consultas por línea ERP).
+
+    Cada lote se confirma en su propia transacción junto con el checkpoint
+    (cafecdoc, clave) en ControlSyncMovAlmacen: si el job se cae, la siguiente
+    ejecución retoma desde la última cabecera confirmada. Reprocesar un lote es
+    idempotente (solo se escriben diferencias y el ledger aplica deltas).
     """
 
-    # 1. Mapa de Sedes
-    mapa_sedes_cache = {}
-    try:
-        mapa_sedes_cache['001'] = Almacen.objects.get(empresa=empresa, codigo='AL').id
-        mapa_sedes_cache['002'] = Almacen.objects.get(empresa=empresa, codigo='AA').id
-        mapa_sedes_cache['003'] = Almacen.objects.get(empresa=empresa, codigo='AD').id
-    except:
-        pass
+    reporte = reporte or ReporteProgreso(empresa.id)
 
-    # 2. Query
-    query = Q(empresa=empresa, catd__in=TIPOS_DOC_RELEVANTES, cafecdoc__gte=fecha_inicio_proceso)
-    cabeceras = LegacyMovAlmCab.objects.filter(query).order_by('cafecdoc')
-    total_f2 = cabeceras.count()
-    productos_afectados = set()
+    # 1. Mapas en memoria (una consulta cada uno), por código normalizado (ver _codigo)
+    almacenes = _mapa_por_codigo(Almacen.objects.filter(empresa=empresa).order_by('id'), 'codigo')
+    productos = _mapa_por_codigo(Producto.objects.filter(empresa=empresa).order_by('id'), 'codigo_producto')
+
+    mapa_sedes_cache = {}
+    for serie, codigo in (('001', 'AL'), ('002', 'AA'), ('003', 'AD')):
+        if codigo in almacenes:
+            mapa_sedes_cache[serie] = almacenes[codigo].id
+
+    # 2. Punto de partida (rango nuevo o checkpoint de una ejecución interrumpida)
+    control_sync, _ = ControlSyncMovAlmacen.objects.get_or_create(empresa=empresa)
+    desde, cursor = _inicio_fase2(control_sync, fecha_inicio_proceso)
+    if control_sync.fase2_desde != desde:
+        control_sync.fase2_desde = desde
+        control_sync.save(update_fields=['fase2_desde'])
+    if cursor:
+        logger.info(f"Fase 2 retomando desde el checkpoint {cursor}")
+
+    # 3. Query
+    query = Q(empresa=empresa, catd__in=TIPOS_DOC_RELEVANTES, cafecdoc__gte=desde)
+    if cursor:
+        query &= _q_clave(CLAVE_FASE2, cursor, 'gt')
+    total_f2 = LegacyMovAlmCab.objects.filter(query).count()
 
     if total_f2 == 0:
-        actualizar_progreso_job(100, "Fase 2 (Sin datos)")
+        _cerrar_fase2(control_sync)
+        reporte.avance(100, "Fase 2 (Sin datos)", 'Fase 2')
         return
 
-    with transaction.atomic():
-        for i, cab in enumerate(cabeceras.iterator()):
+    procesadas = 0
+    for bloque in _iterar_cabeceras_fase2(query):
+        # Un commit por lote: los bloqueos sobre MovimientoAlmacen / Stock duran un lote
+        with transaction.atomic():
+            lote = LoteFase2(empresa, ahora, almacenes, productos, mapa_sedes_cache)
+            lote.procesar(bloque)
+            lote.aplicar()
+            _guardar_checkpoint_fase2(control_sync, bloque[-1])
+
+        procesadas += len(bloque)
+        progreso_local = min(procesadas / total_f2, 1)
+        percent_global = 50 + round(progreso_local * 50, 1)
+        msg = f"Fase 2: {int(percent_global)}% ({procesadas}/{total_f2})"
+        reporte.avance(percent_global, msg, 'Fase 2')
+
+    _cerrar_fase2(control_sync)
+
+
+def _inicio_fase2(control_sync, fecha_inicio):
+    """
+    (desde, cursor) de la Fase 2.
+    - Sin Fase 2 pendiente: el rango pedido, sin cursor.
+    - Pendiente sin ningún lote confirmado: desde el inicio más antiguo de ambos rangos.
+    - Pendiente con checkpoint anterior al rango pedido: se retoma desde el checkpoint
+      (cubre lo pendiente y el rango nuevo).
+    - Checkpoint dentro del rango pedido: se procesa el rango pedido completo.
+    """
+    pendiente = control_sync.fase2_desde
+    if pendiente is None:
+        return fecha_inicio, None
+    if control_sync.fase2_ultima_fecha is None:
+        return min(pendiente, fecha_inicio), None
+    if control_sync.fase2_ultima_fecha < fecha_inicio:
+        clave = tuple(control_sync.fase2_ultima_clave.split('|'))
+        return pendiente, (control_sync.fase2_ultima_fecha,) + clave
+    return fecha_inicio, None
+
+
+def _iterar_cabeceras_fase2(query):
+    """
+    Cabeceras Legacy en bloques ordenados por (cafecdoc, caalma, catd, canumdoc).
+    Keyset sobre la última clave leída: ni OFFSET ni un cursor abierto entre commits.
+    """
+    ultima_clave = None
+    while True:
+        qs = LegacyMovAlmCab.objects.filter(query)
+        if ultima_clave:
+            qs = qs.filter(_q_clave(CLAVE_FASE2, ultima_clave, 'gt'))
+        bloque = list(qs.order_by(*CLAVE_FASE2)[:FASE2_LOTE_CABECERAS])
+        if not bloque:
+            return
+        yield bloque
+        if len(bloque) < FASE2_LOTE_CABECERAS:
+            return
+        ultima_clave = tuple(getattr(bloque[-1], campo) for campo in CLAVE_FASE2)
+
+
+def _guardar_checkpoint_fase2(control_sync, cab):
+    """Registra la última cabecera del lote (llamar dentro de la transacción del lote)."""
+    control_sync.fase2_ultima_fecha = cab.cafecdoc
+    control_sync.fase2_ultima_clave = '|'.join((cab.caalma, cab.catd, cab.canumdoc))
+    control_sync.save(update_fields=['fase2_ultima_fecha', 'fase2_ultima_clave'])
+
+
+def _cerrar_fase2(control_sync):
+    control_sync.fase2_desde = None
+    control_sync.fase2_ultima_fecha = None
+    control_sync.fase2_ultima_clave = None
+    control_sync.save(update_fields=['fase2_desde', 'fase2_ultima_fecha', 'fase2_ultima_clave'])
+
+
+def _fecha_precisa(cab):
+    """CAFECDOC + CAHORA (si la hora es válida) como datetime aware."""
+    fecha_precisa = cab.cafecdoc
+    if cab.cafecdoc and cab.cahora:
+        try:
+            hora_str = str(cab.cahora).strip()
+            hora_obj = datetime.datetime.strptime(hora_str, "%H:%M:%S").time()
+            dt_naive = datetime.datetime.combine(cab.cafecdoc.date(), hora_obj)
+            if settings.USE_TZ:
+                fecha_precisa = timezone.make_aware(dt_naive)
+            else:
+                fecha_precisa = dt_naive
+        except ValueError:
+            pass
+    return fecha_precisa
+
+
+def _cambios(obj, valores):
+    """Subconjunto de 'valores' que difiere de los atributos actuales de obj."""
+    return {campo: valor for campo, valor in valores.items() if getattr(obj, campo) != valor}
 
-            # Notificación
-            if (i + 1) % 50 == 0 or (i + 1) == total_f2:
-                progreso_local = (i + 1) / total_f2
-                percent_global = 50 + round(progreso_local * 50, 1)
-                msg = f"Fase 2: {int(percent_global)}% ({i + 1}/{total_f2})"
-                notificar_grupo_empresa(empresa.id, 'progress', msg,
-                                        result={'percent': percent_global, 'phase': 'Fase 2'})
-                actualizar_progreso_job(percent_global, msg)
 
-            # --- LÓGICA DE CABECERA ---
-            pk_cab = f"{cab.caalma.strip()}-{cab.catd.strip()}-{cab.canumdoc.strip()}"
+def _asignar_cambios(obj, valores):
+    """Asigna solo los atributos que difieren. Retorna True si hubo algún cambio."""
+    cambios = _cambios(obj, valores)
+    for campo, valor in cambios.items():
+        setattr(obj, campo, valor)
+    return bool(cambios)
+
+
+def _codigo(valor):
+    """
+    Código ERP normalizado como lo compara la collation *_ci / PAD SPACE de MySQL
+    (la que usaba Producto.objects.get): sin distinguir mayúsculas ni espacios en los extremos.
+    """
+    return (valor or '').strip().upper()
+
+
+def _mapa_por_codigo(queryset, campo):
+    """{código normalizado: instancia}; ante códigos que solo difieren en mayúsculas gana el primero."""
+    mapa = {}
+    for obj in queryset:
+        codigo = _codigo(getattr(obj, campo))
+        if codigo in mapa:
+            logger.warning(f"{queryset.model.__name__} duplicado para el código '{codigo}' "
+                           f"(ids {mapa[codigo].id} y {obj.id}); se usa {mapa[codigo].id}.")
+            continue
+        mapa[codigo] = obj
+    return mapa
+
+
+def _pk_cab(cab):
+    return f"{cab.caalma.strip()}-{cab.catd.strip()}-{cab.canumdoc.strip()}"
+
+
+def _id_gs_ingreso(cab, det):
+    """Clave de la GS de origen para una NI de traslado."""
+    return f"{(cab.carfalma or '').strip()}-{(cab.carftdoc or '').strip()}-{(cab.carfndoc or '').strip()}-{det.deitem}"
+
+
+class LoteFase2:
+    """
+    Acumula en memoria los cambios de un lote de cabeceras Legacy y los
+    aplica con operaciones masivas (bulk_create / bulk_update con historial).
+    El Stock se ajusta con el delta de las filas cambiadas (ver stock_ledger).
+    """
+
+    CAMPOS_TRANSFERENCIA = [
+        'id_erp_salida_cab', 'id_erp_ingreso_det', 'id_erp_ingreso_cab', 'almacen_origen', 'almacen_destino',
+        'cantidad_enviada', 'cantidad_recibida', 'fecha_envio', 'fecha_recepcion', 'estado', 'modified_date',
+    ]
+    CAMPOS_NOTA = ['id_erp_cab', 'item_erp', 'texto_descripcion', 'texto_detalle', 'modified_date']
+
+    def __init__(self, empresa, ahora, almacenes, productos, mapa_sedes_cache):
+        self.empresa = empresa
+        self.ahora = ahora
+        self.almacenes = almacenes
+        self.productos = productos
+        self.mapa_sedes_cache = mapa_sedes_cache
+
+        self.cabeceras_anuladas = set()
+        # Códigos ERP sin almacén / producto local (se omiten; se avisan una vez por lote)
+        self.almacenes_faltantes = set()
+        self.productos_faltantes = set()
+
+        # id_erp_det -> instancia (existentes precargadas + nuevas del lote)
+        self.movimientos = {}
+        self.notas = {}
+        # id_erp_salida_det -> Transferencia
+        self.transferencias = {}
+
+        self.movimientos_modificados = {}
+        self.notas_modificadas = {}
+        self.transferencias_modificadas = {}
+
+        self.ledger = LedgerStock()
+
+    # --- Precarga ---
+    def _precargar(self, cabeceras, detalles_por_cab):
+        claves_det, claves_transf = set(), set()
+        for cab in cabeceras:
+            pk_cab = _pk_cab(cab)
+            for det in detalles_por_cab.get((cab.caalma, cab.catd, cab.canumdoc), []):
+                claves_det.add(f"{pk_cab}-{det.deitem}")
+                if cab.cacodmov == 'TD' and cab.catipmov == 'I':
+                    claves_transf.add(_id_gs_ingreso(cab, det))
+
+        claves_transf |= claves_det
+        if claves_det:
+            # all_objects: un registro dado de baja lógicamente se reactiva en vez de chocar con la UNIQUE
+            self.movimientos = {
+                m.id_erp_det: m for m in
+                MovimientoAlmacen.all_objects.filter(empresa=self.empresa, id_erp_det__in=claves_det)
+            }
+            self.notas = {
+                n.id_erp_det: n for n in
+                MovimientoAlmacenNota.all_objects.filter(empresa=self.empresa, id_erp_det__in=claves_det)
+            }
+        if claves_transf:
+            self.transferencias = {
+                t.id_erp_salida_det: t for t in
+                Transferencia.all_objects.filter(empresa=self.empresa, id_erp_salida_det__in=claves_transf)
+            }
+
+    def _cargar_detalles(self, cabeceras):
+        """Todos los detalles del lote en una sola consulta, agrupados por cabecera."""
+        claves = {(c.caalma, c.catd, c.canumdoc) for c in cabeceras}
+        detalles_por_cab = defaultdict(list)
+        detalles = LegacyMovAlmDet.objects.filter(
+            empresa=self.empresa, denumdoc__in={c.canumdoc for c in cabeceras}
+        ).order_by('deitem')
+        for det in detalles:
+            key = (det.dealma, det.detd, det.denumdoc)
+            if key in claves:
+                detalles_por_cab[key].append(det)
+        return detalles_por_cab
+
+    # --- Procesamiento en memoria ---
+    def procesar(self, cabeceras):
+        activas = [c for c in cabeceras if c.casitgui != 'A']
+        detalles_por_cab = self._cargar_detalles(activas)
+        self._precargar(activas, detalles_por_cab)
+
+        for cab in cabeceras:
+            pk_cab = _pk_cab(cab)
 
             # A) Anulados
             if cab.casitgui == 'A':
-                MovimientoAlmacen.objects.filter(empresa=empresa, id_erp_cab=pk_cab).delete()
-                # También borramos notas asociadas si se anula
-                MovimientoAlmacenNota.objects.filter(empresa=empresa, id_erp_cab=pk_cab).delete()
+                self.cabeceras_anuladas.add(pk_cab)
                 continue
 
             # B) Validaciones Local
-            try:
-                alm_local = Almacen.objects.get(empresa=empresa, codigo=cab.caalma.strip())
-            except Almacen.DoesNotExist:
+            alm_local = self.almacenes.get(_codigo(cab.caalma))
+            if not alm_local:
+                self.almacenes_faltantes.add(_codigo(cab.caalma))
                 continue
 
-            detalles = LegacyMovAlmDet.objects.filter(
-                empresa=empresa, dealma=cab.caalma, detd=cab.catd, denumdoc=cab.canumdoc
-            ).order_by('deitem')
-
-            if not detalles.exists(): continue
-
-            # --- BUCLE DE DETALLES ---
-            for det in detalles:
-                # ¡AQUÍ ES DONDE DEBE IR pk_det!
+            for det in detalles_por_cab.get((cab.caalma, cab.catd, cab.canumdoc), []):
                 pk_det = f"{pk_cab}-{det.deitem}"
-
                 cod_prod_raw = det.decodigo.strip() if det.decodigo else None
 
                 # 1. Lógica de NOTAS (TEXTO)
                 if not cod_prod_raw or cod_prod_raw.upper() == 'TEXTO':
-                    crear_nota_almacen(empresa, pk_cab, pk_det, det)
-                    continue  # Saltamos al siguiente detalle, no procesamos como producto
+                    crear_nota_almacen(self, pk_cab, pk_det, det)
+                    continue
 
                 # 2. Lógica de PRODUCTOS
-                try:
-                    prod_local = Producto.objects.get(empresa=empresa, codigo_producto=cod_prod_raw)
-                except Producto.DoesNotExist:
+                prod_local = self.productos.get(_codigo(cod_prod_raw))
+                if not prod_local:
+                    self.productos_faltantes.add(_codigo(cod_prod_raw))
                     continue
 
-                productos_afectados.add((alm_local.id, prod_local.id))
-
                 if cab.cacodmov == 'TD':
                     if cab.catipmov == 'I':
-                        process_ingreso_traslado(empresa, cab, det, pk_cab, pk_det, alm_local, prod_local,
-                                                 productos_afectados, ahora, mapa_sedes_cache)
+                        process_ingreso_traslado(self, cab, det, pk_cab, pk_det, alm_local, prod_local)
                     else:
-                        process_salida_traslado(empresa, cab, det, pk_cab, pk_det, alm_local, prod_local, ahora,
-                                                mapa_sedes_cache)
+                        process_salida_traslado(self, cab, det, pk_cab, pk_det, alm_local, prod_local)
                 else:
-                    process_movimiento_normal(empresa, cab, det, pk_cab, pk_det, alm_local, prod_local,
-                                              mapa_sedes_cache)
-
-    # Recálculo
-    if productos_afectados:
-        notificar_grupo_empresa(empresa.id, 'running_f2', 'Finalizando: Recalculando Stock...')
-        for (aid, pid) in productos_afectados:
-            try:
-                Stock.recalcular_stock_completo(empresa.id, aid, pid)
-            except:
-                pass
-
-
-# --- HELPERS FASE 2 (Igual que antes) ---
-def process_movimiento_normal(empresa, cab, det, pk_cab, pk_det, alm, prod, mapa_sedes_cache):
+                    process_movimiento_normal(self, cab, det, pk_cab, pk_det, alm_local, prod_local)
+
+        if self.almacenes_faltantes:
+            logger.warning(f"Fase 2 ({self.empresa}): almacenes sin registro local, documentos omitidos: "
+                           f"{sorted(self.almacenes_faltantes)}")
+        if self.productos_faltantes:
+            logger.warning(f"Fase 2 ({self.empresa}): productos sin registro local, líneas omitidas: "
+                           f"{sorted(self.productos_faltantes)}")
+
+    def guardar_movimiento(self, pk_det, valores):
+        mov = self.movimientos.get(pk_det)
+        if mov is None:
+            self.movimientos[pk_det] = MovimientoAlmacen(empresa=self.empresa, id_erp_det=pk_det, **valores)
+        else:
+            cambios = _cambios(mov, valores)
+            if cambios and mov.pk and pk_det not in self.movimientos_modificados:
+                self.ledger.movimiento(mov, signo=-1)  # aporte con los valores de BD
+                self.movimientos_modificados[pk_det] = mov
+            _asignar_cambios(mov, cambios)
+
+    def guardar_nota(self, pk_det, valores):
+        nota = self.notas.get(pk_det)
+        if nota is None:
+            self.notas[pk_det] = MovimientoAlmacenNota(empresa=self.empresa, id_erp_det=pk_det, **valores)
+        elif _asignar_cambios(nota, valores) and nota.pk:
+            self.notas_modificadas[pk_det] = nota
+
+    def obtener_transferencia(self, id_salida_det):
+        return self.transferencias.get(id_salida_det)
+
+    def nueva_transferencia(self, **valores):
+        transf = Transferencia(empresa=self.empresa, **valores)
+        self.transferencias[transf.id_erp_salida_det] = transf
+        return transf
+
+    def marcar_transferencia(self, transf, valores):
+        cambios = _cambios(transf, valores)
+        if cambios and transf.pk and transf.id_erp_salida_det not in self.transferencias_modificadas:
+            self.ledger.transferencia(transf, signo=-1)  # aporte con los valores de BD
+            self.transferencias_modificadas[transf.id_erp_salida_det] = transf
+        _asignar_cambios(transf, cambios)
+
+    # --- Escritura masiva ---
+    def aplicar(self):
+        if self.cabeceras_anuladas:
+            anulados = MovimientoAlmacen.objects.filter(empresa=self.empresa, id_erp_cab__in=self.cabeceras_anuladas)
+            self.ledger.movimientos_eliminados(anulados)
+            anulados.delete()
+            MovimientoAlmacenNota.objects.filter(empresa=self.empresa,
+                                                 id_erp_cab__in=self.cabeceras_anuladas).delete()
+
+        # Aporte actual de lo nuevo / modificado (se aplica tras escribir, un UPDATE por par)
+        for pk_det, mov in self.movimientos.items():
+            if mov.pk is None or pk_det in self.movimientos_modificados:
+                self.ledger.movimiento(mov)
+        for id_salida, transf in self.transferencias.items():
+            if transf.pk is None or id_salida in self.transferencias_modificadas:
+                self.ledger.transferencia(transf)
+
+        ahora = timezone.now()
+        campos_mov = CAMPOS_MOVIMIENTO_SYNC + ['modified_date']
+        self._escribir(MovimientoAlmacen, self.movimientos, self.movimientos_modificados, campos_mov, ahora)
+        self._escribir(MovimientoAlmacenNota, self.notas, self.notas_modificadas, self.CAMPOS_NOTA, ahora)
+        self._escribir(Transferencia, self.transferencias, self.transferencias_modificadas,
+                       self.CAMPOS_TRANSFERENCIA, ahora)
+
+        self.ledger.aplicar()
+
+    @staticmethod
+    def _escribir(modelo, instancias, modificadas, campos, ahora):
+        nuevas = [obj for obj in instancias.values() if obj.pk is None]
+        if nuevas:
+            bulk_create_with_history(nuevas, modelo, batch_size=FASE2_BULK_BATCH_SIZE)
+        if modificadas:
+            for obj in modificadas.values():
+                obj.modified_date = ahora
+            # all_objects: 'objects' filtra state=True y no actualizaría un registro que se reactiva
+            bulk_update_with_history(list(modificadas.values()), modelo, campos,
+                                     batch_size=FASE2_BULK_BATCH_SIZE, manager=modelo.all_objects)
+
+
+# --- HELPERS FASE 2 ---
+def process_movimiento_normal(lote, cab, det, pk_cab, pk_det, alm, prod):
     doc_tipo = cab.catd.strip()
     cod_mov = (cab.cacodmov or '').strip()
     sit_gui = (cab.casitgui or '').strip()
@@ -379,49 +849,35 @@ def process_movimiento_normal(empresa, cab, det, pk_cab, pk_det, alm, prod, mapa
     if doc_tipo == 'NS' and cod_mov == 'AJ' and (det.decantid or 0) <= 0: return
 
     es_ingreso = (cab.catipmov == 'I')
-    crear_movimiento_en_db(empresa, cab, det, pk_cab, pk_det, alm, prod, es_ingreso, mapa_sedes_cache)
+    crear_movimiento_en_db(lote, cab, det, pk_cab, pk_det, alm, prod, es_ingreso)
 
 
-def process_salida_traslado(empresa, cab, det, pk_cab, pk_det, alm, prod, ahora, mapa_sedes_cache):
-    try:
-        alm_destino = Almacen.objects.get(empresa=empresa, codigo=cab.carfalma.strip())
-    except Almacen.DoesNotExist:
+def process_salida_traslado(lote, cab, det, pk_cab, pk_det, alm, prod):
+    alm_destino = lote.almacenes.get(_codigo(cab.carfalma))
+    if not alm_destino:
         return  # Si no existe destino local, no es transferencia interna válida
 
-    # --- LÓGICA FECHA PRECISA ---
-    fecha_precisa = cab.cafecdoc
-    if cab.cafecdoc and cab.cahora:
-        try:
-            hora_str = str(cab.cahora).strip()
-            hora_obj = datetime.datetime.strptime(hora_str, "%H:%M:%S").time()
-            dt_naive = datetime.datetime.combine(cab.cafecdoc.date(), hora_obj)
-            if settings.USE_TZ:
-                fecha_precisa = timezone.make_aware(dt_naive)
-            else:
-                fecha_precisa = dt_naive
-        except ValueError:
-            pass
-    # ---------------------------
-
-    try:
-        transf = Transferencia.objects.get(empresa=empresa, id_erp_salida_det=pk_det, producto=prod)
-        transf.id_erp_salida_cab = pk_cab
-        transf.almacen_origen = alm
-        transf.cantidad_enviada = det.decantid or 0
-        transf.fecha_envio = fecha_precisa  # <--- Usamos fecha con hora
+    fecha_precisa = _fecha_precisa(cab)
 
+    transf = lote.obtener_transferencia(pk_det)
+    if transf:
+        valores = {
+            'id_erp_salida_cab': pk_cab,
+            'almacen_origen_id': alm.id,
+            'cantidad_enviada': det.decantid or 0,
+            'fecha_envio': fecha_precisa,  # <--- Usamos fecha con hora
+        }
         # Auto-Recepción si ya existe ingreso vinculado
         if transf.id_erp_ingreso_det:
-            limite = ahora - datetime.timedelta(days=DIAS_PARA_AUTO_RECEPCION)
-            # Comparamos fecha precisa vs limite
+            limite = lote.ahora - datetime.timedelta(days=DIAS_PARA_AUTO_RECEPCION)
             if fecha_precisa < limite:
-                transf.estado = 'RECIBIDO'
-                transf.cantidad_recibida = det.decantid
-                transf.fecha_recepcion = transf.fecha_recepcion or fecha_precisa
-        transf.save()
-    except Transferencia.DoesNotExist:
-        Transferencia.objects.create(
-            empresa=empresa, id_erp_salida_det=pk_det, id_erp_salida_cab=pk_cab,
+                valores['estado'] = 'RECIBIDO'
+                valores['cantidad_recibida'] = det.decantid
+                valores['fecha_recepcion'] = transf.fecha_recepcion or fecha_precisa
+        lote.marcar_transferencia(transf, valores)
+    else:
+        lote.nueva_transferencia(
+            id_erp_salida_det=pk_det, id_erp_salida_cab=pk_cab,
             almacen_origen=alm, almacen_destino=alm_destino, producto=prod,
             cantidad_enviada=det.decantid or 0,
             fecha_envio=fecha_precisa,  # <--- Fecha precisa al crear
@@ -429,68 +885,60 @@ def process_salida_traslado(empresa, cab, det, pk_cab, pk_det, alm, prod, ahora,
         )
 
     # Creamos el movimiento físico de SALIDA inmediatamente
-    crear_movimiento_en_db(empresa, cab, det, pk_cab, pk_det, alm, prod, False, mapa_sedes_cache)
+    crear_movimiento_en_db(lote, cab, det, pk_cab, pk_det, alm, prod, False)
 
 
-def process_ingreso_traslado(empresa, cab, det, pk_cab, pk_det, alm, prod, productos_afectados, ahora,
-                             mapa_sedes_cache):
+def process_ingreso_traslado(lote, cab, det, pk_cab, pk_det, alm, prod):
     """NI-TD (Entrada): Crea Transferencia. Solo crea Movimiento si Auto-Recepciona."""
-    id_gs = f"{cab.carfalma.strip()}-{cab.carftdoc.strip()}-{cab.carfndoc.strip()}-{det.deitem}"
+    id_gs = _id_gs_ingreso(cab, det)
 
-    try:
-        alm_origen = Almacen.objects.get(empresa=empresa, codigo=cab.carfalma.strip())
-    except Almacen.DoesNotExist:
-        try:
-            alm_origen = Almacen.objects.get(empresa=empresa, codigo='NA')
-        except:
-            alm_origen = alm
+    alm_origen = lote.almacenes.get(_codigo(cab.carfalma)) or lote.almacenes.get('NA') or alm
+    fecha_precisa = _fecha_precisa(cab)
 
-    # --- LÓGICA FECHA PRECISA ---
-    fecha_precisa = cab.cafecdoc
-    if cab.cafecdoc and cab.cahora:
-        try:
-            hora_str = str(cab.cahora).strip()
-            hora_obj = datetime.datetime.strptime(hora_str, "%H:%M:%S").time()
-            dt_naive = datetime.datetime.combine(cab.cafecdoc.date(), hora_obj)
-            if settings.USE_TZ:
-                fecha_precisa = timezone.make_aware(dt_naive)
-            else:
-                fecha_precisa = dt_naive
-        except ValueError:
-            pass
-    # ---------------------------
+    transf = lote.obtener_transferencia(id_gs)
+    if not transf:
+        transf = lote.nueva_transferencia(
+            id_erp_salida_det=id_gs, producto=prod,
+            almacen_origen=alm_origen, almacen_destino=alm,
+            cantidad_enviada=det.decantid or 0,
+            fecha_envio=fecha_precisa,  # Fecha precisa
+            estado='EN_TRANSITO'
+        )
 
-    transf, created = Transferencia.objects.get_or_create(
-        empresa=empresa, id_erp_salida_det=id_gs, producto=prod,
-        defaults={
-            'almacen_origen': alm_origen, 'almacen_destino': alm,
-            'cantidad_enviada': det.decantid or 0,
-            'fecha_envio': fecha_precisa,  # Fecha precisa
-            'estado': 'EN_TRANSITO'
-        }
-    )
-    transf.id_erp_ingreso_det = pk_det
-    transf.id_erp_ingreso_cab = pk_cab
-    transf.almacen_destino = alm
+    valores = {
+        'id_erp_ingreso_det': pk_det,
+        'id_erp_ingreso_cab': pk_cab,
+        'almacen_destino_id': alm.id,
+    }
 
     debe_crear_movimiento = False
-    limite = ahora - datetime.timedelta(days=DIAS_PARA_AUTO_RECEPCION)
+    limite = lote.ahora - datetime.timedelta(days=DIAS_PARA_AUTO_RECEPCION)
 
     # Comparamos fecha precisa vs limite
     if fecha_precisa < limite:
-        transf.estado = 'RECIBIDO'
-        transf.cantidad_recibida = det.decantid
-        transf.fecha_recepcion = fecha_precisa
+        valores['estado'] = 'RECIBIDO'
+        valores['cantidad_recibida'] = det.decantid
+        valores['fecha_recepcion'] = fecha_precisa
         debe_crear_movimiento = True
 
-    transf.save()
-    productos_afectados.add((alm.id, prod.id))
+    lote.marcar_transferencia(transf, valores)
 
     if debe_crear_movimiento:
-        crear_movimiento_en_db(empresa, cab, det, pk_cab, pk_det, alm, prod, True, mapa_sedes_cache)
+        crear_movimiento_en_db(lote, cab, det, pk_cab, pk_det, alm, prod, True)
+
 
+# Campos que la Fase 2 escribe en MovimientoAlmacen (ver crear_movimiento_en_db)
+CAMPOS_MOVIMIENTO_SYNC = [
+    'id_erp_cab', 'almacen_id', 'producto_id', 'es_ingreso', 'almacen_ref', 'tipo_documento_erp',
+    'numero_documento_erp', 'item_erp', 'fecha_documento', 'fecha_movimiento', 'cantidad', 'costo_unitario',
+    'valor_total', 'lote', 'numero_orden_compra', 'unidad_medida_erp', 'estado_erp', 'glosa_cabecera',
+    'referencia_documento', 'sede_facturacion_id', 'codigo_movimiento', 'cliente_erp_id', 'cliente_erp_nombre',
+    'nombre_proveedor', 'direccion_envio_erp', 'motivo_tras', 'id_importacion', 'importacion',
+    'proveedor_erp_id', 'state', 'texto_busqueda',
+]
 
-def crear_movimiento_en_db(empresa, cab, det, pk_cab, pk_det, alm, prod, es_ingreso, mapa_sedes_cache):
+
+def crear_movimiento_en_db(lote, cab, det, pk_cab, pk_det, alm, prod, es_ingreso):
     item_val = det.deitem
     if item_val is None:
         try:
@@ -502,74 +950,265 @@ def crear_movimiento_en_db(empresa, cab, det, pk_cab, pk_det, alm, prod, es_ingr
     sede_facturacion_id = None
     if cab.catd.strip() == 'GS' and (cab.cacodmov or '').strip() == 'GV' and cab.casitgui == 'F':
         referencia = (cab.carfndoc or '').strip()
-        if referencia and mapa_sedes_cache:
+        if referencia and lote.mapa_sedes_cache:
             match = re.search(r"^[A-Z]+([0-9]{3})", referencia)
-            if match: sede_facturacion_id = mapa_sedes_cache.get(match.group(1))
+            if match: sede_facturacion_id = lote.mapa_sedes_cache.get(match.group(1))
 
     # 2. Lógica Fecha + Hora
-    fecha_precisa = cab.cafecdoc
-    if cab.cafecdoc and cab.cahora:
-        try:
-            hora_str = str(cab.cahora).strip()
-            hora_obj = datetime.datetime.strptime(hora_str, "%H:%M:%S").time()
-            dt_naive = datetime.datetime.combine(cab.cafecdoc.date(), hora_obj)
-            if settings.USE_TZ:
-                fecha_precisa = timezone.make_aware(dt_naive)
-            else:
-                fecha_precisa = dt_naive
-        except ValueError:
-            pass
+    fecha_precisa = _fecha_precisa(cab)
+
+    # 3. Guardado (diferido: se escribe en bloque en LoteFase2.aplicar)
+    valores = {
+        'id_erp_cab': pk_cab, 'almacen_id': alm.id, 'producto_id': prod.id,
+        'es_ingreso': es_ingreso, 'almacen_ref': cab.carfalma,
+        'tipo_documento_erp': cab.catd.strip(),
+        'numero_documento_erp': det.denumdoc.strip(),
+        'item_erp': item_val,
+        'fecha_documento': fecha_precisa,  # <--- Fecha CON HORA
+        'fecha_movimiento': cab.cafecact or fecha_precisa,
+        'cantidad': det.decantid or 0,
+        'costo_unitario': det.depreuni or 0, 'valor_total': det.devaltot or 0,
+        'lote': det.delote or '',
+        'numero_orden_compra': cab.canumord or '',
+        'unidad_medida_erp': det.deunidad or '',
+        'estado_erp': cab.casitgui,
+        'glosa_cabecera': (cab.caglosa or '')[:500],
+        'referencia_documento': cab.carfndoc,
+        'sede_facturacion_id': sede_facturacion_id,
+        'codigo_movimiento': (cab.cacodmov or '').strip(),
+        'cliente_erp_id': (cab.cacodcli or '').strip(),
+        'cliente_erp_nombre': (cab.canomcli or '').strip(),
+        'nombre_proveedor': (cab.canompro or '').strip(),
+        'direccion_envio_erp': (cab.cadirenv or '').strip(),
+        'motivo_tras': (cab.motivo_gs or '').strip(),
+        'id_importacion': (cab.canroimp),
+        'importacion': (cab.caimportacion),
+        'proveedor_erp_id': cab.cacodpro,
+        'state': True
+    }
+    valores['texto_busqueda'] = texto_busqueda_movimiento(prod.nombre_producto, valores)
+    lote.guardar_movimiento(pk_det, valores)
+
+
+def crear_nota_almacen(lote, pk_cab, pk_det, det):
+    """
+    Registra una MovimientoAlmacenNota si el detalle es 'TEXTO'.
+    """
+    lote.guardar_nota(pk_det, {
+        'id_erp_cab': pk_cab,
+        'item_erp': det.deitem,
+        'texto_descripcion': det.dedescri,  # Descripción principal
+        'texto_detalle': det.detexto,  # Detalle extendido
+    })
 
-    # 3. Guardado
-    MovimientoAlmacen.objects.update_or_create(
-        empresa=empresa, id_erp_det=pk_det,
-        defaults={
-            'id_erp_cab': pk_cab, 'almacen': alm, 'producto': prod,
-            'es_ingreso': es_ingreso, 'almacen_ref': cab.carfalma,
-            'tipo_documento_erp': cab.catd.strip(),
-            'numero_documento_erp': det.denumdoc.strip(),
-            'item_erp': item_val,
-            'fecha_documento': fecha_precisa,  # <--- Fecha CON HORA
-            'fecha_movimiento': cab.cafecact or fecha_precisa,
-            'cantidad': det.decantid or 0,
-            'costo_unitario': det.depreuni or 0, 'valor_total': det.devaltot or 0,
-            'lote': det.delote or '',
-            'numero_orden_compra': cab.canumord or '',
-            'unidad_medida_erp': det.deunidad or '',
-            'estado_erp': cab.casitgui,
-            'glosa_cabecera': (cab.caglosa or '')[:500],
-            'referencia_documento': cab.carfndoc,
-            'sede_facturacion_id': sede_facturacion_id,
-            'codigo_movimiento': (cab.cacodmov or '').strip(),
-            'cliente_erp_id': (cab.cacodcli or '').strip(),
-            'cliente_erp_nombre': (cab.canomcli or '').strip(),
-            'nombre_proveedor': (cab.canompro or '').strip(),
-            'direccion_envio_erp': (cab.cadirenv or '').strip(),
-            'motivo_tras': (cab.motivo_gs or '').strip(),
-            'id_importacion':(cab.canroimp),
-            'importacion':(cab.caimportacion),
-            'proveedor_erp_id':cab.cacodpro,
-            'state': True
-        }
-    )
+
+# ==========================================
+# SECCIÓN 5: EXPORTACIÓN DE KÁRDEX (EN SEGUNDO PLANO)
+# ==========================================
+
+KARDEX_EXPORT_DIR = os.path.join('exportaciones', 'kardex')
+KARDEX_EXPORT_EXTENSIONES = {'excel': 'xlsx', 'pdf': 'pdf'}
+
+
+# Vida de un archivo exportado: es también el result_ttl del job (ver ReporteKardexView).
+# Debe ser mayor que el timeout de exportar_kardex_task (un .part más viejo está huérfano).
+KARDEX_EXPORT_TTL_SEGUNDOS = getattr(settings, 'KARDEX_EXPORT_TTL_SEGUNDOS', 24 * 3600)
+
+
+def ruta_exportacion_kardex(nombre_archivo):
+    return os.path.join(settings.MEDIA_ROOT, KARDEX_EXPORT_DIR, nombre_archivo)
+
+
+def exportacion_vencida(ruta, ttl=KARDEX_EXPORT_TTL_SEGUNDOS):
+    """True si el archivo tiene más de 'ttl' segundos (o ya no existe)."""
+    try:
+        return time.time() - os.path.getmtime(ruta) > ttl
+    except OSError:
+        return True
 
 
-def crear_nota_almacen(empresa, pk_cab, pk_det, det):
+def limpiar_exportaciones_kardex(ttl=KARDEX_EXPORT_TTL_SEGUNDOS):
     """
-    Crea un registro en MovimientoAlmacenNota si el detalle es 'TEXTO'.
+    Borra los archivos de MEDIA_ROOT/exportaciones/kardex (y .part huérfanos) con más de
+    'ttl' segundos: para entonces rq ya descartó el resultado del job. Retorna cuántos borró.
     """
+    carpeta = os.path.join(settings.MEDIA_ROOT, KARDEX_EXPORT_DIR)
+    if not os.path.isdir(carpeta):
+        return 0
+    borrados = 0
+    for entrada in os.scandir(carpeta):
+        if entrada.is_file() and exportacion_vencida(entrada.path, ttl):
+            try:
+                os.remove(entrada.path)
+                borrados += 1
+            except OSError as e:
+                logger.warning(f"No se pudo borrar la exportación vencida {entrada.path}: {e}")
+    return borrados
+
+
+def notificar_usuario_exportacion(user_id, status, message, result=None):
+    """Envía al grupo personal del usuario (ver usuarios.consumers) el estado de su exportación."""
+    if not user_id: return
     try:
-        MovimientoAlmacenNota.objects.update_or_create(
-            empresa=empresa,
-            id_erp_det=pk_det,
-            defaults={
-                'id_erp_cab': pk_cab,
-                'item_erp': det.deitem,
-                'texto_descripcion': det.dedescri, # Descripción principal
-                'texto_detalle': det.detexto,      # Detalle extendido
-                # Puedes agregar 'created_by' o lo que necesites de BaseModel
-            }
-        )
+        from usuarios.consumers import get_user_group_name
+        channel_layer = get_channel_layer()
+        if channel_layer:
+            evento = {'type': 'kardex.export', 'status': status, 'message': message}
+            if result: evento['result'] = result
+            async_to_sync(channel_layer.group_send)(get_user_group_name(user_id), evento)
     except Exception as e:
-        # Logueamos pero no detenemos el proceso por una nota
-        logger.error(f"Error creando nota {pk_det}: {e}")
\ No newline at end of file
+        logger.error(f"WebSocket Error: {e}")
+
+
+@job('default', timeout=3600)
+def exportar_kardex_task(empresa_id, almacen_id, producto_ids, fecha_inicio, fecha_fin, export_format,
+                         user_id=None):
+    """
+    Genera el Kárdex en Excel (openpyxl write_only) o PDF (por partes) directo a disco,
+    producto por producto. El archivo queda en MEDIA_ROOT/exportaciones/kardex y se
+    descarga desde KardexExportStatusView hasta que vence (KARDEX_EXPORT_TTL_SEGUNDOS).
+    """
+    from .services import iterar_kardex_detallado
+    from .utils import escribir_kardex_excel, escribir_kardex_pdf
+
+    job_actual = get_current_job()
+    job_id = job_actual.id if job_actual else timezone.now().strftime('%Y%m%d%H%M%S')
+    f_inicio = datetime.date.fromisoformat(fecha_inicio)
+    f_fin = datetime.date.fromisoformat(fecha_fin)
+
+    empresa = Empresa.objects.filter(pk=empresa_id).first()
+    nombre_empresa = empresa.razon_social if empresa else "Empresa Desconocida"
+
+    total = len(producto_ids) or 1
+
+    def productos():
+        for procesados, item in enumerate(
+                iterar_kardex_detallado(empresa_id, almacen_id, producto_ids, f_inicio, f_fin), 1):
+            percent = round(procesados / total * 95, 1)
+            actualizar_progreso_job(percent, f"Kárdex: {procesados}/{total} productos")
+            yield item
+
+    nombre_archivo = f"Kardex_{f_inicio}_{f_fin}_{job_id}.{KARDEX_EXPORT_EXTENSIONES[export_format]}"
+    ruta = ruta_exportacion_kardex(nombre_archivo)
+    ruta_temporal = f"{ruta}.part"
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+
+    notificar_usuario_exportacion(user_id, 'running', 'Generando Kárdex...', result={'job_id': job_id})
+    try:
+        with open(ruta_temporal, 'wb') as destino:
+            if export_format == 'excel':
+                escribir_kardex_excel(productos(), f_inicio, f_fin, nombre_empresa, destino)
+            else:
+                context = {'empresa_id': empresa_id, 'fecha_inicio': f_inicio, 'fecha_fin': f_fin,
+                           'almacen_id': almacen_id}
+                escribir_kardex_pdf(productos(), context, nombre_empresa, destino)
+        os.replace(ruta_temporal, ruta)
+    except Exception as e:
+        if os.path.exists(ruta_temporal):
+            os.remove(ruta_temporal)
+        logger.error(f"Error exportando Kárdex (job {job_id}): {e}", exc_info=True)
+        notificar_usuario_exportacion(user_id, 'error', f"Error generando el Kárdex: {e}",
+                                      result={'job_id': job_id})
+        raise
+
+    if job_actual:
+        job_actual.meta['archivo'] = nombre_archivo
+        job_actual.save_meta()
+    actualizar_progreso_job(100, "Archivo listo")
+    notificar_usuario_exportacion(user_id, 'ready', 'El Kárdex está listo para descargar.',
+                                  result={'job_id': job_id, 'archivo': nombre_archivo})
+    return {'archivo': nombre_archivo}
+
+
+# ==========================================
+# SECCIÓN 6: SINCRONIZACIÓN MULTI-EMPRESA (FAN-OUT)
+# ==========================================
+
+# Bases StarSoft independientes: cada una se sincroniza en su propio job
+ALIASES_ERP = getattr(settings, 'SYNC_ERP_ALIASES',
+                      ['bd_semilla_starsoft', 'bd_maxi_starsoft', 'bd_trading_starsoft'])
+SYNC_ERP_MAX_PARALELO = getattr(settings, 'SYNC_ERP_MAX_PARALELO', 3)
+SYNC_ERP_TIMEOUT = 7200
+
+
+def encolar_sincronizacion_multi(aliases=None, start_year=2000, reconciliation_days=30,
+                                 max_paralelo=None, user_id=None):
+    """
+    Encola un sincronizar_empresa_erp_task por alias sin un job padre que espere
+    ocupando un worker (con menos de max_paralelo + 1 workers los hijos nunca arrancaban):
+
+    - Los alias se reparten en 'max_paralelo' carriles; en cada carril un hijo depende
+      (rq depends_on) del anterior, así nunca corren más de max_paralelo a la vez.
+    - consolidar_sync_multi_task depende de todos los hijos y arma {alias: resultado}.
+    - allow_failure: un hijo caído (timeout, worker muerto) no bloquea a los siguientes.
+
+    Con un solo worker los carriles simplemente corren uno tras otro.
+    Retorna el job de cierre (su id identifica la sincronización multi-empresa).
+    """
+    import uuid
+
+    import django_rq
+    from rq.job import Dependency
+
+    aliases = list(aliases or ALIASES_ERP)
+    max_paralelo = max(1, max_paralelo or SYNC_ERP_MAX_PARALELO)
+    queue = django_rq.get_queue('default')
+
+    # Ids generados antes de encolar: el índice de estado se escribe antes de que un
+    # worker pueda tomar el job
+    hijos = {alias: str(uuid.uuid4()) for alias in aliases}
+    cierre_id = str(uuid.uuid4())
+    carril_mas_largo = -(-len(aliases) // max_paralelo)
+    estado_sync.registrar_encolado(estado_sync.TIPO_MULTI, '', cierre_id, user_id=user_id,
+                                   detalle={'hijos': hijos},
+                                   ttl=SYNC_ERP_TIMEOUT * (carril_mas_largo + 1))
+    for posicion, (alias, hijo_id) in enumerate(hijos.items()):
+        # Un hijo diferido espera a los anteriores de su carril: su plazo en cola crece con ellos
+        estado_sync.registrar_encolado(estado_sync.TIPO_EMPRESA, alias, hijo_id,
+                                       ttl=SYNC_ERP_TIMEOUT * (posicion // max_paralelo + 1))
+
+    ultimos = {}  # carril -> job del último hijo encolado
+    for posicion, alias in enumerate(aliases):
+        carril = posicion % max_paralelo
+        anterior = ultimos.get(carril)
+        ultimos[carril] = queue.enqueue(
+            'almacen.tasks.sincronizar_empresa_erp_task',
+            empresa_alias=alias,
+            start_year=start_year,
+            reconciliation_days=reconciliation_days,
+            job_id=hijos[alias],
+            job_timeout=SYNC_ERP_TIMEOUT,
+            depends_on=Dependency(jobs=[anterior], allow_failure=True) if anterior else None,
+        )
+
+    return queue.enqueue(
+        'almacen.tasks.consolidar_sync_multi_task',
+        hijos=hijos,
+        job_id=cierre_id,
+        depends_on=Dependency(jobs=list(ultimos.values()), allow_failure=True),
+    )
+
+
+@job('default', timeout=600)
+def consolidar_sync_multi_task(hijos):
+    """Cierre de la sincronización multi-empresa: {alias: resultado} de cada hijo."""
+    import django_rq
+
+    queue = django_rq.get_queue('default')
+    resultados = {}
+    for alias, hijo_id in hijos.items():
+        hijo = queue.fetch_job(hijo_id)
+        estado = hijo.get_status() if hijo else None
+        estado = getattr(estado, 'value', estado)  # JobStatus (enum de str) -> 'finished'
+        if estado == 'finished':
+            resultados[alias] = hijo.return_value()
+        else:
+            resultados[alias] = f"Job {estado or 'no encontrado'}"
+
+    # La tarea retorna "OK" o un texto de error (no lanza excepción)
+    fallidas = [alias for alias, resultado in resultados.items() if resultado != "OK"]
+    logger.info(f"Sincronización multi-empresa finalizada: {resultados}")
+    job_actual = get_current_job()
+    estado_sync.registrar_fin(estado_sync.TIPO_MULTI, '', job_actual.id if job_actual else None, not fallidas,
+                              f"Fallaron: {', '.join(fallidas)}" if fallidas else "Finalizado")
+    return resultados
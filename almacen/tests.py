@@ -1,3 +1,460 @@
+import datetime
+from decimal import Decimal
+
 from django.test import TestCase
+from django.utils import timezone
+
+
+class StockLedgerTestCase(TestCase):
+    """
+    El Stock se ajusta con deltas (stock_ledger.LedgerStock) en la sincronización y en
+    la recepción de transferencias. Después de cada operación debe coincidir con el
+    recálculo completo del historial (comparar_stock_con_historial).
+    """
+
+    def setUp(self):
+        from importaciones.models import Empresa, Producto
+        from almacen.models import Almacen
+
+        self.empresa = Empresa.objects.create(nombre_empresa='Ledger', razon_social='Ledger SAC', ruc='20100000001')
+        self.origen = Almacen.objects.create(empresa=self.empresa, codigo='AL', descripcion='Lima')
+        self.destino = Almacen.objects.create(empresa=self.empresa, codigo='AD', descripcion='Arequipa')
+        self.producto = Producto.objects.create(empresa=self.empresa, nombre_producto='Semilla',
+                                                codigo_producto='P1', proveedor_marca='Marca')
+        self.fecha = timezone.now() - datetime.timedelta(days=20)
+
+    def _documento(self, td, numero, cantidad, tipmov='I', codmov='CO', carfalma=None, fecha=None,
+                   codigo='P1', almacen='AL'):
+        """Cabecera + un ítem en las tablas Legacy (lo que trae la Fase 1 desde el ERP)."""
+        from almacen.models import LegacyMovAlmCab, LegacyMovAlmDet
+
+        cab = LegacyMovAlmCab.objects.create(
+            empresa=self.empresa, caalma=almacen, catd=td, canumdoc=numero, cafecdoc=fecha or self.fecha,
+            catipmov=tipmov, cacodmov=codmov, casitgui='F', cahora='10:00:00', carfalma=carfalma,
+        )
+        LegacyMovAlmDet.objects.create(
+            empresa=self.empresa, dealma=almacen, detd=td, denumdoc=numero, deitem=1, decodigo=codigo,
+            decantid=Decimal(cantidad), depreuni=Decimal('1'), devaltot=Decimal(cantidad),
+        )
+        return cab
+
+    def _sincronizar(self):
+        from almacen.tasks import procesar_legacy_data_logic
+
+        ahora = timezone.now()
+        procesar_legacy_data_logic(self.empresa, ahora - datetime.timedelta(days=60), ahora)
+
+    def _stock(self, almacen):
+        from almacen.models import Stock
+
+        stock = Stock.objects.get(empresa=self.empresa, almacen=almacen, producto=self.producto)
+        return stock.cantidad_actual, stock.cantidad_en_transito
+
+    def assertStockCoincideConHistorial(self):
+        from almacen.stock_ledger import comparar_stock_con_historial
+        self.assertEqual(comparar_stock_con_historial(self.empresa.id), [])
+
+    def test_ingreso_and_salida_update_stock(self):
+        self._documento('NI', '0000001', '10')
+        self._documento('GS', '0000002', '3', tipmov='S', codmov='VE')
+        self._sincronizar()
+
+        self.assertEqual(self._stock(self.origen), (Decimal('7'), Decimal('0')))
+        self.assertStockCoincideConHistorial()
+
+        # Reprocesar el mismo rango no cambia nada
+        self._sincronizar()
+        self.assertEqual(self._stock(self.origen), (Decimal('7'), Decimal('0')))
+
+    def test_codes_match_ignoring_case_and_padding(self):
+        # Como la collation de MySQL que usaba Producto.objects.get
+        self.producto.codigo_producto = 'Sem-01'
+        self.producto.save()
+        self._documento('NI', '0000001', '10', codigo='SEM-01  ', almacen='al')
+        self._documento('NI', '0000002', '2', codigo='NO-EXISTE')
+
+        with self.assertLogs('almacen.tasks', level='WARNING') as logs:
+            self._sincronizar()
+
+        self.assertEqual(self._stock(self.origen), (Decimal('10'), Decimal('0')))
+        self.assertStockCoincideConHistorial()
+        self.assertTrue(any('NO-EXISTE' in linea for linea in logs.output))
+
+    def test_edited_movement_applies_the_difference(self):
+        from almacen.models import LegacyMovAlmDet
+
+        self._documento('NI', '0000001', '10')
+        self._sincronizar()
+
+        LegacyMovAlmDet.objects.filter(denumdoc='0000001').update(decantid=Decimal('4'))
+        self._sincronizar()
+
+        self.assertEqual(self._stock(self.origen), (Decimal('4'), Decimal('0')))
+        self.assertStockCoincideConHistorial()
+
+    def test_cancelled_document_removes_its_movements(self):
+        from almacen.models import MovimientoAlmacen
+
+        self._documento('NI', '0000001', '10')
+        salida = self._documento('GS', '0000002', '3', tipmov='S', codmov='VE')
+        self._sincronizar()
+
+        salida.casitgui = 'A'
+        salida.save()
+        self._sincronizar()
+
+        self.assertFalse(MovimientoAlmacen.all_objects.filter(tipo_documento_erp='GS').exists())
+        self.assertEqual(self._stock(self.origen), (Decimal('10'), Decimal('0')))
+        self.assertStockCoincideConHistorial()
+
+    def test_soft_deleted_movement_is_reactivated_by_the_sync(self):
+        from almacen.models import MovimientoAlmacen, Stock
+
+        self._documento('NI', '0000001', '10')
+        self._documento('NI', '0000002', '5')
+        self._sincronizar()
+
+        # Baja lógica: el movimiento deja de contar para el stock
+        MovimientoAlmacen.objects.get(numero_documento_erp='0000002').delete()
+        Stock.recalcular_stock_completo(self.empresa.id, self.origen.id, self.producto.id)
+        self.assertEqual(self._stock(self.origen), (Decimal('10'), Decimal('0')))
+        self.assertStockCoincideConHistorial()
+
+        # Sigue vigente en el ERP: la sincronización lo reactiva y suma su aporte una sola vez
+        self._sincronizar()
+        self.assertTrue(MovimientoAlmacen.objects.filter(numero_documento_erp='0000002').exists())
+        self.assertEqual(self._stock(self.origen), (Decimal('15'), Decimal('0')))
+        self.assertStockCoincideConHistorial()
+
+    def test_transfer_receive_and_revert(self):
+        from almacen.models import Transferencia
+
+        self._documento('NI', '0000001', '10')
+        self._documento('GS', '0000002', '4', tipmov='S', codmov='TD', carfalma='AD')
+        self._sincronizar()
+
+        self.assertEqual(self._stock(self.origen), (Decimal('6'), Decimal('4')))
+        self.assertStockCoincideConHistorial()
+
+        transferencia = Transferencia.objects.get()
+        self.assertTrue(transferencia.recibir_mercaderia(Decimal('3'), timezone.now()))
+        self.assertEqual(transferencia.estado, 'RECIBIDO_PARCIAL')
+        self.assertEqual(self._stock(self.origen), (Decimal('6'), Decimal('0')))
+        self.assertEqual(self._stock(self.destino), (Decimal('3'), Decimal('0')))
+        self.assertStockCoincideConHistorial()
+
+        # Una transferencia ya recibida no se vuelve a recibir
+        self.assertFalse(transferencia.recibir_mercaderia(Decimal('3'), timezone.now()))
+
+        self.assertTrue(transferencia.revertir_recepcion())
+        self.assertEqual(transferencia.estado, 'EN_TRANSITO')
+        self.assertEqual(self._stock(self.origen), (Decimal('6'), Decimal('4')))
+        self.assertEqual(self._stock(self.destino), (Decimal('0'), Decimal('0')))
+        self.assertStockCoincideConHistorial()
+
+    def test_missing_stock_row_is_rebuilt_from_history(self):
+        from almacen.models import LegacyMovAlmDet, Stock
+
+        self._documento('NI', '0000001', '10')
+        self._documento('NI', '0000002', '5')
+        self._sincronizar()
+
+        # Sin fila en Stock el delta solo no alcanza: se recalcula el par completo
+        Stock.objects.filter(almacen=self.origen).delete()
+        LegacyMovAlmDet.objects.filter(denumdoc='0000002').update(decantid=Decimal('7'))
+        self._sincronizar()
+
+        self.assertEqual(self._stock(self.origen), (Decimal('17'), Decimal('0')))
+        self.assertStockCoincideConHistorial()
+
+    def test_comparison_reports_drift(self):
+        from almacen.models import Stock
+        from almacen.stock_ledger import comparar_stock_con_historial
+
+        self._documento('NI', '0000001', '10')
+        self._sincronizar()
+        Stock.objects.filter(almacen=self.origen).update(cantidad_actual=Decimal('99'))
+
+        diferencias = comparar_stock_con_historial(self.empresa.id)
+        self.assertEqual(len(diferencias), 1)
+        self.assertEqual(diferencias[0]['ledger_actual'], Decimal('99'))
+        self.assertEqual(diferencias[0]['esperado_actual'], Decimal('10'))
+
+
+class KardexSnapshotColumnarTestCase(TestCase):
+    """
+    El Kárdex con snapshots mensuales (KardexSaldoMensual) y el motor columnar
+    (kardex_columnar) deben producir exactamente las mismas filas que el cálculo fila
+    por fila sumando todo el historial, también después de editar un mes ya cerrado.
+    """
+    HOY = datetime.datetime(2024, 6, 15, 12, 0, tzinfo=datetime.timezone.utc)
+
+    def setUp(self):
+        from importaciones.models import Empresa, Producto
+        from almacen.models import (Almacen, MovimientoAlmacen, MovimientoAlmacenNota, Transferencia)
+
+        self.empresa = Empresa.objects.create(nombre_empresa='Kardex', razon_social='Kardex SAC', ruc='20100000002')
+        self.almacen = Almacen.objects.create(empresa=self.empresa, codigo='AL', descripcion='Lima')
+        otro = Almacen.objects.create(empresa=self.empresa, codigo='AD', descripcion='Arequipa')
+        self.productos = [
+            Producto.objects.create(empresa=self.empresa, nombre_producto=f'Producto {i}',
+                                    codigo_producto=f'K{i}', proveedor_marca='Marca')
+            for i in range(5)
+        ]
+
+        # Movimientos repartidos en ~10 meses, con todos los casos que el Kárdex distingue
+        # (TD / FT / normal, glosas vacías, estados que no cuentan, bajas lógicas).
+        # El último producto no tiene movimientos.
+        codigos = ['TD', 'FT', 'VE', None, 'CO', 'ft ']
+        estados = ['F', 'V', 'F', 'A', 'P']
+        movimientos = []
+        n = 0
+        for p, producto in enumerate(self.productos[:-1]):
+            for j in range(12 + 5 * p):
+                n += 1
+                cabecera = f'AL-NI-{n % 7}'
+                movimientos.append(MovimientoAlmacen(
+                    empresa=self.empresa, almacen=self.almacen, producto=producto,
+                    id_erp_cab=cabecera, id_erp_det=f'{cabecera}-{n}',
+                    tipo_documento_erp='NI' if j % 3 else 'GS', numero_documento_erp=f'{n:07d}', item_erp=1,
+                    fecha_documento=self.HOY - datetime.timedelta(days=(n * 37) % 300, seconds=n),
+                    cantidad=Decimal(n * 137 % 5000) / Decimal(1000) + 1,
+                    glosa_cabecera=[None, '', 'Glosa cab', ' x '][n % 4],
+                    glosa_detalle=[None, ' Glosa det '][n % 2],
+                    cliente_erp_nombre=[None, '', ' Cliente '][n % 3],
+                    nombre_proveedor=[None, 'Proveedor'][n % 2],
+                    referencia_documento=[None, 'REF-1'][n % 2],
+                    codigo_movimiento=codigos[n % len(codigos)], almacen_ref=[None, 'AD'][n % 2],
+                    es_ingreso=bool(j % 3), estado_erp=estados[n % len(estados)], state=n % 11 != 0,
+                ))
+        MovimientoAlmacen.objects.bulk_create(movimientos)
+
+        for k in (0, 3):
+            MovimientoAlmacenNota.objects.create(empresa=self.empresa, id_erp_cab=f'AL-NI-{k}',
+                                                 id_erp_det=f'AL-NI-{k}-N1', item_erp=90, texto_descripcion=' Nota ')
+            MovimientoAlmacenNota.objects.create(empresa=self.empresa, id_erp_cab=f'AL-NI-{k}',
+                                                 id_erp_det=f'AL-NI-{k}-N2', item_erp=91, texto_descripcion='dos')
+        Transferencia.objects.create(
+            empresa=self.empresa, id_erp_salida_det='AD-GS-1-1', id_erp_salida_cab='AD-GS-1',
+            almacen_origen=otro, almacen_destino=self.almacen, producto=self.productos[1],
+            cantidad_enviada=Decimal('5'), fecha_envio=self.HOY,
+        )
+        self.producto_ids = [p.id for p in self.productos]
+
+    def _rangos(self):
+        hoy = self.HOY.date()
+        return [
+            (datetime.date(2024, 3, 10), hoy),   # inicio a mitad de mes: snapshot + cola
+            (datetime.date(2024, 2, 1), hoy),    # inicio justo en un cierre
+            (datetime.date(2023, 1, 1), hoy),    # antes de todo el historial
+            (hoy, hoy),                          # sin movimientos en el rango
+        ]
+
+    def _kardex_fila_a_fila(self, desde, hasta):
+        from almacen.services import iterar_kardex_fila_a_fila
+        return dict(iterar_kardex_fila_a_fila(self.empresa.id, self.almacen.id, self.producto_ids, desde, hasta))
+
+    def _kardex_historial(self, desde, hasta):
+        """Referencia: fila por fila sin snapshots (el saldo anterior suma todo el historial)."""
+        from django.db import transaction
+        from almacen.models import KardexSaldoMensual
+
+        with transaction.atomic():
+            KardexSaldoMensual.objects.all().delete()
+            kardex = self._kardex_fila_a_fila(desde, hasta)
+            transaction.set_rollback(True)
+        return kardex
+
+    def assertKardexIgualAlHistorial(self):
+        from almacen.kardex_columnar import iterar_kardex_columnar
+        from almacen.models import KardexSaldoMensual
+        from almacen.services import get_kardex_detallado
+
+        self.assertTrue(KardexSaldoMensual.objects.exists())
+        for desde, hasta in self._rangos():
+            with self.subTest(desde=desde):
+                esperado = self._kardex_historial(desde, hasta)
+                self.assertEqual(self._kardex_fila_a_fila(desde, hasta), esperado)
+
+                columnar = get_kardex_detallado(self.empresa.id, self.almacen.id, self.producto_ids, desde, hasta)
+                self.assertEqual(columnar, esperado)
+                for producto_id, datos in esperado.items():
+                    for fila_esperada, fila in zip(datos['kardex'], columnar[producto_id]['kardex']):
+                        self.assertEqual(list(fila), list(fila_esperada))
+                        self.assertEqual(type(fila['detalle']), type(fila_esperada['detalle']))
+
+                # Lotes chicos: el corte de lote no cambia el resultado
+                por_lotes = dict(iterar_kardex_columnar(self.empresa.id, self.almacen.id, self.producto_ids,
+                                                        desde, hasta, tamanio_lote=2))
+                self.assertEqual(por_lotes, {pid: datos['kardex'] for pid, datos in esperado.items()})
+
+    def test_snapshots_and_columnar_match_full_history(self):
+        from almacen.kardex_saldos import reconstruir_todos_los_saldos
+
+        reconstruir_todos_los_saldos()
+        self.assertKardexIgualAlHistorial()
+
+        kardex = self._kardex_fila_a_fila(datetime.date(2024, 3, 10), self.HOY.date())
+        self.assertEqual(kardex[self.productos[1].id]['stock_en_transito'], Decimal('5'))
+        self.assertEqual(kardex[self.productos[-1].id]['kardex'][0]['saldo'], 0)
+
+    def test_backdated_edit_rebuilds_snapshots(self):
+        from almacen.kardex_saldos import reconstruir_todos_los_saldos
+        from almacen.models import MovimientoAlmacen
+        from almacen.stock_ledger import LedgerStock
+
+        reconstruir_todos_los_saldos()
+
+        # Edición de un movimiento en un mes ya cerrado, como la hace la sincronización
+        movimiento = (MovimientoAlmacen.objects.filter(almacen=self.almacen, estado_erp='F')
+                      .order_by('fecha_documento').first())
+        ledger = LedgerStock()
+        ledger.movimiento(movimiento, signo=-1)
+        movimiento.cantidad += Decimal('250')
+        movimiento.save()
+        ledger.movimiento(movimiento)
+        ledger.aplicar()
+
+        self.assertKardexIgualAlHistorial()
+
+
+class KardexExportacionTestCase(TestCase):
+    """
+    Los archivos de las exportaciones en segundo plano vencen junto con el resultado
+    del job (KARDEX_EXPORT_TTL_SEGUNDOS): se borran y la descarga responde 410.
+    """
+
+    def setUp(self):
+        import shutil
+        import tempfile
+        from django.contrib.auth.models import User
+        from django.test import override_settings
+
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        settings_media = override_settings(MEDIA_ROOT=self.media)
+        settings_media.enable()
+        self.addCleanup(settings_media.disable)
+        self.user = User.objects.create_superuser(username='kardexexport', password='testpass123')
+
+    def _archivo(self, nombre, antiguedad):
+        import os
+        import time
+        from almacen.tasks import ruta_exportacion_kardex
+
+        ruta = ruta_exportacion_kardex(nombre)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        with open(ruta, 'wb') as f:
+            f.write(b'kardex')
+        marca = time.time() - antiguedad
+        os.utime(ruta, (marca, marca))
+        return ruta
+
+    def _descargar(self, nombre_archivo):
+        from unittest import mock
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from almacen.views import KardexExportStatusView
+
+        job = mock.Mock(func_name='almacen.tasks.exportar_kardex_task', kwargs={'user_id': self.user.id},
+                        meta={'archivo': nombre_archivo})
+        job.get_status.return_value = 'finished'
+        cola = mock.Mock()
+        cola.fetch_job.return_value = job
+
+        request = APIRequestFactory().get('/api/almacen/reporte-kardex/exportaciones/j1/descargar/')
+        force_authenticate(request, user=self.user)
+        with mock.patch('almacen.views.django_rq.get_queue', return_value=cola):
+            return KardexExportStatusView.as_view(descargar=True)(request, job_id='j1')
+
+    def test_expired_file_returns_410(self):
+        import os
+        from almacen.tasks import KARDEX_EXPORT_TTL_SEGUNDOS
+
+        vigente = self._archivo('Kardex_vigente.xlsx', 60)
+        respuesta = self._descargar('Kardex_vigente.xlsx')
+        self.assertEqual(respuesta.status_code, 200)
+        respuesta.close()
+
+        vencido = self._archivo('Kardex_vencido.xlsx', KARDEX_EXPORT_TTL_SEGUNDOS + 60)
+        self.assertEqual(self._descargar('Kardex_vencido.xlsx').status_code, 410)
+        self.assertFalse(os.path.exists(vencido))
+        self.assertTrue(os.path.exists(vigente))
+
+    def test_cleanup_removes_only_expired_files(self):
+        import os
+        from almacen.tasks import KARDEX_EXPORT_TTL_SEGUNDOS, limpiar_exportaciones_kardex
+
+        vigente = self._archivo('Kardex_vigente.pdf', 60)
+        vencido = self._archivo('Kardex_vencido.pdf', KARDEX_EXPORT_TTL_SEGUNDOS + 60)
+        huerfano = self._archivo('Kardex_caido.xlsx.part', KARDEX_EXPORT_TTL_SEGUNDOS + 60)
+
+        self.assertEqual(limpiar_exportaciones_kardex(), 2)
+        self.assertTrue(os.path.exists(vigente))
+        self.assertFalse(os.path.exists(vencido))
+        self.assertFalse(os.path.exists(huerfano))
+
+
+class BusquedaTestCase(TestCase):
+    """
+    Búsqueda global de movimientos y de stock por producto (almacen/busqueda.py):
+    documento y código en cualquier posición, y en MySQL sin ramas LIKE '%…%' que
+    no pasen antes por un índice FULLTEXT.
+    """
+
+    def setUp(self):
+        from importaciones.models import Empresa, Producto
+        from almacen.models import Almacen, MovimientoAlmacen
+
+        empresa = Empresa.objects.create(nombre_empresa='Busqueda', razon_social='Busqueda SAC', ruc='20100000003')
+        almacen = Almacen.objects.create(empresa=empresa, codigo='AL', descripcion='Lima')
+        self.producto = Producto.objects.create(empresa=empresa, nombre_producto='Semilla de maíz',
+                                                codigo_producto='SM-00451', proveedor_marca='Marca')
+        self.movimiento = MovimientoAlmacen.objects.create(
+            empresa=empresa, almacen=almacen, producto=self.producto,
+            id_erp_cab='AL-NI-0000123', id_erp_det='AL-NI-0000123-1', tipo_documento_erp='NI',
+            numero_documento_erp='0000123', item_erp=1, fecha_documento=timezone.now(), cantidad=Decimal('1'),
+            referencia_documento='F001-000987', texto_busqueda='Semilla de maíz 0000123 F001-000987',
+        )
+
+    def _buscar_movimientos(self, valor):
+        from almacen.filters import MovimientoAlmacenFilter
+        from almacen.models import MovimientoAlmacen
+        return list(MovimientoAlmacenFilter({'search': valor}, queryset=MovimientoAlmacen.objects.all()).qs)
+
+    def test_document_numbers_match_in_any_position(self):
+        from almacen.filters import StockFilter
+        from almacen.models import Stock
+
+        self.assertEqual(self._buscar_movimientos('123'), [self.movimiento])
+        self.assertEqual(self._buscar_movimientos('000987'), [self.movimiento])
+        self.assertEqual(self._buscar_movimientos('semilla'), [self.movimiento])
+        self.assertEqual(self._buscar_movimientos('999'), [])
+
+        Stock.recalcular_stock_completo(self.movimiento.empresa_id, self.movimiento.almacen_id, self.producto.id)
+        self.assertEqual(StockFilter({'search': '451'}, queryset=Stock.objects.all()).qs.count(), 1)
+
+    def test_mysql_search_has_no_unindexed_like_branch(self):
+        from types import SimpleNamespace
+        from unittest import mock
+        from django.db import connection
+        from django.db.models import Q
+        from importaciones.models import Producto
+        from almacen import busqueda
+        from almacen.models import MovimientoAlmacen
 
-# Create your tests here.
+        busquedas = [
+            (MovimientoAlmacen, ('texto_busqueda',), ('numero_documento_erp', 'referencia_documento')),
+            (Producto, ('nombre_producto', 'codigo_producto'), ('codigo_producto',)),
+        ]
+        mysql = SimpleNamespace(vendor='mysql', ops=connection.ops)
+        with mock.patch.object(busqueda, 'connection', mysql):
+            for modelo, columnas, infijo in busquedas:
+                for valor in ('123', '12', 'F001-000987', 'semilla 12', 'maiz de', 'ab cd'):
+                    filtro = busqueda.filtro_busqueda(modelo, valor, columnas, campos_infijo=infijo)
+                    ramas = filtro.children if filtro.connector == Q.OR else [filtro]
+                    for rama in ramas:
+                        sql = str(modelo._base_manager.filter(rama).query)
+                        with self.subTest(modelo=modelo.__name__, valor=valor, rama=sql):
+                            self.assertIn('MATCH (', sql)
+                # Un solo carácter no alcanza ningún índice: no se filtra
+                self.assertIsNone(busqueda.filtro_busqueda(modelo, 'x', columnas, campos_infijo=infijo))
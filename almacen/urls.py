@@ -20,6 +20,10 @@ urlpatterns = [
     path('trigger-sync/', TriggerSyncAPIView.as_view(), name='trigger-sync'), # API del Botón
     path('check-sync-status/', CheckSyncStatusAPIView.as_view(), name='check-sync-status'),
     path('reporte-kardex/', KardexReportView.as_view(), name='api_reporte_kardex'),
+    path('reporte-kardex/exportaciones/<str:job_id>/', KardexExportStatusView.as_view(),
+         name='kardex-exportacion-estado'),
+    path('reporte-kardex/exportaciones/<str:job_id>/descargar/', KardexExportStatusView.as_view(descargar=True),
+         name='kardex-exportacion-descargar'),
 ]
 # Agregar también las rutas del router
 urlpatterns += router.urls
\ No newline at end of file
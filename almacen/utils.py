@@ -1,128 +1,125 @@
 # utils.py
+import os
+import tempfile
 import openpyxl
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, PatternFill, Alignment, Border, Side, NamedStyle
 from openpyxl.utils import get_column_letter
 from io import BytesIO
 from django.http import HttpResponse
 from django.template.loader import render_to_string
+from pypdf import PdfWriter
 from weasyprint import HTML
 from django.utils import timezone
 
+KARDEX_COLUMNAS = ["Fecha", "Documento", "Detalle", "Entrada", "Salida", "Saldo"]
+KARDEX_ANCHOS = [12, 18, 40, 12, 12, 12]
+# Filas de Kárdex por cada PDF parcial (weasyprint maqueta todo el HTML en memoria)
+KARDEX_PDF_FILAS_POR_PARTE = 3000
 
-def generate_kardex_excel(data, f_inicio, f_fin, nombre_empresa=""):
-    # 1. Crear el libro y la hoja
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Reporte Kardex"
-
-    # --- ESTILOS ---
-    header_font = Font(bold=True, color="FFFFFF", size=12)
-    header_fill = PatternFill(start_color="005f73", end_color="005f73", fill_type="solid")
-
-    prod_title_font = Font(bold=True, size=11)
-    prod_title_fill = PatternFill(start_color="e9ecef", end_color="e9ecef", fill_type="solid")
-    prod_border_left = Border(left=Side(style='thick', color='0a9396'))
 
-    table_head_font = Font(bold=True, color="000000", size=10)
-    table_head_fill = PatternFill(start_color="f8f9fa", end_color="f8f9fa", fill_type="solid")
+def _estilos_kardex():
+    """
+    Estilos con nombre del Kárdex. Se registran una vez por libro y cada celda
+    solo guarda la referencia (en vez de crear Font/Border por celda).
+    """
     thin_border = Border(left=Side(style='thin'), right=Side(style='thin'),
                          top=Side(style='thin'), bottom=Side(style='thin'))
-
     number_format = '#,##0.00'
     date_format = 'dd/mm/yyyy'
 
-    # 2. Encabezado General
-    ws.merge_cells('A1:F1')
-    cell_title = ws['A1']
-    # Concatenamos el nombre de la empresa
-    cell_title.value = f"{nombre_empresa} - REPORTE DE KARDEX ({f_inicio} al {f_fin})"
-    cell_title.font = header_font
-    cell_title.fill = header_fill
-    cell_title.alignment = Alignment(horizontal='center', vertical='center')
-    ws.row_dimensions[1].height = 25
+    return [
+        NamedStyle('kx_titulo', font=Font(bold=True, color="FFFFFF", size=12),
+                   fill=PatternFill(start_color="005f73", end_color="005f73", fill_type="solid"),
+                   alignment=Alignment(horizontal='center', vertical='center')),
+        NamedStyle('kx_producto', font=Font(bold=True, size=11),
+                   fill=PatternFill(start_color="e9ecef", end_color="e9ecef", fill_type="solid"),
+                   border=Border(left=Side(style='thick', color='0a9396'))),
+        NamedStyle('kx_cabecera', font=Font(bold=True, color="000000", size=10),
+                   fill=PatternFill(start_color="f8f9fa", end_color="f8f9fa", fill_type="solid"),
+                   border=thin_border, alignment=Alignment(horizontal='center')),
+        NamedStyle('kx_vacio', font=Font(italic=True, color="999999"), alignment=Alignment(horizontal='center')),
+        NamedStyle('kx_fecha', border=thin_border, number_format=date_format),
+        NamedStyle('kx_texto', border=thin_border),
+        NamedStyle('kx_numero', border=thin_border, number_format=number_format),
+        NamedStyle('kx_entrada', font=Font(color="2a9d8f", bold=True), border=thin_border,
+                   number_format=number_format),
+        NamedStyle('kx_salida', font=Font(color="e76f51", bold=True), border=thin_border,
+                   number_format=number_format),
+        NamedStyle('kx_saldo', font=Font(bold=True), border=thin_border, number_format=number_format),
+    ]
+
+
+def escribir_kardex_excel(productos, f_inicio, f_fin, nombre_empresa, destino):
+    """
+    Escribe el Kárdex en modo write_only (las filas se vuelcan al archivo a medida que se agregan).
+    productos: iterable de (producto_id, datos) como get_kardex_detallado(...).items()
+    destino: ruta o archivo binario.
+    """
+    wb = openpyxl.Workbook(write_only=True)
+    for estilo in _estilos_kardex():
+        wb.add_named_style(estilo)
+    ws = wb.create_sheet("Reporte Kardex")
 
-    row_num = 3
+    # En write_only los anchos deben definirse antes de escribir filas
+    for i, width in enumerate(KARDEX_ANCHOS, 1):
+        ws.column_dimensions[get_column_letter(i)].width = width
 
-    # 3. Iterar sobre los productos
-    for p_id, producto in data.items():
+    def celda(valor, estilo):
+        cell = WriteOnlyCell(ws, value=valor)
+        cell.style = estilo
+        return cell
+
+    # 1. Encabezado General
+    ws.row_dimensions[1].height = 25
+    ws.append([celda(f"{nombre_empresa} - REPORTE DE KARDEX ({f_inicio} al {f_fin})", 'kx_titulo')])
+    ws.merged_cells.add('A1:F1')
+    ws.append([])
+    row_num = 3
 
-        # --- A. Título del Producto ---
+    # 2. Productos
+    for p_id, producto in productos:
         product_text = f"{producto['codigo_producto']} - {producto['nombre_producto']}"
         unidad_text = f"Unidad: {producto.get('unidad_medida', 'KG')}"
-
-        ws.merge_cells(f'A{row_num}:F{row_num}')
-        cell_prod = ws[f'A{row_num}']
-        cell_prod.value = f"{product_text}   |   {unidad_text}"
-        cell_prod.font = prod_title_font
-        cell_prod.fill = prod_title_fill
-        cell_prod.border = prod_border_left
-
+        ws.append([celda(f"{product_text}   |   {unidad_text}", 'kx_producto')])
+        ws.merged_cells.add(f'A{row_num}:F{row_num}')
         row_num += 1
 
-        # --- B. Cabeceras de la Tabla ---
-        headers = ["Fecha", "Documento", "Detalle", "Entrada", "Salida", "Saldo"]
-        for col_idx, header in enumerate(headers, 1):
-            cell = ws.cell(row=row_num, column=col_idx, value=header)
-            cell.font = table_head_font
-            cell.fill = table_head_fill
-            cell.border = thin_border
-            cell.alignment = Alignment(horizontal='center')
-
+        ws.append([celda(header, 'kx_cabecera') for header in KARDEX_COLUMNAS])
         row_num += 1
 
-        # --- C. Filas de Movimientos ---
         if not producto['kardex']:
-            ws.merge_cells(f'A{row_num}:F{row_num}')
-            ws[f'A{row_num}'].value = "Sin movimientos en este periodo"
-            ws[f'A{row_num}'].font = Font(italic=True, color="999999")
-            ws[f'A{row_num}'].alignment = Alignment(horizontal='center')
+            ws.append([celda("Sin movimientos en este periodo", 'kx_vacio')])
+            ws.merged_cells.add(f'A{row_num}:F{row_num}')
             row_num += 1
         else:
             for mov in producto['kardex']:
-
-                # --- CORRECCIÓN DE FECHA AQUÍ ---
                 fecha_val = mov['fecha']
-                # Si es una fecha con zona horaria (UTC), la convertimos a local y quitamos la info de zona
+                # Fecha con zona horaria (UTC) -> hora local (Perú) sin tzinfo para Excel
                 if hasattr(fecha_val, 'tzinfo') and fecha_val.tzinfo:
-                    # 1. Convertir a hora local (Perú)
-                    fecha_val = timezone.localtime(fecha_val)
-                    # 2. Quitar la metadata de timezone para que Excel no se queje
-                    fecha_val = fecha_val.replace(tzinfo=None)
-
-                # Escribir Fecha corregida
-                ws.cell(row=row_num, column=1, value=fecha_val).number_format = date_format
-
-                # Resto de columnas (igual que antes)
-                ws.cell(row=row_num, column=2, value=mov.get('doc', '-'))
-                ws.cell(row=row_num, column=3, value=mov['detalle'])
-
-                c_ent = ws.cell(row=row_num, column=4, value=mov['entrada'] if mov['entrada'] > 0 else "")
-                c_ent.number_format = number_format
-                if mov['entrada'] > 0: c_ent.font = Font(color="2a9d8f", bold=True)
-
-                c_sal = ws.cell(row=row_num, column=5, value=mov['salida'] if mov['salida'] > 0 else "")
-                c_sal.number_format = number_format
-                if mov['salida'] > 0: c_sal.font = Font(color="e76f51", bold=True)
-
-                c_bal = ws.cell(row=row_num, column=6, value=mov['saldo'])
-                c_bal.number_format = number_format
-                c_bal.font = Font(bold=True)
-
-                for col in range(1, 7):
-                    ws.cell(row=row_num, column=col).border = thin_border
-
+                    fecha_val = timezone.localtime(fecha_val).replace(tzinfo=None)
+
+                entrada, salida = mov['entrada'], mov['salida']
+                ws.append([
+                    celda(fecha_val, 'kx_fecha'),
+                    celda(mov.get('doc', '-'), 'kx_texto'),
+                    celda(mov['detalle'], 'kx_texto'),
+                    celda(entrada if entrada > 0 else "", 'kx_entrada' if entrada > 0 else 'kx_numero'),
+                    celda(salida if salida > 0 else "", 'kx_salida' if salida > 0 else 'kx_numero'),
+                    celda(mov['saldo'], 'kx_saldo'),
+                ])
                 row_num += 1
 
+        ws.append([])
+        ws.append([])
         row_num += 2
 
-    # 4. Ajuste automático
-    column_widths = [12, 18, 40, 12, 12, 12]
-    for i, width in enumerate(column_widths, 1):
-        ws.column_dimensions[get_column_letter(i)].width = width
+    wb.save(destino)
 
-    # 5. Guardar
+
+def generate_kardex_excel(data, f_inicio, f_fin, nombre_empresa=""):
     output = BytesIO()
-    wb.save(output)
+    escribir_kardex_excel(data.items(), f_inicio, f_fin, nombre_empresa, output)
     output.seek(0)
 
     filename = f"Kardex_{f_inicio}_{f_fin}.xlsx"
@@ -151,4 +148,36 @@ def generate_kardex_pdf(data, context, nombre_empresa=""):
     filename = f"Kardex_{context['fecha_inicio']}.pdf"
     response = HttpResponse(output, content_type='application/pdf')
     response['Content-Disposition'] = f'attachment; filename="{filename}"'
-    return response
\ No newline at end of file
+    return response
+
+def _partes_kardex(productos, filas_por_parte):
+    """Agrupa los productos en dicts de ~filas_por_parte filas (siempre al menos una parte)."""
+    parte, filas, emitidas = {}, 0, 0
+    for p_id, producto in productos:
+        parte[p_id] = producto
+        filas += len(producto['kardex']) + 1
+        if filas >= filas_por_parte:
+            yield parte
+            parte, filas, emitidas = {}, 0, emitidas + 1
+    if parte or not emitidas:
+        yield parte
+
+
+def escribir_kardex_pdf(productos, context, nombre_empresa, destino, filas_por_parte=KARDEX_PDF_FILAS_POR_PARTE):
+    """
+    Genera el PDF por partes: cada parte se maqueta con weasyprint en un archivo
+    temporal y luego se anexan en orden al destino (ruta o archivo binario).
+    """
+    writer = PdfWriter()
+    with tempfile.TemporaryDirectory() as carpeta:
+        for numero, parte in enumerate(_partes_kardex(productos, filas_por_parte), 1):
+            html_string = render_to_string('reportes/kardex_pdf.html', {
+                'kardex_items': parte,
+                'empresa_nombre': nombre_empresa,
+                'parte': numero,
+                **context
+            })
+            ruta_parte = os.path.join(carpeta, f"parte_{numero}.pdf")
+            HTML(string=html_string).write_pdf(target=ruta_parte)
+            writer.append(ruta_parte)
+        writer.write(destino)
@@ -1,6 +1,5 @@
 from collections import defaultdict
 import django_rq
-from rq.registry import StartedJobRegistry
 from rest_framework import viewsets, permissions, status , mixins,filters
 from rest_framework.decorators import action
 from rest_framework.permissions import AllowAny, IsAuthenticated
@@ -14,19 +13,55 @@ from .services import get_stock_actual_rápido, get_kardex_detallado
 import requests
 from .serializers import *
 from .utils import *
+from . import estado_sync
 import logging
+import os
+import datetime
+import hashlib
+import uuid
+from django.http import FileResponse
+from django.conf import settings
+from django.core.cache import cache
 from django.utils import timezone
 from usuarios.permissions import HasModulePermission, CanViewWarehouse, CanManageWarehouse, CanViewStock, CanManageStock
 from usuarios.warehouse_permissions import HasWarehouseAccess, HasSedeAccess
+from usuarios.auth_context import contexto_autorizacion
+from base.pagination import KeysetPagination
 
 logger = logging.getLogger(__name__)
 
+# Segundos que se reutiliza una misma consulta de guías de remisión (StarSoft)
+GREMISION_CACHE_TIMEOUT = getattr(settings, 'GREMISION_CACHE_TIMEOUT', 60)
+
+class GremisionPagination(KeysetPagination):
+    """
+    Keyset sobre la clave de GREMISION_CAB (?paginacion=cursor): cada página es un TOP n
+    en StarSoft. Sin parámetros responde la lista simple de siempre (hasta stream_cap filas).
+    """
+    modo_por_defecto = 'todo'
+    page_size = 50
+    max_page_size = 500
+    count_por_defecto = 'none'  # ?count=estimate si el frontend lo necesita
+
+
 class GremisionCabViewSet(viewsets.ViewSet):
     """
     API endpoint para consultar guías de remisión.
     Requiere permiso para ver información de almacén.
+
+    Filtros: ?fecha_desde=AAAA-MM-DD, ?fecha_hasta=AAAA-MM-DD, ?serie=, ?numero=,
+    ?numero_desde=, ?numero_hasta=, ?tipo_origen=. Paginado por cursor opcional
+    (?paginacion=cursor, ?page_size=, ?cursor=); sin él responde una lista.
+    Las respuestas se cachean unos segundos por alias + parámetros.
     """
     permission_classes = [IsAuthenticated, CanViewWarehouse]
+    cursor_ordering = ('-serie', '-numero', '-tipo_origen')
+
+    mapping = {
+        "semilla": "bd_semilla_starsoft",
+        "maxi": "bd_maxi_starsoft",
+        "trading": "bd_trading_starsoft",
+    }
 
     def list(self, request):
         empresa = request.query_params.get("empresa")
@@ -36,19 +71,65 @@ class GremisionCabViewSet(viewsets.ViewSet):
                 status=400
             )
 
-        mapping = {
-            "semilla": "bd_semilla_starsoft",
-            "maxi": "bd_maxi_starsoft",
-            "trading": "bd_trading_starsoft",
-        }
-
-        db_alias = mapping.get(empresa.lower())
+        db_alias = self.mapping.get(empresa.lower())
         if not db_alias:
             return Response({"error": f"Empresa '{empresa}' no válida"}, status=400)
 
-        data = GremisionCab.objects.using(db_alias).all()
-        serializer = GremisionCabSerializer(data, many=True)
-        return Response(serializer.data)
+        # Read-through cache: la misma consulta no vuelve a StarSoft dentro del TTL
+        clave_cache = self._clave_cache(db_alias, request)
+        paginator = GremisionPagination()
+        guardado = cache.get(clave_cache)
+        if guardado is not None:
+            estado, data = guardado
+            paginator.restaurar_cache(request, estado)
+            return paginator.get_paginated_response(data)
+
+        try:
+            queryset = self._filtrar(GremisionCab.objects.using(db_alias).all(), request.query_params)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
+
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        serializer = GremisionCabSerializer(page, many=True)
+
+        # Se guardan los datos y el estado del cursor; los enlaces se arman por request
+        estado = paginator.estado_cache()
+        if estado is not None:
+            cache.set(clave_cache, (estado, serializer.data), GREMISION_CACHE_TIMEOUT)
+        return paginator.get_paginated_response(serializer.data)
+
+    @staticmethod
+    def _filtrar(queryset, params):
+        """Filtros de fecha y número (se resuelven en SQL Server)."""
+        for param, lookup in (('fecha_desde', 'gte'), ('fecha_hasta', 'lt')):
+            valor = params.get(param)
+            if valor:
+                try:
+                    fecha = datetime.date.fromisoformat(valor)
+                except ValueError:
+                    raise ValueError(f"'{param}' debe tener el formato AAAA-MM-DD")
+                if lookup == 'lt':
+                    fecha += datetime.timedelta(days=1)  # fecha_hasta inclusiva
+                inicio_dia = datetime.datetime.combine(fecha, datetime.time.min, tzinfo=datetime.timezone.utc)
+                queryset = queryset.filter(**{f'fecha_emision__{lookup}': inicio_dia})
+
+        if params.get('serie'):
+            queryset = queryset.filter(serie=params['serie'].strip())
+        if params.get('tipo_origen'):
+            queryset = queryset.filter(tipo_origen=params['tipo_origen'].strip())
+
+        # Los números del ERP van con ceros a la izquierda (ver GremisionConsultaView)
+        for param, lookup in (('numero', 'exact'), ('numero_desde', 'gte'), ('numero_hasta', 'lte')):
+            valor = (params.get(param) or '').strip()
+            if valor:
+                queryset = queryset.filter(**{f'numero__{lookup}': valor.zfill(7)})
+        return queryset
+
+    @staticmethod
+    def _clave_cache(db_alias, request):
+        parametros = sorted((k, v) for k, v in request.query_params.items() if k != 'empresa')
+        huella = hashlib.md5(repr(parametros).encode()).hexdigest()
+        return f"gremisiones:{db_alias}:{huella}"
 
 class GremisionConsultaView(APIView):
     """
@@ -159,17 +240,16 @@ class AlmacenViewSet(viewsets.ModelViewSet):
             return queryset.filter(state=True)
 
         # 3. Validar Perfil
-        if not hasattr(user, 'userprofile'):
+        contexto = contexto_autorizacion(user)
+        if not contexto.tiene_perfil:
             return queryset.none()
 
-        profile = user.userprofile
-
         # 4. Si el perfil NO requiere restricción, ve todo
-        if not profile.require_warehouse_access:
+        if not contexto.require_warehouse_access:
             return queryset.filter(state=True)
 
         # 5. RESTRICTIVO (Por defecto): Solo almacenes asignados
-        almacenes_ids = profile.almacenes_asignados.values_list('id', flat=True)
+        almacenes_ids = contexto.almacenes_ids
         return queryset.filter(id__in=almacenes_ids)
 
     def get_permissions(self):
@@ -239,6 +319,9 @@ class MovimientoAlmacenViewSet(viewsets.ReadOnlyModelViewSet): # Solo lectura
         'numero_documento_erp'
     ]
     ordering = ['-fecha_documento', '-id'] # Orden por defecto
+    # ?paginacion=cursor: keyset sobre (fecha_documento, id); ?all=true queda con tope
+    pagination_class = KeysetPagination
+    cursor_ordering = ('-fecha_documento', '-id')
 
     def get_queryset(self):
         """
@@ -258,17 +341,16 @@ class MovimientoAlmacenViewSet(viewsets.ReadOnlyModelViewSet): # Solo lectura
             return queryset
         
         # Verificar perfil
-        if not hasattr(user, 'userprofile'):
+        contexto = contexto_autorizacion(user)
+        if not contexto.tiene_perfil:
             return queryset.none()
         
-        profile = user.userprofile
-        
         # Si no requiere restricción, ver TODO
-        if not profile.require_warehouse_access:
+        if not contexto.require_warehouse_access:
             return queryset
         
         # Filtrar por almacenes asignados
-        almacenes_ids = profile.almacenes_asignados.values_list('id', flat=True)
+        almacenes_ids = contexto.almacenes_ids
         return queryset.filter(almacen_id__in=almacenes_ids)
 
     #  MÉTODO 'list' SOBRESCRITO PARA OPTIMIZACIÓN N+1
@@ -279,12 +361,15 @@ class MovimientoAlmacenViewSet(viewsets.ReadOnlyModelViewSet): # Solo lectura
         # 2. Paginar el queryset ANTES de hacer la consulta de notas
         page = self.paginate_queryset(queryset)
 
-        # Si no hay página (paginación desactivada) o no hay datos,
-        # simplemente serializa y devuelve.
-        if page is None or not page:
+        # Si no hay página (paginación desactivada), simplemente serializa y devuelve.
+        if page is None:
             serializer = self.get_serializer(queryset, many=True)
             return Response(serializer.data)
 
+        # Página vacía (ej. cursor al final): respuesta paginada sin filas
+        if not page:
+            return self.get_paginated_response([])
+
         # 3. Preparar la consulta de notas (El "truco" de optimización)
 
         # Obtener las claves únicas (empresa, id_erp_cab) DE LA PÁGINA ACTUAL
@@ -355,6 +440,8 @@ class StockViewSet(viewsets.ReadOnlyModelViewSet):
     filterset_class = StockFilter
     ordering_fields = ['producto__nombre_producto', 'cantidad_actual', 'fecha_ultimo_movimiento']
     ordering = ['producto__nombre_producto']  # Ordenar por nombre de producto por defecto
+    pagination_class = KeysetPagination
+    cursor_ordering = ('producto__nombre_producto', 'id')
 
     def get_queryset(self):
         """
@@ -374,29 +461,32 @@ class StockViewSet(viewsets.ReadOnlyModelViewSet):
             return queryset
         
         # Verificar perfil
-        if not hasattr(user, 'userprofile'):
+        contexto = contexto_autorizacion(user)
+        if not contexto.tiene_perfil:
             return queryset.none()
         
-        profile = user.userprofile
-        
         # Si no requiere restricción, ver TODO
-        if not profile.require_warehouse_access:
+        if not contexto.require_warehouse_access:
             return queryset
         
         # Filtrar por almacenes asignados
-        almacenes_ids = profile.almacenes_asignados.values_list('id', flat=True)
+        almacenes_ids = contexto.almacenes_ids
         return queryset.filter(almacen_id__in=almacenes_ids)
 
 class TriggerSyncAPIView(APIView):
     """
     Endpoint para iniciar una sincronización MASTER.
+    Con 'empresas' (lista de alias) o empresa_alias='todas' se encola un job por base
+    ERP en paralelo más un job de cierre (ver encolar_sincronizacion_multi).
     """
     permission_classes = [permissions.IsAuthenticated]
 
     def post(self, request, *args, **kwargs):
         empresa_alias = request.data.get('empresa_alias')
-        if not empresa_alias:
-            return Response({"error": "Se requiere 'empresa_alias'."}, status=status.HTTP_400_BAD_REQUEST)
+        empresas = request.data.get('empresas')
+        if not empresa_alias and not empresas:
+            return Response({"error": "Se requiere 'empresa_alias' o 'empresas'."},
+                            status=status.HTTP_400_BAD_REQUEST)
 
         start_year = request.data.get('start_year', 2000)
         days = request.data.get('days', 15)
@@ -404,13 +494,35 @@ class TriggerSyncAPIView(APIView):
         try:
             queue = django_rq.get_queue('default')
 
+            if empresas or empresa_alias == 'todas':
+                from .tasks import encolar_sincronizacion_multi
+
+                job = encolar_sincronizacion_multi(
+                    aliases=empresas or None,  # None = todas las bases configuradas
+                    start_year=start_year,
+                    reconciliation_days=days,
+                    max_paralelo=request.data.get('max_paralelo'),
+                    user_id=request.user.id,
+                )
+                return Response(
+                    {"status": "Sincronización multi-empresa iniciada.", "job_id": job.id},
+                    status=status.HTTP_202_ACCEPTED
+                )
+
+            # El índice se escribe antes de encolar: un worker libre puede tomar el job
+            # (y marcarlo iniciado o terminado) apenas entra a Redis
+            job_id = str(uuid.uuid4())
+            estado_sync.registrar_encolado(estado_sync.TIPO_EMPRESA, empresa_alias, job_id,
+                                           user_id=request.user.id)
+
             # Encolamos la tarea
             job = queue.enqueue(
                 'almacen.tasks.sincronizar_empresa_erp_task', # Pasamos string para evitar import circular si lo hubiera
                 empresa_alias=empresa_alias,
                 start_year=start_year,
                 reconciliation_days=days,
-                user_id=request.user.id
+                user_id=request.user.id,
+                job_id=job_id
             )
 
             return Response(
@@ -459,17 +571,16 @@ class TransferenciaViewSet(mixins.ListModelMixin,
             return queryset
         
         # Verificar perfil
-        if not hasattr(user, 'userprofile'):
+        contexto = contexto_autorizacion(user)
+        if not contexto.tiene_perfil:
             return queryset.none()
         
-        profile = user.userprofile
-        
         # Si no requiere restricción, ver TODO
-        if not profile.require_warehouse_access:
+        if not contexto.require_warehouse_access:
             return queryset
         
         # Filtrar por almacenes asignados (origen O destino)
-        almacenes_ids = list(profile.almacenes_asignados.values_list('id', flat=True))
+        almacenes_ids = contexto.almacenes_ids
         from django.db.models import Q
         return queryset.filter(
             Q(almacen_origen_id__in=almacenes_ids) | 
@@ -520,10 +631,10 @@ class TransferenciaViewSet(mixins.ListModelMixin,
         # 2. Validar acceso al almacén destino (solo para operadores)
         user = request.user
         if not (hasattr(user, 'is_system_admin') and user.is_system_admin):
-            if hasattr(user, 'userprofile'):
-                profile = user.userprofile
-                if profile.require_warehouse_access:
-                    almacenes_ids = profile.almacenes_asignados.values_list('id', flat=True)
+            contexto = contexto_autorizacion(user)
+            if contexto.tiene_perfil:
+                if contexto.require_warehouse_access:
+                    almacenes_ids = contexto.almacenes_ids
                     if transferencia.almacen_destino_id not in almacenes_ids:
                         return Response(
                             {'error': 'No tiene acceso al almacén destino para recibir esta transferencia.'},
@@ -594,84 +705,20 @@ class TransferenciaViewSet(mixins.ListModelMixin,
 class CheckSyncStatusAPIView(APIView):
     """
     Endpoint para consultar estado de sincronización.
-    Recupera progreso desde Redis (Job Meta).
+    Lee el índice de estado de los jobs (EstadoJobSync, ver estado_sync.py): una
+    consulta por índice en lugar de recorrer los registros de rq trayendo cada job.
     """
     # ¡CRÍTICO! Debe ser IsAuthenticated para obtener request.user.id correctamente
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request, *args, **kwargs):
-        user_id = request.user.id
-
-        # Debe coincidir EXACTAMENTE con como se guardó en Redis (ruta completa)
-        task_name = 'almacen.tasks.sincronizar_empresa_erp_task'
-
-        queue = django_rq.get_queue('default')
-
-        #print(f"\n[CheckStatus] Consultando para Usuario ID: {user_id}", flush=True)
-
-        def verificar_job(job_id, source_name):
-            try:
-                job = queue.fetch_job(job_id)
-                if not job:
-                    return None
-
-                # Debugging agresivo para saber por qué falla
-                # print(f"  - Analizando Job {job_id} ({source_name}): Func={job.func_name}, UserArg={job.kwargs.get('user_id')}, Status={job.get_status()}")
-
-                # 1. Validar Nombre de Función
-                if job.func_name != task_name:
-                    return None
-
-                # 2. Validar Dueño (Usuario)
-                job_user_id = job.kwargs.get('user_id')
-                if job_user_id != user_id:
-                    # print(f"    -> Descartado: Pertenece a user {job_user_id}, no a {user_id}")
-                    return None
+        registro = estado_sync.activo_de_usuario(request.user.id)
+        if registro is None:
+            return Response({"is_syncing": False}, status=status.HTTP_200_OK)
 
-                # 3. Validar Estado
-                status_job = job.get_status()
-                if status_job in ['finished', 'failed', 'canceled', 'stopped']:
-                    # print(f"    -> Descartado: Estado terminal ({status_job})")
-                    return None
-
-                # --- SI LLEGA AQUÍ, ES EL JOB CORRECTO ---
-
-                # Refrescar metadata desde Redis por seguridad
-                job.refresh()
-
-                percent = job.meta.get('progress_percent', 0)
-                msg = job.meta.get('progress_message', 'Sincronización en progreso...')
-
-                #print(f"  [✅ MATCH] Job Encontrado! Progreso: {percent}% - Msg: {msg}", flush=True)
-
-                return {
-                    "is_syncing": True,
-                    "message": msg,
-                    "percent": percent
-                }
-            except Exception as e:
-                #print(f"Error analizando job {job_id}: {e}")
-                return None
-
-        # 1. Revisar Started (En ejecución actualmente)
-        registry = StartedJobRegistry(queue=queue)
-        job_ids = registry.get_job_ids()
-        # print(f"[CheckStatus] Jobs en ejecución (StartedRegistry): {len(job_ids)}")
-
-        for job_id in job_ids:
-            data = verificar_job(job_id, "Started")
-            if data: return Response(data, status=status.HTTP_200_OK)
-
-        # 2. Revisar Queued (Esperando worker)
-        queued_ids = queue.get_job_ids()
-        # print(f"[CheckStatus] Jobs en cola (Queued): {len(queued_ids)}")
-
-        for job_id in queued_ids:
-            data = verificar_job(job_id, "Queued")
-            if data: return Response(data, status=status.HTTP_200_OK)
-
-        #print("[CheckStatus] No se encontraron tareas activas para este usuario.", flush=True)
-        return Response({"is_syncing": False}, status=status.HTTP_200_OK)
+        # Multi-empresa: avance y detalle por alias desde las filas de los hijos
+        data = {"is_syncing": True, **estado_sync.resumen(registro)}
+        return Response(data, status=status.HTTP_200_OK)
 
 class KardexReportView(APIView):
     """
@@ -717,21 +764,53 @@ class KardexReportView(APIView):
         # Validar acceso al almacén (solo para operadores)
         user = request.user
         if not (hasattr(user, 'is_system_admin') and user.is_system_admin):
-            if not hasattr(user, 'userprofile'):
+            contexto = contexto_autorizacion(user)
+            if not contexto.tiene_perfil:
                 return Response(
                     {'error': 'Usuario sin perfil configurado.'},
                     status=status.HTTP_403_FORBIDDEN
                 )
             
-            profile = user.userprofile
-            if profile.require_warehouse_access:
-                almacenes_ids = profile.almacenes_asignados.values_list('id', flat=True)
+            if contexto.require_warehouse_access:
+                almacenes_ids = contexto.almacenes_ids
                 if almacen_id not in almacenes_ids:
                     return Response(
                         {'error': 'No tiene acceso a este almacén para generar el Kardex.'},
                         status=status.HTTP_403_FORBIDDEN
                     )
 
+        export_format = request.query_params.get('export_format')  # 'excel', 'pdf' o None
+
+        # Modo "job": el archivo se genera en RQ y se descarga luego desde KardexExportStatusView
+        if export_format in ('excel', 'pdf') and \
+                request.query_params.get('en_segundo_plano', '').lower() in ('1', 'true'):
+            from .tasks import KARDEX_EXPORT_TTL_SEGUNDOS, limpiar_exportaciones_kardex
+            try:
+                # Los archivos viven lo mismo que el resultado del job
+                limpiar_exportaciones_kardex()
+            except Exception as e:
+                logger.warning(f"No se pudieron limpiar las exportaciones de Kárdex vencidas: {e}")
+            try:
+                job = django_rq.get_queue('default').enqueue(
+                    'almacen.tasks.exportar_kardex_task',
+                    result_ttl=KARDEX_EXPORT_TTL_SEGUNDOS,
+                    empresa_id=empresa_id,
+                    almacen_id=almacen_id,
+                    producto_ids=producto_ids,
+                    fecha_inicio=fecha_inicio.isoformat(),
+                    fecha_fin=fecha_fin.isoformat(),
+                    export_format=export_format,
+                    user_id=user.id
+                )
+            except Exception as e:
+                logger.error(f"Error al encolar la exportación de Kárdex: {e}", exc_info=True)
+                return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+            return Response(
+                {"status": "Exportación en proceso.", "job_id": job.id},
+                status=status.HTTP_202_ACCEPTED
+            )
+
         try:
             nombre_empresa = "Empresa Desconocida"
             try:
@@ -747,8 +826,6 @@ class KardexReportView(APIView):
             )
 
             # 2. Verificar si se pide exportación
-            export_format = request.query_params.get('export_format')  # 'excel', 'pdf' o None
-
             if export_format == 'excel':
                 return generate_kardex_excel(kardex_data, fecha_inicio, fecha_fin,nombre_empresa)
 
@@ -770,6 +847,49 @@ class KardexReportView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+
+class KardexExportStatusView(APIView):
+    """
+    Estado de una exportación de Kárdex en segundo plano y descarga del archivo.
+    GET /api/almacen/reporte-kardex/exportaciones/{job_id}/
+    GET /api/almacen/reporte-kardex/exportaciones/{job_id}/descargar/
+    Solo el usuario que encoló la exportación puede consultarla.
+    """
+    permission_classes = [IsAuthenticated, CanViewWarehouse]
+    descargar = False
+
+    def get(self, request, job_id, *args, **kwargs):
+        job = django_rq.get_queue('default').fetch_job(job_id)
+        if not job or job.func_name != 'almacen.tasks.exportar_kardex_task' \
+                or job.kwargs.get('user_id') != request.user.id:
+            return Response({"error": "Exportación no encontrada."}, status=status.HTTP_404_NOT_FOUND)
+
+        estado = job.get_status()
+        nombre_archivo = job.meta.get('archivo')
+
+        if self.descargar:
+            if estado != 'finished' or not nombre_archivo:
+                return Response({"error": "El archivo aún no está listo."}, status=status.HTTP_409_CONFLICT)
+            from .tasks import ruta_exportacion_kardex, exportacion_vencida
+            ruta = ruta_exportacion_kardex(nombre_archivo)
+            if exportacion_vencida(ruta):
+                if os.path.exists(ruta):
+                    os.remove(ruta)
+                return Response({"error": "El archivo ya no está disponible."}, status=status.HTTP_410_GONE)
+            return FileResponse(open(ruta, 'rb'), as_attachment=True, filename=nombre_archivo)
+
+        data = {
+            "job_id": job.id,
+            "status": estado,
+            "percent": job.meta.get('progress_percent', 0),
+            "message": job.meta.get('progress_message', ''),
+            "listo": estado == 'finished' and bool(nombre_archivo),
+        }
+        if data['listo']:
+            data['url_descarga'] = request.build_absolute_uri('descargar/')
+        return Response(data, status=status.HTTP_200_OK)
+
+
 class TipoEstibajeViewSet(viewsets.ModelViewSet):
     queryset = TipoEstibaje.objects.filter(state=True)  # Solo activos
     serializer_class = TipoEstibajeSerializer
@@ -1,5 +1,14 @@
 # core/pagination.py
+import base64
+import datetime
+import json
+from decimal import Decimal
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 class DynamicPagination(PageNumberPagination):
@@ -20,4 +29,196 @@ class DynamicPagination(PageNumberPagination):
                 request.query_params.get('all') == 'true':
             return None
 
-        return super().paginate_queryset(queryset, request, view)
\ No newline at end of file
+        return super().paginate_queryset(queryset, request, view)
+
+
+class KeysetPagination(DynamicPagination):
+    """
+    Paginación por cursor (keyset) para listados muy grandes.
+    Cada página es WHERE (orden) > última_fila LIMIT n: sin COUNT(*) ni OFFSET,
+    el costo de la página 10.000 es el mismo que el de la primera.
+
+    Modos (el frontend elige):
+    1. ?paginacion=cursor (o ?cursor=...): keyset sobre 'cursor_ordering' de la vista
+       (ej. ('-fecha_documento', '-id')). Respuesta: next / previous / count / results.
+       ?count=estimate (por defecto) cuenta hasta 'count_estimate_cap' filas;
+       ?count=exact hace el COUNT(*) completo; ?count=none lo omite.
+    2. ?pagination=off o ?all=true: ya no serializa la tabla completa; devuelve como
+       máximo 'stream_cap' filas (cabecera X-Result-Truncated si se cortó).
+    3. Sin parámetros: 'modo_por_defecto'. 'paginas' = paginación por número de página
+       (igual que DynamicPagination); 'todo' = lista simple como el modo 2 (vistas que
+       antes devolvían la lista sin paginar).
+    """
+    cursor_query_param = 'cursor'
+    modo_query_param = 'paginacion'
+    count_query_param = 'count'
+    count_estimate_cap = 10000
+    count_por_defecto = 'estimate'
+    stream_cap = 5000
+    ordering = ('-id',)
+    modo_por_defecto = 'paginas'
+
+    modo = None
+    # Lo que se necesita para rearmar la respuesta desde el cache (sin URLs absolutas)
+    _ESTADO_CACHE = ('modo', 'siguiente', 'anterior', 'count', 'count_es_estimado', 'truncado')
+
+    # --- Selección de modo ---
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        params = request.query_params
+
+        if params.get(self.modo_query_param) == 'cursor' or self.cursor_query_param in params:
+            self.modo = 'cursor'
+            return self._paginar_cursor(queryset, request, view)
+
+        if params.get('pagination') == 'off' or params.get('all') == 'true' \
+                or self.modo_por_defecto == 'todo':
+            self.modo = 'todo'
+            filas = list(queryset[:self.stream_cap + 1])
+            self.truncado = len(filas) > self.stream_cap
+            return filas[:self.stream_cap]
+
+        self.modo = 'paginas'
+        return PageNumberPagination.paginate_queryset(self, queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.modo == 'cursor':
+            return Response({
+                'next': self.get_next_link(),
+                'previous': self.get_previous_link(),
+                'count': self.count,
+                'count_is_estimate': self.count_es_estimado,
+                'results': data,
+            })
+        if self.modo == 'todo':
+            return Response(data, headers={
+                'X-Result-Count': str(len(data)),
+                'X-Result-Truncated': 'true' if self.truncado else 'false',
+            })
+        return super().get_paginated_response(data)
+
+    def get_next_link(self):
+        if self.modo != 'cursor':
+            return super().get_next_link()
+        if not self.siguiente:
+            return None
+        return self._url_cursor(self.siguiente, atras=False)
+
+    def get_previous_link(self):
+        if self.modo != 'cursor':
+            return super().get_previous_link()
+        if not self.anterior:
+            return None
+        return self._url_cursor(self.anterior, atras=True)
+
+    # --- Cache de respuestas ---
+
+    def estado_cache(self):
+        """
+        Estado de la página recién paginada para guardarlo junto a los datos serializados.
+        Los enlaces next/previous no se guardan: llevan el host del request y se arman
+        en restaurar_cache. None en modo 'paginas' (depende del objeto Page de Django).
+        """
+        if self.modo == 'paginas':
+            return None
+        return {atributo: getattr(self, atributo, None) for atributo in self._ESTADO_CACHE}
+
+    def restaurar_cache(self, request, estado):
+        self.request = request
+        for atributo, valor in estado.items():
+            setattr(self, atributo, valor)
+
+    # --- Keyset ---
+
+    def _paginar_cursor(self, queryset, request, view):
+        self.ordering = tuple(getattr(view, 'cursor_ordering', None) or self.ordering)
+        self.page_size_actual = self.get_page_size(request) or self.page_size
+        self.count, self.count_es_estimado = self._contar(queryset, request)
+
+        posicion, atras = self._decodificar_cursor(request.query_params.get(self.cursor_query_param))
+        orden = self._invertir(self.ordering) if atras else self.ordering
+
+        qs = queryset.order_by(*orden)
+        if posicion is not None:
+            qs = qs.filter(self._q_despues_de(orden, posicion))
+
+        filas = list(qs[:self.page_size_actual + 1])
+        hay_mas = len(filas) > self.page_size_actual
+        filas = filas[:self.page_size_actual]
+        if atras:
+            filas.reverse()
+
+        # Enlaces: hacia adelante desde la última fila, hacia atrás desde la primera
+        self.siguiente = self.anterior = None
+        if filas:
+            if hay_mas or atras:
+                self.siguiente = self._posicion(filas[-1])
+            if (hay_mas and atras) or (posicion is not None and not atras):
+                self.anterior = self._posicion(filas[0])
+        return filas
+
+    def _contar(self, queryset, request):
+        modo = request.query_params.get(self.count_query_param, self.count_por_defecto)
+        if modo == 'none':
+            return None, False
+        if modo == 'exact':
+            return queryset.order_by().count(), False
+        # COUNT sobre una subconsulta con LIMIT: lee como máximo 'count_estimate_cap' filas
+        contadas = queryset.order_by()[:self.count_estimate_cap + 1].count()
+        if contadas > self.count_estimate_cap:
+            return self.count_estimate_cap, True
+        return contadas, False
+
+    @staticmethod
+    def _invertir(ordering):
+        return tuple(campo[1:] if campo.startswith('-') else f'-{campo}' for campo in ordering)
+
+    @staticmethod
+    def _q_despues_de(ordering, posicion):
+        """(a, b) > (x, y) respetando la dirección de cada campo, expandido a Q."""
+        condicion = Q()
+        for i, campo in enumerate(ordering):
+            nombre = campo.lstrip('-')
+            operador = 'lt' if campo.startswith('-') else 'gt'
+            iguales = {ordering[j].lstrip('-'): posicion[j] for j in range(i)}
+            condicion |= Q(**iguales, **{f'{nombre}__{operador}': posicion[i]})
+        return condicion
+
+    def _posicion(self, fila):
+        valores = []
+        for campo in self.ordering:
+            valor = fila
+            for parte in campo.lstrip('-').split('__'):
+                valor = getattr(valor, parte, None)
+            valores.append(valor)
+        return valores
+
+    # --- Codificación del cursor ---
+
+    @staticmethod
+    def _serializar(valor):
+        if isinstance(valor, (datetime.datetime, datetime.date)):
+            return valor.isoformat()
+        if isinstance(valor, Decimal):
+            return str(valor)
+        return valor
+
+    def _url_cursor(self, posicion, atras):
+        contenido = json.dumps({'p': [self._serializar(v) for v in posicion], 'r': atras})
+        cursor = base64.urlsafe_b64encode(contenido.encode()).decode()
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def _decodificar_cursor(self, cursor):
+        if not cursor:
+            return None, False
+        try:
+            contenido = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+            posicion, atras = contenido['p'], bool(contenido.get('r'))
+        except (ValueError, KeyError, TypeError):
+            raise NotFound("Cursor inválido.")
+        if not isinstance(posicion, list) or len(posicion) != len(self.ordering):
+            raise NotFound("Cursor inválido.")
+        return posicion, atras
@@ -0,0 +1,59 @@
+# importaciones/consultas.py
+"""
+Querysets compartidos por los listados de declaraciones y expedientes.
+
+Los conteos se calculan en la misma consulta del listado (Subquery correlacionado)
+en lugar de un COUNT por fila desde el serializer. Se usa Subquery y no Count
+sobre el JOIN porque algunos listados ya filtran por la relación (documentos__usuario)
+con distinct(), y un Count sobre ese JOIN contaría filas repetidas.
+"""
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import Documento, ExpedienteDeclaracion
+
+
+def _conteo(queryset, campo):
+    """Subquery escalar: cantidad de filas de 'queryset' agrupadas por 'campo' (0 si no hay)."""
+    conteo = (
+        queryset.order_by()
+        .values(campo)
+        .annotate(total=Count('pk'))
+        .values('total')
+    )
+    return Coalesce(Subquery(conteo, output_field=IntegerField()), Value(0))
+
+
+def conteo_documentos(modelo):
+    """
+    Cantidad de Documento activos del objeto (relación genérica content_type/object_id).
+    El content_type se filtra por app_label/model con un JOIN, sin consultar ContentType aparte.
+    """
+    documentos = Documento.objects.filter(
+        content_type__app_label=modelo._meta.app_label,
+        content_type__model=modelo._meta.model_name,
+        object_id=OuterRef('pk'),
+    )
+    return _conteo(documentos, 'object_id')
+
+
+def con_documentos(queryset):
+    """Declaraciones (u otro modelo con GenericRelation 'documentos') con sus documentos y documentos_count."""
+    return (
+        queryset
+        .prefetch_related('documentos')
+        .annotate(documentos_count=conteo_documentos(queryset.model))
+    )
+
+
+def con_cantidad_expedientes(queryset):
+    """Expedientes con cantidad_documentos = expedientes de su misma declaración."""
+    expedientes = ExpedienteDeclaracion.objects.filter(declaracion=OuterRef('declaracion'))
+    return queryset.select_related('declaracion').annotate(
+        cantidad_documentos=_conteo(expedientes, 'declaracion')
+    )
+
+
+def expedientes_con_documento(queryset):
+    """Expedientes con todo lo que usa DocumentoExpedienteSerializer en un solo JOIN."""
+    return queryset.select_related('documento__usuario', 'tipo')
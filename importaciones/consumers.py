@@ -0,0 +1,21 @@
+# importaciones/consumers.py
+import json
+
+
+class ExtraccionDocumentosMixin:
+    """
+    Mixin para el avance de la extracción de documentos en segundo plano
+    (evento 'extraccion.documento', ver importaciones.extraccion), enviado al
+    grupo personal del usuario.
+    """
+
+    async def extraccion_documento(self, event):
+        if not event:
+            return
+
+        await self.send(text_data=json.dumps({
+            'type': 'extraccion_documento',  # El frontend escucha esto
+            'status': event.get('status'),
+            'message': event.get('message'),
+            'result': event.get('result'),
+        }))
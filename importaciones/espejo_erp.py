@@ -0,0 +1,257 @@
+# importaciones/espejo_erp.py
+"""
+Espejo local (MySQL) de las órdenes de importación (IMPORD + IMPORC) y proveedores
+(MAEPROV) de cada base Starsoft, para que el autocompletado no consulte el ERP en
+cada tecla.
+
+- refrescar_espejo(): copia incremental por marca de agua (FEMISION de la orden,
+  PRVDFECMOD/PRVDFECCRE del proveedor). Con completo=True recorre todo y elimina
+  del espejo lo que ya no existe en el ERP. El incremental no ve las eliminaciones:
+  si la última pasada completa (ControlEspejoErp.ultima_completa) tiene más de
+  ESPEJO_ERP_COMPLETO_SEGUNDOS, el refresco se hace completo aunque no se pida,
+  así el refresco automático y el cron sin --completo también las aplican.
+- buscar_ordenes() / buscar_proveedores(): primero por prefijo (índice B-tree de la
+  clave única), luego por subcadena con el índice FULLTEXT ngram (solo MySQL).
+- estado_espejo(): indica si el espejo de una base ya tiene datos y encola un
+  refresco si está vencido (no hay scheduler: el refresco lo dispara el uso, el
+  comando 'refrescar_espejo_erp' o un cron).
+"""
+import datetime
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, connections, transaction
+from django.db.models import Q, BooleanField
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+
+from .models import (OrdenCompraStarsoft, Proveedor, OrdenCompraEspejo, ProveedorEspejo,
+                     ControlEspejoErp)
+
+logger = logging.getLogger(__name__)
+
+ESPEJO_ERP_ALIASES = getattr(settings, 'ESPEJO_ERP_ALIASES',
+                             ['bd_semilla_starsoft', 'bd_maxi_starsoft', 'bd_trading_starsoft'])
+# Antigüedad máxima del espejo antes de encolar un refresco desde el autocompletado
+ESPEJO_ERP_REFRESCO_SEGUNDOS = getattr(settings, 'ESPEJO_ERP_REFRESCO_SEGUNDOS', 900)
+# IMPORD no tiene fecha de modificación: cada refresco incremental vuelve a leer las
+# órdenes emitidas en los últimos N días (cantidades/precios que se corrigen después)
+ESPEJO_ERP_DIAS_REVISION = getattr(settings, 'ESPEJO_ERP_DIAS_REVISION', 30)
+# Cada cuánto un refresco pasa a ser completo (elimina lo que ya no existe en el ERP)
+ESPEJO_ERP_COMPLETO_SEGUNDOS = getattr(settings, 'ESPEJO_ERP_COMPLETO_SEGUNDOS', 86400)
+ESPEJO_ERP_LOTE = 2000
+# ngram_token_size de MySQL: textos más cortos no están en el índice
+NGRAM_MIN_TOKEN = 2
+
+CAMPOS_ORDEN = ['ccodartic', 'cdesartic', 'ncantidad', 'cunidad', 'npreunita', 'ntotvent',
+                'ccodprove', 'cdesprove', 'femision', 'actualizado']
+CAMPOS_PROVEEDOR = ['nombre', 'ruc', 'fecha_modificacion', 'actualizado']
+
+
+# ==========================================
+# SECCIÓN 1: HELPERS
+# ==========================================
+
+def _aware(valor):
+    if valor and settings.USE_TZ and timezone.is_naive(valor):
+        return timezone.make_aware(valor, datetime.timezone.utc)
+    return valor
+
+
+def _kwargs_upsert(unique_fields, update_fields):
+    """bulk_create(update_conflicts=True); MySQL no admite 'unique_fields' (usa la UniqueConstraint)."""
+    kwargs = {'update_conflicts': True, 'update_fields': update_fields}
+    if connections['default'].features.supports_update_conflicts_with_target:
+        kwargs['unique_fields'] = unique_fields
+    return kwargs
+
+
+def _iterar_keyset(queryset, clave, tamanio_lote):
+    """Recorre un values() del ERP en bloques ordenados por 'clave' (sin OFFSET)."""
+    ultimo = None
+    while True:
+        qs = queryset.order_by(*clave)
+        if ultimo is not None:
+            condicion = Q()
+            for i, campo in enumerate(clave):
+                iguales = {clave[j]: ultimo[clave[j]] for j in range(i)}
+                condicion |= Q(**iguales, **{f'{campo}__gt': ultimo[campo]})
+            qs = qs.filter(condicion)
+        filas = list(qs[:tamanio_lote])
+        if not filas:
+            return
+        yield filas
+        ultimo = filas[-1]
+        if len(filas) < tamanio_lote:
+            return
+
+
+def _q_subcadena(columna, texto):
+    """
+    'texto' en cualquier posición de 'columna'. En MySQL la frase se resuelve con el
+    índice FULLTEXT ngram y el LIKE solo confirma sobre esos candidatos.
+    """
+    filtro = Q(**{f'{columna}__icontains': texto})
+    if connection.vendor != 'mysql':
+        return filtro
+    frase = texto.replace('"', ' ').strip()
+    if len(frase) < NGRAM_MIN_TOKEN:
+        return None
+    match = RawSQL(f'MATCH ({connection.ops.quote_name(columna)}) AGAINST (%s IN BOOLEAN MODE)',
+                   [f'"{frase}"'], output_field=BooleanField())
+    return Q(match) & filtro
+
+
+def _buscar(queryset, columna, texto, orden, limite):
+    """Primero coincidencias por prefijo; si no alcanzan, completa con subcadena."""
+    resultados = list(queryset.filter(**{f'{columna}__istartswith': texto}).order_by(*orden)[:limite])
+    if len(resultados) < limite:
+        subcadena = _q_subcadena(columna, texto)
+        if subcadena is not None:
+            vistos = [r.id for r in resultados]
+            resultados += list(
+                queryset.filter(subcadena).exclude(id__in=vistos).order_by(*orden)[:limite - len(resultados)]
+            )
+    return resultados
+
+
+# ==========================================
+# SECCIÓN 2: REFRESCO
+# ==========================================
+
+def _refrescar_ordenes(base_datos, desde, tamanio_lote):
+    erp = (OrdenCompraStarsoft.objects.using(base_datos)
+           .filter(detalles__isnull=False)
+           .values('CNUMERO', 'CITEM', 'CCODARTIC', 'CDESARTIC', 'NCANTIDAD', 'CUNIDAD', 'NPREUNITA',
+                   'NTOTVENT', 'detalles__CCODPROVE', 'detalles__CDESPROVE', 'detalles__FEMISION'))
+    if desde is not None:
+        erp = erp.filter(detalles__FEMISION__gte=desde)
+
+    total, maxima = 0, None
+    for filas in _iterar_keyset(erp, ('CNUMERO', 'CITEM'), tamanio_lote):
+        objetos = []
+        for f in filas:
+            femision = _aware(f['detalles__FEMISION'])
+            if femision and (maxima is None or femision > maxima):
+                maxima = femision
+            objetos.append(OrdenCompraEspejo(
+                base_datos=base_datos, cnumero=f['CNUMERO'], citem=f['CITEM'],
+                ccodartic=f['CCODARTIC'], cdesartic=f['CDESARTIC'], ncantidad=f['NCANTIDAD'] or 0,
+                cunidad=f['CUNIDAD'], npreunita=f['NPREUNITA'] or 0, ntotvent=f['NTOTVENT'] or 0,
+                ccodprove=f['detalles__CCODPROVE'], cdesprove=f['detalles__CDESPROVE'], femision=femision,
+            ))
+        with transaction.atomic():
+            OrdenCompraEspejo.objects.bulk_create(
+                objetos, **_kwargs_upsert(['base_datos', 'cnumero', 'citem'], CAMPOS_ORDEN)
+            )
+        total += len(objetos)
+    return total, maxima
+
+
+def _refrescar_proveedores(base_datos, desde, tamanio_lote):
+    erp = Proveedor.objects.using(base_datos).values(
+        'PRVCCODIGO', 'PRVCNOMBRE', 'PRVCRUC', 'PRVDFECMOD', 'PRVDFECCRE'
+    )
+    if desde is not None:
+        erp = erp.filter(Q(PRVDFECMOD__gte=desde) | Q(PRVDFECCRE__gte=desde))
+
+    total, maxima = 0, None
+    for filas in _iterar_keyset(erp, ('PRVCCODIGO',), tamanio_lote):
+        objetos = []
+        for f in filas:
+            fecha = _aware(f['PRVDFECMOD'] or f['PRVDFECCRE'])
+            if fecha and (maxima is None or fecha > maxima):
+                maxima = fecha
+            objetos.append(ProveedorEspejo(
+                base_datos=base_datos, codigo=f['PRVCCODIGO'], nombre=f['PRVCNOMBRE'],
+                ruc=f['PRVCRUC'], fecha_modificacion=fecha,
+            ))
+        with transaction.atomic():
+            ProveedorEspejo.objects.bulk_create(
+                objetos, **_kwargs_upsert(['base_datos', 'codigo'], CAMPOS_PROVEEDOR)
+            )
+        total += len(objetos)
+    return total, maxima
+
+
+def refrescar_espejo(base_datos, completo=False, tamanio_lote=ESPEJO_ERP_LOTE):
+    """
+    Actualiza el espejo de 'base_datos' desde el ERP. La primera vez, con completo=True
+    o si la última pasada completa venció (ESPEJO_ERP_COMPLETO_SEGUNDOS) copia todo y
+    elimina lo que ya no está en el ERP; si no, solo lo posterior a las marcas de agua.
+    Retorna los conteos.
+    """
+    if base_datos not in connections:
+        raise ValueError(f"Alias '{base_datos}' no configurado.")
+
+    inicio = timezone.now()
+    control, _ = ControlEspejoErp.objects.get_or_create(base_datos=base_datos)
+    completo = completo or control.ultima_actualizacion is None or control.ultima_completa is None or \
+        (inicio - control.ultima_completa).total_seconds() > ESPEJO_ERP_COMPLETO_SEGUNDOS
+
+    desde_ordenes = desde_proveedores = None
+    if not completo:
+        if control.ordenes_hasta:
+            desde_ordenes = control.ordenes_hasta - datetime.timedelta(days=ESPEJO_ERP_DIAS_REVISION)
+        desde_proveedores = control.proveedores_hasta
+
+    ordenes, ordenes_hasta = _refrescar_ordenes(base_datos, desde_ordenes, tamanio_lote)
+    proveedores, proveedores_hasta = _refrescar_proveedores(base_datos, desde_proveedores, tamanio_lote)
+
+    eliminados = 0
+    if completo:
+        # Todo lo vigente se reescribió en esta pasada (auto_now): lo demás ya no está en el ERP
+        eliminados += OrdenCompraEspejo.objects.filter(base_datos=base_datos, actualizado__lt=inicio).delete()[0]
+        eliminados += ProveedorEspejo.objects.filter(base_datos=base_datos, actualizado__lt=inicio).delete()[0]
+
+    control.ordenes_hasta = max(filter(None, [control.ordenes_hasta, ordenes_hasta]), default=None)
+    control.proveedores_hasta = max(filter(None, [control.proveedores_hasta, proveedores_hasta]), default=None)
+    control.ultima_actualizacion = inicio
+    if completo:
+        control.ultima_completa = inicio
+    control.save(update_fields=['ordenes_hasta', 'proveedores_hasta', 'ultima_actualizacion', 'ultima_completa'])
+
+    logger.info(f"Espejo ERP {base_datos}: {ordenes} ítems OC, {proveedores} proveedores, "
+                f"{eliminados} eliminados (completo={completo}).")
+    return {'ordenes': ordenes, 'proveedores': proveedores, 'eliminados': eliminados, 'completo': completo}
+
+
+def estado_espejo(base_datos):
+    """
+    True si el espejo de 'base_datos' ya tiene una carga completa. Si no la tiene o está
+    vencido, encola un refresco (a lo sumo uno por intervalo, vía cache.add).
+    """
+    ultima = (ControlEspejoErp.objects.filter(base_datos=base_datos)
+              .values_list('ultima_actualizacion', flat=True).first())
+    vencido = ultima is None or \
+        (timezone.now() - ultima).total_seconds() > ESPEJO_ERP_REFRESCO_SEGUNDOS
+    if vencido and base_datos in connections and \
+            cache.add(f'espejo_erp:refresco:{base_datos}', 1, ESPEJO_ERP_REFRESCO_SEGUNDOS):
+        try:
+            from .tasks import refrescar_espejo_erp_task
+            refrescar_espejo_erp_task.delay(base_datos)
+        except Exception as e:
+            cache.delete(f'espejo_erp:refresco:{base_datos}')
+            logger.warning(f"No se pudo encolar el refresco del espejo {base_datos}: {e}")
+    return ultima is not None
+
+
+# ==========================================
+# SECCIÓN 3: BÚSQUEDA
+# ==========================================
+
+def buscar_ordenes(base_datos, texto, limite=5):
+    texto = (texto or '').strip()
+    if not texto:
+        return []
+    return _buscar(OrdenCompraEspejo.objects.filter(base_datos=base_datos), 'cnumero', texto,
+                   ('cnumero', 'citem'), limite)
+
+
+def buscar_proveedores(base_datos, texto, limite=5):
+    texto = (texto or '').strip()
+    if not texto:
+        return []
+    return _buscar(ProveedorEspejo.objects.filter(base_datos=base_datos), 'nombre', texto,
+                   ('nombre', 'codigo'), limite)
@@ -0,0 +1,229 @@
+# importaciones/extraccion.py
+"""
+Extracción en segundo plano de los archivos subidos a upload_file.
+
+- upload_file solo calcula el hash, guarda el archivo y encola extraer_documento_task
+  (django_rq); responde de inmediato con el job_id.
+- El resultado se guarda en ExtraccionDocumento por hash del archivo: un archivo
+  idéntico (el mismo hash que usa Documento.hash_archivo) nunca se vuelve a extraer.
+- Los PDF se reparten por lotes de páginas en un ProcessPoolExecutor; Excel e
+  imágenes son una sola unidad de trabajo y se procesan en el mismo job.
+- El avance se publica en el meta del job (recuperable con F5), en la fila de
+  ExtraccionDocumento y por WebSocket al grupo personal del usuario (evento
+  'extraccion.documento', ver importaciones.consumers).
+"""
+import datetime
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connections
+from django.utils import timezone
+
+from .models import ExtraccionDocumento
+from .utilities import extractores
+from .utils import calcular_hash_archivo
+
+logger = logging.getLogger(__name__)
+
+EXTRACCION_DIR = 'extracciones'
+TIPOS_PDF = {'pdf'}
+TIPOS_EXCEL = {'xls', 'xlsx'}
+TIPOS_IMAGEN = {'jpg', 'jpeg', 'png'}
+TIPOS_SOPORTADOS = TIPOS_PDF | TIPOS_EXCEL | TIPOS_IMAGEN
+
+EXTRACCION_MAX_PROCESOS = getattr(settings, 'EXTRACCION_MAX_PROCESOS', os.cpu_count() or 2)
+EXTRACCION_PAGINAS_POR_LOTE = getattr(settings, 'EXTRACCION_PAGINAS_POR_LOTE', 5)
+# Debe coincidir con el timeout de extraer_documento_task: pasado este tiempo una
+# extracción PENDIENTE/PROCESANDO se considera abandonada y se vuelve a encolar
+EXTRACCION_TIMEOUT_SEGUNDOS = 1800
+
+
+def tipo_de_archivo(nombre):
+    return nombre.split('.')[-1].lower()
+
+
+# ==========================================
+# SOLICITUD (desde la vista)
+# ==========================================
+
+def solicitar_extraccion(archivo, user_id=None):
+    """
+    Retorna la ExtraccionDocumento del archivo. Si ya está LISTO (o en curso) no se
+    encola nada; si es nueva, falló o quedó abandonada, guarda el archivo y encola
+    el job.
+    """
+    from .tasks import extraer_documento_task
+
+    tipo = tipo_de_archivo(archivo.name)
+    hash_archivo = calcular_hash_archivo(archivo)
+    extraccion, creada = ExtraccionDocumento.objects.get_or_create(
+        hash_archivo=hash_archivo,
+        defaults={'tipo_archivo': tipo, 'nombre_original': archivo.name[:255]}
+    )
+
+    if not creada:
+        if extraccion.estado == ExtraccionDocumento.ESTADO_LISTO:
+            return extraccion
+        limite = timezone.now() - datetime.timedelta(seconds=EXTRACCION_TIMEOUT_SEGUNDOS)
+        if extraccion.estado != ExtraccionDocumento.ESTADO_ERROR and extraccion.actualizado > limite:
+            return extraccion
+
+    # Se reclama la fila antes de encolar: si dos subidas del mismo archivo llegan
+    # juntas, solo una actualiza y encola
+    reclamada = ExtraccionDocumento.objects.filter(
+        pk=extraccion.pk, actualizado=extraccion.actualizado
+    ).update(
+        estado=ExtraccionDocumento.ESTADO_PENDIENTE, error=None, resultado=None,
+        paginas_total=0, paginas_procesadas=0, actualizado=timezone.now()
+    )
+    if not reclamada and not creada:
+        extraccion.refresh_from_db()
+        return extraccion
+
+    archivo.seek(0)
+    ruta = default_storage.save(f"{EXTRACCION_DIR}/{hash_archivo}.{tipo}", archivo)
+    job = extraer_documento_task.delay(extraccion.id, ruta, user_id)
+    ExtraccionDocumento.objects.filter(pk=extraccion.pk).update(job_id=job.id)
+    extraccion.refresh_from_db()
+    return extraccion
+
+
+# ==========================================
+# PROGRESO
+# ==========================================
+
+def notificar_extraccion(user_id, extraccion, status, message, percent=None):
+    """Envía el estado de la extracción al grupo personal del usuario (usuarios.consumers)."""
+    if not user_id:
+        return
+    try:
+        from asgiref.sync import async_to_sync
+        from channels.layers import get_channel_layer
+        from usuarios.consumers import get_user_group_name
+
+        channel_layer = get_channel_layer()
+        if channel_layer:
+            async_to_sync(channel_layer.group_send)(get_user_group_name(user_id), {
+                'type': 'extraccion.documento',
+                'status': status,
+                'message': message,
+                'result': {'job_id': extraccion.job_id, 'hash': extraccion.hash_archivo,
+                           'percent': percent},
+            })
+    except Exception as e:
+        logger.error(f"WebSocket Error: {e}")
+
+
+def _avance(extraccion, user_id, procesadas, total, fase):
+    from almacen.tasks import actualizar_progreso_job
+
+    percent = round(procesadas / total * 100, 1) if total else 0
+    msg = f"{fase}: {procesadas}/{total} páginas"
+    ExtraccionDocumento.objects.filter(pk=extraccion.pk).update(
+        paginas_procesadas=procesadas, actualizado=timezone.now()
+    )
+    actualizar_progreso_job(percent, msg)
+    notificar_extraccion(user_id, extraccion, 'running', msg, percent)
+
+
+# ==========================================
+# PDF EN PARALELO
+# ==========================================
+
+def _lotes(total, tamanio):
+    return [list(range(inicio, min(inicio + tamanio, total))) for inicio in range(0, total, tamanio)]
+
+
+def _por_paginas(funcion, ruta, total, al_avanzar):
+    """
+    Ejecuta funcion(ruta, indices) por lotes de páginas y retorna {índice: valor}.
+    Con un solo lote no se levanta el pool (el arranque de procesos costaría más).
+    """
+    lotes = _lotes(total, EXTRACCION_PAGINAS_POR_LOTE)
+    resultados = {}
+    if len(lotes) <= 1 or EXTRACCION_MAX_PROCESOS <= 1:
+        for lote in lotes:
+            resultados.update(funcion(ruta, lote))
+            al_avanzar(len(resultados))
+        return resultados
+
+    connections.close_all()  # Los hijos (fork) no deben compartir las conexiones del job
+    with ProcessPoolExecutor(max_workers=min(EXTRACCION_MAX_PROCESOS, len(lotes)),
+                             mp_context=multiprocessing.get_context('fork')) as pool:
+        futuros = [pool.submit(funcion, ruta, lote) for lote in lotes]
+        for futuro in as_completed(futuros):
+            resultados.update(futuro.result())
+            al_avanzar(len(resultados))
+    return resultados
+
+
+def extraer_pdf(ruta, al_avanzar=None):
+    """
+    Tablas de todas las páginas (en orden). Si ninguna página tiene tabla, arma la
+    tabla de certificados desde el texto completo, igual que la extracción original.
+    """
+    total = extractores.contar_paginas(ruta)
+
+    def avance(fase):
+        return (lambda procesadas: al_avanzar(procesadas, total, fase)) if al_avanzar else (lambda _: None)
+
+    tablas = _por_paginas(extractores.tablas_de_paginas, ruta, total, avance("Tablas"))
+    encontradas = [tablas[i] for i in range(total) if tablas[i]]
+    if encontradas:
+        return encontradas
+
+    textos = _por_paginas(extractores.textos_de_paginas, ruta, total, avance("Texto"))
+    return extractores.tabla_desde_texto("".join(textos[i] for i in range(total)))
+
+
+def extraer_resultado(ruta, tipo, al_avanzar=None):
+    """Misma estructura que respondía upload_file en 'data'."""
+    if tipo in TIPOS_PDF:
+        return {"tables": extraer_pdf(ruta, al_avanzar)}
+    if tipo in TIPOS_EXCEL:
+        return {"data": extractores.extraer_excel(ruta)}
+    if tipo in TIPOS_IMAGEN:
+        return {"text": extractores.extraer_texto_imagen(ruta)}
+    return {'message': 'Formato de archivo no soportado'}
+
+
+# ==========================================
+# PROCESO COMPLETO (desde el job)
+# ==========================================
+
+def procesar_extraccion(extraccion_id, ruta, user_id=None):
+    extraccion = ExtraccionDocumento.objects.get(pk=extraccion_id)
+    ExtraccionDocumento.objects.filter(pk=extraccion.pk).update(
+        estado=ExtraccionDocumento.ESTADO_PROCESANDO, actualizado=timezone.now()
+    )
+    notificar_extraccion(user_id, extraccion, 'running', 'Extrayendo datos...', 0)
+
+    def al_avanzar(procesadas, total, fase):
+        if not extraccion.paginas_total:
+            extraccion.paginas_total = total
+            ExtraccionDocumento.objects.filter(pk=extraccion.pk).update(paginas_total=total)
+        _avance(extraccion, user_id, procesadas, total, fase)
+
+    try:
+        resultado = extraer_resultado(default_storage.path(ruta), extraccion.tipo_archivo, al_avanzar)
+    except Exception as e:
+        logger.error(f"Error extrayendo {extraccion.nombre_original} ({extraccion.hash_archivo}): {e}",
+                     exc_info=True)
+        ExtraccionDocumento.objects.filter(pk=extraccion.pk).update(
+            estado=ExtraccionDocumento.ESTADO_ERROR, error=str(e), actualizado=timezone.now()
+        )
+        notificar_extraccion(user_id, extraccion, 'error', f"Error al extraer datos: {e}")
+        raise
+    finally:
+        default_storage.delete(ruta)
+
+    extraccion.resultado = resultado
+    extraccion.estado = ExtraccionDocumento.ESTADO_LISTO
+    extraccion.error = None
+    extraccion.save(update_fields=['resultado', 'estado', 'error', 'paginas_total', 'actualizado'])
+    notificar_extraccion(user_id, extraccion, 'ready', 'Extracción lista.', 100)
+    return extraccion
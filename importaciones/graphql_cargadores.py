@@ -0,0 +1,99 @@
+# importaciones/graphql_cargadores.py
+"""
+Carga por lotes (estilo DataLoader) para el schema GraphQL de importaciones.
+
+graphene-django ejecuta las consultas de forma síncrona, así que en lugar del
+DataLoader asíncrono de graphene se usa un cargador síncrono por request:
+
+- El resolver de una lista "prepara" las claves de todos sus nodos
+  (empresa_id, producto_id, id de la OC...). Preparar no consulta nada.
+- La primera vez que un nodo pide su relación, el cargador trae en UNA consulta
+  todas las claves pendientes y las deja en cache; los nodos hermanos ya no
+  consultan.
+- Cada lote prepara a su vez las claves del siguiente nivel (despacho → proveedor,
+  transportista).
+
+Los cargadores viven en info.context (el request), así que no se comparte
+cache entre requests.
+"""
+from collections import defaultdict
+
+from django.db.models import F
+
+from .models import Empresa, Producto, Despacho, ProveedorTransporte, Transportista
+
+
+class CargadorPorLotes:
+    """Cache por clave + claves pendientes que se resuelven juntas en la primera carga."""
+
+    def __init__(self, cargar_lote, por_defecto=None):
+        self._cargar_lote = cargar_lote  # lista de claves -> {clave: valor}
+        self._por_defecto = por_defecto
+        self._cache = {}
+        self._pendientes = set()
+
+    def preparar(self, claves):
+        self._pendientes.update(c for c in claves if c is not None and c not in self._cache)
+
+    def load(self, clave):
+        if clave is None:
+            return None
+        if clave not in self._cache:
+            self._pendientes.add(clave)
+            claves, self._pendientes = self._pendientes, set()
+            resultado = self._cargar_lote(list(claves))
+            for c in claves:
+                self._cache[c] = resultado.get(c, self._por_defecto() if self._por_defecto else None)
+        return self._cache[clave]
+
+
+def _por_id(modelo):
+    # _base_manager: mismo criterio que el acceso a un FK (incluye registros con borrado lógico)
+    return lambda ids: modelo._base_manager.in_bulk(ids)
+
+
+class Cargadores:
+    """Un cargador por relación, creado una vez por request."""
+
+    def __init__(self):
+        self.empresas = CargadorPorLotes(_por_id(Empresa))
+        self.productos = CargadorPorLotes(_por_id(Producto))
+        self.proveedores = CargadorPorLotes(_por_id(ProveedorTransporte))
+        self.transportistas = CargadorPorLotes(_por_id(Transportista))
+        self.despachos_por_orden = CargadorPorLotes(self._despachos_por_orden, por_defecto=list)
+
+    def preparar_ordenes(self, ordenes):
+        self.empresas.preparar({oc.empresa_id for oc in ordenes})
+        self.productos.preparar({oc.producto_id for oc in ordenes})
+        self.despachos_por_orden.preparar({oc.id for oc in ordenes})
+
+    def _despachos_por_orden(self, orden_ids):
+        """{orden_compra_id: [Despacho]} en una consulta (a través de OrdenCompraDespacho)."""
+        despachos = (
+            Despacho.objects
+            .filter(ordenes_despacho__orden_compra_id__in=orden_ids)
+            .annotate(orden_compra_id=F('ordenes_despacho__orden_compra_id'))
+            .defer('archivo_pdf')
+            .order_by('id')
+        )
+        agrupados = defaultdict(list)
+        for despacho in despachos:
+            agrupados[despacho.orden_compra_id].append(despacho)
+
+        self.proveedores.preparar({d.proveedor_id for lista in agrupados.values() for d in lista})
+        self.transportistas.preparar({d.transportista_id for lista in agrupados.values() for d in lista})
+        return agrupados
+
+
+def cargadores(info):
+    """Cargadores del request actual (se crean en el primer uso)."""
+    contexto = info.context
+    actuales = getattr(contexto, '_cargadores_importaciones', None)
+    if actuales is None:
+        actuales = Cargadores()
+        try:
+            setattr(contexto, '_cargadores_importaciones', actuales)
+        except AttributeError:
+            # Sin contexto (p. ej. schema.execute sin context_value): no hay cache por request
+            pass
+    return actuales
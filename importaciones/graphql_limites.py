@@ -0,0 +1,89 @@
+# importaciones/graphql_limites.py
+"""
+Límites de profundidad y complejidad para el endpoint GraphQL de importaciones.
+
+Se validan antes de ejecutar: una consulta que los excede se rechaza sin tocar la BD.
+- Profundidad: depth_limit_validator de graphene.
+- Complejidad: cada campo cuesta 1 y los hijos de un campo de tipo lista se
+  multiplican por GRAPHQL_FACTOR_LISTA (se asume ese tamaño de página por lista).
+"""
+from django.conf import settings
+from graphene.utils.is_introspection_key import is_introspection_key
+from graphene.validation import depth_limit_validator
+from graphql import GraphQLError, GraphQLList, is_wrapping_type
+from graphql.language import FieldNode, FragmentSpreadNode, InlineFragmentNode
+from graphql.validation import ValidationRule
+
+GRAPHQL_MAX_PROFUNDIDAD = getattr(settings, 'GRAPHQL_MAX_PROFUNDIDAD', 6)
+GRAPHQL_MAX_COMPLEJIDAD = getattr(settings, 'GRAPHQL_MAX_COMPLEJIDAD', 1000)
+GRAPHQL_FACTOR_LISTA = getattr(settings, 'GRAPHQL_FACTOR_LISTA', 10)
+
+
+def _tipo_campo(tipo_padre, nombre):
+    """(tipo nombrado, es_lista) del campo, o (None, False) si no existe."""
+    campos = getattr(tipo_padre, 'fields', None) or {}
+    campo = campos.get(nombre)
+    if campo is None:
+        return None, False
+    tipo, es_lista = campo.type, False
+    while is_wrapping_type(tipo):
+        es_lista = es_lista or isinstance(tipo, GraphQLList)
+        tipo = tipo.of_type
+    return tipo, es_lista
+
+
+def calcular_complejidad(context, selection_set, tipo, factor_lista, fragmentos_visitados=frozenset()):
+    costo = 0
+    for nodo in selection_set.selections:
+        if isinstance(nodo, FieldNode):
+            if is_introspection_key(nodo.name.value):
+                continue
+            tipo_hijo, es_lista = _tipo_campo(tipo, nodo.name.value)
+            hijos = 0
+            if nodo.selection_set and tipo_hijo is not None:
+                hijos = calcular_complejidad(context, nodo.selection_set, tipo_hijo, factor_lista,
+                                             fragmentos_visitados)
+            costo += 1 + (factor_lista if es_lista else 1) * hijos
+        elif isinstance(nodo, InlineFragmentNode):
+            tipo_fragmento = context.schema.get_type(nodo.type_condition.name.value) \
+                if nodo.type_condition else tipo
+            costo += calcular_complejidad(context, nodo.selection_set, tipo_fragmento or tipo, factor_lista,
+                                          fragmentos_visitados)
+        elif isinstance(nodo, FragmentSpreadNode):
+            nombre = nodo.name.value
+            fragmento = context.get_fragment(nombre)
+            # Un fragmento inexistente o cíclico lo reportan las reglas estándar
+            if fragmento is None or nombre in fragmentos_visitados:
+                continue
+            tipo_fragmento = context.schema.get_type(fragmento.type_condition.name.value)
+            costo += calcular_complejidad(context, fragmento.selection_set, tipo_fragmento or tipo,
+                                          factor_lista, fragmentos_visitados | {nombre})
+    return costo
+
+
+def complejidad_limit_validator(max_complejidad, factor_lista=GRAPHQL_FACTOR_LISTA):
+    class ComplejidadValidator(ValidationRule):
+        def enter_operation_definition(self, node, *_args):
+            schema = self.context.schema
+            raiz = {
+                'query': schema.query_type,
+                'mutation': schema.mutation_type,
+                'subscription': schema.subscription_type,
+            }.get(node.operation.value)
+            if raiz is None:
+                return
+            costo = calcular_complejidad(self.context, node.selection_set, raiz, factor_lista)
+            if costo > max_complejidad:
+                nombre = node.name.value if node.name else 'anonymous'
+                self.report_error(GraphQLError(
+                    f"'{nombre}' exceeds maximum operation complexity of {max_complejidad} ({costo}).",
+                    [node],
+                ))
+
+    return ComplejidadValidator
+
+
+REGLAS_VALIDACION = [
+    depth_limit_validator(max_depth=GRAPHQL_MAX_PROFUNDIDAD),
+    complejidad_limit_validator(GRAPHQL_MAX_COMPLEJIDAD),
+]
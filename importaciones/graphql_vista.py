@@ -0,0 +1,30 @@
+# importaciones/graphql_vista.py
+"""
+GraphQLView con la autenticación de DRF.
+
+GraphQLView de graphene-django es una vista Django simple: sin esto el endpoint
+(y GraphiQL) queda abierto a usuarios anónimos. Se envuelve con api_view para
+usar las mismas clases de autenticación que el resto de la API (JWT) e
+IsAuthenticated.
+"""
+from graphene_django.views import GraphQLView
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+
+class GraphQLViewAutenticada(GraphQLView):
+
+    def parse_body(self, request):
+        # DRF ya leyó el cuerpo: request.body no se puede volver a leer
+        if isinstance(request, Request):
+            return request.data
+        return super().parse_body(request)
+
+    @classmethod
+    def as_view(cls, *args, **kwargs):
+        vista = super().as_view(*args, **kwargs)
+        vista = permission_classes((IsAuthenticated,))(vista)
+        vista = authentication_classes(api_settings.DEFAULT_AUTHENTICATION_CLASSES)(vista)
+        return api_view(['GET', 'POST'])(vista)
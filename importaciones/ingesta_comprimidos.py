@@ -0,0 +1,97 @@
+# importaciones/ingesta_comprimidos.py
+"""
+Ingesta de documentos desde un ZIP/RAR ya subido (AsignarDeclaracionDesdeComprimidoView).
+
+Cada archivo del comprimido se lee una sola vez, por bloques: se escribe directo en
+su ubicación final del storage mientras se calcula su SHA-256. Los duplicados se
+resuelven al final con una sola consulta por hash_archivo para todo el comprimido
+(los archivos repetidos se borran del storage) y los Documento se crean en bloque
+con el hash ya calculado, sin volver a leer el archivo.
+"""
+import hashlib
+import os
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from simple_history.utils import bulk_create_with_history
+
+from .models import Declaracion, Documento
+
+
+class _LectorConHash:
+    """Envuelve el stream de un miembro del comprimido y calcula el SHA-256 a medida que se lee."""
+
+    def __init__(self, stream):
+        self._stream = stream
+        self.sha256 = hashlib.sha256()
+
+    def read(self, tamanio=-1):
+        datos = self._stream.read(tamanio)
+        self.sha256.update(datos)
+        return datos
+
+
+def _guardar_miembro(archivo_comp, nombre_miembro, documento):
+    """Escribe el miembro en el storage (ruta de upload_to) y retorna (nombre_guardado, hash)."""
+    nombre_simple = os.path.basename(nombre_miembro)
+    destino = documento.archivo.field.generate_filename(documento, nombre_simple)
+    with archivo_comp.open(nombre_miembro) as stream:
+        lector = _LectorConHash(stream)
+        nombre_guardado = default_storage.save(destino, File(lector, name=nombre_simple))
+    return nombre_guardado, lector.sha256.hexdigest()
+
+
+def _registrado_en(objeto):
+    if isinstance(objeto, Declaracion):
+        return f"{objeto.numero}-{objeto.anio}"
+    return "Desconocido"
+
+
+def ingerir_comprimido(archivo_comp, asignaciones, usuario):
+    """
+    asignaciones: lista de (carpeta, declaracion). Crea un Documento por archivo nuevo
+    y retorna la lista de repetidos [{'archivo', 'registrado_en'}].
+    """
+    candidatos = []  # (documento, nombre_simple)
+    nombres = archivo_comp.namelist()
+    for carpeta, declaracion in asignaciones:
+        for nombre_miembro in nombres:
+            if not nombre_miembro.startswith(carpeta) or nombre_miembro.endswith("/"):
+                continue
+            nombre_simple = os.path.basename(nombre_miembro)
+            documento = Documento(
+                content_object=declaracion,
+                nombre_original=nombre_simple,
+                usuario=usuario
+            )
+            documento.archivo.name, documento.hash_archivo = _guardar_miembro(
+                archivo_comp, nombre_miembro, documento
+            )
+            candidatos.append((documento, nombre_simple))
+
+    if not candidatos:
+        return []
+
+    # Una sola consulta de duplicados para todo el comprimido
+    existentes = {}
+    for doc in Documento.objects.filter(
+            hash_archivo__in={d.hash_archivo for d, _ in candidatos}
+    ).prefetch_related('content_object'):
+        existentes.setdefault(doc.hash_archivo, doc.content_object)
+
+    nuevos, repetidos = [], []
+    for documento, nombre_simple in candidatos:
+        if documento.hash_archivo in existentes:
+            default_storage.delete(documento.archivo.name)
+            repetidos.append({
+                "archivo": nombre_simple,
+                "registrado_en": _registrado_en(existentes[documento.hash_archivo])
+            })
+            continue
+        # Repetido dentro del mismo comprimido: queda registrado en la primera declaración
+        existentes[documento.hash_archivo] = documento.content_object
+        nuevos.append(documento)
+
+    if nuevos:
+        bulk_create_with_history(nuevos, Documento, default_user=usuario)
+    return repetidos
@@ -0,0 +1,113 @@
+# importaciones/management/commands/benchmark_registro_despacho.py
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from importaciones.registro_despacho import registrar_despacho_en_bloque
+from importaciones.utils import procesar_data_reporte
+
+
+class _Revertir(Exception):
+    pass
+
+
+def despacho_sintetico(lineas, ordenes, gastos):
+    """Payload de registrar_despacho con 'lineas' camiones, 'ordenes' recojos y 'gastos' gastos extra."""
+    marca = int(time.time())
+    orden_recojo = [{
+        "numeroRecojo": str(i + 1),
+        "peso_asignado": 1000,
+        "oc": {
+            "codigo_producto": f"BENCH-{i % 10}",
+            "producto": f"PRODUCTO BENCH {i % 10}",
+            "proveedor": "MARCA BENCH",
+            "numero_oc": f"BENCH-{marca}-{i}",
+            "precio_unitario": 0.35,
+            "cantidad": 1000,
+        }
+    } for i in range(ordenes)]
+
+    data_table = [{
+        "numero": i + 1,
+        "placa": f"P{i:05d}",
+        "sacosCargados": 600,
+        "pesoSalida": 30000.0,
+        "placaLlegada": f"P{i:05d}",
+        "sacosDescargados": 598,
+        "pesoLlegada": 29890.5,
+        "merma": 109.5,
+        "sacosFaltantes": 2,
+        "sacosRotos": i % 3,
+        "sacosHumedos": i % 2,
+        "sacosMojados": 0,
+        "pagoEstiba": ("No pago estiba", "Pago parcial", "Pago estiba")[i % 3],
+        "cantDesc": 100,
+    } for i in range(lineas)]
+
+    return {
+        "dataForm": {
+            "empresa": "bd_semilla_starsoft",
+            "proveedor": "PROVEEDOR BENCH",
+            "transportista": "TRANSPORTISTA BENCH",
+            "producto": "PRODUCTO BENCH",
+            "dua": f"BENCH-{marca}",
+            "fechaNumeracion": "2024-01-15T10:00:00.000Z",
+            "cartaPorte": "CP-1",
+            "numFactura": "F001-1",
+            "fletePactado": 45.0,
+            "pesoNetoCrt": 30000.0 * lineas,
+            "ordenRecojo": orden_recojo,
+        },
+        "dataTable": data_table,
+        "dataExtraForm": {
+            "fechaLlegada": "2024-01-20T10:00:00Z",
+            "mermaPermitida": 100.0,
+            "precioProd": 0.35,
+            "gastosNacionalizacion": 10.0,
+            "margenFinanciero": 5.0,
+            "precioSacosRotos": 0.5,
+            "precioSacosHumedos": 0.5,
+            "precioSacosMojados": 0.5,
+            "tipoCambioDescExt": 6.96,
+            "precioEstibaTonelada": 4.0,
+            "otrosGastos": [{"descripcion": f"Gasto {i}", "monto": 10.0} for i in range(gastos)],
+        },
+    }
+
+
+class Command(BaseCommand):
+    help = ('Mide registrar_despacho con un despacho sintético (escritura en bloque + PDF después del '
+            'commit). Todo se ejecuta dentro de una transacción que se revierte.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lineas', type=int, default=1000, help='Camiones (DetalleDespacho).')
+        parser.add_argument('--ordenes', type=int, default=50, help='Órdenes de recojo (OC).')
+        parser.add_argument('--gastos', type=int, default=20, help='Gastos extra.')
+
+    def handle(self, *args, **options):
+        data = despacho_sintetico(options['lineas'], options['ordenes'], options['gastos'])
+        data_procesado = procesar_data_reporte(data)
+        self.stdout.write(f"Despacho sintético: {options['lineas']} líneas, {options['ordenes']} recojos, "
+                          f"{options['gastos']} gastos extra.")
+
+        try:
+            with transaction.atomic():
+                with CaptureQueriesContext(connection) as ctx:
+                    inicio = time.perf_counter()
+                    registrar_despacho_en_bloque(data, data_procesado)
+                    t_transaccion = time.perf_counter() - inicio
+                raise _Revertir()
+        except _Revertir:
+            pass
+
+        # on_commit no corre al revertir: el PDF se mide aparte, ya fuera de la transacción
+        from importaciones.views import generar_reporte_pdf
+        inicio = time.perf_counter()
+        pdf = generar_reporte_pdf(data_procesado)
+        t_pdf = time.perf_counter() - inicio
+
+        self.stdout.write(f"  Transacción: {t_transaccion:8.3f} s  {len(ctx.captured_queries):6d} consultas")
+        self.stdout.write(f"  PDF (después del commit): {t_pdf:8.3f} s  {len(pdf) / 1024:.0f} KB")
+        self.stdout.write(self.style.SUCCESS("✅ Datos revertidos."))
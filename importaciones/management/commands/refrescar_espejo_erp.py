@@ -0,0 +1,30 @@
+# importaciones/management/commands/refrescar_espejo_erp.py
+from django.core.management.base import BaseCommand
+
+from importaciones.espejo_erp import refrescar_espejo, ESPEJO_ERP_ALIASES
+
+
+class Command(BaseCommand):
+    help = ('Refresca el espejo local de órdenes de importación y proveedores del ERP '
+            '(pensado para cron, ej. cada 15 minutos). Cada ESPEJO_ERP_COMPLETO_SEGUNDOS '
+            '(default diario) el refresco pasa solo a completo.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('base_datos', type=str, nargs='*',
+                            help=f"Alias de la(s) BD ERP. Default: {', '.join(ESPEJO_ERP_ALIASES)}.")
+        parser.add_argument('--completo', action='store_true',
+                            help='Fuerza la pasada completa: copia todo y elimina del espejo lo que '
+                                 'ya no existe en el ERP.')
+
+    def handle(self, *args, **options):
+        for alias in options['base_datos'] or ESPEJO_ERP_ALIASES:
+            self.stdout.write(f"Refrescando espejo de {alias}...")
+            try:
+                r = refrescar_espejo(alias, completo=options['completo'])
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f"❌ {alias}: {e}"))
+                continue
+            self.stdout.write(self.style.SUCCESS(
+                f"✅ {alias}: {r['ordenes']} ítems OC, {r['proveedores']} proveedores, "
+                f"{r['eliminados']} eliminados (completo={r['completo']})."
+            ))
@@ -0,0 +1,27 @@
+from django.db import migrations
+
+
+def crear_fulltext(apps, schema_editor):
+    # Búsqueda de productos (almacen/busqueda.py). Django no genera índices FULLTEXT: solo en MySQL.
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    schema_editor.execute(
+        'CREATE FULLTEXT INDEX producto_busqueda_ft ON producto (nombre_producto, codigo_producto)'
+    )
+
+
+def eliminar_fulltext(apps, schema_editor):
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    schema_editor.execute('DROP INDEX producto_busqueda_ft ON producto')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('importaciones', '0038_importacionespermissions_alter_despacho_archivo_pdf'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_fulltext, eliminar_fulltext),
+    ]
@@ -0,0 +1,86 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:26
+
+from django.db import migrations, models
+
+
+def crear_fulltext_ngram(apps, schema_editor):
+    # Búsqueda por subcadena del autocompletado (importaciones/espejo_erp.py). Solo en MySQL.
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    schema_editor.execute(
+        'CREATE FULLTEXT INDEX espejo_oc_numero_ft ON espejo_orden_compra (cnumero) WITH PARSER ngram'
+    )
+    schema_editor.execute(
+        'CREATE FULLTEXT INDEX espejo_prov_nombre_ft ON espejo_proveedor (nombre) WITH PARSER ngram'
+    )
+
+
+def eliminar_fulltext_ngram(apps, schema_editor):
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    schema_editor.execute('DROP INDEX espejo_oc_numero_ft ON espejo_orden_compra')
+    schema_editor.execute('DROP INDEX espejo_prov_nombre_ft ON espejo_proveedor')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('importaciones', '0039_producto_busqueda_fulltext'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ControlEspejoErp',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('base_datos', models.CharField(max_length=50, unique=True)),
+                ('ordenes_hasta', models.DateTimeField(blank=True, null=True)),
+                ('proveedores_hasta', models.DateTimeField(blank=True, null=True)),
+                ('ultima_actualizacion', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'espejo_erp_control',
+            },
+        ),
+        migrations.CreateModel(
+            name='OrdenCompraEspejo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('base_datos', models.CharField(max_length=50)),
+                ('cnumero', models.CharField(max_length=13)),
+                ('citem', models.CharField(max_length=3)),
+                ('ccodartic', models.CharField(blank=True, max_length=20, null=True)),
+                ('cdesartic', models.CharField(blank=True, max_length=200, null=True)),
+                ('ncantidad', models.FloatField(default=0)),
+                ('cunidad', models.CharField(blank=True, max_length=6, null=True)),
+                ('npreunita', models.FloatField(default=0)),
+                ('ntotvent', models.FloatField(default=0)),
+                ('ccodprove', models.CharField(blank=True, max_length=11, null=True)),
+                ('cdesprove', models.CharField(blank=True, max_length=100, null=True)),
+                ('femision', models.DateTimeField(blank=True, null=True)),
+                ('actualizado', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'espejo_orden_compra',
+                'constraints': [models.UniqueConstraint(fields=('base_datos', 'cnumero', 'citem'), name='uniq_espejo_oc_item')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProveedorEspejo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('base_datos', models.CharField(max_length=50)),
+                ('codigo', models.CharField(max_length=11)),
+                ('nombre', models.CharField(blank=True, max_length=100, null=True)),
+                ('ruc', models.CharField(blank=True, max_length=11, null=True)),
+                ('fecha_modificacion', models.DateTimeField(blank=True, null=True)),
+                ('actualizado', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'espejo_proveedor',
+                'indexes': [models.Index(fields=['base_datos', 'nombre'], name='espejo_prov_nombre_idx')],
+                'constraints': [models.UniqueConstraint(fields=('base_datos', 'codigo'), name='uniq_espejo_proveedor')],
+            },
+        ),
+        migrations.RunPython(crear_fulltext_ngram, eliminar_fulltext_ngram),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:36
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('importaciones', '0040_espejo_erp'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExtraccionDocumento',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hash_archivo', models.CharField(max_length=64, unique=True)),
+                ('tipo_archivo', models.CharField(max_length=10)),
+                ('nombre_original', models.CharField(blank=True, max_length=255)),
+                ('estado', models.CharField(choices=[('PENDIENTE', 'Pendiente'), ('PROCESANDO', 'Procesando'), ('LISTO', 'Listo'), ('ERROR', 'Error')], default='PENDIENTE', max_length=20)),
+                ('job_id', models.CharField(blank=True, max_length=100, null=True)),
+                ('resultado', models.JSONField(blank=True, encoder=django.core.serializers.json.DjangoJSONEncoder, null=True)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('paginas_total', models.PositiveIntegerField(default=0)),
+                ('paginas_procesadas', models.PositiveIntegerField(default=0)),
+                ('creado', models.DateTimeField(auto_now_add=True)),
+                ('actualizado', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'extraccion_documento',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 12:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('importaciones', '0041_extraccion_documento'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='controlespejoerp',
+            name='ultima_completa',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
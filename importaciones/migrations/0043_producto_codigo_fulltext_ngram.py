@@ -0,0 +1,27 @@
+from django.db import migrations
+
+
+def crear_fulltext_ngram(apps, schema_editor):
+    # Búsqueda del código de producto en cualquier posición (almacen/busqueda.py). Solo en MySQL.
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    schema_editor.execute(
+        'CREATE FULLTEXT INDEX producto_codigo_ngram_ft ON producto (codigo_producto) WITH PARSER ngram'
+    )
+
+
+def eliminar_fulltext_ngram(apps, schema_editor):
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    schema_editor.execute('DROP INDEX producto_codigo_ngram_ft ON producto')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('importaciones', '0042_controlespejoerp_ultima_completa'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_fulltext_ngram, eliminar_fulltext_ngram),
+    ]
@@ -3,6 +3,7 @@ import os
 
 from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
 from django.contrib.contenttypes.models import ContentType
+from django.core.serializers.json import DjangoJSONEncoder
 from django.utils import timezone
 
 from django.contrib.auth.models import User
@@ -476,3 +477,106 @@ class ImportacionesPermissions(models.Model):
         verbose_name_plural = 'Permisos de Importaciones'
 
 
+
+
+#ESPEJO LOCAL DE TABLAS STARSOFT (autocompletado; se refresca con importaciones/espejo_erp.py)
+
+class OrdenCompraEspejo(models.Model):
+    """Una fila por ítem de IMPORD, con el proveedor de su cabecera IMPORC."""
+    base_datos = models.CharField(max_length=50)
+    cnumero = models.CharField(max_length=13)
+    citem = models.CharField(max_length=3)
+    ccodartic = models.CharField(max_length=20, null=True, blank=True)
+    cdesartic = models.CharField(max_length=200, null=True, blank=True)
+    ncantidad = models.FloatField(default=0)
+    cunidad = models.CharField(max_length=6, null=True, blank=True)
+    npreunita = models.FloatField(default=0)
+    ntotvent = models.FloatField(default=0)
+    ccodprove = models.CharField(max_length=11, null=True, blank=True)
+    cdesprove = models.CharField(max_length=100, null=True, blank=True)
+    femision = models.DateTimeField(null=True, blank=True)
+    actualizado = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'espejo_orden_compra'
+        constraints = [
+            models.UniqueConstraint(fields=['base_datos', 'cnumero', 'citem'], name='uniq_espejo_oc_item'),
+        ]
+
+    def __str__(self):
+        return f"{self.base_datos} {self.cnumero}-{self.citem}"
+
+
+class ProveedorEspejo(models.Model):
+    """Copia de MAEPROV (solo las columnas que usa el autocompletado)."""
+    base_datos = models.CharField(max_length=50)
+    codigo = models.CharField(max_length=11)
+    nombre = models.CharField(max_length=100, null=True, blank=True)
+    ruc = models.CharField(max_length=11, null=True, blank=True)
+    fecha_modificacion = models.DateTimeField(null=True, blank=True)
+    actualizado = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'espejo_proveedor'
+        constraints = [
+            models.UniqueConstraint(fields=['base_datos', 'codigo'], name='uniq_espejo_proveedor'),
+        ]
+        indexes = [
+            models.Index(fields=['base_datos', 'nombre'], name='espejo_prov_nombre_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.base_datos} {self.codigo} {self.nombre or ''}"
+
+
+class ControlEspejoErp(models.Model):
+    """Marcas de agua del refresco incremental del espejo, por base de datos ERP."""
+    base_datos = models.CharField(max_length=50, unique=True)
+    ordenes_hasta = models.DateTimeField(null=True, blank=True)
+    proveedores_hasta = models.DateTimeField(null=True, blank=True)
+    ultima_actualizacion = models.DateTimeField(null=True, blank=True)
+    # Última pasada completa (la única que elimina del espejo lo borrado en el ERP)
+    ultima_completa = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'espejo_erp_control'
+
+    def __str__(self):
+        return f"{self.base_datos} ({self.ultima_actualizacion})"
+
+
+#EXTRACCION DE DATOS DE DOCUMENTOS (upload_file)
+
+class ExtraccionDocumento(models.Model):
+    """
+    Resultado de la extracción (tablas PDF, hojas Excel, texto OCR) por hash del archivo:
+    un archivo idéntico nunca se vuelve a procesar.
+    """
+    ESTADO_PENDIENTE = 'PENDIENTE'
+    ESTADO_PROCESANDO = 'PROCESANDO'
+    ESTADO_LISTO = 'LISTO'
+    ESTADO_ERROR = 'ERROR'
+    ESTADOS = [
+        (ESTADO_PENDIENTE, 'Pendiente'),
+        (ESTADO_PROCESANDO, 'Procesando'),
+        (ESTADO_LISTO, 'Listo'),
+        (ESTADO_ERROR, 'Error'),
+    ]
+
+    hash_archivo = models.CharField(max_length=64, unique=True)
+    tipo_archivo = models.CharField(max_length=10)
+    nombre_original = models.CharField(max_length=255, blank=True)
+    estado = models.CharField(max_length=20, choices=ESTADOS, default=ESTADO_PENDIENTE)
+    job_id = models.CharField(max_length=100, null=True, blank=True)
+    resultado = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    error = models.TextField(null=True, blank=True)
+    paginas_total = models.PositiveIntegerField(default=0)
+    paginas_procesadas = models.PositiveIntegerField(default=0)
+    creado = models.DateTimeField(auto_now_add=True)
+    actualizado = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'extraccion_documento'
+
+    def __str__(self):
+        return f"{self.nombre_original or self.hash_archivo} ({self.estado})"
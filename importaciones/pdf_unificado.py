@@ -0,0 +1,150 @@
+# importaciones/pdf_unificado.py
+"""
+PDF unificado de los expedientes de una declaración, con el folio y la OC/NI
+estampados en cada página.
+
+- Los overlays (reportlab) se generan una sola vez por (tamaño de página, textos)
+  y se reutilizan en todas las páginas que comparten esa combinación.
+- El resultado se escribe a disco (MEDIA_ROOT/cache/pdf_unificados) y se sirve
+  desde ahí: no se arma en un BytesIO ni se copia a la respuesta.
+- El nombre del archivo lleva una clave calculada con los hashes de los documentos
+  y los textos estampados, así una descarga repetida reutiliza el archivo y
+  cualquier cambio en el expediente genera uno nuevo. generar_pdf_unificado_task
+  lo puede precalcular en segundo plano.
+"""
+import hashlib
+import io
+import logging
+import os
+import tempfile
+
+from django.conf import settings
+from pypdf import PdfReader, PdfWriter
+from reportlab.lib.units import cm
+from reportlab.pdfgen import canvas
+
+from .models import ExpedienteDeclaracion
+
+logger = logging.getLogger(__name__)
+
+PDF_UNIFICADO_DIR = os.path.join('cache', 'pdf_unificados')
+
+
+def expedientes_ordenados(declaracion_id):
+    """Expedientes con documento, agrupados por tipo (mismo orden que la descarga original)."""
+    expedientes = (
+        ExpedienteDeclaracion.objects
+        .filter(declaracion_id=declaracion_id)
+        .select_related('documento', 'tipo')
+    )
+    grupos_por_tipo = {}
+    for exp in expedientes:
+        tipo_id = exp.tipo.id if exp.tipo else 0
+        grupos_por_tipo.setdefault(tipo_id, []).append(exp)
+
+    return [exp for tipo_id in sorted(grupos_por_tipo) for exp in grupos_por_tipo[tipo_id]
+            if exp.documento and exp.documento.archivo]
+
+
+def _texto_oc(exp):
+    return f'OC: {exp.orden_compra}  / NI: {exp.nota_ingreso}'
+
+
+def clave_pdf_unificado(expedientes):
+    """Hash del contenido del PDF: documentos (por su hash) + textos estampados, en orden."""
+    sha256 = hashlib.sha256()
+    for exp in expedientes:
+        doc = exp.documento
+        identidad = doc.hash_archivo
+        if not identidad:
+            # Documentos antiguos sin hash: nombre + tamaño + fecha de modificación
+            try:
+                stat = os.stat(doc.archivo.path)
+                identidad = f"{doc.archivo.name}:{stat.st_size}:{stat.st_mtime_ns}"
+            except OSError:
+                identidad = doc.archivo.name
+        sha256.update(f"{identidad}|{exp.folio or ''}|{_texto_oc(exp)}\n".encode())
+    return sha256.hexdigest()
+
+
+def ruta_pdf_unificado(declaracion_id, clave):
+    return os.path.join(settings.MEDIA_ROOT, PDF_UNIFICADO_DIR, f"{declaracion_id}_{clave}.pdf")
+
+
+class _Overlays:
+    """Cache de páginas overlay por (ancho, alto, folio, texto OC/NI)."""
+
+    def __init__(self):
+        self._paginas = {}
+
+    def obtener(self, ancho, alto, folio, texto_oc):
+        clave = (round(ancho, 2), round(alto, 2), folio, texto_oc)
+        if clave not in self._paginas:
+            stream = io.BytesIO()
+            c = canvas.Canvas(stream, pagesize=(ancho, alto))
+            c.setFont("Helvetica-Bold", 10)
+            c.setFillColorRGB(1, 0, 0)
+
+            # Posición del texto: centro horizontal y 0.6 cm desde el borde superior
+            folio_y = alto - 0.6 * cm
+            c.drawCentredString((ancho / 2) + 100, folio_y, folio)
+            c.drawCentredString((ancho / 2) - 200, folio_y, texto_oc)
+            c.save()
+            stream.seek(0)
+            self._paginas[clave] = PdfReader(stream).pages[0]
+        return self._paginas[clave]
+
+
+def escribir_pdf_unificado(expedientes, destino):
+    """Escribe en 'destino' (archivo binario) todas las páginas con su folio estampado."""
+    writer = PdfWriter()
+    overlays = _Overlays()
+
+    for exp in expedientes:
+        try:
+            reader = PdfReader(exp.documento.archivo.path)
+        except Exception as e:
+            logger.warning(f"Error al leer PDF {exp.documento.archivo.name}: {e}")
+            continue
+
+        folio, texto_oc = exp.folio or "", _texto_oc(exp)
+        for page in reader.pages:
+            media_box = page.mediabox
+            overlay = overlays.obtener(float(media_box.width), float(media_box.height), folio, texto_oc)
+            page.merge_page(overlay)
+            writer.add_page(page)
+
+    writer.write(destino)
+
+
+def obtener_pdf_unificado(declaracion_id):
+    """
+    Ruta del PDF unificado vigente de la declaración; lo genera si no existe.
+    Se escribe en un temporal de la misma carpeta y se publica con os.replace
+    (atómico), así dos generaciones simultáneas no dejan un archivo a medias.
+    """
+    expedientes = expedientes_ordenados(declaracion_id)
+    ruta = ruta_pdf_unificado(declaracion_id, clave_pdf_unificado(expedientes))
+    if os.path.exists(ruta):
+        return ruta
+
+    carpeta = os.path.dirname(ruta)
+    os.makedirs(carpeta, exist_ok=True)
+    fd, temporal = tempfile.mkstemp(dir=carpeta, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as destino:
+            escribir_pdf_unificado(expedientes, destino)
+        os.replace(temporal, ruta)
+    except Exception:
+        os.remove(temporal)
+        raise
+
+    # Versiones anteriores de esta declaración (el expediente cambió)
+    prefijo = f"{declaracion_id}_"
+    for nombre in os.listdir(carpeta):
+        if nombre.startswith(prefijo) and nombre.endswith('.pdf') and os.path.join(carpeta, nombre) != ruta:
+            try:
+                os.remove(os.path.join(carpeta, nombre))
+            except OSError:
+                pass
+    return ruta
@@ -0,0 +1,264 @@
+# importaciones/registro_despacho.py
+"""
+Registro de un despacho (registrar_despacho) con escritura en bloque.
+
+- Los datos maestros de las órdenes de recojo (Producto, OrdenCompra) se resuelven
+  con una consulta por tabla para todo el despacho; los que faltan se crean con
+  bulk_create (Producto con su historial).
+- Los duplicados de OC + número de recojo se validan antes de escribir nada, así
+  un error no deja un despacho a medias.
+- DetalleDespacho, OrdenCompraDespacho y GastosExtra se insertan con bulk_create.
+- El PDF del reporte se genera después del commit (transaction.on_commit), fuera
+  de la transacción: no retiene locks mientras reportlab dibuja. Con
+  DESPACHO_PDF_EN_SEGUNDO_PLANO se encola generar_pdf_despacho_task.
+"""
+import logging
+import operator
+import unicodedata
+from functools import reduce
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from simple_history.utils import bulk_create_with_history
+
+from .models import (Empresa, ProveedorTransporte, Transportista, Producto, OrdenCompra, OrdenCompraDespacho,
+                     Despacho, DetalleDespacho, ConfiguracionDespacho, GastosExtra)
+
+logger = logging.getLogger(__name__)
+
+DESPACHO_PDF_EN_SEGUNDO_PLANO = getattr(settings, 'DESPACHO_PDF_EN_SEGUNDO_PLANO', False)
+TAMANIO_LOTE = 500
+CAMPOS_OC = ['codigo_producto', 'producto', 'proveedor', 'numero_oc', 'precio_unitario', 'cantidad']
+
+
+class RecojoDuplicadoError(Exception):
+    """La combinación OC + número de recojo ya está registrada (o se repite en el despacho)."""
+
+
+def _numero_recojo(valor):
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        return valor
+
+
+def _normalizar(valor):
+    """
+    Aproxima la comparación de la collation *_ci de MySQL (la que usaba get_or_create):
+    sin distinguir mayúsculas, acentos ni espacios en los extremos.
+    """
+    texto = unicodedata.normalize('NFKD', str(valor if valor is not None else '')).strip()
+    return ''.join(c for c in texto if not unicodedata.combining(c)).casefold()
+
+
+def _clave_producto(oc_data):
+    return oc_data['codigo_producto'], oc_data['producto'], oc_data['proveedor']
+
+
+def _clave_normalizada(clave):
+    return tuple(_normalizar(valor) for valor in clave)
+
+
+def _q_codigos(codigos):
+    """codigo_producto IN (...) sin distinguir mayúsculas (iexact, como la collation de MySQL)."""
+    return reduce(operator.or_, (Q(codigo_producto__iexact=codigo.strip()) for codigo in codigos))
+
+
+def _resolver_productos(claves):
+    """{(codigo, nombre, marca): Producto}; crea en bloque los que no existen."""
+    por_clave = {}
+
+    def indexar(queryset):
+        # El más antiguo gana, como el get() de get_or_create
+        for producto in queryset.order_by('id'):
+            clave = (producto.codigo_producto, producto.nombre_producto, producto.proveedor_marca)
+            por_clave.setdefault(_clave_normalizada(clave), producto)
+
+    indexar(Producto.objects.filter(_q_codigos({c[0] for c in claves})))
+
+    faltantes = {}
+    for clave in claves:
+        faltantes.setdefault(_clave_normalizada(clave), clave)
+    faltantes = {n: c for n, c in faltantes.items() if n not in por_clave}
+    if faltantes:
+        bulk_create_with_history(
+            [Producto(codigo_producto=c[0], nombre_producto=c[1], proveedor_marca=c[2])
+             for c in faltantes.values()],
+            Producto, batch_size=TAMANIO_LOTE
+        )
+        # MySQL no retorna los ids del bulk_create: se vuelven a leer
+        indexar(Producto.objects.filter(_q_codigos({c[0] for c in faltantes.values()})))
+    return {clave: por_clave[_clave_normalizada(clave)] for clave in claves}
+
+
+def _resolver_ordenes(empresa, lineas, productos):
+    """
+    {numero_oc: OrdenCompra} con la semántica de get_or_create(empresa, numero_oc, producto):
+    una OC existente con otra empresa/producto se intenta crear y el UNIQUE de
+    numero_oc levanta IntegrityError, igual que antes.
+    """
+    numeros = {linea[0]['numero_oc'] for linea in lineas}
+    existentes = {
+        _normalizar(oc.numero_oc): oc
+        for oc in OrdenCompra.objects.filter(reduce(operator.or_, (Q(numero_oc__iexact=n) for n in numeros)))
+    } if numeros else {}
+    ordenes, nuevas = {}, {}
+    for oc_data, _, _ in lineas:
+        numero_oc = oc_data['numero_oc']
+        clave = _normalizar(numero_oc)
+        producto = productos[_clave_producto(oc_data)]
+        actual = existentes.get(clave)
+        if actual and actual.empresa_id == empresa.id and actual.producto_id == producto.id:
+            ordenes[numero_oc] = actual
+        elif clave in nuevas:
+            if nuevas[clave].producto_id != producto.id:
+                raise IntegrityError(f"La OC {numero_oc} se repite con otro producto.")
+        else:
+            nuevas[clave] = OrdenCompra(
+                empresa=empresa, numero_oc=numero_oc, producto=producto,
+                precio_producto=oc_data['precio_unitario'], cantidad=oc_data['cantidad']
+            )
+
+    if nuevas:
+        OrdenCompra.objects.bulk_create(nuevas.values(), batch_size=TAMANIO_LOTE)
+        creadas = {
+            _normalizar(oc.numero_oc): oc
+            for oc in OrdenCompra.objects.filter(numero_oc__in=[oc.numero_oc for oc in nuevas.values()])
+        }
+        for oc_data, _, _ in lineas:
+            ordenes.setdefault(oc_data['numero_oc'], creadas.get(_normalizar(oc_data['numero_oc'])))
+    return ordenes
+
+
+def _validar_recojos(lineas, ordenes):
+    """[(orden_compra, numero_recojo, peso)]; una sola consulta para todos los recojos."""
+    pares = [(ordenes[oc_data['numero_oc']], numero_recojo, peso) for oc_data, numero_recojo, peso in lineas]
+    registrados = set(
+        OrdenCompraDespacho.objects.filter(
+            orden_compra_id__in={par[0].id for par in pares},
+            numero_recojo__in={par[1] for par in pares}
+        ).values_list('orden_compra_id', 'numero_recojo')
+    )
+    for orden_compra, numero_recojo, _ in pares:
+        clave = (orden_compra.id, _numero_recojo(numero_recojo))
+        if clave in registrados:
+            raise RecojoDuplicadoError(
+                f'La OC "{orden_compra.numero_oc}" con número de recojo "{numero_recojo}" ya existe.'
+            )
+        registrados.add(clave)
+    return pares
+
+
+def registrar_despacho_en_bloque(data, data_procesado):
+    """
+    Crea el despacho completo de 'data' (payload de registrar_despacho) y programa
+    la generación del PDF con 'data_procesado' (procesar_data_reporte) tras el commit.
+    Levanta ValueError si faltan datos de una OC y RecojoDuplicadoError si una
+    OC + número de recojo ya existe; en ambos casos no se escribe nada.
+    """
+    data_form = data.get('dataForm', {})
+    data_extra_form = data.get('dataExtraForm', {})
+
+    lineas = []  # (oc_data, numero_recojo, peso_asignado)
+    for orden_recojo in data_form.get('ordenRecojo', []):
+        oc_data = orden_recojo.get('oc', {})
+        if not all(k in oc_data for k in CAMPOS_OC):
+            raise ValueError("Faltan datos necesarios en `oc`.")
+        lineas.append((oc_data, orden_recojo.get('numeroRecojo'), orden_recojo.get('peso_asignado', 0)))
+
+    with transaction.atomic():
+        empresa, _ = Empresa.objects.get_or_create(nombre_empresa=data_form.get('empresa'))
+        proveedor, _ = ProveedorTransporte.objects.get_or_create(nombre_proveedor=data_form.get('proveedor'))
+        transportista, _ = Transportista.objects.get_or_create(
+            nombre_transportista=data_form.get('transportista'))
+
+        productos = _resolver_productos({_clave_producto(linea[0]) for linea in lineas})
+        ordenes = _resolver_ordenes(empresa, lineas, productos)
+        pares = _validar_recojos(lineas, ordenes)
+
+        despacho = Despacho.objects.create(
+            proveedor=proveedor,
+            dua=data_form.get('dua', ''),
+            fecha_numeracion=data_form.get('fechaNumeracion'),
+            carta_porte=data_form.get('cartaPorte', None),
+            num_factura=data_form.get('numFactura', ''),
+            transportista=transportista,
+            flete_pactado=data_form.get('fletePactado', 0.0),
+            peso_neto_crt=data_form.get('pesoNetoCrt', 0.0),
+            fecha_llegada=data_extra_form.get('fechaLlegada', None)
+        )
+
+        OrdenCompraDespacho.objects.bulk_create([
+            OrdenCompraDespacho(despacho=despacho, orden_compra=orden_compra, cantidad_asignada=peso,
+                                numero_recojo=numero_recojo)
+            for orden_compra, numero_recojo, peso in pares
+        ], batch_size=TAMANIO_LOTE)
+
+        DetalleDespacho.objects.bulk_create([
+            DetalleDespacho(
+                despacho=despacho,
+                placa_salida=item.get('placa', ''),
+                sacos_cargados=item.get('sacosCargados', 0),
+                peso_salida=item.get('pesoSalida', 0.0),
+                placa_llegada=item.get('placaLlegada', ''),
+                sacos_descargados=item.get('sacosDescargados', 0),
+                peso_llegada=item.get('pesoLlegada', 0.0),
+                merma=item.get('merma', 0),
+                sacos_faltantes=item.get('sacosFaltantes', 0),
+                sacos_rotos=item.get('sacosRotos', 0),
+                sacos_humedos=item.get('sacosHumedos', 0),
+                sacos_mojados=item.get('sacosMojados', 0),
+                pago_estiba=item.get('pagoEstiba', 0.0),
+                cant_desc=item.get('cantDesc', 0)
+            )
+            for item in data.get('dataTable', [])
+        ], batch_size=TAMANIO_LOTE)
+
+        ConfiguracionDespacho.objects.create(
+            despacho=despacho,
+            merma_permitida=data_extra_form.get('mermaPermitida', 0.0),
+            precio_prod=data_extra_form.get('precioProd', 0.0),
+            gastos_nacionalizacion=data_extra_form.get('gastosNacionalizacion', 0.0),
+            margen_financiero=data_extra_form.get('margenFinanciero', 0.0),
+            precio_sacos_rotos=data_extra_form.get('precioSacosRotos', 0.0),
+            precio_sacos_humedos=data_extra_form.get('precioSacosHumedos', 0.0),
+            precio_sacos_mojados=data_extra_form.get('precioSacosMojados', 0.0),
+            tipo_cambio_desc_ext=data_extra_form.get('tipoCambioDescExt', 0.0),
+            precio_estiba=data_extra_form.get('precioEstibaTonelada', 0.0),
+        )
+
+        GastosExtra.objects.bulk_create([
+            GastosExtra(despacho=despacho, descripcion=item['descripcion'], monto=item['monto'])
+            for item in data_extra_form.get('otrosGastos', [])
+        ], batch_size=TAMANIO_LOTE)
+
+        transaction.on_commit(lambda: programar_pdf_despacho(despacho.id, data_procesado))
+
+    return despacho
+
+
+# ==========================================
+# PDF DEL REPORTE (después del commit)
+# ==========================================
+
+def guardar_pdf_despacho(despacho_id, data_procesado):
+    from .views import generar_reporte_pdf
+
+    Despacho.objects.filter(pk=despacho_id).update(archivo_pdf=generar_reporte_pdf(data_procesado))
+
+
+def programar_pdf_despacho(despacho_id, data_procesado):
+    """
+    Genera el PDF ya fuera de la transacción. Un error aquí no revierte el despacho
+    (queda sin archivo_pdf y se registra en el log).
+    """
+    if DESPACHO_PDF_EN_SEGUNDO_PLANO:
+        from .tasks import generar_pdf_despacho_task
+
+        generar_pdf_despacho_task.delay(despacho_id, data_procesado)
+        return
+    try:
+        guardar_pdf_despacho(despacho_id, data_procesado)
+    except Exception as e:
+        logger.error(f"Error generando el PDF del despacho {despacho_id}: {e}", exc_info=True)
@@ -1,13 +1,70 @@
 import graphene
 from .models import OrdenCompra
+from .graphql_cargadores import cargadores
 from graphene import ObjectType, String, Float, Mutation, Field, Decimal as GraphQLDecimal
 
+
+# Relaciones: se resuelven por lotes con los cargadores del request (graphql_cargadores)
+class EmpresaType(ObjectType):
+    id = graphene.Int()
+    nombre_empresa = String()
+    razon_social = String()
+    ruc = String()
+
+
+class ProductoType(ObjectType):
+    id = graphene.Int()
+    nombre_producto = String()
+    codigo_producto = String()
+    proveedor_marca = String()
+
+
+class ProveedorTransporteType(ObjectType):
+    id = graphene.Int()
+    nombre_proveedor = String()
+
+
+class TransportistaType(ObjectType):
+    id = graphene.Int()
+    nombre_transportista = String()
+
+
+class DespachoType(ObjectType):
+    id = graphene.Int()
+    dua = String()
+    fecha_numeracion = graphene.DateTime()
+    num_factura = String()
+    flete_pactado = GraphQLDecimal()
+    proveedor = Field(ProveedorTransporteType)
+    transportista = Field(TransportistaType)
+
+    def resolve_proveedor(self, info):
+        return cargadores(info).proveedores.load(self.proveedor_id)
+
+    def resolve_transportista(self, info):
+        return cargadores(info).transportistas.load(self.transportista_id)
+
+
 class OrdenCompraType(ObjectType):
     id = String()
     nombre = String()
     precio = GraphQLDecimal()  # Cambiado a GraphQLDecimal
     cantidad = GraphQLDecimal()  # Cambiado a GraphQLDecimal
     fecha = String()
+    numero_oc = String()
+    precio_producto = GraphQLDecimal()
+    empresa = Field(EmpresaType)
+    producto = Field(ProductoType)
+    despachos = graphene.List(DespachoType)
+
+    def resolve_empresa(self, info):
+        return cargadores(info).empresas.load(self.empresa_id)
+
+    def resolve_producto(self, info):
+        return cargadores(info).productos.load(self.producto_id)
+
+    def resolve_despachos(self, info):
+        return cargadores(info).despachos_por_orden.load(self.id)
 
 
 # Consultas
@@ -16,10 +73,14 @@ class Query(graphene.ObjectType):
     all_orden_compras = graphene.List(OrdenCompraType)
 
     def resolve_orden_compra(self, info, id):
-        return OrdenCompra.objects.get(pk=id)
+        orden_compra = OrdenCompra.objects.get(pk=id)
+        cargadores(info).preparar_ordenes([orden_compra])
+        return orden_compra
 
     def resolve_all_orden_compras(self, info):
-        return OrdenCompra.objects.all()
+        ordenes = list(OrdenCompra.objects.all())
+        cargadores(info).preparar_ordenes(ordenes)
+        return ordenes
 
 # Mutaciones
 class CreateOrdenCompra(Mutation):
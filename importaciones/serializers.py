@@ -516,6 +516,9 @@ class DeclaracionConDocumentosSerializer(serializers.ModelSerializer):
     documentos_count = serializers.SerializerMethodField()
 
     def get_documentos_count(self, obj):
+        # Anotado por consultas.con_documentos; el COUNT por fila queda solo como respaldo
+        if hasattr(obj, 'documentos_count'):
+            return obj.documentos_count
         return obj.documentos.count()
 
     class Meta:
@@ -548,6 +551,9 @@ class ExpedienteDeclaracionListadoSerializer(serializers.ModelSerializer):
         ]
 
     def get_cantidad_documentos(self, obj):
+        # Anotado por consultas.con_cantidad_expedientes; el COUNT por fila queda solo como respaldo
+        if hasattr(obj, 'cantidad_documentos'):
+            return obj.cantidad_documentos
         return ExpedienteDeclaracion.objects.filter(declaracion=obj.declaracion).count()
 
 class DocumentoExpedienteSerializer(serializers.ModelSerializer):
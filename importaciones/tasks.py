@@ -0,0 +1,59 @@
+# importaciones/tasks.py
+import logging
+import os
+
+from django_rq import job
+
+from .espejo_erp import refrescar_espejo, ESPEJO_ERP_ALIASES
+
+logger = logging.getLogger(__name__)
+
+
+@job('default', timeout=3600)
+def refrescar_espejo_erp_task(base_datos=None, completo=False):
+    """
+    Refresca el espejo local de órdenes de importación y proveedores.
+    Sin 'base_datos' recorre todas las bases de ESPEJO_ERP_ALIASES; un error en una
+    base no detiene las demás. Retorna {alias: resultado}.
+    """
+    aliases = [base_datos] if base_datos else ESPEJO_ERP_ALIASES
+    resultados = {}
+    for alias in aliases:
+        try:
+            resultados[alias] = refrescar_espejo(alias, completo=completo)
+        except Exception as e:
+            logger.error(f"Error refrescando el espejo ERP {alias}: {e}", exc_info=True)
+            resultados[alias] = {'error': str(e)}
+    return resultados
+
+
+@job('default', timeout=1800)
+def generar_pdf_unificado_task(declaracion_id):
+    """
+    Precalcula el PDF unificado de una declaración (pdf_unificado.obtener_pdf_unificado)
+    para que la descarga posterior lo sirva directamente desde disco.
+    """
+    from .pdf_unificado import obtener_pdf_unificado
+
+    ruta = obtener_pdf_unificado(declaracion_id)
+    logger.info(f"PDF unificado de la declaración {declaracion_id} listo: {ruta}")
+    return os.path.basename(ruta)
+
+
+@job('default', timeout=1800)
+def extraer_documento_task(extraccion_id, ruta, user_id=None):
+    """
+    Extrae tablas/hojas/texto del archivo guardado en 'ruta' (extraccion.procesar_extraccion)
+    y deja el resultado en ExtraccionDocumento. Retorna el hash del archivo.
+    """
+    from .extraccion import procesar_extraccion
+
+    return procesar_extraccion(extraccion_id, ruta, user_id).hash_archivo
+
+
+@job('default', timeout=600)
+def generar_pdf_despacho_task(despacho_id, data_procesado):
+    """PDF del reporte de flete de un despacho recién registrado (registro_despacho)."""
+    from .registro_despacho import guardar_pdf_despacho
+
+    guardar_pdf_despacho(despacho_id, data_procesado)
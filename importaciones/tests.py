@@ -1,3 +1,380 @@
-from django.test import TestCase
+import os
+import resource
+import shutil
+import tempfile
+import zipfile
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.test import TestCase, override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+
+class DescargarZipStreamingTestCase(TestCase):
+    """
+    DescargarZipView arma el ZIP por partes: la respuesta es un stream y la memoria
+    del proceso no crece con el tamaño total de los documentos.
+    """
+    TAMANIO_ARCHIVO = 32 * 1024 * 1024
+    CANTIDAD_ARCHIVOS = 4
+
+    def setUp(self):
+        from importaciones.models import Declaracion, Documento
+
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        self.settings_media = override_settings(MEDIA_ROOT=self.media)
+        self.settings_media.enable()
+        self.addCleanup(self.settings_media.disable)
+
+        self.user = User.objects.create_superuser(username='zipadmin', password='testpass123')
+        self.declaracion = Declaracion.objects.create(numero='118-2024-10-000123', anio=2024)
+        content_type = ContentType.objects.get_for_model(Declaracion)
+
+        carpeta = os.path.join(self.media, 'documentos', 'docs_duas', '118-2024-10-000123-2024')
+        os.makedirs(carpeta)
+        bloque = os.urandom(1024 * 1024)
+        for i in range(self.CANTIDAD_ARCHIVOS):
+            extension = 'pdf' if i % 2 == 0 else 'txt'
+            nombre = f'doc_{i}.{extension}'
+            with open(os.path.join(carpeta, nombre), 'wb') as f:
+                for _ in range(self.TAMANIO_ARCHIVO // len(bloque)):
+                    f.write(bloque)
+            Documento.objects.create(
+                content_type=content_type, object_id=self.declaracion.id,
+                archivo=f'documentos/docs_duas/118-2024-10-000123-2024/{nombre}',
+                nombre_original=nombre, hash_archivo=f'hash-{i}'
+            )
+
+    def _descargar(self):
+        from importaciones.views import DescargarZipView
+
+        request = APIRequestFactory().get('/descargar_zip/')
+        force_authenticate(request, user=self.user)
+        return DescargarZipView.as_view()(request, numero='118-2024-10-000123', anio=2024)
+
+    def test_zip_is_streamed_with_bounded_memory(self):
+        rss_inicial = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # KB en Linux
+        response = self._descargar()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertIn('118-2024-10-000123-2024.zip', response['Content-Disposition'])
+
+        # Se consume el stream a disco, como lo haría el servidor hacia el socket
+        destino = tempfile.TemporaryFile()
+        self.addCleanup(destino.close)
+        for parte in response.streaming_content:
+            destino.write(parte)
+        rss_pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        total = self.TAMANIO_ARCHIVO * self.CANTIDAD_ARCHIVOS
+        self.assertLess((rss_pico - rss_inicial) * 1024, total // 4)
+
+        destino.seek(0)
+        with zipfile.ZipFile(destino) as zip_file:
+            infos = {info.filename: info for info in zip_file.infolist()}
+            self.assertEqual(sorted(infos), [f'doc_{i}.{"pdf" if i % 2 == 0 else "txt"}'
+                                             for i in range(self.CANTIDAD_ARCHIVOS)])
+            self.assertEqual(infos['doc_0.pdf'].compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(infos['doc_1.txt'].compress_type, zipfile.ZIP_DEFLATED)
+            self.assertEqual(infos['doc_0.pdf'].file_size, self.TAMANIO_ARCHIVO)
+            self.assertIsNone(zip_file.testzip())
+
+    def test_missing_declaration_returns_404(self):
+        from importaciones.views import DescargarZipView
+
+        request = APIRequestFactory().get('/descargar_zip/')
+        force_authenticate(request, user=self.user)
+        response = DescargarZipView.as_view()(request, numero='no-existe', anio=2024)
+        self.assertEqual(response.status_code, 404)
+
+
+class ListadosConConteosTestCase(TestCase):
+    """
+    Los listados de declaraciones y expedientes calculan sus conteos en la consulta
+    (consultas.py): la cantidad de consultas no depende de la cantidad de filas.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(username='listados', password='testpass123')
+        # ContentType queda en cache (la usa el prefetch de la relación genérica)
+        from importaciones.models import Declaracion
+        ContentType.objects.get_for_model(Declaracion)
+
+    def _crear_declaraciones(self, cantidad, desde=0):
+        from importaciones.models import Declaracion, Documento, ExpedienteDeclaracion, TipoDocumento
+
+        tipo, _ = TipoDocumento.objects.get_or_create(nombre='Factura')
+        for i in range(desde, desde + cantidad):
+            declaracion = Declaracion.objects.create(numero=f'118-2024-10-{i:06d}', anio=2024)
+            for j in range(i % 3 + 1):
+                documento = Documento.objects.create(
+                    content_object=declaracion, archivo=f'documentos/d{i}_{j}.pdf',
+                    nombre_original=f'd{i}_{j}.pdf', hash_archivo=f'h{i}-{j}', usuario=self.user
+                )
+                ExpedienteDeclaracion.objects.create(
+                    declaracion=declaracion, documento=documento, usuario=self.user,
+                    tipo=tipo if j else None, anio_fiscal=2024, mes_fiscal=10
+                )
+
+    def _get(self, vista, **kwargs):
+        request = APIRequestFactory().get('/listado/')
+        force_authenticate(request, user=self.user)
+        response = vista.as_view()(request, **kwargs)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def _consultas_constantes(self, vista, consultas, **kwargs):
+        self._crear_declaraciones(2)
+        with self.assertNumQueries(consultas):
+            pocas = self._get(vista, **kwargs)
+        self._crear_declaraciones(10, desde=2)
+        with self.assertNumQueries(consultas):
+            muchas = self._get(vista, **kwargs)
+        return pocas, muchas
+
+    def test_listar_declaraciones(self):
+        from importaciones.views import ListarDeclaracionesView
+
+        _, data = self._consultas_constantes(ListarDeclaracionesView, 2)
+        self.assertEqual(len(data), 12)
+        for fila in data:
+            self.assertEqual(fila['documentos_count'], len(fila['documentos']))
+            self.assertEqual(fila['documentos_count'], int(fila['numero'][-6:]) % 3 + 1)
+
+    def test_listar_declaraciones_del_usuario(self):
+        from importaciones.views import ListarDeclaracionesDelUsuarioView
+
+        _, data = self._consultas_constantes(ListarDeclaracionesDelUsuarioView, 2)
+        # El JOIN del filtro por usuario no infla el conteo
+        self.assertEqual(len(data), 12)
+        self.assertEqual(sorted(f['documentos_count'] for f in data), sorted(i % 3 + 1 for i in range(12)))
+
+    def test_listar_expedientes_declaracion(self):
+        from importaciones.views import ListarExpedientesDeclaracionView
+
+        _, data = self._consultas_constantes(ListarExpedientesDeclaracionView, 1)
+        self.assertEqual(len(data), sum(i % 3 + 1 for i in range(12)))
+        for fila in data:
+            self.assertEqual(fila['cantidad_documentos'], int(fila['numero_declaracion'][-6:]) % 3 + 1)
+
+    def test_listar_documentos_por_tipo(self):
+        from importaciones.models import Declaracion, Documento, ExpedienteDeclaracion
+        from importaciones.views import ListarDocumentosPorTipoView
+
+        self._crear_declaraciones(1)
+        declaracion = Declaracion.objects.get()
+        with self.assertNumQueries(1):
+            pocas = self._get(ListarDocumentosPorTipoView, declaracion_id=declaracion.id)
+        for j in range(20):
+            documento = Documento.objects.create(
+                content_object=declaracion, archivo=f'documentos/extra{j}.pdf',
+                nombre_original=f'extra{j}.pdf', hash_archivo=f'extra-{j}', usuario=self.user
+            )
+            ExpedienteDeclaracion.objects.create(declaracion=declaracion, documento=documento,
+                                                 usuario=self.user)
+        with self.assertNumQueries(1):
+            muchas = self._get(ListarDocumentosPorTipoView, declaracion_id=declaracion.id)
+        self.assertEqual(list(pocas), ['Sin clasificar'])
+        self.assertEqual(len(muchas['Sin clasificar']), 21)
+        self.assertEqual(muchas['Sin clasificar'][0]['usuario'], ' ')
+
+
+class GraphQLOrdenCompraTestCase(TestCase):
+    """
+    El schema GraphQL resuelve empresa, producto y despachos (con su proveedor y
+    transportista) por lotes: las consultas no crecen con la cantidad de nodos.
+    """
+    CONSULTA_ANIDADA = '''
+        query {
+          allOrdenCompras {
+            numeroOc
+            empresa { nombreEmpresa }
+            producto { nombreProducto }
+            despachos {
+              dua
+              proveedor { nombreProveedor }
+              transportista { nombreTransportista }
+            }
+          }
+        }
+    '''
+
+    def _crear_ordenes(self, cantidad, desde=0):
+        from importaciones.models import (Empresa, Producto, OrdenCompra, Despacho, OrdenCompraDespacho,
+                                          ProveedorTransporte, Transportista)
+
+        for i in range(desde, desde + cantidad):
+            empresa = Empresa.objects.create(nombre_empresa=f'bd_{i}')
+            producto = Producto.objects.create(nombre_producto=f'Producto {i}', codigo_producto=f'P{i}',
+                                               proveedor_marca='Marca')
+            orden = OrdenCompra.objects.create(empresa=empresa, numero_oc=f'OC-{i}', producto=producto,
+                                               precio_producto='1.500', cantidad=10)
+            for j in range(2):
+                despacho = Despacho.objects.create(
+                    proveedor=ProveedorTransporte.objects.create(nombre_proveedor=f'Prov {i}-{j}'),
+                    transportista=Transportista.objects.create(nombre_transportista=f'Trans {i}-{j}'),
+                    dua=f'DUA-{i}-{j}', fecha_numeracion='2024-01-15T10:00:00Z', num_factura='F1',
+                    flete_pactado='45.00', peso_neto_crt='1000.00'
+                )
+                OrdenCompraDespacho.objects.create(despacho=despacho, orden_compra=orden,
+                                                   cantidad_asignada=5, numero_recojo=j + 1)
+
+    def _ejecutar(self, consulta):
+        from importaciones.schema import schema
+
+        resultado = schema.execute(consulta, context_value=APIRequestFactory().post('/graphql/'))
+        self.assertIsNone(resultado.errors)
+        return resultado.data
+
+    def test_nested_selection_uses_constant_queries(self):
+        # OC + empresas + productos + despachos + proveedores + transportistas
+        self._crear_ordenes(2)
+        with self.assertNumQueries(6):
+            pocas = self._ejecutar(self.CONSULTA_ANIDADA)
+        self._crear_ordenes(15, desde=2)
+        with self.assertNumQueries(6):
+            muchas = self._ejecutar(self.CONSULTA_ANIDADA)
+
+        self.assertEqual(len(pocas['allOrdenCompras']), 2)
+        self.assertEqual(len(muchas['allOrdenCompras']), 17)
+        orden = next(o for o in muchas['allOrdenCompras'] if o['numeroOc'] == 'OC-7')
+        self.assertEqual(orden['empresa'], {'nombreEmpresa': 'bd_7'})
+        self.assertEqual(orden['producto'], {'nombreProducto': 'Producto 7'})
+        self.assertEqual([d['dua'] for d in orden['despachos']], ['DUA-7-0', 'DUA-7-1'])
+        self.assertEqual(orden['despachos'][1]['proveedor'], {'nombreProveedor': 'Prov 7-1'})
+        self.assertEqual(orden['despachos'][0]['transportista'], {'nombreTransportista': 'Trans 7-0'})
+
+    def test_endpoint_requires_authentication(self):
+        from django.urls import resolve
+
+        self._crear_ordenes(1)
+        vista = resolve('/graphql/', urlconf='importaciones.urls').func
+        consulta = {'query': '{ allOrdenCompras { numeroOc empresa { ruc } } }'}
+
+        anonimo = vista(APIRequestFactory().post('/graphql/', consulta, format='json'))
+        self.assertIn(anonimo.status_code, (401, 403))
+        self.assertNotIn(b'OC-0', anonimo.render().content)
+
+        request = APIRequestFactory().post('/graphql/', consulta, format='json')
+        force_authenticate(request, User.objects.create_user(username='graphql', password='x'))
+        respuesta = vista(request)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertIn(b'"numeroOc":"OC-0"', respuesta.content.replace(b' ', b''))
+
+    def test_only_selected_relations_are_loaded(self):
+        self._crear_ordenes(5)
+        with self.assertNumQueries(2):
+            data = self._ejecutar('{ allOrdenCompras { numeroOc empresa { ruc } } }')
+        self.assertEqual(len(data['allOrdenCompras']), 5)
+
+    def test_depth_and_complexity_limits(self):
+        from graphql import parse, validate, specified_rules
+        from importaciones.graphql_limites import depth_limit_validator, complejidad_limit_validator
+        from importaciones.schema import schema
+
+        def errores(consulta, reglas):
+            return validate(schema.graphql_schema, parse(consulta), list(specified_rules) + reglas)
+
+        self.assertEqual(errores(self.CONSULTA_ANIDADA, [depth_limit_validator(max_depth=3),
+                                                         complejidad_limit_validator(1000)]), [])
+        profundidad = errores(self.CONSULTA_ANIDADA, [depth_limit_validator(max_depth=2)])
+        self.assertTrue(profundidad)
+        self.assertTrue(all('maximum operation depth of 2' in e.message for e in profundidad))
+
+        # allOrdenCompras(lista) > despachos(lista): 1 + 10 * (1 + 1 + 10 * (1 + 2 + 2)) = 521
+        complejidad = errores('''
+            { allOrdenCompras { numeroOc despachos { dua proveedor { id } transportista { id } } } }
+        ''', [complejidad_limit_validator(500)])
+        self.assertEqual(len(complejidad), 1)
+        self.assertIn('(521)', complejidad[0].message)
+
+        with self.assertNumQueries(0):
+            from importaciones.graphql_limites import REGLAS_VALIDACION
+            self.assertEqual(errores('{ __schema { types { name fields { name type { name ofType { name } } } } } }',
+                                     REGLAS_VALIDACION), [])
+
+
+class RegistroDespachoTestCase(TestCase):
+    """
+    registrar_despacho_en_bloque valida los recojos antes de escribir, revierte todo
+    ante un error y genera el PDF recién después del commit.
+    """
+
+    def _despacho(self, lineas=3, ordenes=2, gastos=1):
+        from importaciones.management.commands.benchmark_registro_despacho import despacho_sintetico
+        return despacho_sintetico(lineas, ordenes, gastos)
+
+    def _registrar(self, data, data_procesado=None):
+        from importaciones.registro_despacho import registrar_despacho_en_bloque
+        return registrar_despacho_en_bloque(data, data_procesado or {})
+
+    def _conteos(self):
+        from importaciones.models import Despacho, DetalleDespacho, OrdenCompra, OrdenCompraDespacho, Producto
+        return [modelo.objects.count()
+                for modelo in (Despacho, DetalleDespacho, OrdenCompra, OrdenCompraDespacho, Producto)]
+
+    def test_duplicate_recojo_is_rejected_before_writing(self):
+        from importaciones.registro_despacho import RecojoDuplicadoError
+
+        data = self._despacho()
+        with self.captureOnCommitCallbacks():
+            self._registrar(data)
+        antes = self._conteos()
+
+        with self.assertRaises(RecojoDuplicadoError):
+            self._registrar(data)
+        self.assertEqual(self._conteos(), antes)
+
+        # También se repite dentro del mismo despacho
+        repetido = self._despacho(ordenes=1)
+        repetido['dataForm']['ordenRecojo'].append(repetido['dataForm']['ordenRecojo'][0])
+        with self.assertRaises(RecojoDuplicadoError):
+            self._registrar(repetido)
+        self.assertEqual(self._conteos(), antes)
+
+    def test_error_rolls_back_products_and_orders(self):
+        from django.db import IntegrityError
+
+        data = self._despacho(ordenes=1)
+        with self.captureOnCommitCallbacks():
+            self._registrar(data)
+        antes = self._conteos()
+
+        # Misma OC con un producto nuevo: el producto se crea y el UNIQUE de la OC falla
+        otro = self._despacho(ordenes=2)
+        otro['dataForm']['ordenRecojo'][1]['oc']['numero_oc'] = data['dataForm']['ordenRecojo'][0]['oc']['numero_oc']
+        otro['dataForm']['ordenRecojo'][1]['oc']['codigo_producto'] = 'OTRO'
+        with self.captureOnCommitCallbacks() as callbacks, self.assertRaises(IntegrityError):
+            self._registrar(otro)
+        self.assertEqual(self._conteos(), antes)
+        self.assertEqual(callbacks, [])
+
+    def test_existing_product_is_reused_ignoring_case_and_spaces(self):
+        from importaciones.models import Producto
+
+        Producto.objects.create(codigo_producto='BENCH-0', nombre_producto='Producto Bench 0',
+                                proveedor_marca='Marca Bench')
+        data = self._despacho(ordenes=1)
+        data['dataForm']['ordenRecojo'][0]['oc']['codigo_producto'] = ' bench-0 '
+        with self.captureOnCommitCallbacks():
+            despacho = self._registrar(data)
+
+        self.assertEqual(Producto.objects.count(), 1)
+        orden = despacho.ordenes_despacho.get().orden_compra
+        self.assertEqual(orden.producto.nombre_producto, 'Producto Bench 0')
+
+    def test_pdf_is_generated_after_commit(self):
+        from unittest import mock
+
+        data_procesado = {'reporte': 'datos'}
+        with mock.patch('importaciones.views.generar_reporte_pdf', return_value=b'%PDF-1.4') as generar:
+            with self.captureOnCommitCallbacks() as callbacks:
+                despacho = self._registrar(self._despacho(), data_procesado)
+                generar.assert_not_called()
+            self.assertEqual(len(callbacks), 1)
+            callbacks[0]()
+
+        generar.assert_called_once_with(data_procesado)
+        despacho.refresh_from_db()
+        self.assertEqual(bytes(despacho.archivo_pdf), b'%PDF-1.4')
@@ -4,8 +4,9 @@ from rest_framework.routers import DefaultRouter
 from .views import *
 from .views import CargaDirectaView, ProcesarArchivoComprimidoView, AsignarDeclaracionDesdeComprimidoView
 from .views import ProcesarArchivoView,GuardarArchivoView
-from graphene_django.views import GraphQLView
+from .graphql_vista import GraphQLViewAutenticada
 from .schema import schema
+from .graphql_limites import REGLAS_VALIDACION
 
 
 router = DefaultRouter()
@@ -14,7 +15,7 @@ router.register(r'ordenes-despacho-prueba', OrdenCompraDespachoViewSet, basename
 
 urlpatterns = [
     path('', include(router.urls)),
-    path('graphql/', GraphQLView.as_view(graphiql=True, schema=schema)),
+    path('graphql/', GraphQLViewAutenticada.as_view(graphiql=True, schema=schema, validation_rules=REGLAS_VALIDACION)),
     path('lista/', listar_importaciones, name='listar_importaciones'),
     path('buscar_oi/', buscar_orden_importacion, name='buscar_orden_importacion'),
     path('buscar_prov/', buscar_proveedor, name='buscar_proveedor'),
@@ -60,6 +61,7 @@ urlpatterns = [
 
     path('descargar_pdf/<int:despacho_id>/', descargar_pdf, name='descargar_pdf'),
     path('upload/', upload_file, name='upload_file'),
+    path('extraccion/<str:hash_archivo>/', estado_extraccion, name='estado_extraccion'),
     path('upload-file-excel/', upload_file_excel, name='upload_file_excel'),
     path('generar-reporte-estiba/',listar_estiba,name='generar_reporte_estiba'),
     path('procesar_archivo/', ProcesarArchivoView.as_view(), name='procesar_archivo'),
@@ -0,0 +1,84 @@
+# importaciones/utilities/extractores.py
+"""
+Extractores de datos de documentos (PDF, Excel, imágenes).
+
+Sin dependencias de Django: las funciones por página se ejecutan en procesos
+hijos de un ProcessPoolExecutor (ver importaciones/extraccion.py).
+"""
+import pandas as pd
+import pdfplumber
+import pytesseract
+from PIL import Image
+
+# Encabezado de la tabla de certificados cuando el PDF no trae tablas reconocibles
+ENCABEZADO_TABLA_TEXTO = ["No.", "NRO CE", "FECHA", "PLACA", "TRANSPORTISTA", "BULTOS", "PESO BRUTO",
+                          "PESO NETO", "Nros. Precintos SENASAG"]
+
+
+def contar_paginas(ruta):
+    with pdfplumber.open(ruta) as pdf:
+        return len(pdf.pages)
+
+
+def tablas_de_paginas(ruta, indices):
+    """[(índice, tabla o None)] de las páginas indicadas (abre el PDF una sola vez)."""
+    with pdfplumber.open(ruta) as pdf:
+        return [(i, pdf.pages[i].extract_table()) for i in indices]
+
+
+def textos_de_paginas(ruta, indices):
+    """[(índice, texto)] de las páginas indicadas."""
+    with pdfplumber.open(ruta) as pdf:
+        return [(i, pdf.pages[i].extract_text() or "") for i in indices]
+
+
+def tabla_desde_texto(text):
+    """
+    Cuando el PDF no tiene tablas: arma la tabla de certificados desde el texto
+    (filas entre la línea que empieza con "No." y la de "TOTALES").
+    """
+    header = ENCABEZADO_TABLA_TEXTO
+    data = []
+    header_found = False
+
+    for line in text.splitlines():
+        # Detectar si la línea es parte de la tabla (empieza con el encabezado)
+        if line.startswith("No.") and not header_found:
+            header_found = True
+        elif header_found:
+            # Si encontramos la línea "TOTALES", detenemos la extracción sin agregar la línea
+            if "TOTALES" in line:
+                break
+            columns = line.split()
+
+            # Asegurarnos de tener al menos las columnas esperadas antes de procesar
+            if len(columns) >= len(header):
+                no, nro_ce, fecha, placa = columns[0], columns[1], columns[2], columns[3]
+
+                # Las últimas 4 columnas son siempre los mismos datos
+                bultos, peso_bruto, peso_neto, nro_precintos = columns[-4:]
+
+                # Todo lo que queda en el medio se considera como el nombre del transportista
+                transportista = " ".join(columns[4:-4])
+
+                data.append([no, nro_ce, fecha, placa, transportista, bultos, peso_bruto, peso_neto,
+                             nro_precintos])
+
+    return pd.DataFrame(data, columns=header).to_dict(orient='records')
+
+
+def extraer_excel(ruta):
+    """Todas las hojas como {hoja: [filas]}; las celdas vacías quedan en None (JSON válido)."""
+    try:
+        hojas = pd.read_excel(ruta, sheet_name=None)
+        return {
+            nombre: hoja.astype(object).where(pd.notna(hoja), None).to_dict(orient='records')
+            for nombre, hoja in hojas.items()
+        }
+    except Exception as e:
+        return {"error": str(e)}
+
+
+def extraer_texto_imagen(ruta):
+    with Image.open(ruta) as img:
+        return pytesseract.image_to_string(img)
@@ -1,4 +1,5 @@
 import hashlib
+import zipfile
 from datetime import datetime
 from jinja2 import Environment, FileSystemLoader
 from xhtml2pdf import pisa
@@ -645,4 +646,66 @@ def calcular_hash_archivo(file_obj):
     sha256 = hashlib.sha256()
     for chunk in file_obj.chunks():
         sha256.update(chunk)
-    return sha256.hexdigest()
\ No newline at end of file
+    return sha256.hexdigest()
+
+
+# --- ZIP EN STREAMING ---
+
+# Formatos ya comprimidos: deflate no reduce su tamaño y solo gasta CPU
+EXTENSIONES_SIN_COMPRESION = {'.pdf', '.zip', '.rar', '.7z', '.gz', '.jpg', '.jpeg', '.png',
+                              '.docx', '.xlsx', '.pptx'}
+ZIP_TAMANIO_BLOQUE = 1024 * 1024
+
+
+class _SalidaZip:
+    """Destino no 'seekable' para ZipFile: acumula lo escrito hasta que el generador lo entrega."""
+
+    def __init__(self):
+        self._partes = []
+        self._posicion = 0
+
+    def write(self, datos):
+        self._partes.append(bytes(datos))
+        self._posicion += len(datos)
+        return len(datos)
+
+    def tell(self):
+        return self._posicion
+
+    def flush(self):
+        pass
+
+    def vaciar(self):
+        datos = b''.join(self._partes)
+        self._partes = []
+        return datos
+
+
+def generar_zip_streaming(archivos, tamanio_bloque=ZIP_TAMANIO_BLOQUE):
+    """
+    Genera un ZIP por partes a partir de (nombre_en_zip, archivo_abierto_en_binario).
+    Cada archivo se lee de a 'tamanio_bloque' y se cierra al terminar, así la memoria
+    no depende del tamaño del ZIP. Los PDF/imágenes van con ZIP_STORED.
+    """
+    salida = _SalidaZip()
+    with zipfile.ZipFile(salida, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for nombre, archivo in archivos:
+            extension = os.path.splitext(nombre)[1].lower()
+            compresion = zipfile.ZIP_STORED if extension in EXTENSIONES_SIN_COMPRESION else zipfile.ZIP_DEFLATED
+            info = zipfile.ZipInfo(nombre, date_time=datetime.now().timetuple()[:6])
+            info.compress_type = compresion
+            info.external_attr = 0o600 << 16
+            with archivo, zip_file.open(info, 'w', force_zip64=True) as destino:
+                while True:
+                    bloque = archivo.read(tamanio_bloque)
+                    if not bloque:
+                        break
+                    destino.write(bloque)
+                    datos = salida.vaciar()
+                    if datos:
+                        yield datos
+            datos = salida.vaciar()
+            if datos:
+                yield datos
+    # Directorio central
+    yield salida.vaciar()
@@ -1,4 +1,3 @@
-import hashlib
 import math
 import io
 import requests
@@ -18,30 +17,33 @@ from django.utils.timezone import make_aware
 from pypdf import PdfReader, PdfWriter
 from reportlab.lib.styles import getSampleStyleSheet
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from reportlab.lib.units import cm
 from rest_framework import generics, status, permissions, viewsets
 from rest_framework.permissions import IsAuthenticated, AllowAny
 
 from .models import (OrdenCompraStarsoft, GastosExtra, Proveedor, OrdenCompraDespacho, Empresa, OrdenCompra, Producto,
                      ProveedorTransporte, Transportista,
                      Despacho, DetalleDespacho, ConfiguracionDespacho, Declaracion, Documento, ExpedienteDeclaracion,
-                     TipoDocumento)
+                     TipoDocumento, ExtraccionDocumento)
 from .forms import BaseDatosForm
+from .pdf_unificado import obtener_pdf_unificado
+from .ingesta_comprimidos import ingerir_comprimido
+from .extraccion import solicitar_extraccion, tipo_de_archivo, TIPOS_SOPORTADOS
+from .registro_despacho import registrar_despacho_en_bloque, RecojoDuplicadoError
+from .consultas import con_documentos, con_cantidad_expedientes, expedientes_con_documento
+from .espejo_erp import (estado_espejo, buscar_ordenes as buscar_ordenes_espejo,
+                         buscar_proveedores as buscar_proveedores_espejo)
 from django.shortcuts import render
 from django.views.decorators.csrf import csrf_exempt
-from django.http import JsonResponse, HttpResponse, Http404, FileResponse
+from django.http import JsonResponse, HttpResponse, Http404, FileResponse, StreamingHttpResponse
 from rest_framework.decorators import api_view, permission_classes, action
 import pandas as pd
-import pytesseract
-from PIL import Image
-import pdfplumber
 import json
 from django.shortcuts import get_object_or_404
 from .serializers import *
 from .utils import renderizar_template, convertir_html_a_pdf, procesar_data_reporte, procesar_data_bd_reporte, \
     calcular_monto_descuento_estiba, calcular_peso_no_considerado_por_sacos_faltante, \
     calcular_diferencia_de_peso_por_cobrar_kg, calcular_costo_por_kg, calcular_descuento_sacos, \
-    calcular_descuento_solo_sacos, calcular_monto_luego_dsctos_sacos,calcular_hash_archivo
+    calcular_descuento_solo_sacos, calcular_monto_luego_dsctos_sacos,calcular_hash_archivo, generar_zip_streaming
 import os
 from reportlab.lib.pagesizes import landscape, A4, letter
 from reportlab.lib import colors
@@ -69,97 +71,6 @@ def get_db_connection(base_datos):
     connection = connections[base_datos]  # Usa la base de datos dinámica
     return connection
 
-def extract_pdf_tables(file):
-    with pdfplumber.open(file) as pdf:
-        tables = []
-
-        # Intentar extraer tablas de cada página del PDF
-        for i, page in enumerate(pdf.pages):
-            table = page.extract_table()
-
-            if table:
-                print(f"Tabla extraída en página {i + 1}:")
-                headers = table[0]  # La primera fila contiene los encabezados
-                table_data = [headers]  # Agregar los encabezados como la primera fila
-
-                for row in table[1:]:
-                    table_data.append(row)  # Agregar las filas de datos
-
-                tables.append(table_data)
-            else:
-                print(f"No se encontró una tabla en la página {i + 1}")
-
-        # Si no se extrajeron tablas, intentamos extraer texto y convertirlo
-        if not tables:
-            print("No se encontraron tablas, pero aquí está el texto extraído:")
-            text = ""
-            for page in pdf.pages:
-                text += page.extract_text()  # Extraer todo el texto del PDF
-
-            #print(text)
-            lines = text.splitlines()  # Dividir el texto en líneas
-
-            data = []
-            header_found = False
-
-            # Encabezado ajustado según la estructura del texto
-            header = ["No.","NRO CE", "FECHA", "PLACA", "TRANSPORTISTA", "BULTOS", "PESO BRUTO", "PESO NETO",
-                      "Nros. Precintos SENASAG"]
-
-            for line in lines:
-                # Detectar si la línea es parte de la tabla (empieza con el encabezado)
-                if line.startswith("No.") and not header_found:
-                    header_found = True  # Marca que el encabezado ha sido encontrado
-                elif header_found:
-                    # Si encontramos la línea "TOTALES", detenemos la extracción sin agregar la línea
-                    if "TOTALES" in line:
-                        break
-                    else:
-                        # Separar las columnas por espacios
-                        columns = line.split()
-
-                        # Asegurarnos de tener al menos las 8 columnas esperadas antes de procesar
-                        if len(columns) >= len(header):
-                            # Organizar las columnas fijas
-                            no = columns[0]  # No.
-                            nro_ce = columns[1]  # NRO CE
-                            fecha = columns[2]  # FECHA
-                            placa = columns[3]  # PLACA
-
-                            # Las últimas 4 columnas son siempre los mismos datos
-                            bultos = columns[-4]
-                            peso_bruto = columns[-3]
-                            peso_neto = columns[-2]
-                            nro_precintos = columns[-1]
-
-                            # Todo lo que queda en el medio se considera como el nombre del transportista
-                            transportista = " ".join(columns[4:-4])
-
-                            # Crear la fila de datos organizada
-                            row = [no, nro_ce, fecha, placa, transportista, bultos, peso_bruto, peso_neto,
-                                   nro_precintos]
-                            data.append(row)
-            #print("encontro encabezado?", header_found)
-            # Crear un DataFrame con los datos extraídos
-            df_text_table = pd.DataFrame(data, columns=header)
-            # Convertir el DataFrame a una lista de diccionarios
-            return df_text_table.to_dict(orient='records')
-
-def extract_excel_data(file):
-    try:
-        df = pd.read_excel(file, sheet_name=None)
-        data = {}
-        for sheet_name, sheet_data in df.items():
-            data[sheet_name] = sheet_data.to_dict(orient='records')  # Convertir a lista de diccionarios
-        return data
-    except Exception as e:
-        return {"error": str(e)}
-
-def extract_image_text(file):
-    img = Image.open(file)
-    text = pytesseract.image_to_string(img)
-    return text
-
 @api_view(['POST'])
 def upload_file_excel(request):
     try:
@@ -218,30 +129,48 @@ def upload_file_excel(request):
 
 @api_view(['POST'])
 def upload_file(request):
+    """
+    Encola la extracción del archivo (importaciones.extraccion) y responde de inmediato
+    con el job_id. Si el mismo archivo ya se extrajo, retorna el resultado guardado.
+    """
     if 'file' in request.FILES:
         file = request.FILES['file']
-        file_type = file.name.split('.')[-1].lower()
+        if tipo_de_archivo(file.name) not in TIPOS_SOPORTADOS:
+            return JsonResponse({'status': 'success', 'data': {'message': 'Formato de archivo no soportado'}},
+                                status=200)
 
         try:
-            if file_type == 'pdf':
-                tables = extract_pdf_tables(file)
-                response_data = {"tables": tables}
-            elif file_type in ['xls', 'xlsx']:
-                data = extract_excel_data(file)
-                response_data = {"data": data}
-            elif file_type in ['jpg', 'jpeg', 'png']:
-                text = extract_image_text(file)
-                response_data = {"text": text}
-            else:
-                response_data = {'message': 'Formato de archivo no soportado'}
-
-            return JsonResponse({'status': 'success', 'data': response_data}, status=200)
-
+            extraccion = solicitar_extraccion(file, user_id=request.user.id)
         except Exception as e:
             return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
 
+        if extraccion.estado == ExtraccionDocumento.ESTADO_LISTO:
+            return JsonResponse({'status': 'success', 'hash': extraccion.hash_archivo,
+                                 'data': extraccion.resultado}, status=200)
+        return JsonResponse({'status': 'queued', 'job_id': extraccion.job_id, 'hash': extraccion.hash_archivo,
+                             'message': 'Extracción en proceso.'}, status=202)
+
     return JsonResponse({"error": "No se proporcionó archivo."}, status=400)
 
+
+@api_view(['GET'])
+def estado_extraccion(request, hash_archivo):
+    """Estado/resultado de una extracción encolada por upload_file."""
+    extraccion = get_object_or_404(ExtraccionDocumento, hash_archivo=hash_archivo)
+    if extraccion.estado == ExtraccionDocumento.ESTADO_LISTO:
+        return JsonResponse({'status': 'success', 'hash': extraccion.hash_archivo,
+                             'data': extraccion.resultado}, status=200)
+    if extraccion.estado == ExtraccionDocumento.ESTADO_ERROR:
+        return JsonResponse({'status': 'error', 'hash': extraccion.hash_archivo,
+                             'message': extraccion.error}, status=200)
+    return JsonResponse({
+        'status': 'running' if extraccion.estado == ExtraccionDocumento.ESTADO_PROCESANDO else 'queued',
+        'job_id': extraccion.job_id,
+        'hash': extraccion.hash_archivo,
+        'paginas_total': extraccion.paginas_total,
+        'paginas_procesadas': extraccion.paginas_procesadas,
+    }, status=200)
+
 leyenda_codigos = {
     1: "Transbordo",
     2: "Pago estiba",
@@ -260,6 +189,43 @@ def listar_importaciones(request):
 
     return render(request, 'importaciones/lista_importaciones.html', {'form': form, 'registros': registros})
 
+def _orden_a_dict(numero, producto, codigo, cantidad, unidad, precio_unitario, precio_total,
+                  proveedor, codprovee):
+    return {
+        'numero_oc': numero,
+        'producto': producto,
+        'codigo_producto': codigo,
+        'cantidad': cantidad,
+        'unidad_medida': unidad,
+        'precio_unitario': precio_unitario,
+        'precio_total': precio_total,
+        'proveedor': proveedor,
+        'codprovee': codprovee,
+    }
+
+
+def _buscar_orden_en_erp(base_datos, query):
+    """Consulta directa al ERP (solo mientras el espejo de la base no tiene su primera carga)."""
+    connection = get_db_connection(base_datos)
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT TOP 5 
+                i.CNUMERO,
+                i.CDESARTIC,
+                i.CCODARTIC,
+                i.NCANTIDAD,
+                i.CUNIDAD,
+                i.NPREUNITA,
+                i.NTOTVENT,
+                o.CDESPROVE,
+                o.CCODPROVE
+            FROM IMPORD i
+            INNER JOIN IMPORC o ON i.CNUMERO = o.CNUMERO
+            WHERE i.CNUMERO LIKE %s
+        """, [f'%{query}%'])
+        return [_orden_a_dict(*row) for row in cursor.fetchall()]
+
+
 @csrf_exempt
 def buscar_orden_importacion(request):
     base_datos = request.GET.get('base_datos', 'default')  # Obtén el parámetro base_datos desde la URL
@@ -268,45 +234,15 @@ def buscar_orden_importacion(request):
     # Verifica que los parámetros sean válidos
     if base_datos and query:
         try:
-            # Obtener la conexión a la base de datos
-            connection = get_db_connection(base_datos)
-
-            # Realizar la consulta a la base de datos
-            with connection.cursor() as cursor:
-                cursor.execute(f"""
-                    SELECT TOP 5 
-                        i.CNUMERO,
-                        i.CDESARTIC,
-                        i.CCODARTIC,
-                        i.NCANTIDAD,
-                        i.CUNIDAD,
-                        i.NPREUNITA,
-                        i.NTOTVENT,
-                        o.CDESPROVE,
-                        o.CCODPROVE
-                    FROM IMPORD i
-                    INNER JOIN IMPORC o ON i.CNUMERO = o.CNUMERO
-                    WHERE i.CNUMERO LIKE %s
-                """, [f'%{query}%'])
-                resultados = cursor.fetchall()
-
-            # Serializar los resultados
-            resultado_serializado = []
-
-            for row in resultados:
-
-                orden = {
-                    'numero_oc': row[0],  # Asegúrate de que el índice coincida con el esquema de tu tabla
-                    'producto': row[1],  # Este es solo un ejemplo, ajusta según las columnas
-                    'codigo_producto': row[2],
-                    'cantidad': row[3],
-                    'unidad_medida': row[4],
-                    'precio_unitario': row[5],
-                    'precio_total': row[6],
-                    'proveedor': row[7],  # Ajusta según la columna correcta
-                    'codprovee': row[8],  # Ajusta según la columna correcta
-                }
-                resultado_serializado.append(orden)
+            # Espejo local (importaciones/espejo_erp.py); el ERP solo si aún no se cargó
+            if estado_espejo(base_datos):
+                resultado_serializado = [
+                    _orden_a_dict(o.cnumero, o.cdesartic, o.ccodartic, o.ncantidad, o.cunidad,
+                                  o.npreunita, o.ntotvent, o.cdesprove, o.ccodprove)
+                    for o in buscar_ordenes_espejo(base_datos, query)
+                ]
+            else:
+                resultado_serializado = _buscar_orden_en_erp(base_datos, query)
 
             # Retornar los resultados en formato JSON
             return JsonResponse(resultado_serializado, safe=False, status=200)
@@ -330,22 +266,15 @@ def buscar_proveedor(request):
 
         # Valida que se haya proporcionado la base de datos y el término de búsqueda
         if base_datos and termino_busqueda:
-            # Filtra las órdenes que coincidan con el término de búsqueda
-            registros = Proveedor.objects.using(base_datos).filter(
-                PRVCNOMBRE__icontains=termino_busqueda
-            )[:5]  # Carga los detalles relacionados
-
-            # Serializa las órdenes junto con sus detalles
-            resultado = []
-            for registro in registros:
-                # Extraemos la orden principal
-                proveedor = {
-                    'nombre': registro.PRVCNOMBRE,
-                }
-
-                #print(proveedor)
-                resultado.append(proveedor)
+            # Espejo local; el ERP solo si aún no se cargó
+            if estado_espejo(base_datos):
+                nombres = [p.nombre for p in buscar_proveedores_espejo(base_datos, termino_busqueda)]
+            else:
+                nombres = Proveedor.objects.using(base_datos).filter(
+                    PRVCNOMBRE__icontains=termino_busqueda
+                ).values_list('PRVCNOMBRE', flat=True)[:5]
 
+            resultado = [{'nombre': nombre} for nombre in nombres]
             return JsonResponse(resultado, safe=False, status=200)
         else:
             return JsonResponse({'error': 'Parámetros inválidos'}, status=400)
@@ -1273,131 +1202,14 @@ def registrar_despacho(request):
             # Parsear el JSON de la request
             data = json.loads(request.body)
             data_procesado = procesar_data_reporte(data)
-            # Procesar `dataForm`
-            data_form = data.get('dataForm', {})
-            empresa, _ = Empresa.objects.get_or_create(nombre_empresa=data_form.get('empresa'))
-            providers, _ = ProveedorTransporte.objects.get_or_create(nombre_proveedor=data_form.get('proveedor'))
-            transportista, _ = Transportista.objects.get_or_create(nombre_transportista=data_form.get('transportista'))
-            fecha_llegada = data.get('dataExtraForm', {}).get('fechaLlegada', None)
-            # Iniciar transacción
-            with transaction.atomic():
-                # Crear el Despacho
-                despacho = Despacho.objects.create(
-                    proveedor=providers,
-                    dua=data_form.get('dua', ''),
-                    fecha_numeracion=data_form.get('fechaNumeracion'),
-                    carta_porte=data_form.get('cartaPorte', None),
-                    num_factura=data_form.get('numFactura', ''),
-                    transportista=transportista,
-                    flete_pactado=data_form.get('fletePactado', 0.0),
-                    peso_neto_crt=data_form.get('pesoNetoCrt', 0.0),
-                    fecha_llegada=fecha_llegada
-                )
-
-                pdf_bytes = generar_reporte_pdf(data_procesado)
-                # Luego, asignarlo al campo FileField de tu modelo
-                despacho.archivo_pdf = pdf_bytes
-                # Guardar el modelo
-                despacho.save()
-
-
-
-
-                # Procesar cada orden de compra y su número de recojo
-                for orden_recojo in data_form.get('ordenRecojo', []):
-                    oc_data = orden_recojo.get('oc', {})
-                    numero_recojo = orden_recojo.get('numeroRecojo')
-                    peso_asignado = orden_recojo.get('peso_asignado',0)
-
-                    # Validar datos de `oc_data`
-                    if not all(k in oc_data for k in ['codigo_producto', 'producto', 'proveedor', 'numero_oc', 'precio_unitario', 'cantidad']):
-                        raise ValueError("Faltan datos necesarios en `oc`.")
-
-                    # Crear o recuperar el producto
-                    producto, _ = Producto.objects.get_or_create(
-                        codigo_producto=oc_data['codigo_producto'],
-                        nombre_producto=oc_data['producto'],
-                        proveedor_marca=oc_data['proveedor']
-                    )
-
-                    # Crear o recuperar la OrdenCompra
-                    print(f'este es el precio que se asignara a la oc : ',oc_data['precio_unitario'])
-                    orden_compra, _ = OrdenCompra.objects.get_or_create(
-                        empresa=empresa,
-                        numero_oc=oc_data['numero_oc'],
-                        producto=producto,
-                        defaults={
-                            'precio_producto': oc_data['precio_unitario'],
-                            'cantidad': oc_data['cantidad']
-                        }
-                    )
-
-                    # Verificar si ya existe la combinación de OC y número de recojo
-                    if OrdenCompraDespacho.objects.filter(
-                        orden_compra=orden_compra,
-                        numero_recojo=numero_recojo
-                    ).exists():
-                        return JsonResponse(
-                            {
-                                'status': 'error',
-                                'message': f'La OC "{orden_compra.numero_oc}" con número de recojo "{numero_recojo}" ya existe.'
-                            },
-                            status=400
-                        )
-
-                    # Crear la relación OrdenCompraDespacho
-                    OrdenCompraDespacho.objects.create(
-                        despacho=despacho,
-                        orden_compra=orden_compra,
-                        cantidad_asignada=peso_asignado,
-                        numero_recojo=numero_recojo
-                    )
-
-                # Procesar `dataTable` para DetalleDespacho
-                for item in data.get('dataTable', []):
-                    DetalleDespacho.objects.create(
-                        despacho=despacho,
-                        placa_salida=item.get('placa', ''),
-                        sacos_cargados=item.get('sacosCargados', 0),
-                        peso_salida=item.get('pesoSalida', 0.0),
-                        placa_llegada=item.get('placaLlegada', ''),
-                        sacos_descargados=item.get('sacosDescargados', 0),
-                        peso_llegada=item.get('pesoLlegada', 0.0),
-                        merma=item.get('merma', 0),
-                        sacos_faltantes=item.get('sacosFaltantes', 0),
-                        sacos_rotos=item.get('sacosRotos', 0),
-                        sacos_humedos=item.get('sacosHumedos', 0),
-                        sacos_mojados=item.get('sacosMojados', 0),
-                        pago_estiba=item.get('pagoEstiba', 0.0),
-                        cant_desc=item.get('cantDesc', 0)
-                    )
-
-                # Procesar `dataExtraForm` para ConfiguracionDespacho
-                data_extra_form = data.get('dataExtraForm', {})
-                ConfiguracionDespacho.objects.create(
-                    despacho=despacho,
-                    merma_permitida=data_extra_form.get('mermaPermitida', 0.0),
-                    precio_prod=data_extra_form.get('precioProd', 0.0),
-                    gastos_nacionalizacion=data_extra_form.get('gastosNacionalizacion', 0.0),
-                    margen_financiero=data_extra_form.get('margenFinanciero', 0.0),
-                    precio_sacos_rotos=data_extra_form.get('precioSacosRotos', 0.0),
-                    precio_sacos_humedos=data_extra_form.get('precioSacosHumedos', 0.0),
-                    precio_sacos_mojados=data_extra_form.get('precioSacosMojados', 0.0),
-                    tipo_cambio_desc_ext=data_extra_form.get('tipoCambioDescExt', 0.0),
-                    precio_estiba=data_extra_form.get('precioEstibaTonelada', 0.0),
-                )
-
-                for item in data_extra_form.get('otrosGastos', []):
-                    #(item)
-                    GastosExtra.objects.create(
-                        despacho=despacho,
-                        descripcion=item['descripcion'],
-                        monto=item['monto']
-                    )
+            # Escritura en bloque; el PDF se genera después del commit (ver registro_despacho)
+            registrar_despacho_en_bloque(data, data_procesado)
 
             return JsonResponse({'status': 'success', 'message': 'Registro realizado correctamente'}, status=201)
 
 
+        except RecojoDuplicadoError as e:
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
         except IntegrityError as e:
 
             return JsonResponse({
@@ -3621,7 +3433,7 @@ class AsignarDeclaracionDesdeComprimidoView(APIView):
         except Exception as e:
             return Response({"error": str(e)}, status=500)
 
-        repetidos = []
+        asignadas = []
 
         for asignacion in asignaciones:
             carpeta = asignacion.get("carpeta")
@@ -3643,40 +3455,10 @@ class AsignarDeclaracionDesdeComprimidoView(APIView):
                     status=404
                 )
 
-            for file_name in archivo_comp.namelist():
-                if file_name.startswith(carpeta) and not file_name.endswith("/"):
-                    contenido = archivo_comp.read(file_name)
-                    nombre_simple = os.path.basename(file_name)
-
-                    hash_archivo = hashlib.sha256(contenido).hexdigest()
-                    existente = Documento.objects.filter(hash_archivo=hash_archivo).first()
-
-                    if existente:
-                        declaracion_existente = existente.content_object  # Cambiado a content_object
-                        repetidos.append({
-                            "archivo": nombre_simple,
-                            "registrado_en": f"{declaracion_existente.numero}-{declaracion_existente.anio}" if isinstance(declaracion_existente, Declaracion) else "Desconocido"
-                        })
-                        continue
-
-                    carpeta_destino = os.path.join(settings.MEDIA_ROOT, "documentos", f"{numero}-{anio}")
-                    os.makedirs(carpeta_destino, exist_ok=True)
-                    ruta_destino = os.path.join(carpeta_destino, nombre_simple)
-
-                    with open(ruta_destino, "wb") as f:
-                        f.write(contenido)
-
-                    file_content = ContentFile(contenido)
-
-                    documento = Documento(
-                        content_object=declaracion,
-                        nombre_original=nombre_simple,
-                        hash_archivo=hash_archivo,
-                        usuario=request.user
-                    )
-                    # Esto activa la lógica de `upload_to=ruta_documento`
-                    documento.archivo.save(nombre_simple, file_content)
-                    documento.save()
+            asignadas.append((carpeta, declaracion))
+
+        # Una lectura por archivo (hash mientras se escribe) y una consulta de duplicados en total
+        repetidos = ingerir_comprimido(archivo_comp, asignadas, request.user)
 
         archivo_comp.close()
         os.remove(temp_path)
@@ -3698,7 +3480,7 @@ class ListarDeclaracionesView(APIView):
     
     def get(self, request):
         numero = request.query_params.get('numero')
-        queryset = Declaracion.objects.prefetch_related('documentos').all()
+        queryset = con_documentos(Declaracion.objects.all())
         if numero:
             queryset = queryset.filter(numero__icontains=numero)
         data = DeclaracionConDocumentosSerializer(queryset, many=True).data
@@ -3728,23 +3510,15 @@ class DescargarZipView(APIView):
             object_id=declaracion.id
         )
 
-        # Usar un buffer en memoria
-        buffer = io.BytesIO()
-
-        # Crear el archivo ZIP en memoria
-        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        def archivos():
             for doc in documentos:
                 if default_storage.exists(doc.archivo.name):
-                    nombre = os.path.basename(doc.archivo.name)
-                    file_path = os.path.join(settings.MEDIA_ROOT, doc.archivo.name)
-
-                    with open(file_path, "rb") as f:
-                        zip_file.writestr(nombre, f.read())
+                    # Se abre recién al llegar su turno; generar_zip_streaming lo cierra
+                    yield os.path.basename(doc.archivo.name), default_storage.open(doc.archivo.name, 'rb')
 
-        buffer.seek(0)
-
-        # Devolver el archivo ZIP como respuesta
-        response = FileResponse(buffer, as_attachment=True, filename=f"{carpeta}.zip")
+        # El ZIP se arma y se envía por partes: memoria constante sin importar cuántos documentos haya
+        response = StreamingHttpResponse(generar_zip_streaming(archivos()), content_type='application/zip')
+        response['Content-Disposition'] = f'attachment; filename="{carpeta}.zip"'
         return response
 
 class EliminarDocumentoView(APIView):
@@ -3831,9 +3605,9 @@ class ListarDeclaracionesDelUsuarioView(APIView):
         numero = request.query_params.get('numero')
 
         # Filtra las declaraciones que tengan al menos un documento subido por el usuario autenticado
-        queryset = Declaracion.objects.filter(
+        queryset = con_documentos(Declaracion.objects.filter(
             documentos__usuario=request.user
-        ).prefetch_related('documentos').distinct()
+        ).distinct())
 
         # Filtro adicional por número si se proporciona
         if numero:
@@ -4119,7 +3893,7 @@ class ListarExpedientesDeclaracionView(APIView):
         anio_fiscal = request.query_params.get('anio_fiscal')
         mes_fiscal = request.query_params.get('mes_fiscal')
 
-        queryset = ExpedienteDeclaracion.objects.select_related('declaracion')
+        queryset = con_cantidad_expedientes(ExpedienteDeclaracion.objects.all())
 
         if numero:
             queryset = queryset.filter(declaracion__numero__icontains=numero.lstrip('0'))
@@ -4189,16 +3963,17 @@ class ListarDocumentosPorTipoView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, declaracion_id):
-        queryset = (
-            ExpedienteDeclaracion.objects
-            .filter(declaracion_id=declaracion_id)
-            .select_related('documento__usuario', 'tipo')
+        queryset = expedientes_con_documento(
+            ExpedienteDeclaracion.objects.filter(declaracion_id=declaracion_id)
         )
+        expedientes = list(queryset)
+        # Un solo serializer para todas las filas (antes se instanciaba uno por expediente)
+        serializados = DocumentoExpedienteSerializer(expedientes, many=True).data
 
         # Agrupamos por ID de tipo (para poder ordenarlo), pero guardamos el nombre también
         grupos_por_tipo = {}
 
-        for expediente in queryset:
+        for expediente, serialized in zip(expedientes, serializados):
             if expediente.tipo:
                 tipo_id = expediente.tipo.id
                 tipo_nombre = expediente.tipo.nombre
@@ -4212,7 +3987,6 @@ class ListarDocumentosPorTipoView(APIView):
                     "documentos": []
                 }
 
-            serialized = DocumentoExpedienteSerializer(expediente).data
             grupos_por_tipo[tipo_id]["documentos"].append(serialized)
 
         # Ordenamos por ID de tipo y reestructuramos como dict con el nombre como clave
@@ -4334,71 +4108,29 @@ class TipoDocumentoViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated, IsImportacionesAdmin]
 
 class DescargarDocumentosUnificadosPDFView(APIView):
+    """
+    PDF con todos los documentos del expediente y su folio estampado (ver pdf_unificado.py).
+    ?precalcular=true lo genera en segundo plano y responde 202 con el job_id.
+    """
     permission_classes = [IsAuthenticated]
 
     def get(self, request, declaracion_id):
-        expedientes = (
-            ExpedienteDeclaracion.objects
-            .filter(declaracion_id=declaracion_id)
-            .select_related('documento', 'tipo')
+        if request.query_params.get('precalcular') == 'true':
+            try:
+                from .tasks import generar_pdf_unificado_task
+                job = generar_pdf_unificado_task.delay(declaracion_id)
+            except Exception as e:
+                return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            return Response({"status": "Generación en proceso.", "job_id": job.id},
+                            status=status.HTTP_202_ACCEPTED)
+
+        # Reutiliza el archivo en disco si el expediente no cambió; si no, lo genera ahí mismo
+        ruta = obtener_pdf_unificado(declaracion_id)
+        return FileResponse(
+            open(ruta, 'rb'), as_attachment=True, content_type='application/pdf',
+            filename=f"documentos_unificados_{declaracion_id}.pdf"
         )
 
-        # Agrupar por tipo_id para mantener el orden deseado
-        grupos_por_tipo = {}
-        for exp in expedientes:
-            tipo_id = exp.tipo.id if exp.tipo else 0
-            grupos_por_tipo.setdefault(tipo_id, []).append(exp)
-
-        writer = PdfWriter()
-
-        for tipo_id in sorted(grupos_por_tipo.keys()):
-            for exp in grupos_por_tipo[tipo_id]:
-                doc = exp.documento
-                if not doc or not doc.archivo:
-                    continue
-
-                try:
-                    reader = PdfReader(doc.archivo.path)
-                except Exception as e:
-                    print(f"Error al leer PDF: {e}")
-                    continue
-
-                for page_num in range(len(reader.pages)):
-                    page = reader.pages[page_num]
-
-                    # Obtener tamaño real de la página
-                    media_box = page.mediabox
-                    page_width = float(media_box.width)
-                    page_height = float(media_box.height)
-
-                    # Crear overlay con el folio en posición precisa
-                    overlay_stream = io.BytesIO()
-                    c = canvas.Canvas(overlay_stream, pagesize=(page_width, page_height))
-                    c.setFont("Helvetica-Bold", 10)
-                    c.setFillColorRGB(1, 0, 0)
-
-                    # Posición del texto: centro horizontal y 0.2 cm desde el borde superior
-                    folio_y = page_height - 0.6 * cm
-                    c.drawCentredString((page_width / 2)+100, folio_y, exp.folio or "")
-                    c.drawCentredString((page_width / 2) - 200, folio_y, f'OC: {exp.orden_compra}  / NI: {exp.nota_ingreso}' or "")
-                    c.save()
-
-                    overlay_stream.seek(0)
-                    overlay_pdf = PdfReader(overlay_stream)
-                    overlay_page = overlay_pdf.pages[0]
-
-                    page.merge_page(overlay_page)
-                    writer.add_page(page)
-
-        # Preparar respuesta HTTP
-        output_stream = io.BytesIO()
-        writer.write(output_stream)
-        output_stream.seek(0)
-
-        response = HttpResponse(output_stream.read(), content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename="documentos_unificados_{declaracion_id}.pdf"'
-        return response
-
 class ActualizarOrdenCompraNotaIngresoView(APIView):
     permission_classes = [IsAuthenticated]
 
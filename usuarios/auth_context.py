@@ -0,0 +1,181 @@
+"""
+Contexto de autorización por usuario (grupos, permisos, almacenes y sedes asignados).
+
+Se construye una sola vez y se guarda en el cache de Django; las clases de permisos
+y las vistas lo consultan en memoria en lugar de lanzar consultas por request.
+Las señales de usuarios/signals.py lo invalidan cuando cambian grupos, permisos,
+perfiles, CustomPermission o los almacenes / sedes (solo cuentan los activos).
+
+La invalidación solo alcanza a todos los workers si el cache es compartido
+(Redis). Con LocMemCache el contexto se guarda unos segundos nomás
+(AUTH_CONTEXT_TIMEOUT_LOCAL).
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+AUTH_CONTEXT_TIMEOUT = getattr(settings, 'AUTH_CONTEXT_CACHE_TIMEOUT', 300)
+# Con un cache propio de cada proceso (LocMemCache, el default si no se configura CACHES)
+# la invalidación solo llega al worker que atendió el cambio: los demás seguirían
+# sirviendo grupos/permisos revocados hasta el timeout. En ese caso el contexto dura
+# apenas unos segundos; para aprovechar AUTH_CONTEXT_TIMEOUT se necesita un cache
+# compartido (Redis).
+AUTH_CONTEXT_TIMEOUT_LOCAL = getattr(settings, 'AUTH_CONTEXT_CACHE_TIMEOUT_LOCAL', 5)
+_PREFIJO = 'auth_ctx'
+_CLAVE_VERSION = f'{_PREFIJO}:version'
+# Atributo del objeto User donde se memoriza el contexto durante el request
+_ATRIBUTO_USUARIO = '_contexto_autorizacion'
+
+
+class ContextoAutorizacion:
+    """Snapshot inmutable de lo que un usuario puede hacer."""
+
+    def __init__(self, user, datos):
+        # Los flags del User se leen del objeto del request (siempre actuales)
+        self.is_active = user.is_active
+        self.is_superuser = user.is_superuser
+        self.grupos = frozenset(datos['grupos'])
+        self.permisos = frozenset(datos['permisos'])
+        self.tiene_perfil = datos['tiene_perfil']
+        self.require_warehouse_access = datos['require_warehouse_access']
+        self.require_sede_access = datos['require_sede_access']
+        self.almacenes_ids = frozenset(datos['almacenes_ids'])
+        self.sedes_ids = frozenset(datos['sedes_ids'])
+
+    def en_grupo(self, *nombres):
+        return any(nombre in self.grupos for nombre in nombres)
+
+    @property
+    def es_admin_sistema(self):
+        """Superusuario o miembro de SystemAdmin (acceso total)."""
+        return self.is_superuser or self.en_grupo('SystemAdmin')
+
+    def tiene_permiso(self, perm):
+        """Equivalente a user.has_perm(perm) con ModelBackend."""
+        if not self.is_active:
+            return False
+        return self.is_superuser or perm in self.permisos
+
+    def tiene_permiso_modulo(self, perm):
+        """
+        has_perm con los respaldos de app_label del sistema dinámico:
+        'almacen.can_x' también se acepta como 'usuarios.can_x' o 'auth.can_x'.
+        """
+        if self.tiene_permiso(perm):
+            return True
+        if '.' in perm:
+            codename = perm.split('.')[-1]
+            return self.tiene_permiso(f'usuarios.{codename}') or self.tiene_permiso(f'auth.{codename}')
+        return False
+
+    def acceso_almacen(self, almacen_id):
+        if not self.require_warehouse_access:
+            return True
+        return almacen_id in self.almacenes_ids
+
+    def acceso_sede(self, sede_id):
+        if not self.require_sede_access:
+            return True
+        return sede_id in self.sedes_ids
+
+
+def _version_nueva():
+    # Si el cache perdió la versión, se arranca en un valor nunca usado:
+    # los contextos guardados con versiones anteriores quedan inaccesibles.
+    return int(time.time() * 1000)
+
+
+def _version():
+    version = cache.get(_CLAVE_VERSION)
+    if version is None:
+        cache.add(_CLAVE_VERSION, _version_nueva(), None)
+        version = cache.get(_CLAVE_VERSION)
+    return version
+
+
+def _timeout():
+    from django.core.cache import caches
+    from django.core.cache.backends.locmem import LocMemCache
+
+    if isinstance(caches['default'], LocMemCache):
+        return min(AUTH_CONTEXT_TIMEOUT, AUTH_CONTEXT_TIMEOUT_LOCAL)
+    return AUTH_CONTEXT_TIMEOUT
+
+
+def _clave(user_id):
+    return f'{_PREFIJO}:{_version()}:{user_id}'
+
+
+def _construir(user):
+    """Lee de la BD todo lo necesario para autorizar al usuario."""
+    from .models import UserProfile
+
+    datos = {
+        'grupos': list(user.groups.values_list('name', flat=True)),
+        'permisos': list(user.get_all_permissions()),
+        'tiene_perfil': False,
+        'require_warehouse_access': False,
+        'require_sede_access': False,
+        'almacenes_ids': [],
+        'sedes_ids': [],
+    }
+
+    profile = UserProfile.all_objects.filter(user_id=user.pk).values(
+        'id', 'require_warehouse_access', 'require_sede_access'
+    ).first()
+    if profile:
+        datos['tiene_perfil'] = True
+        datos['require_warehouse_access'] = profile['require_warehouse_access']
+        datos['require_sede_access'] = profile['require_sede_access']
+        if profile['require_warehouse_access']:
+            datos['almacenes_ids'] = list(
+                UserProfile.almacenes_asignados.through.objects
+                .filter(userprofile_id=profile['id'], almacen__state=True).values_list('almacen_id', flat=True)
+            )
+        if profile['require_sede_access']:
+            datos['sedes_ids'] = list(
+                UserProfile.sedes_asignadas.through.objects
+                .filter(userprofile_id=profile['id'], direccion__state=True).values_list('direccion_id', flat=True)
+            )
+    return datos
+
+
+def contexto_autorizacion(user):
+    """
+    Contexto de autorización del usuario autenticado.
+    Orden de búsqueda: memo en el objeto User -> cache de Django -> BD.
+    """
+    contexto = getattr(user, _ATRIBUTO_USUARIO, None)
+    if contexto is not None:
+        return contexto
+
+    clave = _clave(user.pk)
+    datos = cache.get(clave)
+    if datos is None:
+        datos = _construir(user)
+        cache.set(clave, datos, _timeout())
+
+    contexto = ContextoAutorizacion(user, datos)
+    setattr(user, _ATRIBUTO_USUARIO, contexto)
+    return contexto
+
+
+def invalidar_usuario(user_id):
+    """Descarta el contexto de un usuario (al confirmar la transacción en curso)."""
+    transaction.on_commit(lambda: cache.delete(_clave(user_id)))
+
+
+def invalidar_todos():
+    """
+    Descarta el contexto de todos los usuarios subiendo la versión de las claves
+    (cambios en grupos o permisos que afectan a un número indeterminado de usuarios).
+    """
+    def _subir_version():
+        try:
+            cache.incr(_CLAVE_VERSION)
+        except ValueError:
+            cache.set(_CLAVE_VERSION, _version_nueva(), None)
+
+    transaction.on_commit(_subir_version)
@@ -2,7 +2,8 @@
 import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 
-from almacen.consumers import SyncStatusMixin
+from almacen.consumers import SyncStatusMixin, ExportacionesMixin
+from importaciones.consumers import ExtraccionDocumentosMixin
 
 
 # ¡El nombre de este grupo ahora es GENÉRICO!
@@ -11,7 +12,7 @@ def get_user_group_name(user_id):
     return f"user_{user_id}"
 
 
-class MainConsumer(SyncStatusMixin,AsyncWebsocketConsumer):
+class MainConsumer(SyncStatusMixin, ExportacionesMixin, ExtraccionDocumentosMixin, AsyncWebsocketConsumer):
     """
     Este es ahora el ÚNICO consumer que maneja al usuario.
     Autentica y luego espera mensajes de "subscribe" y "unsubscribe".
@@ -0,0 +1,67 @@
+# usuarios/management/commands/benchmark_rate_limit.py
+import time
+
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test import RequestFactory
+
+from usuarios.rate_limit import ResultadoLimite, VentanaDeslizante, VentanaFija
+
+
+class _DictEnProceso:
+    """Algoritmo anterior de RateLimitMiddleware (dict del proceso, limpieza completa por request)."""
+
+    def __init__(self):
+        self.request_counts = {}
+
+    def consumir(self, clave, limite, ventana):
+        ahora = time.time()
+        for client_id in list(self.request_counts.keys()):
+            self.request_counts[client_id] = [t for t in self.request_counts[client_id] if ahora - t < ventana]
+            if not self.request_counts[client_id]:
+                del self.request_counts[client_id]
+        usados = len(self.request_counts.get(clave, []))
+        if usados < limite:
+            self.request_counts.setdefault(clave, []).append(ahora)
+        return ResultadoLimite(usados < limite, limite, max(limite - usados - 1, 0), ventana)
+
+
+class Command(BaseCommand):
+    help = ('Mide el costo por request de RateLimitMiddleware con distinta cantidad de clientes activos: '
+            'dict en proceso (anterior) contra contadores en el cache de Django.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clientes', default='10,1000,10000',
+                            help='Cantidades de clientes activos, separadas por coma.')
+        parser.add_argument('--requests', type=int, default=2000, help='Requests medidos por escenario.')
+        parser.add_argument('--cache', default='default', help='Alias del cache para los backends nuevos.')
+
+    def handle(self, *args, **options):
+        from usuarios.middleware import RateLimitMiddleware
+
+        factory = RequestFactory()
+        n = options['requests']
+        marca = int(time.time())
+
+        for clientes in [int(c) for c in options['clientes'].split(',')]:
+            self.stdout.write(f"{clientes} clientes activos, {n} requests:")
+            for nombre, limitador in (
+                ('dict en proceso', _DictEnProceso()),
+                ('VentanaFija', VentanaFija(options['cache'])),
+                ('VentanaDeslizante', VentanaDeslizante(options['cache'])),
+            ):
+                middleware = RateLimitMiddleware(lambda request: HttpResponse())
+                middleware.limitador = limitador
+                middleware.rutas = []
+
+                # Clientes con requests recientes (prefijo por escenario: no se mezclan contadores)
+                ips = [f'bench-{marca}-{clientes}-{nombre}-{i}' for i in range(clientes)]
+                for ip in ips:
+                    limitador.consumir(ip, 100, 60)
+
+                requests = [factory.get('/api/bench/', REMOTE_ADDR=ips[i % clientes]) for i in range(n)]
+                inicio = time.perf_counter()
+                for request in requests:
+                    middleware(request)
+                total = time.perf_counter() - inicio
+                self.stdout.write(f"  {nombre:<18} {total / n * 1e6:10.1f} µs/request")
@@ -7,6 +7,7 @@ from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
 from urllib.parse import parse_qs
 from .audit_log import AuditLog, get_client_ip
 from rest_framework import status as drf_status
+from django.conf import settings
 import time
 
 User = get_user_model()
@@ -192,46 +193,39 @@ class SecurityHeadersMiddleware:
 
 class RateLimitMiddleware:
     """
-    Middleware simple de rate limiting para prevenir ataques de fuerza bruta.
-    
-    NOTA IMPORTANTE: Esta implementación usa memoria en proceso y NO es adecuada
-    para entornos de producción con múltiples procesos/servidores.
-    
-    Para producción, reemplazar con:
-    - Django-ratelimit: https://django-ratelimit.readthedocs.io/
-    - Django REST framework throttling con Redis backend
-    - Django-redis para caché distribuido
-    
-    Ejemplo con DRF throttling (recomendado):
-        REST_FRAMEWORK = {
-            'DEFAULT_THROTTLE_CLASSES': [
-                'rest_framework.throttling.AnonRateThrottle',
-                'rest_framework.throttling.UserRateThrottle'
-            ],
-            'DEFAULT_THROTTLE_RATES': {
-                'anon': '100/hour',
-                'user': '1000/hour'
-            }
-        }
+    Rate limiting por IP para prevenir ataques de fuerza bruta.
+
+    Los contadores viven en el cache de Django (ver rate_limit.py), compartido por
+    todos los workers; cada request cuesta un número fijo de operaciones de cache.
+
+    Configuración (settings):
+    - RATE_LIMIT_MAX_REQUESTS / RATE_LIMIT_WINDOW_SECONDS: límite general (100 / 60 s).
+    - RATE_LIMIT_RUTAS: límites por prefijo de ruta, con su propio contador,
+      p. ej. {'/api/accounts/auth/login/': (10, 60)}.
+    - RATE_LIMIT_BACKEND: 'usuarios.rate_limit.VentanaFija' (por defecto) o
+      'usuarios.rate_limit.VentanaDeslizante'.
+    - RATE_LIMIT_CACHE_ALIAS: alias del cache (por defecto 'default').
+
+    Las respuestas llevan X-RateLimit-Limit, X-RateLimit-Remaining y
+    X-RateLimit-Reset (segundos); las rechazadas (429) también Retry-After.
     """
     
     def __init__(self, get_response):
+        from .rate_limit import limitador_configurado, limites_por_ruta
+
         self.get_response = get_response
-        # ADVERTENCIA: En memoria, no persistente, no funciona con múltiples workers
-        self.request_counts = {}
-        self.max_requests = 100  # Máximo de requests por ventana
-        self.window_seconds = 60  # Ventana de tiempo en segundos
+        self.limitador = limitador_configurado()
+        self.max_requests = getattr(settings, 'RATE_LIMIT_MAX_REQUESTS', 100)  # Máximo de requests por ventana
+        self.window_seconds = getattr(settings, 'RATE_LIMIT_WINDOW_SECONDS', 60)  # Ventana de tiempo en segundos
+        self.rutas = limites_por_ruta()
     
     def __call__(self, request):
         # Obtener identificador del cliente (IP)
         client_id = get_client_ip(request)
-        
-        # Limpiar contadores antiguos
-        current_time = time.time()
-        self._cleanup_old_entries(current_time)
-        
-        # Verificar límite de rate
-        if self._is_rate_limited(client_id, current_time):
+        clave, limite, ventana = self._limite(request.path, client_id)
+
+        resultado = self.limitador.consumir(clave, limite, ventana)
+        if not resultado.permitido:
             # Log del intento de rate limit
             user = getattr(request, 'user', None)
             if user and not user.is_anonymous:
@@ -245,41 +239,24 @@ class RateLimitMiddleware:
                 )
             
             from django.http import JsonResponse
-            return JsonResponse(
+            response = JsonResponse(
                 {'error': 'Rate limit exceeded. Please try again later.'},
                 status=429
             )
+            response['Retry-After'] = str(resultado.reinicio)
+            return self._agregar_headers(response, resultado)
         
-        # Incrementar contador
-        self._increment_counter(client_id, current_time)
-        
-        return self.get_response(request)
+        return self._agregar_headers(self.get_response(request), resultado)
     
-    def _is_rate_limited(self, client_id, current_time):
-        """Verifica si el cliente ha excedido el límite de rate"""
-        if client_id not in self.request_counts:
-            return False
-        
-        requests = self.request_counts[client_id]
-        recent_requests = [t for t in requests if current_time - t < self.window_seconds]
-        
-        return len(recent_requests) >= self.max_requests
+    def _limite(self, path, client_id):
+        """(clave del contador, máximo, ventana) según la ruta: gana el prefijo más específico"""
+        for prefijo, (maximo, ventana) in self.rutas:
+            if path.startswith(prefijo):
+                return f'{prefijo}|{client_id}', maximo, ventana
+        return str(client_id), self.max_requests, self.window_seconds
     
-    def _increment_counter(self, client_id, current_time):
-        """Incrementa el contador de solicitudes del cliente"""
-        if client_id not in self.request_counts:
-            self.request_counts[client_id] = []
-        
-        self.request_counts[client_id].append(current_time)
-    
-    def _cleanup_old_entries(self, current_time):
-        """Limpia entradas antiguas del contador"""
-        for client_id in list(self.request_counts.keys()):
-            self.request_counts[client_id] = [
-                t for t in self.request_counts[client_id]
-                if current_time - t < self.window_seconds
-            ]
-            
-            # Eliminar cliente si no tiene requests recientes
-            if not self.request_counts[client_id]:
-                del self.request_counts[client_id]
\ No newline at end of file
+    def _agregar_headers(self, response, resultado):
+        response['X-RateLimit-Limit'] = str(resultado.limite)
+        response['X-RateLimit-Remaining'] = str(resultado.restantes)
+        response['X-RateLimit-Reset'] = str(resultado.reinicio)
+        return response
@@ -4,6 +4,13 @@ These classes provide granular permission checking for different user roles.
 """
 from rest_framework.permissions import BasePermission
 
+from .auth_context import contexto_autorizacion
+
+
+def _ctx(request):
+    """Contexto de autorización cacheado del usuario (grupos/permisos sin consultas)."""
+    return contexto_autorizacion(request.user)
+
 # =============================================================================
 # 1. PERMISOS LEGACY (Basados en Grupos/Roles Fijos)
 # Nota: Se mantiene compatibilidad con grupos antiguos y se asegura acceso a Superuser.
@@ -18,7 +25,7 @@ class IsSystemAdmin(BasePermission):
             and request.user.is_authenticated
             and (
                 request.user.is_superuser or
-                request.user.groups.filter(name='SystemAdmin').exists()
+                _ctx(request).en_grupo('SystemAdmin')
             )
         )
 
@@ -31,9 +38,7 @@ class IsAccountsAdmin(BasePermission):
             and request.user.is_authenticated
             and (
                 request.user.is_superuser or
-                request.user.groups.filter(name='SystemAdmin').exists() or
-                request.user.groups.filter(name='accounts_admin').exists() or
-                request.user.groups.filter(name='AccountsAdmin').exists()
+                _ctx(request).en_grupo('SystemAdmin', 'accounts_admin', 'AccountsAdmin')
             )
         )
 
@@ -46,8 +51,7 @@ class IsImportacionesAdmin(BasePermission):
             and request.user.is_authenticated
             and (
                 request.user.is_superuser or
-                request.user.groups.filter(name='SystemAdmin').exists() or
-                request.user.groups.filter(name='importaciones_admin').exists()
+                _ctx(request).en_grupo('SystemAdmin', 'importaciones_admin')
             )
         )
 
@@ -60,8 +64,7 @@ class IsAlmacenAdmin(BasePermission):
             and request.user.is_authenticated
             and (
                 request.user.is_superuser or
-                request.user.groups.filter(name='SystemAdmin').exists() or
-                request.user.groups.filter(name='almacen_admin').exists()
+                _ctx(request).en_grupo('SystemAdmin', 'almacen_admin')
             )
         )
 
@@ -74,8 +77,7 @@ class CanManageUsers(BasePermission):
 
         return (
             request.user.is_superuser or
-            request.user.groups.filter(name='SystemAdmin').exists() or
-            request.user.groups.filter(name='accounts_admin').exists()
+            _ctx(request).en_grupo('SystemAdmin', 'accounts_admin')
         )
 
 class CanAccessImportaciones(BasePermission):
@@ -87,8 +89,8 @@ class CanAccessImportaciones(BasePermission):
 
         return (
             request.user.is_superuser or
-            request.user.groups.filter(name='SystemAdmin').exists() or
-            request.user.has_perm('usuarios.importaciones_ver_modulo')
+            _ctx(request).en_grupo('SystemAdmin') or
+            _ctx(request).tiene_permiso('usuarios.importaciones_ver_modulo')
         )
 
 class CanAccessAlmacen(BasePermission):
@@ -100,10 +102,10 @@ class CanAccessAlmacen(BasePermission):
 
         return (
             request.user.is_superuser or
-            request.user.groups.filter(name='SystemAdmin').exists() or
+            _ctx(request).en_grupo('SystemAdmin') or
             # CORREGIDO: Decía 'ialmacen' (typo) y verificaba nombre de grupo en vez de permiso
             # Si usas permisos modernos, debería ser has_perm. Si es legacy grupo, está bien filter.
-            request.user.groups.filter(name='almacen_admin').exists()
+            _ctx(request).en_grupo('almacen_admin')
         )
 
 class IsOwnerOrAdmin(BasePermission):
@@ -114,8 +116,7 @@ class IsOwnerOrAdmin(BasePermission):
             return False
 
         if (request.user.is_superuser or
-            request.user.groups.filter(name='SystemAdmin').exists() or
-            request.user.groups.filter(name='accounts_admin').exists()):
+            _ctx(request).en_grupo('SystemAdmin', 'accounts_admin')):
             return True
 
         if hasattr(obj, 'user'):
@@ -144,9 +145,9 @@ class CanEditDocuments(BasePermission):
 
         return (
             request.user.is_superuser or
-            request.user.groups.filter(name='SystemAdmin').exists() or
-            request.user.has_perm('importaciones.administrar_documentos_dua') or
-            request.user.has_perm('proveedor.administrar_documentos')
+            _ctx(request).en_grupo('SystemAdmin') or
+            _ctx(request).tiene_permiso('importaciones.administrar_documentos_dua') or
+            _ctx(request).tiene_permiso('proveedor.administrar_documentos')
         )
 
 class CanDeleteResource(BasePermission):
@@ -161,10 +162,7 @@ class CanDeleteResource(BasePermission):
 
         return (
             request.user.is_superuser or
-            request.user.groups.filter(name='SystemAdmin').exists() or
-            request.user.groups.filter(name='accounts_admin').exists() or
-            request.user.groups.filter(name='importaciones_admin').exists() or
-            request.user.groups.filter(name='almacen_admin').exists()
+            _ctx(request).en_grupo('SystemAdmin', 'accounts_admin', 'importaciones_admin', 'almacen_admin')
         )
 
 
@@ -186,7 +184,7 @@ class HasModulePermission(BasePermission):
             return False
 
         # 1. ACCESO TOTAL: Superusuario o SystemAdmin
-        if request.user.is_superuser or request.user.groups.filter(name='SystemAdmin').exists():
+        if request.user.is_superuser or _ctx(request).en_grupo('SystemAdmin'):
             return True
 
         # 2. Obtener el permiso requerido
@@ -198,23 +196,12 @@ class HasModulePermission(BasePermission):
         # Normalizamos a lista para manejar múltiples permisos
         perms_to_check = permission if isinstance(permission, (list, tuple)) else [permission]
 
-        for perm_str in perms_to_check:
-            # A. Intento Directo (Ej: 'almacen.can_view_warehouse')
-            if request.user.has_perm(perm_str):
-                return True
+        # A. Intento Directo (Ej: 'almacen.can_view_warehouse')
+        # B/C. Respaldo con App 'usuarios' / 'auth' (Fix de Migración):
+        # si el permiso se llama 'almacen.can_view', probamos 'usuarios.can_view' y 'auth.can_view'
+        contexto = _ctx(request)
+        return any(contexto.tiene_permiso_modulo(perm_str) for perm_str in perms_to_check)
 
-            # B. Intento con App 'usuarios' (Fix de Migración)
-            # Si el permiso se llama 'almacen.can_view', probamos 'usuarios.can_view'
-            if '.' in perm_str:
-                codename = perm_str.split('.')[-1]
-                if request.user.has_perm(f'usuarios.{codename}'):
-                    return True
-
-                # C. Intento con App 'auth' (Por si acaso)
-                if request.user.has_perm(f'auth.{codename}'):
-                    return True
-
-        return False
 
 
 # ========================================
@@ -0,0 +1,87 @@
+"""
+Contadores de rate limiting en el cache de Django (Redis en producción, locmem en tests).
+
+RateLimitMiddleware guardaba los contadores en un dict del proceso y lo recorría
+completo en cada request; con varios workers (gunicorn/daphne) el límite real se
+multiplicaba por la cantidad de workers. Aquí cada request hace un número fijo de
+operaciones sobre el cache compartido, sin recorrer a los demás clientes: las
+claves vencen solas con el timeout de la ventana.
+
+Backends (RATE_LIMIT_BACKEND):
+- VentanaFija: un contador por (cliente, ventana) con incremento atómico.
+- VentanaDeslizante: aproximación por ventana deslizante; pondera el contador de
+  la ventana anterior por la fracción de ella que sigue dentro de la ventana
+  actual (evita la ráfaga de 2x en el borde de las ventanas fijas).
+"""
+import math
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+RATE_LIMIT_BACKEND = 'usuarios.rate_limit.VentanaFija'
+_PREFIJO = 'rl'
+
+# permitido, límite, restantes en la ventana y segundos hasta que se libera
+ResultadoLimite = namedtuple('ResultadoLimite', 'permitido limite restantes reinicio')
+
+
+class VentanaFija:
+    """Contador por ventana fija: clave rl:<clave>:<índice de ventana>."""
+
+    def __init__(self, cache_alias='default', reloj=time.time):
+        self.cache = caches[cache_alias]
+        self._reloj = reloj
+
+    def consumir(self, clave, limite, ventana):
+        ahora = self._reloj()
+        indice = int(ahora // ventana)
+        total = self._incrementar(f'{_PREFIJO}:{clave}:{indice}', ventana)
+        reinicio = math.ceil((indice + 1) * ventana - ahora)
+        return ResultadoLimite(total <= limite, limite, max(limite - total, 0), reinicio)
+
+    def _incrementar(self, clave_cache, ventana):
+        # add no pisa un contador existente; incr es atómico en Redis y locmem.
+        # El timeout cubre la ventana siguiente (la usa VentanaDeslizante).
+        self.cache.add(clave_cache, 0, timeout=ventana * 2)
+        try:
+            return self.cache.incr(clave_cache)
+        except ValueError:
+            # La clave venció o fue desalojada entre add e incr
+            self.cache.set(clave_cache, 1, timeout=ventana * 2)
+            return 1
+
+
+class VentanaDeslizante(VentanaFija):
+    """Ventana deslizante aproximada con los contadores de la ventana actual y la anterior."""
+
+    def consumir(self, clave, limite, ventana):
+        ahora = self._reloj()
+        indice = int(ahora // ventana)
+        actual = self._incrementar(f'{_PREFIJO}:{clave}:{indice}', ventana)
+        anterior = self.cache.get(f'{_PREFIJO}:{clave}:{indice - 1}', 0)
+
+        transcurrido = (ahora % ventana) / ventana
+        total = actual + anterior * (1 - transcurrido)
+        reinicio = (indice + 1) * ventana - ahora
+        if total > limite and anterior:
+            # El peso de la ventana anterior baja con el tiempo: cuándo vuelve a caber un request
+            reinicio = min((total - limite) / anterior * ventana, reinicio)
+        return ResultadoLimite(total <= limite, limite, max(int(limite - total), 0), max(math.ceil(reinicio), 1))
+
+
+def limitador_configurado():
+    """Instancia del backend de RATE_LIMIT_BACKEND sobre el cache RATE_LIMIT_CACHE_ALIAS."""
+    clase = import_string(getattr(settings, 'RATE_LIMIT_BACKEND', RATE_LIMIT_BACKEND))
+    return clase(cache_alias=getattr(settings, 'RATE_LIMIT_CACHE_ALIAS', 'default'))
+
+
+def limites_por_ruta():
+    """
+    RATE_LIMIT_RUTAS: {prefijo de ruta: (máximo, ventana en segundos)}.
+    Se ordena del prefijo más largo al más corto para que gane el más específico.
+    """
+    rutas = getattr(settings, 'RATE_LIMIT_RUTAS', {})
+    return sorted(rutas.items(), key=lambda item: len(item[0]), reverse=True)
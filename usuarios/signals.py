@@ -0,0 +1,76 @@
+"""
+Invalidación del contexto de autorización cacheado (usuarios/auth_context.py).
+Se conectan en UsuariosConfig.ready().
+"""
+from django.contrib.auth.models import User, Group, Permission
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from almacen.models import Almacen
+from .auth_context import invalidar_usuario, invalidar_todos
+from .models import UserProfile, CustomPermission, Direccion
+
+ACCIONES_M2M = ('post_add', 'post_remove', 'post_clear')
+
+
+# --- Cambios que afectan a un solo usuario ---
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def _usuario_modificado(sender, instance, **kwargs):
+    invalidar_usuario(instance.pk)
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def _perfil_modificado(sender, instance, **kwargs):
+    invalidar_usuario(instance.user_id)
+
+
+def _m2m_de_usuario(instance, action, reverse, usuario_id, **kwargs):
+    """
+    M2M con el usuario (o su perfil) en un extremo. Desde el lado del usuario se
+    invalida solo ese usuario; desde el otro lado (ej. group.user_set.add) pueden
+    ser varios, se invalidan todos.
+    """
+    if action not in ACCIONES_M2M:
+        return
+    if reverse:
+        invalidar_todos()
+    else:
+        invalidar_usuario(usuario_id(instance))
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def _usuario_m2m(sender, instance, action, reverse, **kwargs):
+    _m2m_de_usuario(instance, action, reverse, lambda user: user.pk)
+
+
+@receiver(m2m_changed, sender=UserProfile.almacenes_asignados.through)
+@receiver(m2m_changed, sender=UserProfile.sedes_asignadas.through)
+def _perfil_m2m(sender, instance, action, reverse, **kwargs):
+    _m2m_de_usuario(instance, action, reverse, lambda profile: profile.user_id)
+
+
+# --- Cambios que afectan a un número indeterminado de usuarios ---
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+@receiver(post_save, sender=Permission)
+@receiver(post_delete, sender=Permission)
+@receiver(post_save, sender=CustomPermission)
+@receiver(post_delete, sender=CustomPermission)
+# Un almacén o sede dado de baja (state=False) deja de contar en el acceso asignado
+@receiver(post_save, sender=Almacen)
+@receiver(post_delete, sender=Almacen)
+@receiver(post_save, sender=Direccion)
+@receiver(post_delete, sender=Direccion)
+def _roles_modificados(sender, **kwargs):
+    invalidar_todos()
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def _permisos_de_grupo(sender, action, **kwargs):
+    if action in ACCIONES_M2M:
+        invalidar_todos()
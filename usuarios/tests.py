@@ -1,4 +1,4 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.contrib.auth.models import User
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
@@ -97,3 +97,125 @@ class PermissionsCompatibilityTestCase(APITestCase):
         self.assertTrue(CanDeleteResource)
         self.assertTrue(CanManageUsers)
 
+
+
+class AuthContextCacheTestCase(TestCase):
+    """
+    El contexto de autorización se arma una vez, se sirve desde el cache
+    y se invalida con las señales de grupos, permisos y perfil.
+    """
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.user = User.objects.create_user(username='ctxuser', password='testpass123')
+
+    def _contexto(self):
+        from usuarios.auth_context import contexto_autorizacion
+        # Usuario recién leído: simula un request nuevo (sin memo en el objeto)
+        return contexto_autorizacion(User.objects.get(pk=self.user.pk))
+
+    def test_context_is_served_from_cache(self):
+        self._contexto()
+        user = User.objects.get(pk=self.user.pk)
+        from usuarios.auth_context import contexto_autorizacion
+        with self.assertNumQueries(0):
+            contexto = contexto_autorizacion(user)
+        self.assertFalse(contexto.en_grupo('SystemAdmin'))
+
+    def test_process_local_cache_uses_short_timeout(self):
+        # LocMemCache no se comparte entre workers: la invalidación no llega a los demás
+        from usuarios import auth_context
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.assertEqual(auth_context._timeout(), auth_context.AUTH_CONTEXT_TIMEOUT_LOCAL)
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+                                                   'LOCATION': 'redis://127.0.0.1:6379/1'}}):
+            self.assertEqual(auth_context._timeout(), auth_context.AUTH_CONTEXT_TIMEOUT)
+
+    def test_soft_deleted_almacen_is_not_granted(self):
+        from almacen.models import Almacen
+        from usuarios.models import UserProfile
+
+        profile = UserProfile.objects.create(user=self.user, require_warehouse_access=True)
+        activo = Almacen.objects.create(codigo='AL', descripcion='Lima')
+        baja = Almacen.objects.create(codigo='AD', descripcion='Arequipa')
+        with self.captureOnCommitCallbacks(execute=True):
+            profile.almacenes_asignados.add(activo, baja)
+        self.assertEqual(self._contexto().almacenes_ids, {activo.id, baja.id})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            baja.delete()  # baja lógica
+        self.assertEqual(self._contexto().almacenes_ids, {activo.id})
+
+    def test_group_and_permission_changes_invalidate_context(self):
+        from django.contrib.auth.models import Group, Permission
+        self.assertFalse(self._contexto().en_grupo('almacen_admin'))
+
+        grupo = Group.objects.create(name='almacen_admin')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.groups.add(grupo)
+        self.assertTrue(self._contexto().en_grupo('almacen_admin'))
+
+        permiso = Permission.objects.get(codename='view_user')
+        self.assertFalse(self._contexto().tiene_permiso('auth.view_user'))
+        with self.captureOnCommitCallbacks(execute=True):
+            grupo.permissions.add(permiso)
+        self.assertTrue(self._contexto().tiene_permiso('auth.view_user'))
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    RATE_LIMIT_MAX_REQUESTS=3,
+    RATE_LIMIT_WINDOW_SECONDS=60,
+    RATE_LIMIT_RUTAS={'/api/accounts/auth/login/': (1, 60)},
+)
+class RateLimitMiddlewareTestCase(TestCase):
+    """Contadores en el cache compartido: el límite no se multiplica por worker."""
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+
+    def _middleware(self):
+        from django.http import HttpResponse
+        from usuarios.middleware import RateLimitMiddleware
+        return RateLimitMiddleware(lambda request: HttpResponse('ok'))
+
+    def _get(self, middleware, path='/api/almacen/', ip='10.0.0.1'):
+        from django.test import RequestFactory
+        return middleware(RequestFactory().get(path, REMOTE_ADDR=ip))
+
+    def test_limit_is_shared_between_workers(self):
+        # Dos instancias = dos workers con el mismo cache
+        worker_a, worker_b = self._middleware(), self._middleware()
+        respuestas = [self._get(worker_a), self._get(worker_b), self._get(worker_a), self._get(worker_b)]
+
+        self.assertEqual([r.status_code for r in respuestas], [200, 200, 200, 429])
+        self.assertEqual([r['X-RateLimit-Remaining'] for r in respuestas], ['2', '1', '0', '0'])
+        self.assertEqual(respuestas[0]['X-RateLimit-Limit'], '3')
+        self.assertIn('Retry-After', respuestas[-1])
+        # Otro cliente no se ve afectado
+        self.assertEqual(self._get(worker_a, ip='10.0.0.2').status_code, 200)
+
+    def test_route_limit_has_its_own_counter(self):
+        middleware = self._middleware()
+        self.assertEqual(self._get(middleware, '/api/accounts/auth/login/').status_code, 200)
+        respuesta = self._get(middleware, '/api/accounts/auth/login/')
+        self.assertEqual(respuesta.status_code, 429)
+        self.assertEqual(respuesta['X-RateLimit-Limit'], '1')
+        self.assertEqual(self._get(middleware).status_code, 200)
+
+    def test_sliding_window_weights_previous_window(self):
+        from usuarios.rate_limit import VentanaDeslizante, VentanaFija
+
+        for clase, permitido_en_borde in ((VentanaFija, True), (VentanaDeslizante, False)):
+            reloj = [59.0]
+            limitador = clase(reloj=lambda: reloj[0])
+            clave = f'borde-{clase.__name__}'
+            for _ in range(3):
+                self.assertTrue(limitador.consumir(clave, 3, 60).permitido)
+            # Recién empezada la ventana siguiente: la fija se reinicia, la deslizante aún pesa la anterior
+            reloj[0] = 61.0
+            self.assertEqual(limitador.consumir(clave, 3, 60).permitido, permitido_en_borde)
+            reloj[0] = 119.0
+            self.assertTrue(limitador.consumir(clave, 3, 60).permitido)
@@ -1,6 +1,8 @@
 from rest_framework import permissions
 from django.core.exceptions import PermissionDenied
 
+from .auth_context import contexto_autorizacion
+
 
 class HasWarehouseAccess(permissions.BasePermission):
     """
@@ -26,13 +28,12 @@ class HasWarehouseAccess(permissions.BasePermission):
             return False
 
         # Usuario debe tener perfil
-        if not hasattr(request.user, 'userprofile'):
+        contexto = contexto_autorizacion(request.user)
+        if not contexto.tiene_perfil:
             return False
 
-        profile = request.user.userprofile
-
         # Si no requiere restricción, dar acceso
-        if not profile.require_warehouse_access:
+        if not contexto.require_warehouse_access:
             return True
 
         # Para listados, permitir (filtraremos después)
@@ -47,27 +48,27 @@ class HasWarehouseAccess(permissions.BasePermission):
         if hasattr(request.user, 'is_system_admin') and request.user.is_system_admin:
             return True
 
-        profile = request.user.userprofile
+        contexto = contexto_autorizacion(request.user)
 
         # Si no requiere restricción, dar acceso
-        if not profile.require_warehouse_access:
+        if not contexto.require_warehouse_access:
             return True
 
-        # Obtener el almacén del objeto
-        almacen = None
-        if hasattr(obj, 'almacen'):
-            almacen = obj.almacen
-        elif hasattr(obj, 'almacen_id'):
-            almacen = obj.almacen
+        # Obtener el almacén del objeto (solo el id: sin cargar la FK)
+        almacen_id = None
+        if hasattr(obj, 'almacen_id'):
+            almacen_id = obj.almacen_id
+        elif hasattr(obj, 'almacen') and obj.almacen:
+            almacen_id = obj.almacen.id
         elif obj.__class__.__name__ == 'Almacen':
-            almacen = obj
+            almacen_id = obj.id
 
-        if not almacen:
+        if not almacen_id:
             # No se pudo determinar el almacén, denegar por seguridad
             return False
 
         # Verificar acceso
-        return profile.tiene_acceso_almacen(almacen)
+        return contexto.acceso_almacen(almacen_id)
 
 
 class HasSedeAccess(permissions.BasePermission):
@@ -84,13 +85,12 @@ class HasSedeAccess(permissions.BasePermission):
         if not request.user.is_authenticated:
             return False
 
-        if not hasattr(request.user, 'userprofile'):
+        contexto = contexto_autorizacion(request.user)
+        if not contexto.tiene_perfil:
             return False
 
-        profile = request.user.userprofile
-
         # Si no requiere restricción, dar acceso
-        if not profile.require_sede_access:
+        if not contexto.require_sede_access:
             return True
 
         # Para listados, permitir (filtraremos después)
@@ -104,10 +104,10 @@ class HasSedeAccess(permissions.BasePermission):
         if hasattr(request.user, 'is_system_admin') and request.user.is_system_admin:
             return True
 
-        profile = request.user.userprofile
+        contexto = contexto_autorizacion(request.user)
 
         # Si no requiere restricción, dar acceso
-        if not profile.require_sede_access:
+        if not contexto.require_sede_access:
             return True
 
         # Obtener la sede del objeto
@@ -123,4 +123,4 @@ class HasSedeAccess(permissions.BasePermission):
             return False
 
         # Verificar acceso
-        return profile.tiene_acceso_sede(sede)
\ No newline at end of file
+        return contexto.acceso_sede(sede.id)
\ No newline at end of file